@@ -0,0 +1,330 @@
+# async_backend.py
+import os
+import re
+import time
+import signal
+import asyncio
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+from watchdog.events import FileSystemEventHandler
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from orca_job_manager import OrcaExecutor, signal_process_group
+from resource_usage import SharedProcessSampler
+from job_scheduler import JobScheduler
+from file_watcher import ingest_xyz_file
+from workflow import WorkflowDefinition
+
+_async_logger = get_logger('async_backend')
+
+# 出力の追跡 (進捗の記録) に使うパターン
+_OPT_CYCLE_PATTERN = re.compile(rb"GEOMETRY OPTIMIZATION CYCLE\s+(\d+)")
+_ENERGY_PATTERN = re.compile(rb"FINAL SINGLE POINT ENERGY\s+(-?\d+\.\d+)")
+_TAIL_CHUNK_SIZE = 64 * 1024
+
+
+class AsyncOrcaExecutor(OrcaExecutor):
+    """
+    asyncio.create_subprocess_exec で ORCA を監視する実行器。
+    準備・結果処理 (ファイルI/O、StateStore、結果DB) は OrcaExecutor と共通で、
+    スレッドプールで実行される。ORCA の実行中はスレッドを占有しない。
+    """
+
+    def __init__(self, config, handler):
+        super().__init__(config, handler)
+        # job_id -> {'opt_cycle', 'energy', 'updated'} (出力の追跡で更新)
+        self.progress = {}
+        # 実行中のすべての ORCA のプロセスツリーを1つのスレッドでサンプリングする
+        self.usage_sampler = SharedProcessSampler(self.usage_sample_interval)
+
+    def apply_config(self, config):
+        super().apply_config(config)
+        self.usage_sampler.interval = self.usage_sample_interval
+
+    async def execute_async(self, inp_file, mol_name, calc_type, pool):
+        loop = asyncio.get_running_loop()
+        run = await loop.run_in_executor(pool, self.prepare_run, inp_file, mol_name, calc_type)
+        if run is None:
+            return
+
+        started = time.monotonic()
+        try:
+            returncode, sampled = await self._run_orca_async(run)
+        except Exception as e:
+            await loop.run_in_executor(pool, self.abort_run, run, e)
+            return
+        finally:
+            self.progress.pop(run.job_id, None)
+
+        # 子プロセスの回収はイベントループが行うため rusage は取れず、/proc のサンプリングのみ記録する
+        await loop.run_in_executor(pool, self.measure_usage, run, time.monotonic() - started, None, sampled)
+        await loop.run_in_executor(pool, self.finish_run, run, returncode)
+
+    async def _run_orca_async(self, run):
+        """
+        ORCA の標準出力を非同期に読み、.out に書きながら進捗を追跡する。
+        Returns: (returncode, プロセスツリーのサンプリング結果)
+        """
+        process = await asyncio.create_subprocess_exec(
+            self.orca_executable, str(run.orca_path),
+            cwd=run.work_dir,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True
+        )
+        with self._processes_lock:
+            self._processes.add(process)
+        sampler = self.usage_sampler.add(process.pid)
+        timeout = None
+        if self.timeout_seconds > 0:
+            timeout = asyncio.get_running_loop().call_later(self.timeout_seconds, self._timeout, run, process)
+        try:
+            progress = self.progress.setdefault(run.job_id, {'opt_cycle': None, 'energy': None, 'updated': None})
+            tail = b''
+            with open(run.output_path, 'wb') as out_f:
+                while True:
+                    chunk = await process.stdout.read(_TAIL_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    out_f.write(chunk)
+                    # チャンク境界をまたぐ行のため、前回の末尾を含めて検索する
+                    window = tail + chunk
+                    cycles = _OPT_CYCLE_PATTERN.findall(window)
+                    energies = _ENERGY_PATTERN.findall(window)
+                    if cycles:
+                        progress['opt_cycle'] = int(cycles[-1])
+                    if energies:
+                        progress['energy'] = float(energies[-1])
+                    if cycles or energies:
+                        progress['updated'] = time.time()
+                    tail = window[-256:]
+            returncode = await process.wait()
+        finally:
+            if timeout is not None:
+                timeout.cancel()
+            sampled = self.usage_sampler.remove(sampler)
+            with self._processes_lock:
+                self._processes.discard(process)
+        return returncode, sampled
+
+    def _timeout(self, run, process):
+        """timeout_seconds を超えた ORCA に SIGTERM を送り、kill_grace 秒後も残っていれば SIGKILL を送る。"""
+        if process.returncode is not None:
+            return
+        run.timed_out = True
+        self.logger.warning(
+            f"ORCA run {run.orca_path.name} exceeded timeout_seconds ({self.timeout_seconds:.0f}s); terminating."
+        )
+        signal_process_group(process, signal.SIGTERM)
+        asyncio.get_running_loop().call_later(self.kill_grace, self._kill_if_running, process)
+
+    @staticmethod
+    def _kill_if_running(process):
+        if process.returncode is None:
+            signal_process_group(process, getattr(signal, 'SIGKILL', signal.SIGTERM))
+
+
+class AsyncJobScheduler(JobScheduler):
+    """
+    asyncio のイベントループ (専用スレッド) でジョブを監視するスケジューラ。
+    キュー・重複チェック・パッキング・ドレインは JobScheduler と共通で、
+    同時実行数 (max_parallel_jobs) はスレッド数ではなく監視タスク数で制限される。
+    """
+
+    def __init__(self, config, state_store, executor):
+        super().__init__(config, state_store, executor)
+        self.post_processing_threads = config.getint('orca', 'post_processing_threads', fallback=4)
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._wakeup = None
+        self._tasks = set()
+        self._pool = ThreadPoolExecutor(max_workers=self.post_processing_threads,
+                                        thread_name_prefix='orca-post')
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self._thread = threading.Thread(target=self._run_loop, name='orca-async-scheduler', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        self.logger.info(
+            f"AsyncJobScheduler started (max concurrent jobs: {self.num_threads}, "
+            f"post-processing threads: {self.post_processing_threads})."
+        )
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._dispatch())
+        finally:
+            self.loop.close()
+            self._pool.shutdown(wait=True)
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._wakeup.set() # 起動前に登録されたジョブを配布する
+        self._ready.set()
+
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self.job_queue.closed:
+                break
+
+            while len(self._tasks) < self.num_threads:
+                try:
+                    job = self.job_queue.get_nowait()
+                except Empty:
+                    break
+                if self.disk_guard is not None and not await loop.run_in_executor(
+                        self._pool, self.disk_guard.admit, str(job[0]), job[2]):
+                    # ディスク容量が足りない: キューに戻し、check_interval 後に再確認する
+                    self.job_queue.requeue_front([job])
+                    loop.call_later(self.disk_guard.check_interval, self._wakeup.set)
+                    break
+                # パック作成は .inp を読むためスレッドプールで行う
+                pack = await loop.run_in_executor(self._pool, self.collect_pack, job)
+                task = asyncio.create_task(self._supervise(pack))
+                self._tasks.add(task)
+                task.add_done_callback(self._task_finished)
+
+        # ドレイン: 実行中のジョブの終了 (または中断) を待つ
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _task_finished(self, task):
+        self._tasks.discard(task)
+        self._wakeup.set()
+
+    async def _supervise(self, pack):
+        try:
+            if len(pack) > 1:
+                # パック実行は短時間の小分子ジョブのみなので、スレッドプールで同期実行する
+                await asyncio.get_running_loop().run_in_executor(self._pool, self.executor.execute_packed, pack)
+            else:
+                await self.executor.execute_async(*pack[0], pool=self._pool)
+        except Exception as e:
+            self.logger.error(f"Job supervision experienced unhandled error: {e}")
+        finally:
+            self.job_queue.task_done(pack)
+
+    def _notify(self):
+        if self.loop is not None and self._wakeup is not None and not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass # ループが終了済み
+
+    def _enqueue(self, jobs):
+        queued = super()._enqueue(jobs)
+        if queued:
+            self._notify()
+        return queued
+
+    def _close_queue(self):
+        super()._close_queue()
+        self._notify()
+
+    def _release_worker_slot(self):
+        # 同時実行数は num_threads で制限しているため、減らすだけで次の配布から反映される
+        self._notify()
+
+    def _add_worker_slots(self, count):
+        self._notify()
+
+    def _tenants_changed(self):
+        self._notify()
+
+    def _alive_workers(self):
+        return [self._thread] if self._thread is not None and self._thread.is_alive() else []
+
+
+class AsyncXYZIngestor:
+    """
+    watchdog のイベントをイベントループに渡し、ファイルの書き込み完了を非同期に待ってから取り込む。
+    (XYZHandler はファイルごとに time.sleep(1) するため、大量投入時に直列化される)
+    """
+
+    def __init__(self, config, scheduler, workflow_definition=None, tenant=None):
+        self.config = config
+        self.scheduler = scheduler # AsyncJobScheduler (イベントループを共有する)
+        self.workflow_definition = workflow_definition or WorkflowDefinition.from_config(config)
+        # この取り込みが監視する入力ディレクトリのテナント ([tenants])
+        self.tenant = tenant
+        self.settle_seconds = config.getfloat('orca', 'ingest_settle_seconds', fallback=1.0)
+        self.max_concurrent = config.getint('orca', 'ingest_concurrency', fallback=32)
+        self.logger = _async_logger
+        self._in_flight = set()
+        self._semaphore = None
+        self.event_handler = _ForwardingHandler(self)
+
+    def submit(self, path):
+        """watchdog のスレッドから呼ばれる。"""
+        loop = self.scheduler.loop
+        if loop is None or loop.is_closed() or not self.scheduler.accepting:
+            return
+        try:
+            loop.call_soon_threadsafe(self._schedule, path)
+        except RuntimeError:
+            pass
+
+    def _schedule(self, path):
+        if path in self._in_flight:
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._in_flight.add(path)
+        asyncio.ensure_future(self._ingest(path))
+
+    async def _ingest(self, path):
+        try:
+            async with self._semaphore:
+                if not await self._wait_until_settled(path):
+                    return
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(
+                    self.scheduler._pool, ingest_xyz_file,
+                    self.config, Path(path), self.scheduler, self.workflow_definition, self.tenant
+                )
+        except Exception as e:
+            self.logger.error(f"Error processing new XYZ file {Path(path).name}: {e}")
+        finally:
+            self._in_flight.discard(path)
+
+    async def _wait_until_settled(self, path):
+        """ファイルサイズと更新時刻が settle_seconds の間変化しなくなるまで待つ。"""
+        interval = min(0.2, self.settle_seconds) or 0.05
+        last, stable_since = None, time.monotonic()
+        while True:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return False
+            current = (stat.st_size, stat.st_mtime_ns)
+            now = time.monotonic()
+            if current != last:
+                last, stable_since = current, now
+            elif now - stable_since >= self.settle_seconds:
+                return True
+            await asyncio.sleep(interval)
+
+
+class _ForwardingHandler(FileSystemEventHandler):
+    def __init__(self, ingestor):
+        self.ingestor = ingestor
+
+    def on_created(self, event):
+        if not event.is_directory and event.src_path.lower().endswith('.xyz'):
+            self.ingestor.submit(event.src_path)
+
+    def on_moved(self, event):
+        # 一時ファイルからのリネームで投入された場合
+        if not event.is_directory and event.dest_path.lower().endswith('.xyz'):
+            self.ingestor.submit(event.dest_path)
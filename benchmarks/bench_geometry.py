@@ -0,0 +1,127 @@
+# benchmarks/bench_geometry.py
+"""
+Geometry の解析・入力生成のマイクロベンチマーク。
+
+使い方 (リポジトリのルートで実行):
+    python benchmarks/bench_geometry.py [--atoms 5000] [--conformers 2000] [--repeat 5]
+
+旧実装 (行ごとのリスト構築と文字列の += 連結) と比較した結果を表示する。
+"""
+import sys
+import time
+import argparse
+import configparser
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from geometry import Geometry # noqa: E402
+from orca_utils import parse_xyz, generate_orca_input, _parse_coordinate_block # noqa: E402
+
+
+# --- 比較用の旧実装 ---
+def legacy_parse_xyz(xyz_content):
+    lines = xyz_content.strip().split('\n')
+    atoms, coords = [], []
+    for line in lines[2:]:
+        parts = line.split()
+        if len(parts) >= 4:
+            try:
+                coords.append([float(parts[1]), float(parts[2]), float(parts[3])])
+                atoms.append(parts[0])
+            except ValueError:
+                continue
+    return atoms, coords
+
+
+def legacy_generate_orca_input(config, mol_name, atoms, coords, calc_type='opt'):
+    calc_keywords = f"OPT {config['orca'].get('method', 'B3LYP')} {config['orca'].get('basis', 'def2-SVP')} TightSCF"
+    if config['orca'].getboolean('use_rijcosx', fallback=False):
+        calc_keywords += " RIJCOSX"
+    config['orca'].get('solvent', '').strip()
+    input_content = f"""# ORCA Input generated by pipeline
+# Molecule: {mol_name} | Type: {calc_type}
+
+! {calc_keywords}
+
+%pal nprocs {config['orca']['nprocs']} end
+%maxcore {config['orca'].get('maxcore', '2000')}
+
+* xyz {config['orca']['charge']} {config['orca']['multiplicity']}
+"""
+    for atom, coord in zip(atoms, coords):
+        input_content += f"  {atom} {coord[0]:.6f} {coord[1]:.6f} {coord[2]:.6f}\n"
+    input_content += "*\n"
+    return input_content
+
+
+# --- 入力データ ---
+def make_xyz(n_atoms, seed=0):
+    rng = np.random.default_rng(seed)
+    elements = rng.choice(['C', 'H', 'N', 'O'], size=n_atoms)
+    coords = rng.uniform(-20.0, 20.0, size=(n_atoms, 3))
+    return Geometry(elements, coords).to_xyz(comment='benchmark')
+
+
+def make_config():
+    config = configparser.ConfigParser()
+    config.read_dict({'orca': {'nprocs': '4', 'maxcore': '2000', 'charge': '0', 'multiplicity': '1'}})
+    return config
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def report(name, new_seconds, old_seconds):
+    speedup = old_seconds / new_seconds if new_seconds else float('inf')
+    print(f"{name:<40} new {new_seconds * 1e3:9.2f} ms   legacy {old_seconds * 1e3:9.2f} ms   x{speedup:5.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--atoms', type=int, default=5000, help='atoms in the large cluster')
+    parser.add_argument('--conformers', type=int, default=2000, help='size of the small-molecule ensemble')
+    parser.add_argument('--conformer-atoms', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    config = make_config()
+
+    # 1. 大きなクラスター1つ
+    xyz = make_xyz(args.atoms)
+    geometry = parse_xyz(xyz)
+    atoms, coords = legacy_parse_xyz(xyz)
+    print(f"Cluster: {args.atoms} atoms")
+    report("parse_xyz", best_of(lambda: parse_xyz(xyz), args.repeat),
+           best_of(lambda: legacy_parse_xyz(xyz), args.repeat))
+    report("generate_orca_input",
+           best_of(lambda: generate_orca_input(config, 'cluster', geometry), args.repeat),
+           best_of(lambda: legacy_generate_orca_input(config, 'cluster', atoms, coords), args.repeat))
+
+    out_block = "\n".join(geometry.to_atom_lines())
+    report("_parse_coordinate_block (output side)",
+           best_of(lambda: _parse_coordinate_block(out_block), args.repeat),
+           best_of(lambda: legacy_parse_xyz("x\nx\n" + out_block), args.repeat))
+
+    # 2. 小分子のコンフォマーアンサンブル
+    ensemble = [make_xyz(args.conformer_atoms, seed=i) for i in range(args.conformers)]
+    print(f"\nEnsemble: {args.conformers} conformers x {args.conformer_atoms} atoms")
+    report("parse_xyz (ensemble)",
+           best_of(lambda: [parse_xyz(x) for x in ensemble], args.repeat),
+           best_of(lambda: [legacy_parse_xyz(x) for x in ensemble], args.repeat))
+    report("parse + generate (ensemble)",
+           best_of(lambda: [generate_orca_input(config, 'c', parse_xyz(x)) for x in ensemble], args.repeat),
+           best_of(lambda: [legacy_generate_orca_input(config, 'c', *legacy_parse_xyz(x)) for x in ensemble],
+                   args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,469 @@
+# benchmarks/bench_pipeline.py
+"""
+偽 ORCA (benchmarks/fake_orca/) を使ったパイプライン全体の負荷試験。
+
+一時ディレクトリに設定ファイルとフォルダを作り、main_coordinator を子プロセスとして起動して
+N 個の XYZ ファイルを流し、以下を報告する:
+
+    ingest rate              XYZ の投入から StateStore への登録までの速度
+    scheduling latency       ジョブ登録から ORCA プロセス開始までの待ち時間
+    state write amplification  StateStore の保存回数・書き込みバイト数 (ジョブあたり)
+    memory growth            コーディネーターの RSS の増加量
+    end-to-end throughput    全ジョブ終了までのジョブ数/秒と、ORCA 実行時間に対する効率
+
+使い方 (リポジトリのルートで実行):
+    python benchmarks/bench_pipeline.py --molecules 200 --workers 8 --runtime 0.2
+    python benchmarks/bench_pipeline.py --mode startup --molecules 2000 --runtime 0 --json-out bench.jsonl
+
+--mode watch   : コーディネーター起動後に input_dir へファイルを投入する (watchdog 経由)
+--mode startup : 起動前に input_dir に置いておく (process_existing_xyz_files 経由)
+--json-out を指定すると結果を1行の JSON として追記する (回帰の追跡用)。
+--tenants K を指定すると [tenants] の入力ディレクトリを K-1 個追加し、分子の --tenant-share を
+default テナントに先に投入してから残りを他のテナントに投入する (大量投入による飢餓の再現)。
+テナントごとのスケジューリング待ち時間を報告する。
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+FAKE_ORCA = BENCH_DIR / 'fake_orca' / 'orca'
+FAKE_SLURM = BENCH_DIR / 'fake_slurm'
+COORDINATOR = BENCH_DIR / 'instrumented_coordinator.py'
+
+TERMINAL_PREFIXES = ('COMPLETED', 'FAILED', 'PERMANENT_FAILED')
+ELEMENTS = ('C', 'H', 'N', 'O')
+ATOMIC_NUMBERS = {'H': 1, 'C': 6, 'N': 7, 'O': 8}
+# 取り込み時の検証 ([validation] min_distance) を通るよう、原子同士をこれ以上離す
+MIN_DISTANCE = 0.8
+
+
+# --- 入力の準備 ---
+def make_xyz(name, n_atoms, rng):
+    """
+    ランダムな構造の XYZ。[validation] を通るよう原子同士を MIN_DISTANCE 以上離し、
+    電子数を偶数 (charge 0, multiplicity 1 と整合) にする。
+    """
+    half_box = max(5.0, 0.6 * n_atoms ** (1 / 3) * MIN_DISTANCE * 2)
+    atoms = []
+    for index in range(n_atoms):
+        electrons = sum(ATOMIC_NUMBERS[symbol] for symbol, _ in atoms)
+        if index == n_atoms - 1:
+            element = rng.choice(('H', 'N') if electrons % 2 else ('C', 'O'))
+        else:
+            element = rng.choice(ELEMENTS)
+        while True:
+            position = tuple(rng.uniform(-half_box, half_box) for _ in range(3))
+            if all(sum((a - b) ** 2 for a, b in zip(position, other)) >= MIN_DISTANCE ** 2 for _, other in atoms):
+                break
+        atoms.append((element, position))
+    lines = [str(n_atoms), name]
+    lines.extend(f"{element} {x:.6f} {y:.6f} {z:.6f}" for element, (x, y, z) in atoms)
+    return "\n".join(lines) + "\n"
+
+
+def tenant_names(args):
+    return [f"t{index}" for index in range(1, args.tenants)]
+
+
+def tenant_config(folders, args):
+    names = tenant_names(args)
+    if not names:
+        return ""
+    sections = "".join(f"\n[tenants.{name}]\ninput_dir = {folders / f'input_{name}'}\n" for name in names)
+    return f"\n[tenants]\nnames = {', '.join(names)}\n{sections}"
+
+
+def assign_inputs(names, folders, args):
+    """分子名 -> 入力ディレクトリ (投入順: default テナントの分をすべて投入してから他のテナント)。"""
+    tenants = tenant_names(args)
+    if not tenants:
+        return {name: folders / 'input' for name in names}
+    bulk = max(1, min(len(names) - len(tenants), round(len(names) * args.tenant_share)))
+    inputs = {name: folders / 'input' for name in names[:bulk]}
+    for index, name in enumerate(names[bulk:]):
+        inputs[name] = folders / f"input_{tenants[index % len(tenants)]}"
+    return inputs
+
+
+def write_config(root, args):
+    folders = root / 'folders'
+    config = f"""[paths]
+input_dir = {folders / 'input'}
+waiting_dir = {folders / 'waiting'}
+working_dir = {folders / 'working'}
+products_dir = {folders / 'products'}
+state_dir = {folders / 'state'}
+quarantine_dir = {folders / 'quarantine'}
+
+[orca]
+orca_executable = {FAKE_ORCA}
+method = B3LYP
+basis = def2-SVP
+charge = 0
+multiplicity = 1
+nprocs = 1
+maxcore = 500
+max_parallel_jobs = {args.workers}
+max_retries = 2
+executor_backend = {args.backend}
+
+[products]
+compression = {args.compression}
+
+[packing]
+enabled = {'true' if args.packing else 'false'}
+max_atoms = {args.pack_max_atoms}
+max_jobs_per_pack = {args.pack_size}
+
+[ladder]
+enabled = {'true' if args.ladder else 'false'}
+methods = XTB2
+
+[numfreq]
+enabled = {'true' if args.numfreq else 'false'}
+
+[slurm]
+sbatch = {FAKE_SLURM / 'sbatch'}
+squeue = {FAKE_SLURM / 'squeue'}
+sacct = {FAKE_SLURM / 'sacct'}
+scancel = {FAKE_SLURM / 'scancel'}
+time_limit =
+batch_wait_seconds = 1
+poll_interval_seconds = 1
+""" + tenant_config(folders, args)
+    (root / 'config.txt').write_text(config)
+    for name in ('input', 'waiting', 'working', 'products', 'state') + tuple(f"input_{t}" for t in tenant_names(args)):
+        (folders / name).mkdir(parents=True, exist_ok=True)
+    return folders
+
+
+def bench_environment(root, args):
+    env = dict(os.environ)
+    env.update({
+        'PYTHONUNBUFFERED': '1',
+        'BENCH_METRICS_FILE': str(root / 'bench_metrics.json'),
+        'FAKE_ORCA_LOG': str(root / 'fake_orca_events.log'),
+        'FAKE_ORCA_RUNTIME': str(args.runtime),
+        'FAKE_ORCA_OUTPUT_KB': str(args.output_kb),
+        'FAKE_ORCA_OPT_CYCLES': str(args.opt_cycles),
+        'FAKE_ORCA_FAILURE_RATE': str(args.failure_rate),
+        'FAKE_ORCA_FAILURE_MODE': args.failure_mode,
+        'FAKE_ORCA_SEED': str(args.seed),
+        # --backend slurm: 偽 SLURM の状態はベンチマークごとの作業ディレクトリに置く
+        'FAKE_SLURM_DIR': str(root / 'fake_slurm_state'),
+        'FAKE_SLURM_CPUS': str(args.workers),
+    })
+    return env
+
+
+# --- 監視 ---
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # 書き込み途中の状態ファイルは次回に読み直す
+        return None
+
+
+def wait_for_log(log_path, text, timeout, process):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Coordinator exited early (code {process.returncode}); see {log_path}")
+        if log_path.exists() and text in log_path.read_text(errors='ignore'):
+            return
+        time.sleep(0.05)
+    raise TimeoutError(f"Coordinator did not report '{text}' within {timeout}s; see {log_path}")
+
+
+def is_terminal(status):
+    return str(status).startswith(TERMINAL_PREFIXES)
+
+
+def monitor(state_path, n_molecules, args):
+    """全分子が登録され、全ジョブが終了状態のまま settle 秒経過するまで待つ。"""
+    first_terminal_seen = {}
+    stable_since = None
+    deadline = time.time() + args.timeout
+    state = {}
+
+    while time.time() < deadline:
+        time.sleep(args.poll_interval)
+        snapshot = read_json(state_path)
+        if snapshot is None:
+            continue
+        state = snapshot
+        now = time.time()
+        for job_id, info in state.items():
+            if is_terminal(info.get('status')) and job_id not in first_terminal_seen:
+                first_terminal_seen[job_id] = now
+
+        molecules = {info.get('molecule') for info in state.values()}
+        done = len(molecules) >= n_molecules and all(is_terminal(i.get('status')) for i in state.values())
+        if not done:
+            stable_since = None
+        elif stable_since is None:
+            stable_since = now
+        elif now - stable_since >= args.settle:
+            return state, first_terminal_seen, True
+
+    return state, first_terminal_seen, False
+
+
+def read_orca_events(path):
+    """偽 ORCA のイベントログ -> {base: {'start': 最初の開始時刻, 'end': 最後の終了時刻, 'run': 合計実行時間}}"""
+    events = {}
+    if not path.exists():
+        return events
+    pending = {}
+    for line in path.read_text().splitlines():
+        parts = line.split()
+        if len(parts) < 3:
+            continue
+        stamp, kind, base = float(parts[0]), parts[1], parts[2]
+        record = events.setdefault(base, {'start': None, 'end': None, 'run': 0.0})
+        if kind == 'start':
+            record['start'] = stamp if record['start'] is None else min(record['start'], stamp)
+            pending[base] = stamp
+        elif kind == 'end':
+            record['end'] = stamp
+            if base in pending:
+                record['run'] += stamp - pending.pop(base)
+    return events
+
+
+# --- 集計 ---
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def registration_time(info):
+    try:
+        return datetime.fromisoformat(info['start_time']).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def summarize(args, state, terminal_seen, events, metrics, drop_times, started_at, ready_at, state_path):
+    jobs = len(state)
+    statuses = {}
+    for info in state.values():
+        key = str(info.get('status', '')).split(':')[0]
+        statuses[key] = statuses.get(key, 0) + 1
+
+    # ingest: 分子ごとの最初のジョブ登録時刻
+    registered = {}
+    for info in state.values():
+        stamp = registration_time(info)
+        # テナントの分子名は '<テナント>@<XYZ の名前>'
+        mol_name = str(info.get('molecule')).split('@', 1)[-1]
+        if stamp is not None and info.get('calc_type') == args.root_step:
+            registered[mol_name] = min(stamp, registered.get(mol_name, stamp))
+    # startup モードでは起動時に取り込まれるため、プロセス起動時刻を起点にする
+    ingest_origin = min(drop_times.values()) if drop_times else started_at
+    ingest_span = (max(registered.values()) - ingest_origin) if registered else float('nan')
+    ingest_latencies = [registered[m] - t for m, t in drop_times.items() if m in registered]
+
+    # scheduling latency: 登録 -> 偽 ORCA の開始
+    scheduling = []
+    by_tenant = {}
+    run_seconds = 0.0
+    for job_id, info in state.items():
+        record = events.get(Path(job_id).stem)
+        stamp = registration_time(info)
+        if record is None:
+            continue
+        run_seconds += record['run']
+        if record['start'] is not None and stamp is not None:
+            scheduling.append(max(0.0, record['start'] - stamp))
+            by_tenant.setdefault(info.get('tenant', 'default'), []).append(scheduling[-1])
+
+    makespan = (max(terminal_seen.values()) - ingest_origin) if terminal_seen else float('nan')
+    # インポート直後ではなく、起動完了後の RSS を基準にする
+    rss = [rss for stamp, rss in metrics.get('rss_samples', []) if stamp >= ready_at]
+    final_state_bytes = state_path.stat().st_size if state_path.exists() else 0
+    saves = metrics.get('state_saves', 0)
+
+    return {
+        'jobs': jobs,
+        'statuses': statuses,
+        'startup_seconds': ready_at - started_at,
+        'ingest_rate_per_s': len(registered) / ingest_span if ingest_span and ingest_span > 0 else float('nan'),
+        'ingest_latency_p50_s': percentile(ingest_latencies, 0.5),
+        'ingest_latency_max_s': max(ingest_latencies) if ingest_latencies else float('nan'),
+        'sched_latency_p50_s': percentile(scheduling, 0.5),
+        'sched_latency_p95_s': percentile(scheduling, 0.95),
+        'sched_latency_max_s': max(scheduling) if scheduling else float('nan'),
+        'state_saves': saves,
+        'state_saves_per_job': saves / jobs if jobs else float('nan'),
+        'state_bytes_written': metrics.get('state_bytes_written', 0),
+        'state_write_amplification': (metrics.get('state_bytes_written', 0) / final_state_bytes
+                                      if final_state_bytes else float('nan')),
+        'state_save_seconds': metrics.get('state_save_seconds', 0.0),
+        'rss_start_mb': rss[0] / 2**20 if rss else float('nan'),
+        'rss_peak_mb': max(rss) / 2**20 if rss else float('nan'),
+        'rss_growth_mb': (rss[-1] - rss[0]) / 2**20 if rss else float('nan'),
+        'makespan_s': makespan,
+        'throughput_jobs_per_s': jobs / makespan if makespan and makespan > 0 else float('nan'),
+        # ORCA の実行時間をワーカー数で割った理想値に対する効率 (1.0 = オーバーヘッドなし)
+        'worker_efficiency': (run_seconds / args.workers) / makespan if makespan and makespan > 0 else float('nan'),
+        'tenant_sched_latency_s': {
+            tenant: {'jobs': len(values), 'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95)}
+            for tenant, values in sorted(by_tenant.items())
+        } if args.tenants > 1 else {},
+    }
+
+
+def print_report(args, summary, completed):
+    print(f"\nPipeline benchmark: {args.molecules} molecules x {args.atoms} atoms, {args.workers} workers, "
+          f"backend={args.backend}, mode={args.mode}, runtime={args.runtime}s, packing={'on' if args.packing else 'off'}"
+          f"{', ladder=on' if args.ladder else ''}")
+    if not completed:
+        print(f"WARNING: timed out after {args.timeout}s; results are partial.")
+    print(f"  jobs                      {summary['jobs']}  {summary['statuses']}")
+    print(f"  coordinator start-up      {summary['startup_seconds']:.2f} s")
+    print(f"  ingest rate               {summary['ingest_rate_per_s']:.1f} molecules/s "
+          f"(latency p50 {summary['ingest_latency_p50_s']:.3f} s, max {summary['ingest_latency_max_s']:.3f} s)")
+    print(f"  scheduling latency        p50 {summary['sched_latency_p50_s']:.3f} s, "
+          f"p95 {summary['sched_latency_p95_s']:.3f} s, max {summary['sched_latency_max_s']:.3f} s")
+    print(f"  state store               {summary['state_saves']} saves ({summary['state_saves_per_job']:.1f}/job), "
+          f"{summary['state_bytes_written'] / 2**20:.1f} MB written "
+          f"(x{summary['state_write_amplification']:.0f} of final size), "
+          f"{summary['state_save_seconds']:.2f} s spent saving")
+    print(f"  memory                    start {summary['rss_start_mb']:.1f} MB, peak {summary['rss_peak_mb']:.1f} MB, "
+          f"growth {summary['rss_growth_mb']:+.1f} MB")
+    print(f"  end-to-end                {summary['makespan_s']:.2f} s, "
+          f"{summary['throughput_jobs_per_s']:.2f} jobs/s, worker efficiency {summary['worker_efficiency']:.0%}")
+    for tenant, latency in summary['tenant_sched_latency_s'].items():
+        print(f"  tenant {tenant:<18} {latency['jobs']} jobs, scheduling latency p50 {latency['p50']:.3f} s, "
+              f"p95 {latency['p95']:.3f} s")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- 実行 ---
+def run(args):
+    root = Path(args.workdir).resolve() if args.workdir else Path(tempfile.mkdtemp(prefix='orca_bench_'))
+    root.mkdir(parents=True, exist_ok=True)
+    folders = write_config(root, args)
+    state_path = folders / 'state' / 'state_store.json'
+    log_path = root / 'coordinator.log'
+    rng = random.Random(args.seed)
+    names = [f"mol{i:06d}" for i in range(args.molecules)]
+    input_dirs = assign_inputs(names, folders, args)
+
+    if args.mode == 'startup':
+        for name in names:
+            (input_dirs[name] / f"{name}.xyz").write_text(make_xyz(name, args.atoms, rng))
+
+    drop_times = {}
+    started_at = time.time()
+    with open(log_path, 'w') as log_file:
+        process = subprocess.Popen([sys.executable, str(COORDINATOR)], cwd=root, env=bench_environment(root, args),
+                                   stdout=log_file, stderr=subprocess.STDOUT)
+    try:
+        wait_for_log(log_path, "Watching for XYZ files", args.timeout, process)
+        ready_at = time.time()
+
+        if args.mode == 'watch':
+            interval = 1.0 / args.drop_rate if args.drop_rate > 0 else 0.0
+            for name in names:
+                content = make_xyz(name, args.atoms, rng)
+                drop_times[name] = time.time()
+                (input_dirs[name] / f"{name}.xyz").write_text(content)
+                if interval:
+                    time.sleep(interval)
+
+        state, terminal_seen, completed = monitor(state_path, args.molecules, args)
+    finally:
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    metrics = read_json(root / 'bench_metrics.json') or {}
+    events = read_orca_events(root / 'fake_orca_events.log')
+    summary = summarize(args, state, terminal_seen, events, metrics, drop_times, started_at, ready_at, state_path)
+    print_report(args, summary, completed)
+
+    if args.json_out:
+        record = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'completed': completed,
+            'params': {k: v for k, v in vars(args).items() if k not in ('json_out', 'workdir', 'keep')},
+            'results': summary,
+        }
+        with open(args.json_out, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+
+    if args.keep or args.workdir:
+        print(f"\nBenchmark directory kept: {root}")
+    else:
+        shutil.rmtree(root, ignore_errors=True)
+    return 0 if completed else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--molecules', type=int, default=100)
+    parser.add_argument('--atoms', type=int, default=12, help='atoms per molecule')
+    parser.add_argument('--workers', type=int, default=4, help='max_parallel_jobs')
+    parser.add_argument('--backend', choices=('thread', 'asyncio', 'slurm'), default='thread',
+                        help='[orca] executor_backend (slurm uses benchmarks/fake_slurm)')
+    parser.add_argument('--mode', choices=('watch', 'startup'), default='watch')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='XYZ files per second in watch mode (0 = all at once)')
+    parser.add_argument('--runtime', type=float, default=0.2, help='fake ORCA seconds per job')
+    parser.add_argument('--output-kb', type=float, default=64, help='fake ORCA output size per job')
+    parser.add_argument('--opt-cycles', type=int, default=5)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--failure-mode', default='scf', choices=('scf', 'noconv', 'memory', 'input', 'crash', 'mixed'))
+    parser.add_argument('--compression', default='gzip', choices=('gzip', 'zstd', 'none'))
+    parser.add_argument('--packing', action='store_true', help='enable [packing] for small molecules')
+    parser.add_argument('--pack-max-atoms', type=int, default=12)
+    parser.add_argument('--pack-size', type=int, default=16)
+    parser.add_argument('--ladder', action='store_true', help='enable the [ladder] XTB2 pre-optimization for opt jobs')
+    parser.add_argument('--numfreq', action='store_true',
+                        help='split freq jobs into numerical-frequency gradient jobs ([numfreq])')
+    parser.add_argument('--tenants', type=int, default=1,
+                        help='number of [tenants] input directories (1 = only [paths] input_dir)')
+    parser.add_argument('--tenant-share', type=float, default=0.8,
+                        help='fraction of molecules dropped first into the default tenant (with --tenants)')
+    parser.add_argument('--root-step', default='opt', help='first workflow step (used for ingest timing)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--settle', type=float, default=2.0, help='seconds all jobs must stay terminal')
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    parser.add_argument('--workdir', help='run in this directory instead of a temporary one (kept afterwards)')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary directory')
+    parser.add_argument('--json-out', help='append the results as one JSON line to this file')
+    return run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
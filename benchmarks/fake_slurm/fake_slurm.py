@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# benchmarks/fake_slurm/fake_slurm.py
+"""
+クラスタなしで SLURM バックエンドを試すための、ローカルで動く偽 SLURM。
+
+同じディレクトリの sbatch / squeue / sacct / scancel はこのスクリプトを呼び出す。
+[slurm] の各コマンドをこれらに向けるか、このディレクトリを PATH の先頭に置いて使う。
+
+対応しているもの (slurm_backend.py が使う範囲):
+    sbatch --parsable [--array=0-N[%M]] script    (#SBATCH 行も解釈する)
+    squeue --noheader --array --format=%i|%T --jobs=ID,...
+    sacct  --noheader --parsable2 --allocations --format=JobID,State,ExitCode --jobs=ID,...
+    scancel [--signal=SIG] [--full] [--state=PENDING] ID[_TASK] ...
+
+ジョブの状態は FAKE_SLURM_DIR (既定: <tmp>/fake_slurm_<uid>) に保存される。
+    FAKE_SLURM_CPUS        同時に実行するタスク数 (既定: CPU 数)
+    FAKE_SLURM_TIME_LIMIT  タスクの実行時間の上限 [秒] (既定: --time の値、なければ無制限)
+    FAKE_SLURM_QUEUE_DELAY 投入からタスク開始までの待ち時間 [秒] (既定 0)
+"""
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import signal
+import tempfile
+import subprocess
+from pathlib import Path
+
+STATE_DIR = Path(os.environ.get('FAKE_SLURM_DIR', Path(tempfile.gettempdir()) / f"fake_slurm_{os.getuid()}"))
+ACTIVE_STATES = ('PENDING', 'RUNNING', 'COMPLETING')
+
+
+# --- 状態の保存 ---
+def task_path(job_id, task_id):
+    return STATE_DIR / 'jobs' / str(job_id) / f"{task_id}.json"
+
+
+def write_task(job_id, task_id, **fields):
+    path = task_path(job_id, task_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    record = read_task(job_id, task_id) or {}
+    record.update(fields)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f)
+    os.replace(tmp_path, path)
+    return record
+
+
+def read_task(job_id, task_id):
+    try:
+        with open(task_path(job_id, task_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def job_tasks(job_id):
+    job_dir = STATE_DIR / 'jobs' / str(job_id)
+    if not job_dir.is_dir():
+        return []
+    tasks = []
+    for path in job_dir.glob('*.json'):
+        if not path.stem.isdigit():
+            continue # spec.json
+        record = read_task(job_id, path.stem)
+        if record is not None:
+            tasks.append((int(path.stem), record))
+    return sorted(tasks)
+
+
+def next_job_id():
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    counter = STATE_DIR / 'next_job_id'
+    with open(counter, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        value = int(f.read().strip() or 1000)
+        f.seek(0)
+        f.truncate()
+        f.write(str(value + 1))
+    return value
+
+
+def parse_job_ids(values):
+    """'123,124_5' のような指定を [(job_id, task_id or None)] にする。"""
+    ids = []
+    for value in values:
+        for item in value.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            job_id, _, task_id = item.partition('_')
+            ids.append((int(job_id), int(task_id) if task_id.isdigit() else None))
+    return ids
+
+
+def option(args, *names, default=None):
+    """'--name=value' / '--name value' / '-n value' 形式のオプションを取り出す。"""
+    for index, arg in enumerate(args):
+        for name in names:
+            if arg.startswith(name + '='):
+                return arg.split('=', 1)[1]
+            if arg == name and index + 1 < len(args):
+                return args[index + 1]
+    return default
+
+
+def parse_time_limit(value):
+    """SLURM の --time (MM, MM:SS, HH:MM:SS, D-HH:MM:SS) を秒にする。"""
+    if not value:
+        return None
+    days = 0
+    if '-' in value:
+        day_part, value = value.split('-', 1)
+        days = int(day_part)
+    parts = [int(p) for p in value.split(':')]
+    if len(parts) == 1:
+        seconds = parts[0] * 60
+    elif len(parts) == 2:
+        seconds = parts[0] * 60 + parts[1]
+    else:
+        seconds = parts[0] * 3600 + parts[1] * 60 + parts[2]
+    return days * 86400 + seconds
+
+
+# --- コマンド ---
+def cmd_sbatch(args):
+    script = next((a for a in reversed(args) if not a.startswith('-')), None)
+    if script is None or not os.path.exists(script):
+        print("sbatch: error: Unable to open file", file=sys.stderr)
+        return 1
+
+    with open(script) as f:
+        script_text = f.read()
+    directives = []
+    for line in script_text.splitlines():
+        if line.startswith('#SBATCH'):
+            directives.extend(line[len('#SBATCH'):].split())
+    options = directives + args
+
+    array = option(options, '--array', '-a', default='0')
+    match = re.match(r"^(\d+)(?:-(\d+))?(?:%(\d+))?$", array)
+    if not match:
+        print(f"sbatch: error: invalid --array specification {array}", file=sys.stderr)
+        return 1
+    first, last = int(match.group(1)), int(match.group(2) or match.group(1))
+    throttle = int(match.group(3)) if match.group(3) else None
+
+    job_id = next_job_id()
+    spec = {
+        'script': os.path.abspath(script),
+        'cwd': os.getcwd(),
+        'output': option(options, '--output', '-o', default='slurm-%A_%a.out'),
+        'time_limit': parse_time_limit(option(options, '--time', '-t')),
+        'throttle': throttle,
+        'tasks': list(range(first, last + 1)),
+        'submitted': time.time(),
+    }
+    job_dir = STATE_DIR / 'jobs' / str(job_id)
+    job_dir.mkdir(parents=True, exist_ok=True)
+    with open(job_dir / 'spec.json', 'w') as f:
+        json.dump(spec, f)
+    for task_id in spec['tasks']:
+        write_task(job_id, task_id, state='PENDING', exit_code='0:0')
+
+    # タスクを実行するスーパーバイザーをバックグラウンドで起動する
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '_run_array', str(job_id)],
+        cwd=spec['cwd'], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+    if '--parsable' in args:
+        print(job_id)
+    else:
+        print(f"Submitted batch job {job_id}")
+    return 0
+
+
+def cmd_run_array(args):
+    """sbatch から起動され、配列ジョブのタスクをローカルで実行する。"""
+    job_id = int(args[0])
+    with open(STATE_DIR / 'jobs' / str(job_id) / 'spec.json') as f:
+        spec = json.load(f)
+
+    max_running = int(os.environ.get('FAKE_SLURM_CPUS', os.cpu_count() or 1))
+    if spec['throttle']:
+        max_running = min(max_running, spec['throttle'])
+    time_limit = float(os.environ.get('FAKE_SLURM_TIME_LIMIT', 0)) or spec['time_limit']
+    time.sleep(float(os.environ.get('FAKE_SLURM_QUEUE_DELAY', 0)))
+
+    pending = list(spec['tasks'])
+    running = {}
+    while pending or running:
+        while pending and len(running) < max_running:
+            task_id = pending.pop(0)
+            record = read_task(job_id, task_id)
+            if record is None or record.get('state') != 'PENDING':
+                continue # 開始前に取り消された
+            output = (spec['output'].replace('%A', str(job_id)).replace('%a', str(task_id))
+                      .replace('%j', str(job_id)))
+            env = dict(os.environ, SLURM_JOB_ID=str(job_id), SLURM_ARRAY_JOB_ID=str(job_id),
+                       SLURM_ARRAY_TASK_ID=str(task_id))
+            with open(os.path.join(spec['cwd'], output), 'w') as out_f:
+                process = subprocess.Popen(['bash', spec['script']], cwd=spec['cwd'], env=env,
+                                           stdout=out_f, stderr=subprocess.STDOUT, start_new_session=True)
+            write_task(job_id, task_id, state='RUNNING', pid=process.pid, started=time.time())
+            running[task_id] = (process, time.time())
+
+        time.sleep(0.05)
+        for task_id, (process, started) in list(running.items()):
+            returncode = process.poll()
+            if returncode is None:
+                if time_limit and time.time() - started > time_limit:
+                    write_task(job_id, task_id, timed_out=True)
+                    os.killpg(process.pid, signal.SIGTERM)
+                continue
+
+            record = read_task(job_id, task_id) or {}
+            if record.get('timed_out'):
+                state = 'TIMEOUT'
+            elif record.get('cancel_requested'):
+                state = 'CANCELLED'
+            elif returncode == 0:
+                state = 'COMPLETED'
+            else:
+                state = 'FAILED'
+            exit_code = f"{returncode}:0" if returncode >= 0 else f"0:{-returncode}"
+            write_task(job_id, task_id, state=state, exit_code=exit_code, ended=time.time())
+            del running[task_id]
+    return 0
+
+
+def cmd_squeue(args):
+    ids = parse_job_ids([option(args, '--jobs', '-j', default='')])
+    for job_id, task_filter in ids:
+        for task_id, record in job_tasks(job_id):
+            if task_filter is not None and task_id != task_filter:
+                continue
+            if record.get('state') in ACTIVE_STATES:
+                print(f"{job_id}_{task_id}|{record['state']}")
+    return 0
+
+
+def cmd_sacct(args):
+    ids = parse_job_ids([option(args, '--jobs', '-j', default='')])
+    for job_id, task_filter in ids:
+        for task_id, record in job_tasks(job_id):
+            if task_filter is not None and task_id != task_filter:
+                continue
+            print(f"{job_id}_{task_id}|{record.get('state')}|{record.get('exit_code', '0:0')}")
+    return 0
+
+
+def cmd_scancel(args):
+    sig_name = option(args, '--signal', '-s')
+    only_state = option(args, '--state', '-t')
+    targets = [a for a in args if re.match(r"^\d+(_\d+)?$", a)]
+    for job_id, task_filter in parse_job_ids(targets):
+        for task_id, record in job_tasks(job_id):
+            if task_filter is not None and task_id != task_filter:
+                continue
+            state = record.get('state')
+            if only_state and state != only_state.upper():
+                continue
+            if state == 'PENDING' and not sig_name:
+                write_task(job_id, task_id, state='CANCELLED', exit_code='0:0', ended=time.time())
+            elif state == 'RUNNING' and record.get('pid'):
+                sig = getattr(signal, f"SIG{sig_name.upper().replace('SIG', '')}") if sig_name else signal.SIGTERM
+                if not sig_name:
+                    write_task(job_id, task_id, cancel_requested=True)
+                try:
+                    os.killpg(record['pid'], sig)
+                except ProcessLookupError:
+                    pass
+    return 0
+
+
+COMMANDS = {
+    'sbatch': cmd_sbatch,
+    'squeue': cmd_squeue,
+    'sacct': cmd_sacct,
+    'scancel': cmd_scancel,
+    '_run_array': cmd_run_array,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(f"usage: fake_slurm.py {{{','.join(c for c in COMMANDS if not c.startswith('_'))}}} ...", file=sys.stderr)
+        sys.exit(2)
+    sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
@@ -0,0 +1,83 @@
+# benchmarks/instrumented_coordinator.py
+"""
+bench_pipeline.py から起動される main_coordinator のラッパー。
+
+StateStore の状態ファイルの書き込み回数 ([io] fsync = group ではまとめた後の回数)・
+書き込みバイト数・書き込み時間を数え、プロセスの RSS と合わせて
+BENCH_METRICS_FILE (JSON) に定期的に書き出してから main_coordinator.main() を実行する。
+パイプラインのコードは変更しない (計測用のラッパーのみ)。
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import state_store # noqa: E402
+
+METRICS_FILE = os.environ.get('BENCH_METRICS_FILE', 'bench_metrics.json')
+SAMPLE_INTERVAL = float(os.environ.get('BENCH_SAMPLE_INTERVAL', 0.5))
+
+_metrics = {
+    'state_saves': 0,
+    'state_bytes_written': 0,
+    'state_save_seconds': 0.0,
+    'rss_samples': [],
+}
+_metrics_lock = threading.Lock()
+_original_write_state = state_store.StateStore._write_state
+
+
+def _counted_write_state(self, fsync=None):
+    started = time.perf_counter()
+    _original_write_state(self, fsync)
+    elapsed = time.perf_counter() - started
+    try:
+        size = self.state_file.stat().st_size
+    except OSError:
+        size = 0
+    with _metrics_lock:
+        _metrics['state_saves'] += 1
+        _metrics['state_bytes_written'] += size
+        _metrics['state_save_seconds'] += elapsed
+
+
+state_store.StateStore._write_state = _counted_write_state
+
+
+def current_rss_bytes():
+    """現在の RSS (Linux は /proc、それ以外は ru_maxrss で代用)。"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def dump_metrics():
+    with _metrics_lock:
+        _metrics['rss_samples'].append((time.time(), current_rss_bytes()))
+        snapshot = dict(_metrics, threads=threading.active_count(), written_at=time.time())
+    tmp_path = f"{METRICS_FILE}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, METRICS_FILE)
+
+
+def _sampler():
+    while True:
+        dump_metrics()
+        time.sleep(SAMPLE_INTERVAL)
+
+
+if __name__ == '__main__':
+    atexit.register(dump_metrics)
+    threading.Thread(target=_sampler, daemon=True).start()
+
+    import main_coordinator
+    main_coordinator.main()
@@ -0,0 +1,167 @@
+# config_reload.py
+import os
+import threading
+from pathlib import Path
+
+# --- 依存関係のインポート ---
+from config_utils import load_config, validate_config
+from logging_utils import get_logger
+
+_reload_logger = get_logger('config_reload')
+
+# 実行中に変更できない設定 (セクション, オプション)。オプションが None ならセクション全体。
+# 再読み込みでは古い値を残し、変更されていれば再起動が必要である旨を警告する。
+RESTART_REQUIRED = (
+    ('paths', None),
+    ('orca', 'executor_backend'),
+    ('orca', 'post_processing_threads'),
+    ('watcher', 'mode'),
+    ('tenants', 'names'),
+    ('status_api', None),
+)
+
+
+def _restart_required(section, option):
+    return any(section == s and (o is None or option == o) for s, o in RESTART_REQUIRED)
+
+
+def _options(config, section):
+    if not config.has_section(section):
+        return {}
+    return {option: config.get(section, option, raw=True) for option in config.options(section)}
+
+
+def diff_config(old, new):
+    """
+    Returns: 変更のリスト [(section, option, 古い値, 新しい値)] (値が無い場合は None)
+    """
+    changes = []
+    for section in sorted(set(old.sections()) | set(new.sections())):
+        old_options, new_options = _options(old, section), _options(new, section)
+        for option in sorted(set(old_options) | set(new_options)):
+            if old_options.get(option) != new_options.get(option):
+                changes.append((section, option, old_options.get(option), new_options.get(option)))
+    return changes
+
+
+def apply_config_changes(config, changes):
+    """
+    変更を config (各コンポーネントが参照している同じ ConfigParser) にその場で反映する。
+    セクションを丸ごと置き換えると、読み込み中の他スレッドから一時的にオプションが見えなくなるため、
+    オプション単位で上書き・削除する。
+    """
+    for section, option, _, value in changes:
+        if value is None:
+            config.remove_option(section, option)
+            if not config.options(section):
+                config.remove_section(section)
+            continue
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, option, value)
+
+
+class ConfigReloader:
+    """
+    設定ファイルを再読み込みし、実行中のパイプラインに反映するクラス。
+
+    - SIGHUP (request_reload) または設定ファイルの mtime の変化で再読み込みする
+    - 新しい設定は validate_config で検証し、不正なら何も変更せずに古い設定で動き続ける
+    - 変更は共有の ConfigParser にその場で反映されるため、.inp の生成など都度 config を読む処理は
+      次の呼び出しから新しい値を使う。値をキャッシュしているコンポーネントは register() した
+      コールバック (apply_config など) で更新する
+    - [paths] などの RESTART_REQUIRED は古い値のまま残す
+
+    実行中のジョブには影響しない (同時実行数を減らす場合も、実行中のジョブの終了を待つ)。
+    """
+
+    def __init__(self, config, config_path, watch_interval=None):
+        self.config = config
+        self.config_path = Path(config_path)
+        if watch_interval is None:
+            watch_interval = config.getfloat('reload', 'watch_interval_seconds', fallback=5.0)
+        self.watch_interval = watch_interval
+        self.logger = _reload_logger
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._requested = threading.Event()
+        self._stop = threading.Event()
+        self._mtime_ns = self._current_mtime()
+        self._thread = threading.Thread(target=self._run, name='config-reloader', daemon=True)
+
+    def register(self, callback):
+        """再読み込みの反映後に callback(config) を呼ぶ。"""
+        self._callbacks.append(callback)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._requested.set()
+
+    def join(self, timeout=None):
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def request_reload(self):
+        """シグナルハンドラから呼ばれる。実際の再読み込みは監視スレッドで行う。"""
+        self._requested.set()
+
+    def _current_mtime(self):
+        try:
+            return os.stat(self.config_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            # watch_interval が 0 の場合は SIGHUP でのみ再読み込みする
+            self._requested.wait(self.watch_interval if self.watch_interval > 0 else None)
+            if self._stop.is_set():
+                break
+            requested = self._requested.is_set()
+            self._requested.clear()
+            mtime_ns = self._current_mtime()
+            if requested or (mtime_ns is not None and mtime_ns != self._mtime_ns):
+                self._mtime_ns = mtime_ns
+                self.reload()
+
+    def reload(self):
+        """
+        設定ファイルを読み直して反映する。
+        Returns: 反映した変更のリスト。検証に失敗した場合は None
+        """
+        with self._lock:
+            try:
+                new_config = load_config(self.config_path)
+                validate_config(new_config)
+            except Exception as e:
+                self.logger.error(f"Configuration reload rejected; keeping the current settings: {e}")
+                return None
+
+            changes = []
+            for section, option, old, new in diff_config(self.config, new_config):
+                if _restart_required(section, option):
+                    self.logger.warning(
+                        f"[{section}] {option} changed ({old!r} -> {new!r}) but requires a restart; ignored."
+                    )
+                    continue
+                changes.append((section, option, old, new))
+            if not changes:
+                self.logger.info("Configuration reloaded; no applicable changes.")
+                return []
+
+            apply_config_changes(self.config, changes)
+            for section, option, old, new in changes:
+                if section == 'gmail' and 'password' in option:
+                    old, new = old and '***', new and '***'
+                self.logger.info(f"Config [{section}] {option}: {old!r} -> {new!r}")
+
+            for callback in self._callbacks:
+                try:
+                    callback(self.config)
+                except Exception as e:
+                    self.logger.error(f"Failed to apply reloaded configuration ({callback!r}): {e}")
+            self.logger.info(f"Configuration reloaded from {self.config_path} ({len(changes)} changes applied).")
+            return changes
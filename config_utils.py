@@ -18,3 +18,75 @@ def load_config(config_path='config.txt'):
         raise ValueError("Configuration must contain 'paths' and 'orca' sections.")
         
     return config
+
+
+# 整数でなければならない設定 (セクション, オプション, 最小値)
+_INT_OPTIONS = (
+    ('orca', 'nprocs', 1),
+    ('orca', 'maxcore', 1),
+    ('orca', 'max_parallel_jobs', 1),
+    ('orca', 'max_retries', 0),
+    ('notification', 'min_interval', 0),
+    ('numfreq', 'nprocs', 1),
+    ('orca', 'multiplicity', 1),
+)
+_FLOAT_OPTIONS = (
+    ('orca', 'timeout_seconds'),
+    ('orca', 'resource_sample_interval_seconds'),
+    ('shutdown', 'drain_timeout_seconds'),
+    ('shutdown', 'kill_grace_seconds'),
+    ('watcher', 'poll_interval_seconds'),
+    ('watcher', 'rescan_interval_seconds'),
+    ('disk', 'min_free_gb'),
+    ('disk', 'check_interval_seconds'),
+    ('profiling', 'interval_ms'),
+    ('profiling', 'flush_interval_seconds'),
+    ('profiling', 'slow_lock_ms'),
+    ('numfreq', 'step_bohr'),
+    ('validation', 'min_distance'),
+)
+
+
+def validate_config(config):
+    """
+    設定値の型と範囲、ワークフロー定義を検証します (設定の再読み込み前のチェック)。
+    問題があればすべてをまとめて ValueError を送出します。
+    """
+    errors = []
+    for section, option, minimum in _INT_OPTIONS:
+        if config.has_option(section, option):
+            try:
+                if config.getint(section, option) < minimum:
+                    errors.append(f"[{section}] {option} must be >= {minimum}")
+            except ValueError:
+                errors.append(f"[{section}] {option} must be an integer")
+    for section, option in _FLOAT_OPTIONS:
+        if config.has_option(section, option):
+            try:
+                config.getfloat(section, option)
+            except ValueError:
+                errors.append(f"[{section}] {option} must be a number")
+    if not config.has_option('orca', 'max_parallel_jobs'):
+        errors.append("[orca] max_parallel_jobs is required")
+
+    # 循環インポートを避けるため、ここでインポートする
+    from workflow import WorkflowDefinition
+    try:
+        WorkflowDefinition.from_config(config)
+    except ValueError as e:
+        errors.append(f"invalid workflow: {e}")
+
+    from tenants import tenants_from_config
+    try:
+        tenants_from_config(config)
+    except ValueError as e:
+        errors.append(f"invalid tenants: {e}")
+
+    from input_validator import InputValidator
+    try:
+        InputValidator(config)
+    except ValueError as e:
+        errors.append(f"invalid validation settings: {e}")
+
+    if errors:
+        raise ValueError('; '.join(errors))
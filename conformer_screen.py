@@ -0,0 +1,323 @@
+# conformer_screen.py
+import re
+import json
+import time
+import signal
+import shutil
+import threading
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from pipeline_utils import ensure_directory, safe_write # I/Oユーティリティ
+from orca_utils import check_orca_output, extract_results # ORCAユーティリティ
+from orca_job_manager import signal_process_group
+
+_screen_logger = get_logger('conformer_screen')
+
+HARTREE_TO_KCAL = 627.509474
+# CREST などが XYZ のコメント行に書くエネルギー (Eh)
+_COMMENT_ENERGY_PATTERN = re.compile(r"^\s*(?:energy[:=]?\s*)?(-\d+\.\d+)\b", re.IGNORECASE)
+
+
+def kabsch_rmsd(reference, candidates):
+    """
+    reference (N, 3) と candidates (M, N, 3) の、最適な重ね合わせ (Kabsch) 後の RMSD を
+    M 個まとめて計算する。回転行列は求めず、共分散行列の特異値から RMSD を直接得る。
+    Returns: shape (M,) の配列 (Å)
+    """
+    reference = reference - reference.mean(axis=0)
+    candidates = candidates - candidates.mean(axis=1, keepdims=True)
+    covariance = np.einsum('ni,mnj->mij', reference, candidates)
+    u, singular, vt = np.linalg.svd(covariance)
+    # 鏡映になる場合は最小の特異値の符号を反転する (回転のみで重ね合わせる)
+    reflection = np.linalg.det(u) * np.linalg.det(vt) < 0
+    singular[reflection, -1] *= -1
+    squared = (reference ** 2).sum() + (candidates ** 2).sum(axis=(1, 2)) - 2.0 * singular.sum(axis=1)
+    return np.sqrt(np.maximum(squared, 0.0) / len(reference))
+
+
+def deduplicate(geometries, threshold, order=None, heavy_atoms_only=True):
+    """
+    RMSD が threshold 以下の構造を重複とみなし、order の順 (既定: 入力順) に先に現れたものを残す。
+    原子の並びが異なる構造同士は比較しない (別の分子とみなす)。
+    Returns: (残した添字のリスト, {重複の添字: 残した構造の添字, RMSD})
+    """
+    order = list(range(len(geometries))) if order is None else list(order)
+    groups = {}
+    for index in order:
+        groups.setdefault(tuple(geometries[index].elements.tolist()), []).append(index)
+
+    kept, duplicates = [], {}
+    for elements, indices in groups.items():
+        mask = np.array([symbol.upper() != 'H' for symbol in elements])
+        if not heavy_atoms_only or mask.sum() < 3:
+            mask[:] = True
+        coords = np.stack([geometries[index].coords[mask] for index in indices])
+        group_kept = []
+        for position, index in enumerate(indices):
+            if group_kept:
+                rmsd = kabsch_rmsd(coords[position], coords[group_kept])
+                nearest = int(np.argmin(rmsd))
+                if rmsd[nearest] <= threshold:
+                    duplicates[index] = (indices[group_kept[nearest]], float(rmsd[nearest]))
+                    continue
+            group_kept.append(position)
+        kept.extend(indices[position] for position in group_kept)
+
+    rank = {index: position for position, index in enumerate(order)}
+    return sorted(kept, key=rank.get), duplicates
+
+
+def comment_energy(comment):
+    """XYZ のコメント行がエネルギー (Eh) のみの場合はその値を返す。"""
+    match = _COMMENT_ENERGY_PATTERN.match(comment or '')
+    return float(match.group(1)) if match else None
+
+
+class ScreeningInterrupted(Exception):
+    """シャットダウンで前最適化が中断された。XYZ は入力ディレクトリに残し、次回起動時に取り込み直す。"""
+
+
+class ConformerScreen:
+    """
+    コンフォマーアンサンブル (複数フレームの XYZ、CREST の crest_conformers.xyz など) を
+    DFT ジョブの登録前に絞り込むクラス ([prescreen] enabled = true の場合)。
+
+    1. RMSD (Kabsch による重ね合わせ後、既定では水素を除く) で重複する構造を除く
+    2. preopt_method を設定した場合、残った構造を安価な方法 (XTB2, HF-3c など) で前最適化し、
+       最適化後の構造で再び重複を除く。設定しない場合はコメント行のエネルギーがあれば使う
+    3. 最安定の構造からの energy_window_kcal 以内、エネルギーの低い順に max_conformers 個まで残す
+
+    前最適化は、すべての取り込みスレッドを合わせて同時に preopt_parallel 個までに制限し、
+    preopt_timeout_seconds を過ぎたものは終了させる。stop() (ドレイン) で実行中のものを終了させる。
+    結果は products_dir/<名前>/<名前>_prescreen.json に記録する。
+    """
+
+    def __init__(self, config):
+        self.logger = _screen_logger
+        self.stopping = False
+        # 実行中の前最適化のプロセスと、同時実行数の制限
+        self._slots = threading.Condition()
+        self._active = 0
+        self._processes = set()
+        self._load_options(config)
+
+    def apply_config(self, config):
+        """設定の再読み込み。実行中の前最適化はそのまま続行し、以降の前最適化に反映する。"""
+        self._load_options(config)
+        with self._slots:
+            self._slots.notify_all()
+
+    def _load_options(self, config):
+        self.config = config
+        self.enabled = config.getboolean('prescreen', 'enabled', fallback=False)
+        self.rmsd_threshold = config.getfloat('prescreen', 'rmsd_threshold', fallback=0.125)
+        self.heavy_atoms_only = config.getboolean('prescreen', 'heavy_atoms_only', fallback=True)
+        self.preopt_method = config.get('prescreen', 'preopt_method', fallback='').strip()
+        self.preopt_keywords = config.get('prescreen', 'preopt_keywords', fallback='Opt').strip()
+        self.preopt_nprocs = max(1, config.getint('prescreen', 'preopt_nprocs', fallback=1))
+        self.preopt_parallel = max(1, config.getint('prescreen', 'preopt_parallel', fallback=4))
+        self.preopt_timeout = max(0.0, config.getfloat('prescreen', 'preopt_timeout_seconds', fallback=1800.0))
+        self.kill_grace = config.getfloat('shutdown', 'kill_grace_seconds', fallback=10.0)
+        self.use_preoptimized_geometry = config.getboolean('prescreen', 'use_preoptimized_geometry', fallback=True)
+        self.energy_window = config.getfloat('prescreen', 'energy_window_kcal', fallback=6.0)
+        self.max_conformers = config.getint('prescreen', 'max_conformers', fallback=10)
+        self.orca_executable = config['orca']['orca_executable']
+        self.work_root = Path(config['paths']['working_dir']) / '_prescreen'
+        self.products_dir = Path(config['paths']['products_dir'])
+
+    def screen(self, mol_name, frames):
+        """
+        frames: parse_xyz_frames の結果 [(コメント行, Geometry)]
+        Returns: DFT に進める [(分子名, Geometry)] (分子名は '<mol_name>_c<フレーム番号>')
+        """
+        geometries = [geometry for _, geometry in frames]
+        names = [f"{mol_name}_c{index + 1:03d}" for index in range(len(frames))]
+        energies = [comment_energy(comment) for comment, _ in frames]
+        report = {'molecule': mol_name, 'input_conformers': len(frames), 'conformers': {}}
+
+        kept, duplicates = deduplicate(geometries, self.rmsd_threshold, heavy_atoms_only=self.heavy_atoms_only)
+        self._record_duplicates(report, names, duplicates)
+
+        if self.preopt_method:
+            energies, geometries, failed = self._preoptimize(mol_name, names, geometries, kept, energies)
+            for index in failed:
+                report['conformers'][names[index]] = {'status': 'discarded', 'reason': 'pre-optimization failed'}
+            kept = [index for index in kept if index not in failed]
+            # 前最適化で同じ極小に落ちた構造を、エネルギーの低いものを残して除く
+            kept, duplicates = deduplicate(
+                geometries, self.rmsd_threshold, order=self._by_energy(kept, energies),
+                heavy_atoms_only=self.heavy_atoms_only
+            )
+            self._record_duplicates(report, names, duplicates)
+
+        selected = self._prune_by_energy(report, names, kept, energies)
+        for index in selected:
+            report['conformers'][names[index]] = {'status': 'selected', 'energy': energies[index]}
+        self._write_report(mol_name, report)
+        self.logger.info(
+            f"Pre-screened {mol_name}: {len(frames)} conformers -> {len(selected)} for DFT "
+            f"({len(frames) - len(kept)} duplicates or failures, {len(kept) - len(selected)} outside the energy window)."
+        )
+        return [(names[index], geometries[index]) for index in selected]
+
+    def _record_duplicates(self, report, names, duplicates):
+        for index, (kept_index, rmsd) in duplicates.items():
+            report['conformers'][names[index]] = {
+                'status': 'discarded', 'reason': f"duplicate of {names[kept_index]}", 'rmsd': round(rmsd, 4)
+            }
+
+    def _by_energy(self, indices, energies):
+        # エネルギーの無い構造は最後 (入力順)
+        return sorted(indices, key=lambda index: (energies[index] is None, energies[index] or 0.0))
+
+    def _prune_by_energy(self, report, names, kept, energies):
+        ordered = self._by_energy(kept, energies)
+        known = [energies[index] for index in ordered if energies[index] is not None]
+        selected = []
+        for index in ordered:
+            energy = energies[index]
+            if known and self.energy_window > 0 and energy is not None and \
+                    (energy - known[0]) * HARTREE_TO_KCAL > self.energy_window:
+                reason = f"{(energy - known[0]) * HARTREE_TO_KCAL:.2f} kcal/mol above the lowest conformer"
+            elif self.max_conformers > 0 and len(selected) >= self.max_conformers:
+                reason = f"not among the lowest {self.max_conformers}"
+            else:
+                selected.append(index)
+                continue
+            report['conformers'][names[index]] = {'status': 'discarded', 'reason': reason, 'energy': energy}
+        return selected
+
+    # --- 前最適化 ---
+    def _preoptimize(self, mol_name, names, geometries, indices, energies):
+        """
+        Returns: (energies, geometries, 失敗した添字の集合)。
+        すべて失敗した場合 (ORCA の設定ミスなど) は前最適化を使わずに続行する。
+        ドレインで中断した場合は ScreeningInterrupted を送出する。
+        """
+        work_dir = self.work_root / mol_name
+        ensure_directory(work_dir)
+        try:
+            with ThreadPoolExecutor(max_workers=self.preopt_parallel) as pool:
+                results = dict(zip(indices, pool.map(
+                    lambda index: self._run_preopt(work_dir, names[index], geometries[index]), indices
+                )))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if self.stopping:
+            raise ScreeningInterrupted(f"pre-optimization of {mol_name} interrupted by shutdown")
+
+        failed = {index for index, result in results.items() if result is None}
+        if failed and len(failed) == len(indices):
+            self.logger.error(f"Pre-optimization failed for every conformer of {mol_name}; using input geometries.")
+            return energies, geometries, set()
+
+        energies, geometries = list(energies), list(geometries)
+        for index, result in results.items():
+            if result is None:
+                continue
+            energies[index] = result['final_energy']
+            if self.use_preoptimized_geometry and result['geometry'] is not None:
+                geometries[index] = result['geometry']
+        return energies, geometries, failed
+
+    def _run_preopt(self, work_dir, name, geometry):
+        charge = self.config['orca'].get('charge', '0')
+        multiplicity = self.config['orca'].get('multiplicity', '1')
+        inp_path = work_dir / f"{name}.inp"
+        out_path = work_dir / f"{name}.out"
+        content = (
+            f"! {self.preopt_method} {self.preopt_keywords}\n"
+            f"%pal nprocs {self.preopt_nprocs} end\n"
+            f"* xyz {charge} {multiplicity}\n" + geometry.to_coordinate_block() + "*\n"
+        )
+        if not safe_write(inp_path, content) or not self._acquire_slot():
+            return None
+        try:
+            with open(out_path, 'w') as out_f:
+                process = subprocess.Popen([self.orca_executable, inp_path.name], cwd=work_dir, stdout=out_f,
+                                           stderr=subprocess.STDOUT, start_new_session=True)
+            self._wait_preopt(name, process)
+        except OSError as e:
+            self.logger.error(f"Could not run pre-optimization for {name}: {e}")
+            return None
+        finally:
+            self._release_slot()
+        if self.stopping:
+            return None
+
+        success, message, _ = check_orca_output(out_path)
+        results = extract_results(out_path) if success else None
+        if results is None or results['final_energy'] is None:
+            self.logger.warning(f"Pre-optimization of {name} failed: {message}")
+            return None
+        return results
+
+    def _wait_preopt(self, name, process):
+        with self._slots:
+            self._processes.add(process)
+            stopping = self.stopping
+        if stopping:
+            # stop() の走査の後に起動した場合
+            signal_process_group(process, signal.SIGTERM)
+        try:
+            process.wait(timeout=self.preopt_timeout or None)
+        except subprocess.TimeoutExpired:
+            self.logger.warning(f"Pre-optimization of {name} exceeded preopt_timeout_seconds "
+                                f"({self.preopt_timeout:g}s); terminating.")
+            signal_process_group(process, signal.SIGTERM)
+            try:
+                process.wait(timeout=self.kill_grace)
+            except subprocess.TimeoutExpired:
+                signal_process_group(process, signal.SIGKILL)
+                process.wait()
+        finally:
+            with self._slots:
+                self._processes.discard(process)
+                self._slots.notify_all()
+
+    def _acquire_slot(self):
+        """同時実行数の枠を待つ。Returns: 枠を得たか (ドレイン中は False)"""
+        with self._slots:
+            while not self.stopping and self._active >= self.preopt_parallel:
+                self._slots.wait()
+            if self.stopping:
+                return False
+            self._active += 1
+            return True
+
+    def _release_slot(self):
+        with self._slots:
+            self._active -= 1
+            self._slots.notify_all()
+
+    def stop(self):
+        """
+        ドレイン: 新しい前最適化を始めず、実行中のものに SIGTERM を送る。
+        kill_grace 秒以内に終了しなければ SIGKILL を送る。
+        """
+        with self._slots:
+            self.stopping = True
+            self._slots.notify_all()
+            processes = list(self._processes)
+        if not processes:
+            return
+        self.logger.info(f"Terminating {len(processes)} running pre-optimization(s).")
+        for process in processes:
+            signal_process_group(process, signal.SIGTERM)
+        deadline = time.monotonic() + self.kill_grace
+        for process in processes:
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                signal_process_group(process, signal.SIGKILL)
+
+    def _write_report(self, mol_name, report):
+        report_dir = self.products_dir / mol_name
+        ensure_directory(report_dir)
+        safe_write(report_dir / f"{mol_name}_prescreen.json", json.dumps(report, indent=2))
@@ -0,0 +1,243 @@
+# diagnostics.py
+import os
+import re
+import sys
+import time
+import threading
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from pipeline_utils import atomic_write, ensure_directory, LOG_DIR
+
+_diagnostics_logger = get_logger('diagnostics')
+
+# プロファイルではスレッド名の通し番号 (ThreadWorker-3, usage-sampler-1234 など) を除き、役割ごとに集計する
+_THREAD_NUMBER_PATTERN = re.compile(r"[-_ ]?\d+$")
+
+# ロックの待ち時間がこれを超えたら警告する ([profiling] slow_lock_ms、configure_diagnostics で設定)
+_slow_lock_seconds = 0.5
+
+
+def configure_diagnostics(config):
+    """[profiling] の設定を反映する (起動時と設定の再読み込み時に呼ぶ)。"""
+    global _slow_lock_seconds
+    _slow_lock_seconds = config.getfloat('profiling', 'slow_lock_ms', fallback=500.0) / 1000.0
+
+
+class TimedLock:
+    """
+    操作ごとに待ち時間と保持時間を集計する RLock (StateStore のロック競合の計測用)。
+    hold() を入れ子にした場合は外側の操作のみを計測する。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.RLock()
+        self._owner_depth = threading.local()
+        # 操作名 -> [回数, 待ち時間の合計, 待ち時間の最大, 保持時間の合計, 保持時間の最大]
+        self._stats = {}
+
+    @contextmanager
+    def hold(self, operation):
+        depth = getattr(self._owner_depth, 'value', 0)
+        if depth:
+            with self._lock:
+                self._owner_depth.value = depth + 1
+                try:
+                    yield
+                finally:
+                    self._owner_depth.value = depth
+            return
+
+        requested = time.perf_counter()
+        with self._lock:
+            acquired = time.perf_counter()
+            self._owner_depth.value = 1
+            try:
+                yield
+            finally:
+                self._owner_depth.value = 0
+                self._record(operation, acquired - requested, time.perf_counter() - acquired)
+
+    def _record(self, operation, waited, held):
+        # ロックを保持したまま呼ばれる
+        stats = self._stats.setdefault(operation, [0, 0.0, 0.0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+        stats[3] += held
+        stats[4] = max(stats[4], held)
+        if waited > _slow_lock_seconds:
+            _diagnostics_logger.warning(
+                f"{self.name} lock contention: {operation} waited {waited * 1000:.0f} ms "
+                f"(held {held * 1000:.0f} ms)"
+            )
+
+    def stats(self):
+        """Returns: {操作名: {'count', 'wait_total_ms', 'wait_max_ms', 'hold_total_ms', 'hold_max_ms'}}"""
+        with self._lock:
+            snapshot = {operation: list(values) for operation, values in self._stats.items()}
+        return {
+            operation: {
+                'count': count,
+                'wait_total_ms': round(wait_total * 1000, 1),
+                'wait_max_ms': round(wait_max * 1000, 1),
+                'hold_total_ms': round(hold_total * 1000, 1),
+                'hold_max_ms': round(hold_max * 1000, 1),
+            }
+            for operation, (count, wait_total, wait_max, hold_total, hold_max) in snapshot.items()
+        }
+
+
+def format_lock_stats(lock):
+    lines = [f"{lock.name} lock (per operation: count, wait total/max, hold total/max):"]
+    stats = sorted(lock.stats().items(), key=lambda item: -item[1]['wait_total_ms'])
+    for operation, s in stats:
+        lines.append(
+            f"  {operation:<24} {s['count']:>8}  wait {s['wait_total_ms']:>10.1f} / {s['wait_max_ms']:>8.1f} ms"
+            f"  hold {s['hold_total_ms']:>10.1f} / {s['hold_max_ms']:>8.1f} ms"
+        )
+    return lines
+
+
+def write_thread_dump(output_dir=LOG_DIR, state_store=None, scheduler=None):
+    """
+    全スレッドのスタックを、ThreadWorker が実行中のジョブとともにファイルに書き出す (SIGUSR1)。
+    Returns: 書き出したファイルのパス
+    """
+    threads = {thread.ident: thread for thread in threading.enumerate()}
+    lines = [f"Thread dump at {datetime.now()} (pid {os.getpid()}, {len(threads)} threads)"]
+    if scheduler is not None:
+        executor = getattr(scheduler, 'executor', None)
+        lines.append(
+            f"Scheduler: {scheduler.job_queue.qsize()} queued, "
+            f"{executor.running_count() if executor is not None else 'n/a'} running, "
+            f"parallel jobs {scheduler.num_threads}"
+            + (", dispatch paused (low disk space)" if getattr(scheduler.disk_guard, 'paused', False) else "")
+        )
+    if state_store is not None:
+        lines.extend(format_lock_stats(state_store.lock))
+    lines.append("")
+
+    for ident, frame in sys._current_frames().items():
+        thread = threads.get(ident)
+        name = thread.name if thread is not None else f"<unknown {ident}>"
+        header = f"--- {name} (ident {ident}{', daemon' if thread is not None and thread.daemon else ''})"
+        job = getattr(thread, 'current_job', None)
+        if job is not None:
+            header += f" running {job[1]} ({job[2]}): {job[0]}"
+        lines.append(header)
+        lines.extend(line.rstrip('\n') for line in traceback.format_stack(frame))
+        lines.append("")
+
+    ensure_directory(output_dir)
+    path = Path(output_dir) / f"thread_dump_{datetime.now():%Y%m%d_%H%M%S}.txt"
+    atomic_write(path, "\n".join(lines) + "\n")
+    _diagnostics_logger.info(f"Wrote thread dump ({len(threads)} threads) to {path}")
+    return path
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).stem})"
+
+
+def collapse_stack(frame):
+    """フレームを根から順に ';' で連結する (flamegraph.pl / speedscope の collapsed 形式)。"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """
+    標準ライブラリのみのサンプリングプロファイラ ([profiling])。
+    interval ごとに sys._current_frames() で全スレッドのスタックを取り、スレッド名を根とする
+    collapsed 形式 ('thread;frame;frame count') で flush_interval ごとにファイルへ書き出す
+    (スレッド名の通し番号は除き、同じ役割のスレッドをまとめる)。
+    SIGUSR2 で実行中に開始・停止できる。
+    """
+
+    def __init__(self, config, output_dir=None):
+        self.interval = max(0.001, config.getfloat('profiling', 'interval_ms', fallback=10.0) / 1000.0)
+        self.flush_interval = config.getfloat('profiling', 'flush_interval_seconds', fallback=60.0)
+        self.output_dir = Path(output_dir or config.get('profiling', 'output_dir', fallback=str(LOG_DIR)))
+        self.logger = _diagnostics_logger
+        self.samples = Counter()
+        self.sample_count = 0
+        self.path = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        with self._lock:
+            self.samples = Counter()
+            self.sample_count = 0
+        self.path = self.output_dir / f"profile_{datetime.now():%Y%m%d_%H%M%S}.collapsed"
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        self.logger.info(f"Sampling profiler started ({self.interval * 1000:.0f} ms interval) -> {self.path}")
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def toggle(self):
+        """SIGUSR2: 停止中なら開始し、実行中なら停止する (停止時に書き出す)。"""
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        last_flush = time.monotonic()
+        while not self._stop.wait(self.interval):
+            self.sample(exclude=own_ident)
+            if self.flush_interval > 0 and time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+        self.flush()
+        self.logger.info(f"Sampling profiler stopped after {self.sample_count} samples -> {self.path}")
+
+    def sample(self, exclude=None):
+        names = {thread.ident: _THREAD_NUMBER_PATTERN.sub('', thread.name) for thread in threading.enumerate()}
+        stacks = [
+            f"{names.get(ident, ident)};{collapse_stack(frame)}"
+            for ident, frame in sys._current_frames().items() if ident != exclude
+        ]
+        with self._lock:
+            self.samples.update(stacks)
+            self.sample_count += 1
+
+    def flush(self):
+        """これまでの集計 (開始からの累計) をファイルに書き出す。"""
+        if self.path is None:
+            return None
+        with self._lock:
+            content = "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+        try:
+            ensure_directory(self.output_dir)
+            atomic_write(self.path, content)
+        except OSError as e:
+            self.logger.error(f"Could not write profile {self.path}: {e}")
+            return None
+        return self.path
@@ -0,0 +1,256 @@
+# disk_guard.py
+import os
+import time
+import shlex
+import threading
+import subprocess
+from pathlib import Path
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from notification_service import send_notification
+from resource_tuner import estimate_basis_functions, find_basis
+from resource_usage import ResourceUsageStats, size_bucket, MIN_SAMPLES
+
+_disk_logger = get_logger('disk_guard')
+
+_MB = 1024 * 1024
+# 容量の確保 (予約) を維持するジョブの状態
+_ACTIVE_STATUSES = ('PENDING', 'RUNNING')
+
+
+def read_inp_job_info(inp_path):
+    """
+    .inp の '!' 行のキーワードと最初の '* xyz' ブロックの元素記号を読む。
+    Returns: (keywords のリスト, elements のリスト)
+    """
+    keywords, elements = [], []
+    in_coords = False
+    with open(inp_path, 'r', errors='ignore') as f:
+        for line in f:
+            stripped = line.strip()
+            if in_coords:
+                if stripped == '*':
+                    break
+                if stripped:
+                    elements.append(stripped.split()[0])
+            elif stripped.startswith('!'):
+                keywords.extend(stripped[1:].split())
+            elif stripped.lower().startswith('* xyz') and not stripped.lower().startswith('* xyzfile'):
+                in_coords = True
+    return keywords, elements
+
+
+def free_bytes(path):
+    """path を含むファイルシステムで、一般ユーザーが使える空き容量 (バイト)。"""
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+class DiskGuard:
+    """
+    ジョブを実行に回す前にディスクの空き容量を確認するアドミッション制御 ([disk])。
+
+    - ジョブごとに作業ディレクトリ (scratch) と products に必要な容量を見積もる。
+      同じ分子サイズ・計算タイプの完了ジョブの書き込み量 (resource_usage の write_mb) が十分にあれば
+      その90パーセンタイル、無ければ基底関数の数の2乗に比例するモデルを使う
+    - 実行を許可したジョブの見積もりは、そのジョブが PENDING/RUNNING の間は確保済みとして数える
+    - いずれかのファイルシステムで (空き容量 - 確保済み - 見積もり) が min_free_gb を下回る場合は
+      実行を許可せず、スケジューラは check_interval 秒ごとに再確認する (その間の配布は止まる)
+    - 容量不足の間は check_interval ごとに products の .gbw を整理する (ProductsStore.prune。
+      low_space_retention_days を設定すると、通常より短い保持日数で整理する)
+
+    quota_command を設定すると、その出力 (使える残りバイト数) も空き容量の上限として使う
+    ({path} は対象のディレクトリに置き換えられる)。
+    """
+
+    def __init__(self, config, state_store, products_store=None, notification_throttle=None):
+        self.state_store = state_store
+        self.products_store = products_store
+        self.notification_throttle = notification_throttle
+        self.logger = _disk_logger
+        self.usage_stats = ResourceUsageStats(state_store)
+        self._reserved = {} # job_id -> {ファイルシステムのパス: バイト数}
+        self._estimates = {}
+        self._history = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self.paused = False
+        self._last_prune = 0.0
+        self.apply_config(config)
+
+    def apply_config(self, config):
+        """起動時と設定の再読み込み時に [disk] を読み込む。"""
+        self.config = config
+        self.enabled = config.getboolean('disk', 'enabled', fallback=True)
+        self.min_free = int(config.getfloat('disk', 'min_free_gb', fallback=5.0) * 1024 * _MB)
+        self.check_interval = config.getfloat('disk', 'check_interval_seconds', fallback=30.0)
+        self.scratch_bytes_per_bf2 = config.getfloat('disk', 'scratch_bytes_per_bf2', fallback=200.0)
+        self.products_bytes_per_bf2 = config.getfloat('disk', 'products_bytes_per_bf2', fallback=16.0)
+        self.min_job_bytes = int(config.getfloat('disk', 'min_job_mb', fallback=50.0) * _MB)
+        self.quota_command = config.get('disk', 'quota_command', fallback='').strip()
+        # 容量不足時の整理で使う保持日数 (0 なら [products] retention_days)
+        self.low_space_retention_days = config.getfloat('disk', 'low_space_retention_days', fallback=0.0)
+        self.history_ttl = config.getfloat('tuning', 'history_refresh_seconds', fallback=300.0)
+        self.default_basis = config['orca'].get('basis')
+
+        working_dir = config['paths']['working_dir']
+        scratch_dir = config.get('disk', 'scratch_dir', fallback='').strip()
+        # 見積もりの内訳ごとに、それを書き込むディレクトリ
+        self.locations = {
+            'scratch': scratch_dir or working_dir,
+            'output': working_dir,
+            'products': config['paths']['products_dir'],
+        }
+
+    # --- アドミッション ---
+    def admit(self, job_id, calc_type=None):
+        """
+        ジョブ (.inp のパス) を実行してよいか判定し、よければその容量を確保する。
+        Returns: 実行してよければ True
+        """
+        if not self.enabled:
+            return True
+        needs = self._needs_by_filesystem(job_id, calc_type)
+        with self._lock:
+            reserved = self._active_reservations()
+            shortages = []
+            for device, (path, need) in needs.items():
+                available = self._available(path) - sum(r.get(device, (None, 0))[1] for r in reserved.values())
+                if available - need < self.min_free:
+                    shortages.append((path, available, need))
+            if not shortages:
+                self._reserved[job_id] = needs
+                if self.paused:
+                    self.paused = False
+                    self.logger.info("Disk space is available again; resuming job dispatch.")
+                return True
+            self._on_shortage(job_id, shortages)
+            return False
+
+    def wait(self):
+        """容量不足で実行を止めている間、次の確認まで待つ (wake() で中断される)。"""
+        self._wake.wait(self.check_interval)
+        self._wake.clear()
+
+    def wake(self):
+        self._wake.set()
+
+    def report_disk_error(self, job_id, message):
+        """ORCA が容量不足で失敗した場合に呼ばれる。次の確認で整理を行い、予約を見直す。"""
+        with self._lock:
+            self._reserved.pop(job_id, None)
+            self._estimates.pop(job_id, None)
+            self._last_prune = 0.0
+        self.logger.error(f"Disk space error reported for {job_id}: {message}")
+
+    def _active_reservations(self):
+        """終了したジョブの予約を解放し、残りを返す。"""
+        for job_id in list(self._reserved):
+            job = self.state_store.get_job(job_id)
+            if job is None or job.get('status') not in _ACTIVE_STATUSES:
+                del self._reserved[job_id]
+                self._estimates.pop(job_id, None)
+        return self._reserved
+
+    def _on_shortage(self, job_id, shortages):
+        if not self.paused:
+            self.paused = True
+            details = "; ".join(
+                f"{path}: {available / _MB:.0f} MB free, job needs ~{need / _MB:.0f} MB "
+                f"+ {self.min_free / _MB:.0f} MB reserve"
+                for path, available, need in shortages
+            )
+            message = f"Low disk space; pausing job dispatch before {Path(job_id).name}. {details}"
+            self.logger.warning(message)
+            send_notification(self.config, "WARNING: Pipeline paused (low disk space)", message,
+                              throttle_instance=self.notification_throttle)
+
+        now = time.monotonic()
+        if self.products_store is not None and now - self._last_prune >= self.check_interval:
+            self._last_prune = now
+            try:
+                self.products_store.prune(retention_days=self.low_space_retention_days or None)
+            except Exception as e:
+                self.logger.error(f"Products store pruning failed: {e}")
+
+    def _available(self, path):
+        try:
+            available = free_bytes(path)
+        except OSError as e:
+            self.logger.warning(f"Could not check free space on {path}: {e}")
+            return float('inf')
+        if self.quota_command:
+            quota = self._quota_bytes(path)
+            if quota is not None:
+                available = min(available, quota)
+        return available
+
+    def _quota_bytes(self, path):
+        command = self.quota_command.replace('{path}', shlex.quote(str(path)))
+        try:
+            result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=30)
+            return int(result.stdout.split()[0])
+        except (OSError, subprocess.TimeoutExpired, ValueError, IndexError) as e:
+            self.logger.warning(f"quota_command failed for {path}: {e}")
+            return None
+
+    # --- 見積もり ---
+    def _needs_by_filesystem(self, job_id, calc_type):
+        """Returns: {st_dev: (代表パス, 必要バイト数)} (同じファイルシステム上の内訳は合算する)"""
+        estimate = self.estimate(job_id, calc_type)
+        needs = {}
+        for component, need in estimate.items():
+            path = self.locations[component]
+            try:
+                device = os.stat(path).st_dev
+            except OSError:
+                device = path
+            previous = needs.get(device, (path, 0))
+            needs[device] = (previous[0], previous[1] + need)
+        return needs
+
+    def estimate(self, job_id, calc_type=None):
+        """
+        Returns: {'scratch', 'output', 'products'} -> バイト数
+        """
+        with self._lock:
+            cached = self._estimates.get(job_id)
+        if cached is not None:
+            return cached
+
+        try:
+            keywords, elements = read_inp_job_info(job_id)
+        except OSError:
+            keywords, elements = [], []
+        basis = find_basis(keywords) or self.default_basis
+        n_bf = estimate_basis_functions(elements, basis) if elements else 0
+
+        scratch = max(self.min_job_bytes, int(self.scratch_bytes_per_bf2 * n_bf ** 2))
+        history = self._history_write_bytes(len(elements), calc_type)
+        if history:
+            scratch = max(self.min_job_bytes, history)
+        # .out (圧縮前) と .gbw (基底関数の数の2乗に比例)
+        output = self.min_job_bytes // 5
+        products = int(self.products_bytes_per_bf2 * n_bf ** 2) + output
+        estimate = {'scratch': scratch, 'output': output, 'products': products}
+        with self._lock:
+            self._estimates[job_id] = estimate
+        return estimate
+
+    def _history_write_bytes(self, n_atoms, calc_type):
+        """同じ区分の完了ジョブの書き込み量の90パーセンタイル (25%の余裕込み)。区分ごとにキャッシュする。"""
+        key = (size_bucket(n_atoms), calc_type)
+        now = time.monotonic()
+        cached = self._history.get(key)
+        if cached is not None and now - cached[0] < self.history_ttl:
+            return cached[1]
+        writes = sorted(
+            usage['write_mb'] for bucket, usage in self.usage_stats.records(calc_type)
+            if bucket == key[0] and usage.get('write_mb') is not None
+        )
+        value = None
+        if len(writes) >= MIN_SAMPLES:
+            value = int(writes[min(len(writes) - 1, int(len(writes) * 0.9))] * 1.25 * _MB)
+        self._history[key] = (now, value)
+        return value
@@ -6,51 +6,202 @@ from watchdog.events import FileSystemEventHandler
 
 # --- 依存関係の明示的なインポート ---
 from logging_utils import get_logger
-from orca_utils import parse_xyz, generate_orca_input # ORCAユーティリティ
-from pipeline_utils import safe_write # I/Oユーティリティ
+from orca_utils import parse_xyz, parse_xyz_frames # ORCAユーティリティ
+from workflow import WorkflowDefinition # ワークフローのルートステップ定義
+from pipeline_utils import bulk_write, safe_write, ensure_directory, get_unique_path # I/Oユーティリティ
+from input_validator import InvalidInputError # 取り込み時の事前検証
+from input_scanner import InputScanner # 大きな入力ディレクトリの差分走査
+from conformer_screen import ScreeningInterrupted # ドレインによる前最適化の中断
+from tenants import DEFAULT_TENANT, MOLECULE_SEPARATOR, qualified_name, split_qualified_name, tenants_from_config
 # JobManagerは外部から注入される（DI）
 
 _watcher_logger = get_logger('file_watcher')
 
-def process_existing_xyz_files(config, job_manager):
-    """Processes all existing XYZ files in the input directory at startup."""
-    # ... (元のコードのロジックを再現)
-    input_dir = Path(config['paths']['input_dir'])
+# 起動時の取り込みで、.inp の書き込みとジョブ登録をまとめる XYZ ファイル数
+INGEST_BATCH_SIZE = 256
+
+
+def molecule_name(config, xyz_path, tenant=None):
+    """
+    XYZ ファイルの分子名 (default 以外のテナントは '<テナント>@<名前>'、tenants.qualified_name)。
+    default テナントの名前が他のテナントの分子名と紛らわしい場合は InvalidInputError を送出する。
+    """
+    stem = Path(xyz_path).stem
+    if tenant in (None, DEFAULT_TENANT):
+        if MOLECULE_SEPARATOR in stem and \
+                split_qualified_name(stem, tenants_from_config(config))[0] != DEFAULT_TENANT:
+            raise InvalidInputError(f"the name '{stem}' is reserved for molecules of another tenant")
+        return stem
+    return qualified_name(tenant, stem)
+
+
+def build_xyz_inputs(config, xyz_path, workflow_definition, tenant=None):
+    """
+    XYZ ファイルからワークフローのルートステップの (inp_path, inp_content, job) のリストを作る。
+    座標が読めない場合は空のリスト。
+    複数フレームの XYZ (コンフォマーアンサンブル) は、ConformerScreen が注入されていれば
+    絞り込んだ各コンフォマーを '<名前>_c<フレーム番号>' という分子として登録する。
+    InputValidator が注入されていれば、入力を厳密に検証し、不合格なら InvalidInputError を送出する。
+    tenant: XYZ を置いた入力ディレクトリのテナント (分子名の名前空間)
+    """
+    xyz_path = Path(xyz_path)
     waiting_dir = Path(config['paths']['waiting_dir'])
-    
-    _watcher_logger.info("Checking for existing XYZ files...")
-    
-    for xyz_path in input_dir.glob('*.xyz'):
-        try:
-            mol_name = xyz_path.stem
-            
-            with open(xyz_path, 'r') as f:
-                xyz_content = f.read()
+    mol_name = molecule_name(config, xyz_path, tenant)
 
-            atoms, coords = parse_xyz(xyz_content) # orca_utils
-            
-            if not atoms:
-                continue
+    with open(xyz_path, 'r') as f:
+        xyz_content = f.read()
 
-            inp_content = generate_orca_input(config, mol_name, atoms, coords, calc_type='opt') # orca_utils
-            
-            inp_path = waiting_dir / f"{mol_name}_opt.inp"
-            
-            safe_write(inp_path, inp_content) # pipeline_utils
-            
-            xyz_path.rename(waiting_dir / xyz_path.name)
-            
-            job_manager.add_job(str(inp_path), mol_name, 'opt') # 注入されたJobManagerのメソッド
-            
+    molecules = None
+    screen = workflow_definition.conformer_screen
+    screening = screen is not None and screen.enabled
+    validator = workflow_definition.input_validator
+    if validator is not None and validator.enabled:
+        frames = validator.validate(xyz_content, allow_multiple_frames=screening) # input_validator
+        molecules = [(mol_name, frames[0][1])] if len(frames) == 1 else screen.screen(mol_name, frames)
+    elif screening:
+        frames = parse_xyz_frames(xyz_content) # orca_utils
+        if len(frames) > 1:
+            molecules = screen.screen(mol_name, frames)
+    if molecules is None:
+        geometry = parse_xyz(xyz_content) # orca_utils
+        if not geometry.n_atoms:
+            return []
+        molecules = [(mol_name, geometry)]
+
+    inputs = []
+    for name, geometry in molecules:
+        for step_name in workflow_definition.roots():
+            inp_content = workflow_definition.generate_input(config, step_name, name, geometry) # orca_utils
+            inp_path = waiting_dir / f"{name}_{step_name}.inp"
+            inputs.append((inp_path, inp_content, (str(inp_path), name, step_name)))
+    return inputs
+
+
+def waiting_xyz_path(config, xyz_path, tenant=None):
+    """取り込んだ XYZ の移動先 (waiting_dir/<分子名>.xyz。テナント間で衝突しない)。"""
+    xyz_path = Path(xyz_path)
+    return Path(config['paths']['waiting_dir']) / f"{qualified_name(tenant, xyz_path.stem)}{xyz_path.suffix}"
+
+
+def quarantine_xyz_file(config, xyz_path, reason, tenant=None):
+    """
+    検証に失敗した XYZ を [paths] quarantine_dir (テナントごとのサブディレクトリ) に移動し、
+    理由を '<名前>.reason.txt' に書く。ジョブは登録しない。
+    """
+    xyz_path = Path(xyz_path)
+    quarantine_dir = Path(config['paths'].get('quarantine_dir', 'folders/quarantine'))
+    if tenant and tenant != DEFAULT_TENANT:
+        quarantine_dir = quarantine_dir / tenant
+    try:
+        ensure_directory(quarantine_dir)
+        target = get_unique_path(quarantine_dir / xyz_path.name)
+        xyz_path.rename(target)
+    except OSError as e:
+        _watcher_logger.error(f"Could not quarantine invalid XYZ file {xyz_path.name} ({reason}): {e}")
+        return None
+    safe_write(target.with_suffix('.reason.txt'), f"{xyz_path}: {reason}\n")
+    _watcher_logger.warning(f"Quarantined invalid XYZ file {xyz_path.name} -> {target}: {reason}")
+    return target
+
+
+def ingest_xyz_file(config, xyz_path, job_manager, workflow_definition, tenant=None):
+    """
+    1つの XYZ ファイルを取り込み、ワークフローのルートステップ (既定: opt) の .inp を
+    waiting_dir に生成してジョブを登録する。XYZ は waiting_dir に移動する。
+    tenant: XYZ を置いた入力ディレクトリのテナント ([tenants])
+    Returns: 登録したジョブ数
+    """
+    xyz_path = Path(xyz_path)
+    try:
+        inputs = build_xyz_inputs(config, xyz_path, workflow_definition, tenant)
+    except InvalidInputError as e:
+        quarantine_xyz_file(config, xyz_path, e.reason, tenant)
+        return 0
+    except ScreeningInterrupted as e:
+        _watcher_logger.info(f"Left {xyz_path.name} in the input directory: {e}")
+        return 0
+    if not inputs:
+        return 0
+
+    written = bulk_write((inp_path, inp_content) for inp_path, inp_content, _ in inputs) # pipeline_utils
+    if len(written) != len(inputs):
+        return 0
+    xyz_path.rename(waiting_xyz_path(config, xyz_path, tenant))
+
+    return job_manager.add_jobs_bulk([job for _, _, job in inputs], tenant=tenant) # 注入されたJobManagerのメソッド
+
+
+def ingest_xyz_files(config, xyz_paths, job_manager, workflow_definition, tenant=None):
+    """
+    複数の XYZ ファイルをまとめて取り込む。.inp の書き込み (ディレクトリの fsync) と
+    ジョブの登録 (StateStore の保存) がそれぞれ1回で済む。読めないファイルはログに記録して飛ばし、
+    検証に失敗したファイルは隔離する。
+    Returns: 登録したジョブ数
+    """
+    prepared = []
+    for xyz_path in xyz_paths:
+        xyz_path = Path(xyz_path)
+        try:
+            inputs = build_xyz_inputs(config, xyz_path, workflow_definition, tenant)
+        except InvalidInputError as e:
+            quarantine_xyz_file(config, xyz_path, e.reason, tenant)
+            continue
+        except ScreeningInterrupted as e:
+            _watcher_logger.info(f"Left {xyz_path.name} in the input directory: {e}")
+            continue
         except Exception as e:
             _watcher_logger.error(f"Error processing existing XYZ file {xyz_path.name}: {e}")
+            continue
+        if inputs:
+            prepared.append((xyz_path, inputs))
+
+    written = set(bulk_write(
+        (inp_path, inp_content) for _, inputs in prepared for inp_path, inp_content, _ in inputs
+    ))
+
+    jobs = []
+    for xyz_path, inputs in prepared:
+        if not all(inp_path in written for inp_path, _, _ in inputs):
+            continue
+        try:
+            xyz_path.rename(waiting_xyz_path(config, xyz_path, tenant))
+        except OSError as e:
+            _watcher_logger.error(f"Error processing existing XYZ file {xyz_path.name}: {e}")
+            continue
+        jobs.extend(job for _, _, job in inputs)
+
+    return job_manager.add_jobs_bulk(jobs, tenant=tenant) if jobs else 0
+
+
+def process_existing_xyz_files(config, job_manager, workflow_definition=None, scanner=None, tenant=None):
+    """
+    Processes the XYZ files in the input directory at startup.
+    ディレクトリ一覧を一度に読み込まず、InputScanner で前回の走査以降のファイルだけを順に取り込む。
+    tenant を指定した場合は scanner の入力ディレクトリをそのテナントのものとして取り込む。
+    """
+    workflow_definition = workflow_definition or WorkflowDefinition.from_config(config)
+    scanner = scanner or InputScanner(config)
+    
+    _watcher_logger.info(f"Checking for existing XYZ files in {scanner.input_dir}...")
+    
+    # 一覧全体ではなく INGEST_BATCH_SIZE 件ずつ取り込む
+    batch = []
+    for path in scanner.scan(force=True, settle=False):
+        batch.append(path)
+        if len(batch) >= INGEST_BATCH_SIZE:
+            ingest_xyz_files(config, batch, job_manager, workflow_definition, tenant=tenant)
+            batch = []
+    if batch:
+        ingest_xyz_files(config, batch, job_manager, workflow_definition, tenant=tenant)
 
 
 class XYZHandler(FileSystemEventHandler):
-    """Handles file system events for new XYZ files."""
-    def __init__(self, config, job_manager):
+    """Handles file system events for new XYZ files (1つの入力ディレクトリ = 1つのテナント)."""
+    def __init__(self, config, job_manager, workflow_definition=None, tenant=None):
         self.config = config
         self.job_manager = job_manager # JobManagerの注入
+        self.workflow_definition = workflow_definition or WorkflowDefinition.from_config(config)
+        self.tenant = tenant
         self.waiting_dir = Path(config['paths']['waiting_dir'])
         self.logger = _watcher_logger
 
@@ -62,27 +213,14 @@ class XYZHandler(FileSystemEventHandler):
             
             time.sleep(1) # ファイルの書き込み完了を待つ
             
-            try:
-                # ... (元のコードのロジックを再現)
-                mol_name = xyz_path.stem
-                
-                with open(xyz_path, 'r') as f:
-                    xyz_content = f.read()
-
-                atoms, coords = parse_xyz(xyz_content) # orca_utils
-                
-                if not atoms:
-                    return
-
-                inp_content = generate_orca_input(self.config, mol_name, atoms, coords, calc_type='opt') # orca_utils
-                
-                inp_path = self.waiting_dir / f"{mol_name}_opt.inp"
-                
-                safe_write(inp_path, inp_content) # pipeline_utils
-                
-                xyz_path.rename(self.waiting_dir / xyz_path.name)
-                
-                self.job_manager.add_job(str(inp_path), mol_name, 'opt') # 注入されたJobManagerのメソッド
-                
-            except Exception as e:
-                self.logger.error(f"Error processing new XYZ file {xyz_path.name}: {e}")
+            self.ingest(xyz_path)
+
+    def ingest(self, path):
+        """XYZ ファイルを1つ取り込む (InputPoller からも呼ばれる)。"""
+        xyz_path = Path(path)
+        if not xyz_path.exists():
+            return # 差分走査 (InputPoller) で取り込み済み
+        try:
+            ingest_xyz_file(self.config, xyz_path, self.job_manager, self.workflow_definition, tenant=self.tenant)
+        except Exception as e:
+            self.logger.error(f"Error processing new XYZ file {xyz_path.name}: {e}")
@@ -0,0 +1,118 @@
+# geometry.py
+import numpy as np
+
+# 原子行の一括変換 (from_atom_lines) に使う構造化 dtype。元素記号 (ラベル) は最大 _MAX_LABEL_LENGTH 文字
+_MAX_LABEL_LENGTH = 16
+_ATOM_ROW_DTYPE = np.dtype([('element', f'U{_MAX_LABEL_LENGTH}'), ('coords', np.float64, (3,))])
+
+class Geometry:
+    """
+    分子構造を NumPy 配列で保持するクラス。
+    elements: 元素記号の配列 (shape (N,), str)
+    coords:   直交座標 (Å) の配列 (shape (N, 3), float64)
+    """
+
+    __slots__ = ('elements', 'coords')
+
+    def __init__(self, elements, coords):
+        self.elements = np.asarray(elements, dtype=str).reshape(-1)
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        if len(self.elements) != len(self.coords):
+            raise ValueError(
+                f"Element count ({len(self.elements)}) does not match coordinate count ({len(self.coords)})."
+            )
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=str), np.empty((0, 3), dtype=np.float64))
+
+    @property
+    def n_atoms(self):
+        return len(self.elements)
+
+    def __len__(self):
+        return self.n_atoms
+
+    def __repr__(self):
+        return f"Geometry(n_atoms={self.n_atoms})"
+
+    # --- 解析 ---
+    @classmethod
+    def from_atom_lines(cls, lines, element_column=0):
+        """
+        原子行 ('El x y z' など) のリストから Geometry を作る。
+        element_column が負の場合は末尾からの位置 (例: -4 は 'Index El x y z' 形式)。
+        全行を解析できれば np.loadtxt で一括で配列化し、できない場合は行ごとに解析して
+        解析できない行 (ヘッダ等) を読み飛ばす。
+        """
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return cls.empty()
+
+        # 座標列: 元素列の直後3列 (element_column < 0 の場合は末尾3列)
+        if element_column >= 0:
+            coord_columns = slice(element_column + 1, element_column + 4)
+            columns = (element_column, element_column + 1, element_column + 2, element_column + 3)
+        else:
+            coord_columns = slice(-3, None)
+            columns = (element_column, -3, -2, -1)
+
+        # 高速パス: np.loadtxt (C 実装) で元素列と座標列を一括で変換する。
+        # 列が足りない行や数値でない行があれば ValueError となり、行ごとの解析に切り替える
+        try:
+            table = np.loadtxt(lines, dtype=_ATOM_ROW_DTYPE, usecols=columns, comments=None, ndmin=1)
+        except ValueError:
+            table = None
+        if table is not None:
+            elements = table['element']
+            # 列ずれ (元素列に数値) や、切り詰められた長いラベルが無いことを確認する
+            if (np.char.isalpha(elements.astype('U1')).all()
+                    and np.char.str_len(elements).max() < _MAX_LABEL_LENGTH):
+                return cls(elements, np.ascontiguousarray(table['coords']))
+
+        rows = [line.split() for line in lines]
+        elements = []
+        coords = []
+        for row in rows:
+            if len(row) < 4:
+                continue
+            try:
+                coord = [float(value) for value in row[coord_columns]]
+            except ValueError:
+                continue
+            elements.append(row[element_column])
+            coords.append(coord)
+
+        if not elements:
+            return cls.empty()
+        return cls(elements, coords)
+
+    @classmethod
+    def from_xyz(cls, xyz_content):
+        """XYZ 形式 (原子数行 + コメント行 + 原子行) の1フレームを解析する。"""
+        lines = xyz_content.strip().split('\n')
+        if len(lines) < 3:
+            return cls.empty()
+        return cls.from_atom_lines(lines[2:])
+
+    # --- 出力 ---
+    def to_atom_lines(self, indent='  '):
+        """ORCA の '* xyz' ブロック用の原子行リストを返す。"""
+        line_format = indent + "%s %.6f %.6f %.6f"
+        return [line_format % row for row in zip(self.elements.tolist(), *self.coords.T.tolist())]
+
+    def to_coordinate_block(self, indent='  '):
+        """原子行を1回の join で連結した文字列 (末尾改行付き) を返す。"""
+        if not self.n_atoms:
+            return ""
+        return "\n".join(self.to_atom_lines(indent)) + "\n"
+
+    def to_xyz(self, comment=''):
+        """XYZ 形式の文字列を返す。"""
+        return f"{self.n_atoms}\n{comment}\n" + self.to_coordinate_block(indent='')
+
+    # --- 補助 ---
+    def element_counts(self):
+        """{元素記号: 個数} の辞書を返す。"""
+        symbols, counts = np.unique(self.elements, return_counts=True)
+        return dict(zip(symbols.tolist(), counts.tolist()))
@@ -0,0 +1,222 @@
+# input_scanner.py
+import os
+import json
+import time
+import threading
+from pathlib import Path
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from pipeline_utils import safe_write # I/Oユーティリティ
+from tenants import DEFAULT_TENANT
+
+_scanner_logger = get_logger('input_scanner')
+
+SCAN_INDEX_NAME = 'input_scan_index.json'
+WATCH_MODES = ('auto', 'inotify', 'polling')
+
+# inotify のイベントが届かないことがあるファイルシステム
+NETWORK_FILESYSTEMS = (
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'lustre', 'gpfs', 'beegfs', 'ceph', 'glusterfs',
+    'fuse.sshfs', 'fuse.glusterfs', 'fuse.ceph', '9p',
+)
+
+
+def filesystem_type(path):
+    """/proc/mounts から path を含むマウントのファイルシステム種別を返す (不明なら None)。"""
+    try:
+        real = os.path.realpath(path)
+        best, fstype = '', None
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace('\\040', ' ')
+                if (real == mount_point or real.startswith(mount_point.rstrip('/') + '/')) \
+                        and len(mount_point) > len(best):
+                    best, fstype = mount_point, fields[2]
+        return fstype
+    except OSError:
+        return None
+
+
+def is_network_filesystem(path):
+    return filesystem_type(path) in NETWORK_FILESYSTEMS
+
+
+class InputScanner:
+    """
+    input_dir を os.scandir でストリーミング走査し、新しい .xyz だけを返すスキャナ。
+
+    ディレクトリ全体の一覧は保持しない。代わりに、処理済みファイルの ctime の最大値
+    (high-water mark) と、その直前 margin_seconds 以内の処理済みファイル (inode -> ctime) だけを
+    state_dir/input_scan_index.json に保存する。ctime は mtime と違い cp -p / rsync -t で
+    過去の値にならないため、古い mtime のまま投入されたファイルも見落とさない。
+    ディレクトリ自体の mtime が前回の走査から変わっていなければ走査を省略する。
+    """
+
+    def __init__(self, config, index_path=None, input_dir=None, tenant=None):
+        self.input_dir = Path(input_dir or config['paths']['input_dir'])
+        state_dir = Path(config['paths'].get('state_dir', 'folders/state'))
+        # テナントの入力ディレクトリ ([tenants]) はそれぞれ別の索引を持つ
+        index_name = SCAN_INDEX_NAME if tenant in (None, DEFAULT_TENANT) else f"input_scan_index_{tenant}.json"
+        self.index_path = Path(index_path) if index_path else state_dir / index_name
+        # 書き込み中のファイルを避けるため、最終更新からこの秒数が経つまで返さない
+        self.settle_seconds = config.getfloat('watcher', 'settle_seconds', fallback=2.0)
+        # NFS などでのタイムスタンプの粒度・時計のずれを吸収する幅
+        self.margin_ns = int(config.getfloat('watcher', 'ctime_margin_seconds', fallback=2.0) * 1e9)
+        self.logger = _scanner_logger
+        self._lock = threading.Lock()
+        self.high_water_ns = 0
+        self.recent = {}
+        self.dir_mtime_ns = None
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            if str(index.get('input_dir')) != str(self.input_dir.resolve()):
+                return # 別のディレクトリの索引
+            self.high_water_ns = int(index.get('high_water_ns', 0))
+            self.recent = {int(inode): int(ctime) for inode, ctime in index.get('recent', {}).items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            self.logger.warning(f"Ignoring unreadable input scan index {self.index_path}: {e}")
+
+    def _save_index(self):
+        index = {
+            'input_dir': str(self.input_dir.resolve()),
+            'high_water_ns': self.high_water_ns,
+            'recent': {str(inode): ctime for inode, ctime in self.recent.items()},
+        }
+        safe_write(self.index_path, json.dumps(index))
+
+    def reset(self):
+        """索引を消し、次の走査で input_dir のすべての .xyz を返すようにする。"""
+        with self._lock:
+            self.high_water_ns = 0
+            self.recent = {}
+            self.dir_mtime_ns = None
+            self._save_index()
+
+    def scan(self, force=False, settle=True):
+        """
+        前回の走査以降に現れた .xyz のパスを1つずつ返すジェネレータ。
+        呼び出し側が処理を終えて次を要求した時点で、そのファイルを処理済みとして記録する。
+        force: ディレクトリの mtime が変わっていなくても走査する
+        settle: 最近更新されたファイルを書き込み中とみなして保留する (起動時の走査では False)
+        """
+        with self._lock:
+            try:
+                dir_mtime_ns = os.stat(self.input_dir).st_mtime_ns
+            except OSError:
+                return
+            if not force and dir_mtime_ns == self.dir_mtime_ns:
+                return
+
+            threshold = self.high_water_ns - self.margin_ns
+            settle_before_ns = time.time_ns() - int(self.settle_seconds * 1e9) if settle else None
+            new_high = self.high_water_ns
+            deferred_min = None
+            found = 0
+
+            try:
+                with os.scandir(self.input_dir) as entries:
+                    for entry in entries:
+                        if not entry.name.lower().endswith('.xyz'):
+                            continue
+                        try:
+                            if not entry.is_file():
+                                continue
+                            stat = entry.stat()
+                        except OSError:
+                            continue # 走査中に移動・削除された
+                        ctime_ns = stat.st_ctime_ns
+                        if ctime_ns <= threshold or self.recent.get(entry.inode()) == ctime_ns:
+                            continue
+                        if settle_before_ns is not None and stat.st_mtime_ns > settle_before_ns:
+                            # 書き込み中の可能性: high-water mark をこれより先に進めない
+                            deferred_min = ctime_ns if deferred_min is None else min(deferred_min, ctime_ns)
+                            continue
+
+                        yield entry.path
+                        found += 1
+                        self.recent[entry.inode()] = ctime_ns
+                        new_high = max(new_high, ctime_ns)
+            finally:
+                if deferred_min is not None:
+                    new_high = min(new_high, deferred_min - 1)
+                elif dir_mtime_ns < time.time_ns() - self.margin_ns:
+                    # 次回は、この走査の後にファイルが作られたときだけ走査する
+                    # (mtime の粒度内に作られたファイルを見落とさないよう、十分古い場合に限る)
+                    self.dir_mtime_ns = dir_mtime_ns
+                self.high_water_ns = max(self.high_water_ns, new_high)
+                cutoff = self.high_water_ns - self.margin_ns
+                self.recent = {inode: ctime for inode, ctime in self.recent.items() if ctime > cutoff}
+                if found or deferred_min is None:
+                    self._save_index()
+                if found:
+                    self.logger.info(f"Input scan found {found} new XYZ files in {self.input_dir}.")
+
+
+class InputPoller:
+    """
+    InputScanner を定期的に実行し、新しいファイルを handler(path) に渡すスレッド。
+    inotify が使えない (イベントが届かない) ファイルシステムではこれが唯一の検出手段になり、
+    inotify を使う場合も取りこぼしを拾うために長い間隔で実行する。
+    """
+
+    def __init__(self, scanner, handler, interval):
+        self.scanner = scanner
+        self.handler = handler
+        self.interval = interval
+        self.logger = _scanner_logger
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='input-poller', daemon=True)
+
+    def start(self):
+        if self.interval > 0:
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self):
+        # 起動時の走査で書き込み中として保留したファイルを早めに拾う
+        wait = min(self.interval, self.scanner.settle_seconds + 1.0)
+        while not self._stop.wait(wait):
+            wait = self.interval
+            try:
+                for path in self.scanner.scan():
+                    if self._stop.is_set():
+                        break
+                    self.handler(path)
+            except Exception as e:
+                self.logger.error(f"Input directory scan failed: {e}")
+
+
+def resolve_watch_mode(config, input_dir=None):
+    """
+    [watcher] mode を 'inotify' か 'polling' に決める (auto は input_dir のファイルシステムから判定)。
+    input_dir: 判定するディレクトリ (既定: [paths] input_dir。テナントの入力ディレクトリごとに判定する)
+    """
+    mode = config.get('watcher', 'mode', fallback='auto').strip().lower()
+    if mode not in WATCH_MODES:
+        _scanner_logger.warning(f"Invalid watcher mode '{mode}' in config, defaulting to 'auto'.")
+        mode = 'auto'
+    if mode == 'auto':
+        input_dir = input_dir or config['paths']['input_dir']
+        if is_network_filesystem(input_dir):
+            _scanner_logger.info(
+                f"{input_dir} is on a network filesystem ({filesystem_type(input_dir)}); using polling."
+            )
+            return 'polling'
+        return 'inotify'
+    return mode
@@ -0,0 +1,260 @@
+# input_validator.py
+import numpy as np
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from geometry import Geometry
+
+_validator_logger = get_logger('input_validator')
+
+# 元素記号 (原子番号順、H = 1 ... Og = 118)
+ELEMENTS = (
+    'H', 'He',
+    'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
+    'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar',
+    'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn',
+    'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr',
+    'Rb', 'Sr', 'Y', 'Zr', 'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd',
+    'In', 'Sn', 'Sb', 'Te', 'I', 'Xe',
+    'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd', 'Pm', 'Sm', 'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er', 'Tm', 'Yb', 'Lu',
+    'Hf', 'Ta', 'W', 'Re', 'Os', 'Ir', 'Pt', 'Au', 'Hg', 'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn',
+    'Fr', 'Ra', 'Ac', 'Th', 'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf', 'Es', 'Fm', 'Md', 'No', 'Lr',
+    'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds', 'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og',
+)
+ATOMIC_NUMBERS = {symbol: number for number, symbol in enumerate(ELEMENTS, start=1)}
+
+# 隣接セル (半球分の13方向 + 同じセル)。各セル対を一度だけ調べる
+_HALF_SHELL = np.array(
+    [(0, 0, 0)] + [
+        (dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+        if (dx, dy, dz) > (0, 0, 0)
+    ],
+    dtype=np.int64,
+)
+# これ未満の原子数では全ペアの距離を直接計算する
+_BRUTE_FORCE_ATOMS = 64
+# 全ペアの直接計算を行ごとに分割する大きさ (距離行列の要素数)
+_BRUTE_FORCE_CHUNK = 1 << 22
+
+
+class InvalidInputError(ValueError):
+    """XYZ 入力が事前検証を通らなかった (reason に理由)。"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def atomic_numbers(elements):
+    """
+    元素記号の配列を原子番号の配列に変換する (大文字・小文字は問わない)。
+    Returns: (原子番号の配列, 表に無い元素記号のリスト)
+    """
+    symbols, inverse = np.unique(np.asarray(elements, dtype=str), return_inverse=True)
+    lookup = np.array([ATOMIC_NUMBERS.get(symbol.capitalize(), 0) for symbol in symbols.tolist()], dtype=np.int64)
+    unknown = [symbol for symbol, number in zip(symbols.tolist(), lookup.tolist()) if not number]
+    return lookup[inverse.reshape(-1)], unknown
+
+
+def _closest_pair_brute_force(coords, cutoff):
+    n_atoms = len(coords)
+    rows_per_chunk = max(1, _BRUTE_FORCE_CHUNK // n_atoms)
+    best = (np.inf, -1, -1)
+    for start in range(0, n_atoms, rows_per_chunk):
+        rows = np.arange(start, min(n_atoms, start + rows_per_chunk))
+        distances = np.linalg.norm(coords[rows, None, :] - coords[None, :, :], axis=-1)
+        # 自分自身と、調べ済みのペア (j <= i) を除く
+        distances[np.arange(n_atoms)[None, :] <= rows[:, None]] = np.inf
+        row, column = np.unravel_index(int(np.argmin(distances)), distances.shape)
+        if distances[row, column] < best[0]:
+            best = (float(distances[row, column]), int(rows[row]), int(column))
+    return best if best[0] < cutoff else None
+
+
+def closest_pair(coords, cutoff):
+    """
+    距離が cutoff 未満の原子のペアのうち、最も近いものを探す。
+    一辺 cutoff のセルに原子を振り分け (cell list)、同じセルと隣接セルの原子同士のみを比べるため、
+    原子の密度が有限であれば O(N log N) で済む。
+    Returns: (距離, i, j) (i < j)、cutoff 未満のペアが無ければ None
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    n_atoms = len(coords)
+    if n_atoms < 2 or cutoff <= 0:
+        return None
+
+    cells = np.floor((coords - coords.min(axis=0)) / cutoff).astype(np.int64)
+    dims = cells.max(axis=0) + 3 # 隣接セルの添字が範囲外にならないよう両側に1つずつ余裕を持たせる
+    if n_atoms < _BRUTE_FORCE_ATOMS or float(np.prod(dims.astype(np.float64))) >= 2.0 ** 62:
+        return _closest_pair_brute_force(coords, cutoff)
+
+    cells += 1
+    strides = np.array([dims[1] * dims[2], dims[2], 1], dtype=np.int64)
+    keys = cells @ strides
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    best = (np.inf, -1, -1)
+    for offset in _HALF_SHELL:
+        neighbour_keys = keys + offset @ strides
+        lower = np.searchsorted(sorted_keys, neighbour_keys, side='left')
+        upper = np.searchsorted(sorted_keys, neighbour_keys, side='right')
+        counts = upper - lower
+        total = int(counts.sum())
+        if not total:
+            continue
+        # 原子 i と、隣接セルの原子 (sorted_keys[lower[i]:upper[i]]) の組を一度に展開する
+        first = np.repeat(np.arange(n_atoms), counts)
+        starts = np.repeat(lower - (np.cumsum(counts) - counts), counts)
+        second = order[starts + np.arange(total)]
+        if not offset.any():
+            keep = first < second
+            first, second = first[keep], second[keep]
+            if not len(first):
+                continue
+        distances = np.linalg.norm(coords[first] - coords[second], axis=1)
+        index = int(np.argmin(distances))
+        if distances[index] < best[0]:
+            i, j = sorted((int(first[index]), int(second[index])))
+            best = (float(distances[index]), i, j)
+    return best if best[0] < cutoff else None
+
+
+def _first_bad_atom_line(lines, first_line_number):
+    """原子行として読めない最初の行 (行番号, 内容)。すべて読めれば None。"""
+    for offset, line in enumerate(lines):
+        row = line.split()
+        if len(row) >= 4 and row[0][:1].isalpha():
+            try:
+                [float(value) for value in row[1:4]]
+                continue
+            except ValueError:
+                pass
+        return first_line_number + offset, line.strip()
+    return None
+
+
+def parse_xyz_strict(xyz_content, allow_multiple_frames=False):
+    """
+    XYZ を厳密に解析する。各フレームの原子数の行と原子行の数が一致し、
+    すべての原子行が 'El x y z' (5列目以降は無視) として読める必要がある。
+    Returns: [(コメント行, Geometry)]
+    Raises: InvalidInputError (行番号と理由)
+    """
+    lines = xyz_content.splitlines()
+    frames = []
+    header_line = 0
+    i = 0
+    while i < len(lines):
+        if not lines[i].strip():
+            i += 1
+            continue
+        header = lines[i].strip()
+        try:
+            n_atoms = int(header)
+        except ValueError:
+            if frames:
+                raise InvalidInputError(
+                    f"line {i + 1}: more atom lines than the atom count on line {header_line} declares: '{header[:60]}'"
+                )
+            raise InvalidInputError(f"line {i + 1}: expected the atom count, found '{header[:60]}'")
+        if n_atoms <= 0:
+            raise InvalidInputError(f"line {i + 1}: atom count must be positive, found {n_atoms}")
+        header_line = i + 1
+        if frames and not allow_multiple_frames:
+            raise InvalidInputError(
+                f"line {i + 1}: file contains more than one frame; "
+                f"conformer ensembles require [prescreen] enabled = true"
+            )
+
+        atom_lines = lines[i + 2:i + 2 + n_atoms]
+        if len(atom_lines) < n_atoms or not all(line.strip() for line in atom_lines):
+            present = next((k for k, line in enumerate(atom_lines) if not line.strip()), len(atom_lines))
+            raise InvalidInputError(
+                f"line {i + 1}: header declares {n_atoms} atoms but only {present} atom lines follow"
+            )
+        geometry = Geometry.from_atom_lines(atom_lines)
+        if geometry.n_atoms != n_atoms:
+            bad = _first_bad_atom_line(atom_lines, i + 3)
+            detail = f"line {bad[0]}: malformed atom line '{bad[1][:60]}'" if bad else \
+                f"line {i + 1}: header declares {n_atoms} atoms but {geometry.n_atoms} could be read"
+            raise InvalidInputError(detail)
+        frames.append((lines[i + 1].strip() if i + 1 < len(lines) else '', geometry))
+        i += 2 + n_atoms
+
+    if not frames:
+        raise InvalidInputError("file contains no atoms")
+    return frames
+
+
+class InputValidator:
+    """
+    XYZ を取り込む時点で、ORCA に渡す前に入力を検証するクラス ([validation])。
+
+    - 各フレームの原子数の行と原子行の数が一致し、すべての原子行が読めること
+    - 元素記号が周期表 (H-Og) にあること
+    - 座標が有限であること
+    - 最も近い原子間の距離が min_distance (Å) 以上であること (重なった原子、座標の重複)
+    - 電子数 (原子番号の和 - [orca] charge) とスピン多重度の偶奇が合うこと
+
+    不合格の XYZ は InvalidInputError を送出し、取り込み側で隔離される (ジョブは登録されない)。
+    """
+
+    def __init__(self, config):
+        self.logger = _validator_logger
+        self.enabled = config.getboolean('validation', 'enabled', fallback=True)
+        self.check_parity = config.getboolean('validation', 'check_parity', fallback=True)
+        try:
+            self.min_distance = config.getfloat('validation', 'min_distance', fallback=0.5)
+            self.charge = int(config['orca'].get('charge', '0'))
+            self.multiplicity = int(config['orca'].get('multiplicity', '1'))
+        except ValueError:
+            raise ValueError("[validation] min_distance must be a number and [orca] charge/multiplicity integers.")
+        if self.multiplicity < 1:
+            raise ValueError("[orca] multiplicity must be >= 1.")
+
+    def validate(self, xyz_content, allow_multiple_frames=False):
+        """
+        Returns: [(コメント行, Geometry)] (allow_multiple_frames が False なら1フレーム)
+        Raises: InvalidInputError
+        """
+        frames = parse_xyz_strict(xyz_content, allow_multiple_frames)
+        for index, (_, geometry) in enumerate(frames):
+            try:
+                self.check_geometry(geometry)
+            except InvalidInputError as e:
+                if len(frames) > 1:
+                    raise InvalidInputError(f"frame {index + 1}: {e.reason}")
+                raise
+        return frames
+
+    def check_geometry(self, geometry):
+        numbers, unknown = atomic_numbers(geometry.elements)
+        if unknown:
+            raise InvalidInputError(f"unknown element symbol(s): {', '.join(unknown[:10])}")
+
+        finite = np.isfinite(geometry.coords).all(axis=1)
+        if not finite.all():
+            atom = int(np.argmin(finite))
+            raise InvalidInputError(f"atom {atom + 1} ({geometry.elements[atom]}) has a non-finite coordinate")
+
+        pair = closest_pair(geometry.coords, self.min_distance)
+        if pair is not None:
+            distance, i, j = pair
+            raise InvalidInputError(
+                f"atoms {i + 1} ({geometry.elements[i]}) and {j + 1} ({geometry.elements[j]}) are "
+                f"{distance:.3f} Å apart (minimum {self.min_distance} Å)"
+            )
+
+        if self.check_parity:
+            electrons = int(numbers.sum()) - self.charge
+            unpaired = self.multiplicity - 1
+            if electrons < unpaired:
+                raise InvalidInputError(
+                    f"{electrons} electrons (charge {self.charge}) cannot have multiplicity {self.multiplicity}"
+                )
+            if (electrons - unpaired) % 2:
+                raise InvalidInputError(
+                    f"{electrons} electrons (charge {self.charge}) are incompatible with multiplicity "
+                    f"{self.multiplicity}; {'even' if electrons % 2 else 'odd'} multiplicity required"
+                )
@@ -1,33 +1,47 @@
 # job_handler.py
-import shutil
-import traceback
 from pathlib import Path
 
 # --- 依存関係のインポート ---
 from logging_utils import get_logger
 from notification_service import send_notification # 通知サービス
-from pipeline_utils import safe_write # I/Oユーティリティ
+from products_store import ProductsStore # 成果物の圧縮・重複排除保存
+from results_db import ResultsDatabase, default_results_db_path # 計算結果データベース
 # ORCAユーティリティ
 from orca_utils import (
-    generate_orca_input, 
-    extract_final_structure, 
+    extract_results, 
     generate_energy_plot, 
     generate_comparison_plot
 )
 
 _handler_logger = get_logger('job_handler')
 
+
+def is_permanent_failure(current_retries, max_retries, error_type):
+    """リトライの上限を超えたか、リトライしても成功しない種類 (FATAL_*) の失敗か。"""
+    return current_retries > max_retries or error_type.startswith("FATAL")
+
+
 class JobCompletionHandler:
-    """ジョブ成功・失敗時の後処理と、連鎖計算のロジックを担当するクラス。"""
+    """ジョブ成功・失敗時の後処理を担当し、連鎖計算はワークフローエンジンに委譲するクラス。"""
     
-    def __init__(self, config, state_store, notification_throttle, scheduler):
+    def __init__(self, config, state_store, notification_throttle, scheduler, products_store=None,
+                 results_db=None, workflow=None):
         # 依存関係の注入
         self.config = config
         self.state_store = state_store
         self.notification_throttle = notification_throttle
         self.scheduler = scheduler # JobSchedulerのインスタンス
+        self.products_store = products_store or ProductsStore(config)
+        self.results_db = results_db or ResultsDatabase(default_results_db_path(config))
+        self.workflow = workflow # WorkflowEngineのインスタンス (Setter注入も可)
+        # 振動数計算の変位ジョブを回収する NumericalFrequencies (Setter注入)
+        self.numfreq = None
         self.logger = _handler_logger
         
+        self.apply_config(config)
+
+    def apply_config(self, config):
+        """起動時と設定の再読み込み時に、リトライ回数の上限を読み込む。"""
         try:
             self.max_retries = int(config.get('orca', 'max_retries', fallback=3))
         except ValueError:
@@ -38,42 +52,65 @@ class JobCompletionHandler:
         """循環依存解決のため、後からschedulerインスタンスを注入するメソッド。"""
         self.scheduler = scheduler
 
+    def set_workflow(self, workflow):
+        """WorkflowEngine は scheduler に依存するため、後から注入する。"""
+        self.workflow = workflow
+
+    def set_numerical_frequencies(self, numfreq):
+        self.numfreq = numfreq
+
     # --- 状態更新のユーティリティメソッド ---
-    def update_status_running(self, inp_path):
-        self.state_store.update_status(inp_path, 'RUNNING')
+    def update_status_running(self, inp_path, **fields):
+        self.state_store.update_status(inp_path, 'RUNNING', **fields)
 
     def update_status_error(self, inp_path, message):
         self.state_store.update_status(inp_path, f'FAILED: {message}')
 
     # --- 成功時のハンドリング ---
-    def handle_success(self, orca_path, mol_name, calc_type, work_dir, product_dir):
-        """Handles successful ORCA job completion."""
+    def handle_success(self, orca_path, mol_name, calc_type, work_dir, product_dir, job_id=None):
+        """
+        Handles successful ORCA job completion.
+        job_id is the StateStore key of the job (the original .inp path).
+        """
         self.logger.info(f"Job completed successfully: {mol_name} ({calc_type})")
 
+        # 数値振動数の変位ジョブは勾配のみを回収し、products には保存しない
+        if self.numfreq is not None and self.numfreq.is_displacement(calc_type):
+            if not self.numfreq.record_displacement(job_id, mol_name, calc_type, orca_path):
+                # ORCA は正常終了しているため、再実行しても .engrad は得られない (キーワードの誤りなど)
+                self.handle_failure(job_id, mol_name, "Gradient file (.engrad) missing or unreadable",
+                                    self.state_store.increment_retry_count(job_id), "FATAL_INPUT")
+            return
+
         output_path = orca_path.with_suffix('.out')
         
         mol_product_dir = product_dir / mol_name
         mol_product_dir.mkdir(parents=True, exist_ok=True)
         
-        final_output_path = mol_product_dir / output_path.name
-        
-        shutil.copy(output_path, final_output_path)
-        self.state_store.update_status(str(final_output_path), 'COMPLETED')
+        self._record_results(job_id, output_path, mol_name, calc_type)
 
-        generate_energy_plot(final_output_path, mol_product_dir)
-        
-        # ★★★ ここからが変更点 ★★★
-        # Molden生成に必要な .gbw ファイルもコピーする
+        # .out は圧縮して保存 (final_output_path は圧縮拡張子を含まない論理パス)
+        final_output_path = self.products_store.store_output(output_path, mol_name)
+
+        # Molden生成に必要な .gbw ファイルは内容ハッシュで重複排除して保存する。
+        # MoldenService は COMPLETED になった版で .gbw を探すため、状態の更新より先に置く
         gbw_file = orca_path.with_suffix('.gbw')
         if gbw_file.exists():
-            shutil.copy(gbw_file, mol_product_dir / gbw_file.name)
-            self.logger.info(f"Copied .gbw file for {mol_name}")
+            self.products_store.store_gbw(gbw_file, mol_name)
+            self.logger.info(f"Stored .gbw file for {mol_name}")
         else:
             self.logger.warning(f"Could not find .gbw file for {mol_name}. Molden generation may fail.")
-        # ★★★ 変更点ここまで ★★★
 
-        if calc_type == 'opt':
-            self._chain_frequency_calculation(mol_name, mol_product_dir)
+        if job_id is not None:
+            self.state_store.update_status(job_id, 'COMPLETED', output_path=str(final_output_path))
+
+        generate_energy_plot(final_output_path, mol_product_dir)
+
+        self.products_store.maybe_prune()
+
+        # ワークフロー DAG の後続ステップ (例: opt → freq / sp / nmr) を登録
+        if self.workflow is not None:
+            self.workflow.on_step_completed(mol_name, calc_type)
 
         send_notification(
             self.config, 
@@ -82,15 +119,28 @@ class JobCompletionHandler:
             throttle_instance=self.notification_throttle
         )
 
+    def _record_results(self, job_id, output_path, mol_name, calc_type):
+        """
+        解析済みの結果を結果データベースに追記する (失敗してもジョブは成功扱い)。
+        job_id には StateStore のキー (元の .inp のパス) を記録し、ジョブの記録と結合できるようにする。
+        """
+        try:
+            results = extract_results(output_path)
+            if results:
+                self.results_db.record(job_id, mol_name, calc_type, results)
+        except Exception as e:
+            self.logger.error(f"Failed to record results for {mol_name} ({calc_type}): {e}")
+
     # --- 失敗時のハンドリング ---
     def handle_failure(self, orca_path, mol_name, message, current_retries, error_type):
         """
         Handles ORCA job failure, checking retry counts and error type.
+        Returns: True if the failure is permanent (the input will not be retried).
         """
         
-        is_permanent_failure = (current_retries > self.max_retries) or (error_type.startswith("FATAL"))
+        is_permanent = is_permanent_failure(current_retries, self.max_retries, error_type)
 
-        if is_permanent_failure:
+        if is_permanent:
             log_message = (
                 f"Job PERMANENTLY FAILED (Retries: {current_retries}, Type: {error_type}): "
                 f"{mol_name}. Reason: {message}"
@@ -108,7 +158,22 @@ class JobCompletionHandler:
             
             if error_type == "FATAL_RESOURCE":
                 self.scheduler.reduce_workers(reason="Resource Limit")
+
+            job = self.state_store.get_job(str(orca_path)) or {}
+            if self.numfreq is not None and self.numfreq.is_displacement(job.get('calc_type')):
+                self.numfreq.displacement_failed(mol_name, job['calc_type'], message)
         
+        elif error_type == "DISK_SPACE":
+            # ディスク容量不足: 実行を止めて容量の回復 (products の整理) を待ち、同じジョブを再登録する
+            log_message = (
+                f"Job failed (Attempt {current_retries}/{self.max_retries}, Type: {error_type}): "
+                f"{mol_name}. Reason: {message}. Will retry once disk space is available."
+            )
+            self.logger.warning(log_message)
+            self.state_store.update_status(str(orca_path), f'FAILED: {message}')
+            job = self.state_store.get_job(str(orca_path)) or {}
+            self.scheduler.disk_space_exhausted(orca_path, mol_name, job.get('calc_type'), message)
+
         else:
             log_message = (
                 f"Job failed (Attempt {current_retries}/{self.max_retries}, Type: {error_type}): "
@@ -125,28 +190,4 @@ class JobCompletionHandler:
                 throttle_instance=self.notification_throttle
             )
 
-    # --- 連鎖計算のロジック ---
-    def _chain_frequency_calculation(self, mol_name, product_dir):
-        """Chains an optimization job to a frequency job."""
-        opt_output = product_dir / f"{mol_name}_opt.out" 
-        
-        try:
-            atoms, coords = extract_final_structure(opt_output)
-            
-            if atoms and coords:
-                freq_inp_content = generate_orca_input(self.config, mol_name, atoms, coords, calc_type='freq')
-                
-                freq_inp_name = f"{mol_name}_freq.inp"
-                freq_inp_path = product_dir / freq_inp_name
-                
-                safe_write(freq_inp_path, freq_inp_content)
-                
-                self.logger.info(f"Generated frequency input for {mol_name} at {freq_inp_path.name}")
-                
-                self.scheduler.add_job(str(freq_inp_path), mol_name, 'freq')
-                
-            else:
-                self.logger.error(f"Could not extract structure for {mol_name} freq chain.")
-
-        except Exception as e:
-            self.logger.error(f"Error during frequency chain for {mol_name}: {e}\n{traceback.format_exc()}")
+        return is_permanent
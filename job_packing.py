@@ -0,0 +1,167 @@
+# job_packing.py
+import re
+import threading
+from pathlib import Path
+from queue import Empty
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from pipeline_utils import atomic_write # I/Oユーティリティ
+
+_packing_logger = get_logger('job_packing')
+
+# ORCA が $new_job ごとに出力する区切り (例: "$$$$$$$$  JOB NUMBER  2 $$$$$$$$")
+_JOB_MARKER_PATTERN = re.compile(r"^\s*\$+\s*JOB NUMBER\s+(\d+)\s*\$+\s*$", re.MULTILINE)
+_TERMINATED_PATTERN = re.compile(r"ORCA TERMINATED NORMALLY", re.IGNORECASE)
+
+
+def count_inp_atoms(inp_path, limit=None):
+    """
+    .inp の '* xyz' ブロックの原子数を数える。limit を超えた時点で読み込みを打ち切る。
+    Returns: 原子数 (limit 指定時は最大 limit + 1)、座標ブロックが無ければ None
+    """
+    count = None
+    with open(inp_path, 'r', errors='ignore') as f:
+        for line in f:
+            stripped = line.strip()
+            if count is None:
+                if stripped.lower().startswith('* xyz'):
+                    count = 0
+                continue
+            if stripped == '*':
+                break
+            if stripped:
+                count += 1
+                if limit is not None and count > limit:
+                    break
+    return count
+
+
+def collect_pack(job_queue, first_job, packer, is_packable):
+    """
+    first_job (パッキング対象) に続けて、キューからパッキング対象のジョブを取り出してパックを作る。
+    最大 packer.max_scan 件を調べ、対象外のジョブは元の順序のままキューの先頭に戻す。
+    Returns: 実行するジョブのリスト (first_job を先頭に含む)
+    """
+    pack, deferred = [first_job], []
+    for _ in range(packer.max_scan):
+        if len(pack) >= packer.max_jobs:
+            break
+        try:
+            job = job_queue.get_nowait()
+        except Empty:
+            break
+        if is_packable(job):
+            pack.append(job)
+        else:
+            deferred.append(job)
+
+    if deferred:
+        job_queue.requeue_front(deferred)
+    return pack
+
+
+def _is_compound_input(inp_path):
+    """.inp に $new_job が含まれるか (method ladder など)。"""
+    with open(inp_path, 'r', errors='ignore') as f:
+        return any(line.strip().lower() == '$new_job' for line in f)
+
+
+class JobPacker:
+    """
+    小さな分子のジョブを ORCA の $new_job 複合入力にまとめ、
+    実行後に出力を分子ごとに分割するクラス。
+    """
+
+    def __init__(self, config):
+        self.enabled = config.getboolean('packing', 'enabled', fallback=False)
+        self.max_atoms = config.getint('packing', 'max_atoms', fallback=12)
+        self.max_jobs = max(1, config.getint('packing', 'max_jobs_per_pack', fallback=16))
+        # 1回のパック作成でキューから取り出して調べる最大件数
+        self.max_scan = self.max_jobs * 4
+        self.logger = _packing_logger
+        self._atom_counts = {}
+        self._lock = threading.Lock()
+
+    def is_packable(self, inp_file):
+        """パッキング対象 (原子数が max_atoms 以下) のジョブかどうか。"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            count = self._atom_counts.get(inp_file)
+        if count is None:
+            try:
+                # method ladder の入力は既に $new_job 複合入力のため、まとめない
+                count = None if _is_compound_input(inp_file) else count_inp_atoms(inp_file, limit=self.max_atoms)
+            except OSError:
+                return False
+            if count is None:
+                return False
+            with self._lock:
+                self._atom_counts[inp_file] = count
+        return count <= self.max_atoms
+
+    def forget(self, inp_file):
+        with self._lock:
+            self._atom_counts.pop(inp_file, None)
+
+    def build_compound_input(self, inp_paths):
+        """
+        各 .inp の先頭に %base "<stem>" を付け、$new_job で連結した複合入力を返す。
+        %base により .gbw などのファイルは分子ごとの名前で出力される。
+        ORCA は既定で前のジョブの軌道を初期推測に使うが、別分子では意味が無いため
+        MORead を指定していないジョブには PModel の初期推測を明示する。
+        """
+        parts = []
+        for inp_path in inp_paths:
+            inp_path = Path(inp_path)
+            with open(inp_path, 'r') as f:
+                content = f.read().strip()
+            header = f'%base "{inp_path.stem}"\n'
+            if 'moread' not in content.lower():
+                header += "! NoAutoStart PModel\n"
+            parts.append(f'{header}{content}\n')
+        return "\n$new_job\n".join(parts)
+
+    def split_output(self, packed_output, stems, dest_dir):
+        """
+        複合ジョブの出力を分子ごとの <stem>.out に分割して dest_dir に書き込む。
+        ORCA の正常終了マーカーは最後のジョブの出力にしか無いため、後続のジョブが開始された
+        (ORCA がそのジョブを終えて次に進んだ) ジョブは finished として別に返す。
+        判定は check_orca_output(path, finished=True) で行う (マーカーは付け足さない)。
+
+        Returns:
+            tuple: (outputs, finished)
+                outputs: stem -> 出力パス。実行されなかった (前のジョブで中断した) ジョブは None。
+                finished: ORCA が次のジョブに進んだ (または全体が正常終了した) ジョブの stem の集合
+        """
+        with open(packed_output, 'r', errors='ignore') as f:
+            content = f.read()
+
+        markers = {int(m.group(1)): m.start() for m in _JOB_MARKER_PATTERN.finditer(content)}
+        # 最初のジョブには区切りが出力されない場合がある
+        markers.setdefault(1, 0)
+        terminated = bool(_TERMINATED_PATTERN.search(content))
+
+        starts = [markers.get(i + 1) for i in range(len(stems))]
+        started = [i for i, start in enumerate(starts) if start is not None]
+        last_started = started[-1] if started else -1
+
+        outputs = {}
+        finished = set()
+        for i, stem in enumerate(stems):
+            start = starts[i]
+            if start is None:
+                outputs[stem] = None
+                continue
+            following = [s for s in starts[i + 1:] if s is not None]
+            end = following[0] if following else len(content)
+
+            if i < last_started or (i == last_started and terminated):
+                finished.add(stem)
+
+            out_path = Path(dest_dir) / f"{stem}.out"
+            atomic_write(out_path, content[start:end])
+            outputs[stem] = out_path
+
+        return outputs, finished
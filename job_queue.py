@@ -0,0 +1,270 @@
+# job_queue.py
+import json
+import heapq
+import threading
+from collections import Counter, deque
+from pathlib import Path
+from queue import Empty
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from pipeline_utils import safe_write # I/Oユーティリティ
+from tenants import DEFAULT_TENANT
+
+_queue_logger = get_logger('job_queue')
+
+QUEUE_SNAPSHOT_NAME = 'queue_snapshot.json'
+
+
+def default_queue_snapshot_path(config):
+    """state_dir/queue_snapshot.json (ドレイン時に未実行のキュー内容を保存する)"""
+    state_dir = Path(config['paths'].get('state_dir', 'folders/state'))
+    return state_dir / QUEUE_SNAPSHOT_NAME
+
+
+def save_queue_snapshot(path, jobs):
+    """キューに残っているジョブ (inp_file, mol_name, calc_type) を順序付きで保存する。"""
+    content = json.dumps([[str(inp_file), mol_name, calc_type] for inp_file, mol_name, calc_type in jobs])
+    return safe_write(path, content)
+
+
+def load_queue_snapshot(path, remove=False):
+    """
+    保存されたキューの順序を {inp_file: 順位} として返す。ファイルが無い・壊れている場合は空。
+    remove=True の場合は読み込み後に削除する (一度だけ使う)。
+    """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    try:
+        with open(path, 'r') as f:
+            jobs = json.load(f)
+        order = {entry[0]: index for index, entry in enumerate(jobs)}
+    except (OSError, ValueError, TypeError, IndexError) as e:
+        _queue_logger.warning(f"Ignoring unreadable queue snapshot {path}: {e}")
+        order = {}
+    if remove:
+        path.unlink(missing_ok=True)
+    return order
+
+
+class JobQueue:
+    """
+    ワーカーに (inp_file, mol_name, calc_type) を配るキュー。
+
+    ワーカーは get() で Condition を待つだけで、タイムアウトによるポーリングは行わない。
+    get() が None (停止の番兵) を返したらワーカーは終了する。番兵が返るのは
+    - close() 後 (ドレイン: キューに残ったジョブは実行せず、drain_pending() で回収する)
+    - retire_worker() で要求された数だけ (ワーカー数の削減: 空いたワーカーから順に終了)
+
+    ジョブはテナント (TenantRegistry、[tenants]) ごとの FIFO に入り、重み付きの公平配分で取り出す。
+    - 実行中 (取り出してから task_done() まで) のジョブ数 / weight が最も小さいテナントから取り出す
+      (すべてのテナントにジョブがあれば、ワーカーは weight の比で分け合う)
+    - 同数の場合は、これまでの取り出し数 / weight (pass) が小さいテナントを選ぶ。キューが空だった
+      テナントの pass は他のテナントの最小値まで進め、空いていた間の分を後からまとめて使わせない
+    - max_running に達したテナントのジョブは、そのテナントのジョブが終わるまで取り出さない
+    テナントが1つ (既定) の場合は従来どおりの FIFO になる。
+    """
+
+    def __init__(self, tenants=None):
+        self.tenants = tenants
+        self._queues = {} # テナント -> deque
+        self._size = 0
+        self._pass = {}
+        self._running = Counter()
+        self._in_flight = {} # 取り出したジョブの inp_file -> テナント
+        self._condition = threading.Condition()
+        self._closed = False
+        self._retire_requests = 0
+
+    def _tenant(self, job):
+        return self.tenants.tenant_of(job[1]) if self.tenants is not None else DEFAULT_TENANT
+
+    def _push(self, job, front=False):
+        # ロックを保持したまま呼ばれる
+        tenant = self._tenant(job)
+        queue = self._queues.get(tenant)
+        if queue is None:
+            queue = self._queues[tenant] = deque()
+            others = [self._pass[name] for name in self._queues if name != tenant]
+            self._pass[tenant] = max(self._pass.get(tenant, 0.0), min(others, default=0.0))
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        self._size += 1
+        # 実行しなかった (キューに戻された・再登録された) ジョブは実行中から外す
+        self._release(str(job[0]))
+
+    def _release(self, job_id):
+        tenant = self._in_flight.pop(job_id, None)
+        if tenant is None:
+            return False
+        self._running[tenant] -= 1
+        if not self._running[tenant]:
+            del self._running[tenant]
+        return True
+
+    def _eligible(self):
+        """取り出せるテナントを公平配分の順に並べる (先頭が次に取り出すテナント)。"""
+        candidates = []
+        for tenant in self._queues:
+            limit = self.tenants.max_running(tenant) if self.tenants is not None else 0
+            if limit and self._running[tenant] >= limit:
+                continue
+            weight = self.tenants.weight(tenant) if self.tenants is not None else 1.0
+            candidates.append((self._running[tenant] / weight, self._pass[tenant], tenant))
+        return [tenant for _, _, tenant in sorted(candidates)]
+
+    def _pop(self):
+        """次のジョブを取り出して実行中として数える。取り出せるジョブが無ければ None。"""
+        if not self._size:
+            return None
+        if len(self._queues) == 1 and self.tenants is None:
+            tenant = next(iter(self._queues))
+        else:
+            eligible = self._eligible()
+            if not eligible:
+                return None
+            tenant = eligible[0]
+        queue = self._queues[tenant]
+        job = queue.popleft()
+        if not queue:
+            del self._queues[tenant]
+        self._size -= 1
+        self._pass[tenant] += 1.0 / (self.tenants.weight(tenant) if self.tenants is not None else 1.0)
+        self._in_flight[str(job[0])] = tenant
+        self._running[tenant] += 1
+        return job
+
+    def put(self, job):
+        self.put_many([job])
+
+    def put_many(self, jobs):
+        """ジョブを末尾に追加する。close() 後は追加せず False を返す。"""
+        with self._condition:
+            if self._closed:
+                return False
+            added = 0
+            for job in jobs:
+                self._push(job)
+                added += 1
+            if added == 1:
+                self._condition.notify()
+            elif added:
+                self._condition.notify_all()
+            return True
+
+    def requeue_front(self, jobs):
+        """取り出したが実行しなかったジョブを元の順序のまま先頭に戻す。"""
+        jobs = list(jobs)
+        with self._condition:
+            for job in reversed(jobs):
+                self._push(job, front=True)
+            if jobs and not self._closed:
+                self._condition.notify_all()
+
+    def task_done(self, jobs):
+        """取り出したジョブの実行が終わった (または実行しなかった) ことを記録する。"""
+        with self._condition:
+            released = [self._release(str(job[0])) for job in jobs]
+            # max_running で止めていたテナントのジョブを取り出せるようになった
+            if any(released) and self._size:
+                self._condition.notify_all()
+
+    def refresh(self):
+        """テナントの設定 (max_running など) が変わったときに、待機中のワーカーに取り直させる。"""
+        with self._condition:
+            self._condition.notify_all()
+
+    def get(self):
+        """ジョブが来るまで待つ。停止すべきワーカーには None を返す。"""
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                if self._retire_requests:
+                    self._retire_requests -= 1
+                    return None
+                job = self._pop()
+                if job is not None:
+                    return job
+                self._condition.wait()
+
+    def get_nowait(self):
+        with self._condition:
+            job = None if self._closed else self._pop()
+            if job is None:
+                raise Empty
+            return job
+
+    def retire_worker(self):
+        """ワーカーを1つ終了させる (実行中のジョブが終わったワーカーから順に)。"""
+        with self._condition:
+            self._retire_requests += 1
+            self._condition.notify()
+
+    def cancel_retire(self, count):
+        """
+        まだ実行されていないワーカー終了要求を最大 count 個取り消す (ワーカー数を再び増やす場合)。
+        Returns: 取り消した要求の数
+        """
+        with self._condition:
+            cancelled = min(count, self._retire_requests)
+            self._retire_requests -= cancelled
+            return cancelled
+
+    def close(self):
+        """新しいジョブの受け付けと配布を止め、待機中のワーカーをすべて起こす。"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _ordered(self):
+        """
+        キューのジョブを取り出される見込みの順 (pass の順に交互、実行中の数と上限は考えない) に並べる。
+        """
+        if len(self._queues) <= 1:
+            return [job for queue in self._queues.values() for job in queue]
+        heap = [(self._pass[tenant], index, tenant) for index, tenant in enumerate(self._queues)]
+        heapq.heapify(heap)
+        positions = {tenant: 0 for tenant in self._queues}
+        jobs = []
+        while heap:
+            pass_value, index, tenant = heapq.heappop(heap)
+            queue = self._queues[tenant]
+            jobs.append(queue[positions[tenant]])
+            positions[tenant] += 1
+            if positions[tenant] < len(queue):
+                weight = self.tenants.weight(tenant) if self.tenants is not None else 1.0
+                heapq.heappush(heap, (pass_value + 1.0 / weight, index, tenant))
+        return jobs
+
+    def drain_pending(self):
+        """キューに残っているジョブをすべて取り出して返す。"""
+        with self._condition:
+            jobs = self._ordered()
+            self._queues.clear()
+            self._size = 0
+            return jobs
+
+    def snapshot(self):
+        with self._condition:
+            return self._ordered()
+
+    def qsize(self):
+        with self._condition:
+            return self._size
+
+    def tenant_counts(self):
+        """Returns: {テナント: {'queued': キュー内のジョブ数, 'running': 実行中のジョブ数}}"""
+        with self._condition:
+            tenants = set(self._queues) | set(self._running)
+            return {
+                tenant: {'queued': len(self._queues.get(tenant, ())), 'running': self._running[tenant]}
+                for tenant in tenants
+            }
@@ -0,0 +1,217 @@
+# job_recovery.py
+import os
+import time
+import shutil
+from pathlib import Path
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from job_queue import default_queue_snapshot_path, load_queue_snapshot
+
+_recovery_logger = get_logger('recovery')
+
+# 再キューイング対象とするステータス (FAILED は 'FAILED: <理由>' 形式)
+RECOVERABLE_STATUSES = ('PENDING', 'RUNNING', 'INTERRUPTED', 'FAILED')
+
+# waiting_dir の .inp 名から計算タイプを推定する際の既知タイプ (既定ワークフロー)
+KNOWN_CALC_TYPES = ('opt', 'freq')
+
+# products_dir 内で完了済みとみなす出力ファイルの拡張子
+PRODUCT_OUTPUT_SUFFIXES = ('.out', '.out.gz', '.out.zst')
+
+
+def _status_category(status):
+    """'FAILED: SCF failed...' のようなステータスを 'FAILED' に正規化する。"""
+    return (status or '').split(':', 1)[0].strip().upper()
+
+
+def read_inp_header(inp_path):
+    """
+    generate_orca_input が書き込むヘッダ行 ('# Molecule: X | Type: Y') から
+    (mol_name, calc_type) を読み取る。見つからない場合は (None, None)。
+    ファイル全体ではなく先頭数行のみを読む。
+    """
+    try:
+        with open(inp_path, 'r', errors='ignore') as f:
+            for _ in range(3):
+                line = f.readline()
+                if not line:
+                    break
+                if line.startswith('# Molecule:'):
+                    mol_part, _, type_part = line[len('# Molecule:'):].partition('| Type:')
+                    mol_name = mol_part.strip()
+                    calc_type = type_part.strip()
+                    if mol_name and calc_type:
+                        return mol_name, calc_type
+    except OSError:
+        pass
+    return None, None
+
+
+def guess_job_from_stem(stem, known_calc_types=KNOWN_CALC_TYPES):
+    """
+    ヘッダが無い .inp 用のフォールバック。末尾の '_<calc_type>' のみを計算タイプとして扱う
+    (分子名の途中に '_opt' を含む場合の誤判定を防ぐ)。
+    """
+    mol_name, sep, calc_type = stem.rpartition('_')
+    if sep and mol_name and calc_type in known_calc_types:
+        return mol_name, calc_type
+    return stem, 'opt'
+
+
+class RecoveryReport:
+    """起動時リカバリの集計結果。"""
+
+    def __init__(self):
+        self.requeued = 0
+        self.adopted = 0
+        self.completed = 0
+        self.missing_input = 0
+        self.orphans_removed = 0
+        self.elapsed_seconds = 0.0
+
+    def summary(self):
+        return (
+            f"re-queued={self.requeued} (untracked inputs adopted={self.adopted}), "
+            f"marked completed={self.completed}, missing inputs={self.missing_input}, "
+            f"orphaned work dirs removed={self.orphans_removed}, "
+            f"elapsed={self.elapsed_seconds:.2f}s"
+        )
+
+
+class RecoveryEngine:
+    """
+    起動時に StateStore・waiting_dir・working_dir・products_dir を1回の走査で突き合わせ、
+    未完了ジョブをまとめて再登録するクラス。
+    """
+
+    def __init__(self, config, state_store, scheduler, known_calc_types=KNOWN_CALC_TYPES):
+        # 依存関係の注入
+        self.config = config
+        self.state_store = state_store
+        self.scheduler = scheduler
+        # ワークフローのステップ名 (ヘッダの無い .inp の計算タイプ推定に使用)
+        self.known_calc_types = tuple(known_calc_types)
+        self.logger = _recovery_logger
+
+        self.waiting_dir = Path(config['paths']['waiting_dir'])
+        self.working_dir = Path(config['paths']['working_dir'])
+        self.products_dir = Path(config['paths']['products_dir'])
+
+    def run(self):
+        """リカバリを実行し、RecoveryReport を返す。"""
+        started = time.perf_counter()
+        report = RecoveryReport()
+
+        completed_keys = self._index_products()
+        waiting_inputs = self._index_waiting_inputs()
+
+        # (mol_name, calc_type) -> (inp_path, mol_name, calc_type)
+        to_queue = {}
+        status_updates = {}
+
+        # 1. StateStore に記録されている未完了ジョブ
+        for job_id, info in self.state_store.items():
+            if _status_category(info.get('status')) not in RECOVERABLE_STATUSES:
+                continue
+
+            mol_name = info.get('molecule')
+            calc_type = info.get('calc_type')
+            key = (mol_name, calc_type)
+
+            if key in completed_keys:
+                status_updates[job_id] = 'COMPLETED'
+                report.completed += 1
+                continue
+
+            if job_id not in waiting_inputs and not Path(job_id).exists():
+                status_updates[job_id] = 'PERMANENT_FAILED: Input file missing at recovery'
+                report.missing_input += 1
+                continue
+
+            waiting_inputs.pop(job_id, None)
+            to_queue.setdefault(key, (job_id, mol_name, calc_type))
+
+        # 2. StateStore に記録されていない waiting_dir 内の .inp
+        for inp_path in waiting_inputs:
+            mol_name, calc_type = read_inp_header(inp_path)
+            if mol_name is None:
+                mol_name, calc_type = guess_job_from_stem(Path(inp_path).stem, self.known_calc_types)
+            key = (mol_name, calc_type)
+
+            if key in completed_keys:
+                Path(inp_path).unlink(missing_ok=True)
+                report.completed += 1
+                continue
+
+            if key not in to_queue:
+                to_queue[key] = (inp_path, mol_name, calc_type)
+                report.adopted += 1
+
+        # 3. 再登録されない作業ディレクトリの掃除
+        active_stems = {Path(inp_path).stem for inp_path, _, _ in to_queue.values()}
+        report.orphans_removed = self._remove_orphaned_work_dirs(active_stems)
+
+        # 4. 一括永続化と再キューイング
+        if status_updates:
+            self.state_store.update_statuses_bulk(status_updates)
+        # 前回のドレインで保存されたキューの順序を復元する (記録の無いジョブはその後ろ)
+        queue_order = load_queue_snapshot(default_queue_snapshot_path(self.config), remove=True)
+        jobs = sorted(to_queue.values(), key=lambda job: queue_order.get(job[0], len(queue_order)))
+        report.requeued = self.scheduler.add_jobs_bulk(jobs, is_recovery=True)
+
+        report.elapsed_seconds = time.perf_counter() - started
+        self.logger.info(f"Startup recovery finished: {report.summary()}")
+        return report
+
+    def _index_products(self):
+        """products_dir/<mol>/<mol>_<calc>.out から完了済み (mol, calc_type) の集合を作る。"""
+        completed = set()
+        if not self.products_dir.is_dir():
+            return completed
+
+        with os.scandir(self.products_dir) as mol_entries:
+            for mol_entry in mol_entries:
+                if not mol_entry.is_dir():
+                    continue
+                mol_name = mol_entry.name
+                prefix = f"{mol_name}_"
+                with os.scandir(mol_entry.path) as file_entries:
+                    for entry in file_entries:
+                        name = entry.name
+                        if not name.startswith(prefix):
+                            continue
+                        # 圧縮保存された出力 (.out.gz / .out.zst) も完了とみなす
+                        for suffix in PRODUCT_OUTPUT_SUFFIXES:
+                            if name.endswith(suffix):
+                                completed.add((mol_name, name[len(prefix):-len(suffix)]))
+                                break
+        return completed
+
+    def _index_waiting_inputs(self):
+        """waiting_dir 内の .inp パスを {str(path): None} としてストリーミングで索引化する。"""
+        inputs = {}
+        if not self.waiting_dir.is_dir():
+            return inputs
+
+        with os.scandir(self.waiting_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.inp') and entry.is_file():
+                    inputs[str(self.waiting_dir / entry.name)] = None
+        return inputs
+
+    def _remove_orphaned_work_dirs(self, active_stems):
+        """再キューイング対象に対応しない working_dir 内のディレクトリを削除する。"""
+        removed = 0
+        if not self.working_dir.is_dir():
+            return removed
+
+        with os.scandir(self.working_dir) as entries:
+            orphans = [entry.path for entry in entries
+                       if entry.is_dir() and entry.name not in active_stems]
+
+        for path in orphans:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+            self.logger.info(f"Removed orphaned working directory: {Path(path).name}")
+        return removed
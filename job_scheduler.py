@@ -0,0 +1,392 @@
+# job_scheduler.py
+import time
+import signal
+import itertools
+import threading
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from notification_service import send_notification
+from job_queue import JobQueue, default_queue_snapshot_path, save_queue_snapshot
+from job_packing import collect_pack
+from tenants import TenantRegistry
+
+_scheduler_logger = get_logger('scheduler')
+
+# シャットダウン時に実行中の ORCA をどう扱うか ([shutdown] drain_mode)
+DRAIN_MODES = ('wait', 'checkpoint', 'terminate')
+# スタックダンプやプロファイルでワーカーを見分けるための通し番号
+_worker_ids = itertools.count(1)
+
+class ThreadWorker(threading.Thread):
+    """Worker thread that executes jobs by calling the injected executor."""
+    def __init__(self, job_queue, manager):
+        super().__init__(name=f"ThreadWorker-{next(_worker_ids)}")
+        self.job_queue = job_queue
+        # JobSchedulerインスタンスを受け取り、executorへアクセスする
+        self.manager = manager 
+        self.daemon = True
+        # 実行中のジョブ (スタックダンプ用。待機中は None)
+        self.current_job = None
+
+    def run(self):
+        while True:
+            # ジョブが来るまで待機する。None (番兵) はドレインまたはワーカー削減による停止要求
+            job = self.job_queue.get()
+            if job is None:
+                break
+            # ディスク容量が足りなければジョブをキューに戻し、しばらく待ってから取り直す
+            if not self.manager.admit(job):
+                continue
+
+            self.current_job = job
+            pack = [job]
+            try:
+                # 小分子ジョブは、キューに並んでいる他の小分子ジョブとまとめて1プロセスで実行する
+                pack = self.manager.collect_pack(job)
+                # 委託: 実行ロジックは注入されたexecutorに依頼する
+                if len(pack) > 1:
+                    self.manager.executor.execute_packed(pack)
+                else:
+                    self.manager.executor.execute(*job)
+            except Exception as e:
+                _scheduler_logger.error(f"Worker experienced unhandled error: {e}")
+            finally:
+                self.current_job = None
+                # テナントの実行中のジョブ数 (max_running、公平配分) から外す
+                self.job_queue.task_done(pack)
+
+        self.manager.worker_exited(self)
+
+
+class JobScheduler:
+    """旧JobManagerの根幹: ジョブの受付、キュー管理、スレッドの開始/停止のみを行う。"""
+    
+    def __init__(self, config, state_store, executor):
+        # 依存関係の注入
+        self.config = config
+        self.state_store = state_store
+        self.executor = executor # 実行器 (OrcaExecutor) が注入される
+        
+        self.logger = _scheduler_logger
+        
+        # ★★★ 修正点3: num_threads を max_parallel_jobs から取得 ★★★
+        self.num_threads = int(self.config['orca']['max_parallel_jobs'])
+        # 設定ファイル上の値 (reduce_workers による削減後も、設定が変わらない限り元に戻さない)
+        self.configured_parallel_jobs = self.num_threads
+        
+        # 入力ディレクトリ (ユーザー/プロジェクト) ごとの公平配分 ([tenants])
+        self.tenants = TenantRegistry(config, state_store)
+        self.job_queue = JobQueue(self.tenants)
+        self.workers = []
+        self._workers_lock = threading.Lock()
+        self.is_running = False
+        # ドレイン中は新しいジョブを StateStore に PENDING として記録するだけでキューには入れない
+        self.accepting = True
+        self.queue_snapshot_path = default_queue_snapshot_path(config)
+        # パック実行で処理されず再登録されたジョブ (単独で実行する)
+        self.unpackable = set()
+        self._pack_lock = threading.Lock()
+        # ディスク容量によるアドミッション制御 (DiskGuard、Setter注入)
+        self.disk_guard = None
+
+        self._load_drain_settings(config)
+
+    def _load_drain_settings(self, config):
+        """シャットダウン時のドレイン設定"""
+        self.drain_mode = config.get('shutdown', 'drain_mode', fallback='checkpoint').strip().lower()
+        if self.drain_mode not in DRAIN_MODES:
+            self.logger.warning(f"Invalid drain_mode '{self.drain_mode}' in config, defaulting to 'checkpoint'.")
+            self.drain_mode = 'checkpoint'
+        self.drain_timeout = config.getfloat('shutdown', 'drain_timeout_seconds', fallback=60.0)
+        self.kill_grace = config.getfloat('shutdown', 'kill_grace_seconds', fallback=10.0)
+
+    def apply_config(self, config):
+        """
+        設定の再読み込み: 同時実行数とドレイン設定を更新する。
+        max_parallel_jobs は設定ファイル上の値が変わった場合のみ反映する
+        (reduce_workers で削減した分は、設定が変わらない限りそのまま)。
+        """
+        self._load_drain_settings(config)
+        self.tenants.apply_config(config)
+        self._tenants_changed()
+        parallel_jobs = int(config['orca']['max_parallel_jobs'])
+        if parallel_jobs != self.configured_parallel_jobs:
+            self.configured_parallel_jobs = parallel_jobs
+            self.set_parallel_jobs(parallel_jobs)
+
+    def set_parallel_jobs(self, num_threads):
+        """
+        同時実行数を変更する。増やす場合はすぐにワーカーを追加し、減らす場合は
+        実行中のジョブが終わったワーカーから順に終了させる (実行中のジョブは中断しない)。
+        """
+        num_threads = max(1, int(num_threads))
+        with self._workers_lock:
+            previous, self.num_threads = self.num_threads, num_threads
+        if num_threads > previous:
+            self._add_worker_slots(num_threads - previous)
+        else:
+            for _ in range(previous - num_threads):
+                self._release_worker_slot()
+        if num_threads != previous:
+            self.logger.info(f"Parallel jobs changed from {previous} to {num_threads}.")
+
+    def _tenants_changed(self):
+        # max_running を上げた場合などに、止めていたテナントのジョブを配布し直す
+        self.job_queue.refresh()
+
+    def set_disk_guard(self, disk_guard):
+        self.disk_guard = disk_guard
+
+    def admit(self, job):
+        """
+        ジョブを実行に回す前にディスクの空き容量を確認する。
+        容量が足りなければジョブをキューの先頭に戻し、次の確認まで待って False を返す。
+        """
+        if self.disk_guard is None or self.disk_guard.admit(str(job[0]), job[2]):
+            return True
+        self.job_queue.requeue_front([job])
+        self.disk_guard.wait()
+        return False
+
+    def disk_space_exhausted(self, inp_file, mol_name, calc_type, message):
+        """
+        ORCA がディスク容量不足で失敗した場合に呼ばれる。ジョブは作業ディレクトリの
+        後片付けが済んだ後 (check_interval 秒後) に再登録し、容量が戻るまでアドミッションで待たせる。
+        """
+        if self.disk_guard is None:
+            return
+        self.disk_guard.report_disk_error(str(inp_file), message)
+        timer = threading.Timer(self.disk_guard.check_interval, self.add_jobs_bulk,
+                                args=([(inp_file, mol_name, calc_type)],), kwargs={'is_recovery': True})
+        timer.daemon = True
+        timer.start()
+
+    def start(self):
+        if not self.is_running:
+            self.is_running = True
+            with self._workers_lock:
+                for i in range(self.num_threads):
+                    worker = ThreadWorker(self.job_queue, self)
+                    self.workers.append(worker)
+                    worker.start()
+            self.logger.info(f"JobScheduler started with {self.num_threads} workers.")
+
+    def worker_exited(self, worker):
+        """ワーカーの終了時に呼ばれ、ワーカーの枠を解放する。"""
+        with self._workers_lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+
+    def shutdown(self):
+        """設定ファイルの [shutdown] に従ってドレインする。"""
+        self.drain(mode=self.drain_mode, timeout=self.drain_timeout)
+
+    def drain(self, mode='checkpoint', timeout=60.0):
+        """
+        グレースフルなドレイン。
+        1. 新しいジョブの受け付けとキューからの配布を止める
+        2. 未実行のジョブを queue_snapshot.json に保存する (次回起動時に同じ順序で再開)
+        3. 実行中の ORCA を mode に従って処理する
+           - wait: 終了を待つ。timeout を過ぎたら checkpoint と同様に中断する
+           - checkpoint: SIGINT で中断し、作業ディレクトリを再開用に残す
+           - terminate: SIGTERM で直ちに終了させる
+           いずれも kill_grace 秒以内に終了しなければ SIGKILL を送る。
+        Returns: 保存した未実行ジョブ数
+        """
+        self.is_running = False
+        self.accepting = False
+        self._close_queue()
+
+        pending = self.job_queue.drain_pending()
+        if pending:
+            save_queue_snapshot(self.queue_snapshot_path, pending)
+        self.logger.info(
+            f"Draining scheduler (mode={mode}): {len(pending)} queued jobs saved, "
+            f"{self.executor.running_count()} ORCA processes running."
+        )
+
+        deadline = time.monotonic() + max(0.0, timeout)
+        if mode == 'wait':
+            # 実行中のジョブの完了を待つ (以降に終了したジョブは通常どおり処理される)
+            self._join_workers(deadline)
+            if not self._alive_workers():
+                return len(pending)
+            self.logger.warning("Drain timeout reached; checkpointing running ORCA jobs.")
+
+        # 以降に終了したジョブは失敗ではなく中断として記録され、作業ディレクトリが残る
+        self.executor.request_stop()
+        interrupt = signal.SIGINT if mode != 'terminate' else signal.SIGTERM
+        signalled = self.executor.signal_running(interrupt)
+        if signalled:
+            self.logger.info(f"Sent {signal.Signals(interrupt).name} to {signalled} running ORCA processes.")
+
+        grace = self.kill_grace if mode == 'terminate' else max(self.kill_grace, deadline - time.monotonic())
+        self._join_workers(time.monotonic() + grace)
+        if self._alive_workers() and self.executor.running_count():
+            self.logger.warning("ORCA processes did not exit in time; sending SIGKILL.")
+            self.executor.signal_running(getattr(signal, 'SIGKILL', signal.SIGTERM))
+            self._join_workers(time.monotonic() + self.kill_grace)
+
+        return len(pending)
+
+    def _close_queue(self):
+        self.job_queue.close()
+        if self.disk_guard is not None:
+            self.disk_guard.wake()
+
+    def terminate_running(self):
+        """2回目のシャットダウン要求などで、実行中の ORCA を直ちに終了させる。"""
+        self.executor.request_stop()
+        self.executor.signal_running(signal.SIGTERM)
+
+    def _alive_workers(self):
+        with self._workers_lock:
+            return [worker for worker in self.workers if worker.is_alive()]
+
+    def _join_workers(self, deadline):
+        for worker in self._alive_workers():
+            worker.join(max(0.0, deadline - time.monotonic()))
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._alive_workers():
+            worker.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        if self._alive_workers():
+            self.logger.warning("Some JobScheduler workers did not stop in time.")
+        else:
+            self.logger.info("All JobScheduler workers stopped.")
+
+    def _enqueue(self, jobs):
+        """ドレイン中でなければキューに追加する。Returns: キューに入れたか"""
+        return self.accepting and self.job_queue.put_many(jobs)
+
+    def add_job(self, inp_file, mol_name, calc_type, is_recovery=False):
+        """
+        Adds a new job to the queue.
+        is_recovery=True の場合、重複チェックをスキップして強制的に再キューイングします。
+        """
+        
+        if not is_recovery:
+            new_job_info = {'molecule': mol_name, 'calc_type': calc_type}
+            if self.state_store.has_pending_or_running(new_job_info):
+                self.logger.warning(f"Job for {mol_name}/{calc_type} is already running or pending. Skipping.")
+                return
+
+        # add_jobはステータスを'PENDING'として上書き（または新規作成）します
+        self.state_store.add_job(mol_name, calc_type, str(inp_file), status='PENDING',
+                                 **self.tenants.job_fields(mol_name))
+        if not self._enqueue([(inp_file, mol_name, calc_type)]):
+            self.logger.info(f"Scheduler is draining; {mol_name} ({calc_type}) kept as PENDING for the next start.")
+            return
+        
+        if is_recovery:
+            self.logger.info(f"Recovered job: {mol_name} ({calc_type}). Re-queued.")
+        else:
+            self.logger.info(f"Added new job: {mol_name} ({calc_type}). Queue size: {self.job_queue.qsize()}")
+    
+    def add_jobs_bulk(self, jobs, is_recovery=False, pack=True, tenant=None):
+        """
+        複数のジョブをまとめて登録します。StateStore への保存は1回だけ行われます。
+        jobs: (inp_file, mol_name, calc_type) のイテラブル
+        pack=False の場合、これらのジョブはパッキングせず単独で実行します。
+        tenant: 取り込んだ入力ディレクトリのテナント (省略時は分子の既存のテナント)
+        Returns: キューに追加したジョブ数
+        """
+        jobs = list(jobs)
+        if tenant is not None:
+            self.tenants.assign({mol_name for _, mol_name, _ in jobs}, tenant)
+        accepted = []
+        # 重複チェックは StateStore の1回の走査で作った集合に対して行う (同じバッチ内の重複も除く)
+        active = None if is_recovery else self.state_store.active_job_keys()
+        for inp_file, mol_name, calc_type in jobs:
+            if active is not None:
+                if (mol_name, calc_type) in active:
+                    self.logger.warning(f"Job for {mol_name}/{calc_type} is already running or pending. Skipping.")
+                    continue
+                active.add((mol_name, calc_type))
+            accepted.append((inp_file, mol_name, calc_type))
+
+        self.state_store.add_jobs_bulk(
+            ((mol_name, calc_type, str(inp_file)) for inp_file, mol_name, calc_type in accepted),
+            fields={str(inp_file): self.tenants.job_fields(mol_name) for inp_file, mol_name, _ in accepted}
+            if self.tenants.enabled else None
+        )
+        if not pack:
+            with self._pack_lock:
+                self.unpackable.update(str(inp_file) for inp_file, _, _ in accepted)
+        if accepted and not self._enqueue(accepted):
+            self.logger.info(f"Scheduler is draining; {len(accepted)} jobs kept as PENDING for the next start.")
+            return len(accepted)
+
+        self.logger.info(
+            f"Added {len(accepted)} {'recovered ' if is_recovery else ''}jobs in bulk. "
+            f"Queue size: {self.job_queue.qsize()}"
+        )
+        return len(accepted)
+
+    def collect_pack(self, first_job):
+        """
+        first_job が小分子ジョブであれば、キューから他の小分子ジョブを取り出してパックを作る。
+        パック対象外のジョブはキューに戻す。
+        Returns: 実行するジョブのリスト (first_job を先頭に含む)
+        """
+        packer = getattr(self.executor, 'packer', None)
+        if packer is None or not packer.enabled:
+            return [first_job]
+        if not self._packable(first_job):
+            with self._pack_lock:
+                self.unpackable.discard(str(first_job[0]))
+            return [first_job]
+
+        return collect_pack(self.job_queue, first_job, packer, self._packable)
+
+    def _release_worker_slot(self):
+        self.job_queue.retire_worker()
+
+    def _add_worker_slots(self, count):
+        if not self.is_running:
+            return # start() で num_threads 個のワーカーが起動する
+        # 終了待ちのワーカーがあれば、新しく起動する代わりにそれを残す
+        count -= self.job_queue.cancel_retire(count)
+        with self._workers_lock:
+            for _ in range(count):
+                worker = ThreadWorker(self.job_queue, self)
+                self.workers.append(worker)
+                worker.start()
+
+    def _packable(self, job):
+        inp_file = str(job[0])
+        with self._pack_lock:
+            if inp_file in self.unpackable:
+                return False
+        return self.executor.can_pack(inp_file)
+
+    def reduce_workers(self, reason="Resource"):
+        """
+        メモリ不足などのリソースエラーに応じて、
+        実行中のワーカー数を動的に減らします。
+        """
+        if self.num_threads > 1:
+            self.num_threads -= 1
+            
+            # 実行中のジョブを終えたワーカーから1つ終了させ、その枠を解放する
+            self._release_worker_slot()
+            
+            log_message = (
+                f"FATAL RESOURCE ERROR ({reason}) detected. "
+                f"Dynamically reducing parallel workers to {self.num_threads}."
+            )
+            self.logger.critical(log_message)
+            
+            # この重大なイベントを管理者に通知する
+            send_notification(
+                self.config,
+                "CRITICAL: Pipeline workers reduced",
+                log_message
+            )
+        else:
+            self.logger.warning(
+                f"FATAL RESOURCE ERROR ({reason}) detected, "
+                f"but cannot reduce workers further (already at 1)."
+            )
@@ -1,143 +1,57 @@
 # main_coordinator.py
 import sys
-import time
+import signal
 import threading
 from pathlib import Path
-from queue import Queue, Empty
 from watchdog.observers import Observer
 
 # --- 枝モジュールからのインポート ---
 from config_utils import load_config
+from config_reload import ConfigReloader
 from logging_utils import get_logger, set_log_level
-from pipeline_utils import ensure_directory, LOG_DIR # ユーティリティ
+from pipeline_utils import ensure_directory, configure_io, remove_stale_temp_files, LOG_DIR # ユーティリティ
 from state_store import StateStore
-from notification_service import NotificationThrottle, send_notification
+from notification_service import NotificationThrottle
 from file_watcher import XYZHandler, process_existing_xyz_files
-from orca_executor import OrcaExecutor # 新しい実行器
+from orca_job_manager import OrcaExecutor # 新しい実行器
 from job_handler import JobCompletionHandler # 新しいハンドラ
 from molden_service import MoldenService 
+from job_recovery import RecoveryEngine
+from products_store import ProductsStore
+from results_db import ResultsDatabase, default_results_db_path
+from workflow import WorkflowEngine, WorkflowDefinition
+from job_scheduler import JobScheduler
+from async_backend import AsyncOrcaExecutor, AsyncJobScheduler, AsyncXYZIngestor
+from slurm_backend import SlurmExecutor, SlurmJobScheduler
+from resource_usage import ResourceUsageStats
+from resource_tuner import ResourceTuner
+from conformer_screen import ConformerScreen
+from input_validator import InputValidator
+from numfreq import NumericalFrequencies
+from input_scanner import InputScanner, InputPoller, resolve_watch_mode
+from status_api import StatusService
+from disk_guard import DiskGuard
+from diagnostics import configure_diagnostics, write_thread_dump, SamplingProfiler
 
+CONFIG_PATH = 'config.txt'
+
+# [orca] executor_backend で選択できる実行バックエンド
+EXECUTOR_BACKENDS = ('thread', 'asyncio', 'slurm')
 
-_scheduler_logger = get_logger('scheduler')
-
-class ThreadWorker(threading.Thread):
-    """Worker thread that executes jobs by calling the injected executor."""
-    def __init__(self, job_queue, manager):
-        super().__init__()
-        self.job_queue = job_queue
-        # JobSchedulerインスタンスを受け取り、executorへアクセスする
-        self.manager = manager 
-        self.daemon = True
-        self.running = True
-
-    def run(self):
-        while self.running:
-            try:
-                # job_queue.get(timeout=1) は、(inp_file, mol_name, calc_type) を返す
-                inp_file, mol_name, calc_type = self.job_queue.get(timeout=1)
-                
-                # 委託: 実行ロジックは注入されたexecutorに依頼する
-                self.manager.executor.execute(inp_file, mol_name, calc_type)
-                
-                self.job_queue.task_done()
-            except Empty:
-                # タイムアウト（キューが空）の場合はループを継続
-                continue
-            except Exception as e:
-                _scheduler_logger.error(f"Worker experienced unhandled error: {e}")
-
-    def stop(self):
-        """スレッドを安全に停止させるためのフラグ"""
-        self.running = False
-
-
-class JobScheduler:
-    """旧JobManagerの根幹: ジョブの受付、キュー管理、スレッドの開始/停止のみを行う。"""
-    
-    def __init__(self, config, state_store, executor):
-        # 依存関係の注入
-        self.config = config
-        self.state_store = state_store
-        self.executor = executor # 実行器 (OrcaExecutor) が注入される
-        
-        self.logger = _scheduler_logger
-        
-        # ★★★ 修正点3: num_threads を max_parallel_jobs から取得 ★★★
-        self.num_threads = int(self.config['orca']['max_parallel_jobs'])
-        
-        self.job_queue = Queue()
-        self.workers = []
-        self.is_running = False
-
-    def start(self):
-        if not self.is_running:
-            self.is_running = True
-            for i in range(self.num_threads):
-                worker = ThreadWorker(self.job_queue, self)
-                self.workers.append(worker)
-                worker.start()
-            self.logger.info(f"JobScheduler started with {self.num_threads} workers.")
-
-    def shutdown(self):
-        self.is_running = False
-        for worker in self.workers:
-            worker.stop()
-
-    def join(self):
-        for worker in self.workers:
-            worker.join()
-        self.logger.info("All JobScheduler workers stopped.")
-
-    def add_job(self, inp_file, mol_name, calc_type, is_recovery=False):
-        """
-        Adds a new job to the queue.
-        is_recovery=True の場合、重複チェックをスキップして強制的に再キューイングします。
-        """
-        
-        if not is_recovery:
-            new_job_info = {'molecule': mol_name, 'calc_type': calc_type}
-            if self.state_store.has_pending_or_running(new_job_info):
-                self.logger.warning(f"Job for {mol_name}/{calc_type} is already running or pending. Skipping.")
-                return
-
-        # add_jobはステータスを'PENDING'として上書き（または新規作成）します
-        self.state_store.add_job(mol_name, calc_type, str(inp_file), status='PENDING')
-        self.job_queue.put((inp_file, mol_name, calc_type))
-        
-        if is_recovery:
-            self.logger.info(f"Recovered job: {mol_name} ({calc_type}). Re-queued.")
-        else:
-            self.logger.info(f"Added new job: {mol_name} ({calc_type}). Queue size: {self.job_queue.qsize()}")
-    
-    def reduce_workers(self, reason="Resource"):
-        """
-        メモリ不足などのリソースエラーに応じて、
-        実行中のワーカー数を動的に減らします。
-        """
-        if self.num_threads > 1:
-            self.num_threads -= 1
-            
-            # 停止するワーカーをリストから取り出す
-            worker_to_stop = self.workers.pop()
-            worker_to_stop.stop()
-            
-            log_message = (
-                f"FATAL RESOURCE ERROR ({reason}) detected. "
-                f"Dynamically reducing parallel workers to {self.num_threads}."
-            )
-            self.logger.critical(log_message)
-            
-            # この重大なイベントを管理者に通知する
-            send_notification(
-                self.config,
-                "CRITICAL: Pipeline workers reduced",
-                log_message
-            )
-        else:
-            self.logger.warning(
-                f"FATAL RESOURCE ERROR ({reason}) detected, "
-                f"but cannot reduce workers further (already at 1)."
-            )
+
+def create_backend(config, state_store, handler):
+    """設定に応じた (executor, scheduler) の組を作る。"""
+    backend = config.get('orca', 'executor_backend', fallback='thread').strip().lower()
+    if backend == 'asyncio':
+        executor = AsyncOrcaExecutor(config, handler)
+        return executor, AsyncJobScheduler(config, state_store, executor)
+    if backend == 'slurm':
+        executor = SlurmExecutor(config, handler)
+        return executor, SlurmJobScheduler(config, state_store, executor)
+    if backend == 'thread':
+        executor = OrcaExecutor(config, handler)
+        return executor, JobScheduler(config, state_store, executor)
+    raise ValueError(f"Unknown executor_backend '{backend}' (expected one of {', '.join(EXECUTOR_BACKENDS)}).")
 
 
 def main():
@@ -149,106 +63,242 @@ def main():
     logger = get_logger('pipeline')
     
     try:
-        config = load_config()
+        config = load_config(CONFIG_PATH)
     except Exception as e:
         logger.error(f"Failed to load configuration: {e}")
         sys.exit(1)
+    # 書き込みの fsync 方針 ([io])
+    configure_io(config)
+    configure_diagnostics(config)
 
     # 2. 依存関係の初期化と注入
    # --- 修正後 (L92-L113) ---
     # サービス層の初期化
-    notification_throttle = NotificationThrottle()
+    notification_throttle = NotificationThrottle(config.getint('notification', 'min_interval', fallback=60))
     
     # state_fileのパスを構築
     state_dir = Path(config['paths'].get('state_dir', 'folders/state'))
     ensure_directory(state_dir)
     state_file_path = state_dir / 'state_store.json'
     state_store = StateStore(state_file=str(state_file_path))
+    # これまでのジョブの消費リソースを分子サイズごとに集計し、設定値との差を記録する
+    ResourceUsageStats(state_store).log_summary(config)
     
     # ハンドラ層の初期化
-    handler = JobCompletionHandler(config, state_store, notification_throttle, scheduler=None)
-    
-    # 実行器層の初期化
-    executor = OrcaExecutor(config, handler) 
+    products_store = ProductsStore(config)
+    results_db = ResultsDatabase(default_results_db_path(config))
+    handler = JobCompletionHandler(config, state_store, notification_throttle, scheduler=None,
+                                   products_store=products_store, results_db=results_db)
     
-    # スケジューラ層の初期化
-    scheduler = JobScheduler(config, state_store, executor) 
+    # 実行器層とスケジューラ層の初期化 (スレッド / asyncio バックエンド)
+    try:
+        executor, scheduler = create_backend(config, state_store, handler)
+    except ValueError as e:
+        logger.error(f"Invalid executor configuration: {e}")
+        sys.exit(1)
     
     # 循環依存の解決: HandlerにSchedulerを注入する (DI)
     handler.set_scheduler(scheduler)
+    # ディスクの空き容量によるアドミッション制御 ([disk])
+    disk_guard = DiskGuard(config, state_store, products_store, notification_throttle)
+    scheduler.set_disk_guard(disk_guard)
+
+    # ワークフロー層の初期化 (opt → freq などの連鎖計算)
+    try:
+        workflow = WorkflowEngine(config, state_store, scheduler)
+    except ValueError as e:
+        logger.error(f"Invalid workflow configuration: {e}")
+        sys.exit(1)
+    handler.set_workflow(workflow)
+    # 振動数計算を変位ごとの勾配ジョブに分割し、ワーカープール全体で実行する ([numfreq] enabled = true の場合)
+    numfreq = NumericalFrequencies(config, state_store, scheduler, handler)
+    workflow.set_numerical_frequencies(numfreq)
+    handler.set_numerical_frequencies(numfreq)
+    # ジョブごとの nprocs/maxcore の自動調整 ([tuning] enabled = true の場合)
+    workflow.definition.set_resource_tuner(ResourceTuner(config, state_store))
+    # 複数フレームの XYZ (コンフォマーアンサンブル) の事前絞り込み ([prescreen] enabled = true の場合)
+    workflow.definition.set_conformer_screen(ConformerScreen(config))
+    # 取り込み時の XYZ の事前検証。不合格の XYZ は quarantine_dir に隔離する ([validation])
+    try:
+        workflow.definition.set_input_validator(InputValidator(config))
+    except ValueError as e:
+        logger.error(f"Invalid validation configuration: {e}")
+        sys.exit(1)
 
     # パスの検証と作成
     required_dirs = ['input_dir', 'waiting_dir', 'products_dir', 'working_dir']
     for dir_key in required_dirs:
         path = Path(config['paths'][dir_key])
         ensure_directory(path) 
-
-        # コード内で使用するために、正しいキー名で再設定
-        if code_key != config_key:
-            config['paths'][code_key] = config['paths'][config_key]
+    # ユーザー/プロジェクトごとの入力ディレクトリ ([tenants]。[paths] input_dir は 'default' テナント)
+    tenants = list(scheduler.tenants.tenants.values())
+    for tenant in tenants:
+        ensure_directory(Path(tenant.input_dir))
+    # 前回のクラッシュで残った書き込み途中の一時ファイルを削除
+    for directory in (config['paths']['waiting_dir'], state_dir):
+        remove_stale_temp_files(directory)
 
     # 3. 実行順序の制御 (メインロジック)
 
-    # 起動時リカバリ (Task 2.1)
+    # 起動時リカバリ (StateStore / waiting / working / products を一括で突き合わせる)
     logger.info("Checking for interrupted jobs...")
-    recovered_jobs = state_store.get_jobs_by_status('RUNNING')
-    
-    if recovered_jobs:
-        logger.warning(f"Found {len(recovered_jobs)} running jobs. Re-queuing them...")
-        for job_id, job_info in recovered_jobs:
-            scheduler.add_job(
-                job_id,
-                job_info['molecule'],
-                job_info['calc_type'],
-                is_recovery=True
-            )
-    else:
-        logger.info("No interrupted jobs found. Proceeding with normal startup.")
-    
-    # 既存INPファイルの処理
-    waiting_dir = Path(config['paths']['waiting_dir'])
-    existing_inp_files = list(waiting_dir.glob('*.inp'))
-    if existing_inp_files:
-        logger.info(f"Found {len(existing_inp_files)} existing INP files in waiting directory")
-        for inp_file in existing_inp_files:
-            mol_name = inp_file.stem.replace('_opt', '').replace('_freq', '')
-            calc_type = 'freq' if '_freq' in inp_file.stem else 'opt'
-            scheduler.add_job(str(inp_file), mol_name, calc_type)
+    RecoveryEngine(config, state_store, scheduler,
+                   known_calc_types=workflow.definition.steps).run()
+
+    # 途中まで完了しているワークフローの後続ステップを登録
+    numfreq.resume()
+    workflow.resume()
     
-    # 既存XYZファイルの処理
-    process_existing_xyz_files(config, scheduler)
+    # 既存XYZファイルの処理 (前回の走査以降に置かれたファイルのみ)
+    scanners = {tenant.name: InputScanner(config, input_dir=tenant.input_dir, tenant=tenant.name)
+                for tenant in tenants}
+    for tenant in tenants:
+        process_existing_xyz_files(config, scheduler, workflow.definition, scanner=scanners[tenant.name],
+                                   tenant=tenant.name)
     
     # ジョブスケジューラの開始
     scheduler.start()
     
     # Moldenサービスの開始
-    molden_watcher = MoldenService(config)
+    molden_watcher = MoldenService(config, state_store)
     molden_watcher.start()
+
+    # ダッシュボード向けの読み取り専用 HTTP/JSON API ([status_api] enabled = true の場合)
+    status_service = None
+    if config.getboolean('status_api', 'enabled', fallback=False):
+        status_service = StatusService(config, state_store, scheduler)
+        if not status_service.start():
+            status_service = None
     
-    # ファイル監視の開始
+    # ファイル監視の開始 (テナントの入力ディレクトリごと)
     input_dir = config['paths']['input_dir']
-    event_handler = XYZHandler(config, scheduler)
-    observer = Observer()
-    observer.schedule(event_handler, input_dir, recursive=False)
-    observer.start()
+    observer = None
+    pollers = [] # (InputPoller, watch_mode)
+    for tenant in tenants:
+        if isinstance(scheduler, AsyncJobScheduler):
+            # 取り込みもイベントループ上で行う (ファイルごとの待機を並行させる)
+            ingestor = AsyncXYZIngestor(config, scheduler, workflow.definition, tenant=tenant.name)
+            event_handler, ingest_path = ingestor.event_handler, ingestor.submit
+        else:
+            event_handler = XYZHandler(config, scheduler, workflow.definition, tenant=tenant.name)
+            ingest_path = event_handler.ingest
+
+        # NFS などイベントが届かないファイルシステムでは定期的な差分走査のみで検出する
+        watch_mode = resolve_watch_mode(config, tenant.input_dir)
+        if watch_mode == 'inotify':
+            if observer is None:
+                observer = Observer()
+            observer.schedule(event_handler, tenant.input_dir, recursive=False)
+            # イベントの取りこぼしを拾うための長い間隔の走査
+            poll_interval = config.getfloat('watcher', 'rescan_interval_seconds', fallback=300.0)
+        else:
+            poll_interval = config.getfloat('watcher', 'poll_interval_seconds', fallback=10.0)
+        poller = InputPoller(scanners[tenant.name], ingest_path, poll_interval)
+        poller.start()
+        pollers.append((poller, watch_mode))
+    if observer is not None:
+        observer.start()
+
+    # 設定の再読み込み (SIGHUP または設定ファイルの変更)。実行中のジョブはそのまま続行する
+    reloader = ConfigReloader(config, CONFIG_PATH)
+    reloader.register(configure_io)
+    reloader.register(configure_diagnostics)
+    reloader.register(lambda cfg: notification_throttle.set_interval(
+        cfg.getint('notification', 'min_interval', fallback=60)))
+    reloader.register(handler.apply_config)
+    reloader.register(executor.apply_config)
+    reloader.register(scheduler.apply_config)
+    reloader.register(disk_guard.apply_config)
+    reloader.register(numfreq.apply_config)
+
+    def apply_workflow_config(cfg):
+        if not workflow.definition.update_step_options(WorkflowDefinition.from_config(cfg)):
+            logger.warning("Workflow steps or dependencies changed; restart the pipeline to apply them.")
+        workflow.definition.set_resource_tuner(ResourceTuner(cfg, state_store))
+        workflow.definition.conformer_screen.apply_config(cfg)
+        workflow.definition.set_input_validator(InputValidator(cfg))
+
+    def apply_watcher_config(cfg):
+        for poller, watch_mode in pollers:
+            option = 'rescan_interval_seconds' if watch_mode == 'inotify' else 'poll_interval_seconds'
+            poller.interval = cfg.getfloat('watcher', option, fallback=poller.interval)
+
+    reloader.register(apply_workflow_config)
+    reloader.register(apply_watcher_config)
+    reloader.start()
+    
+    # 遅延の調査用: SIGUSR1 でスタックダンプ、SIGUSR2 (または [profiling] enabled) でサンプリングプロファイラ
+    profiler = SamplingProfiler(config)
+    if config.getboolean('profiling', 'enabled', fallback=False):
+        profiler.start()
     
     logger.info(f"Watching for XYZ files in: {input_dir}")
+    for tenant in tenants[1:]:
+        logger.info(f"Watching for XYZ files of tenant '{tenant.name}' (weight {tenant.weight:g}, "
+                    f"max running {tenant.max_running or 'unlimited'}) in: {tenant.input_dir}")
     logger.info("Press Ctrl+C to stop the pipeline")
-    
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        logger.info("Shutdown signal received")
+
+    # シグナルを受けるまでメインスレッドは待機するだけ (ポーリングしない)
+    stop_event = threading.Event()
+
+    def request_shutdown(signum, frame):
+        if stop_event.is_set():
+            # ドレイン中に再度シグナルを受けた場合は、実行中の ORCA を直ちに終了させる
+            logger.warning("Second shutdown signal received; terminating running ORCA jobs.")
+            scheduler.terminate_running()
+            return
+        logger.info(f"Shutdown signal received ({signal.Signals(signum).name})")
+        stop_event.set()
+
+    def request_reload(signum, frame):
+        logger.info("SIGHUP received; reloading configuration.")
+        reloader.request_reload()
+
+    def dump_threads(signum, frame):
+        write_thread_dump(state_store=state_store, scheduler=scheduler)
+        if profiler.running:
+            profiler.flush()
+
+    def toggle_profiler(signum, frame):
+        profiler.toggle()
+
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, request_reload)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, dump_threads)
+        signal.signal(signal.SIGUSR2, toggle_profiler)
+
+    # Event.wait() はタイムアウトなしだと一部のプラットフォームでシグナルを受け取れないため、長い間隔で待つ
+    while not stop_event.wait(timeout=3600):
+        pass
+
+    reloader.stop()
+    profiler.stop()
+    for poller, _ in pollers:
+        poller.stop()
+    if observer is not None:
         observer.stop()
-        scheduler.shutdown()
-        molden_watcher.stop()
-        
+    # 取り込み中の前最適化を終了させる (XYZ は入力ディレクトリに残る)
+    workflow.definition.conformer_screen.stop()
+    scheduler.shutdown()
+    molden_watcher.stop()
+    if status_service is not None:
+        status_service.stop()
+    
+    if observer is not None:
         observer.join()
-        scheduler.join()
-        molden_watcher.join(timeout=5)
-        
-        logger.info("Pipeline stopped cleanly.")
+    for poller, _ in pollers:
+        poller.join(timeout=5)
+    reloader.join(timeout=5)
+    profiler.join(timeout=5)
+    scheduler.join(timeout=scheduler.kill_grace)
+    molden_watcher.join(timeout=5)
+    # group commit で保留中の状態を書き込む
+    state_store.flush()
+    
+    logger.info("Pipeline stopped cleanly.")
 
 if __name__ == '__main__':
     main()
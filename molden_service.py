@@ -14,13 +14,17 @@ from pipeline_utils import ensure_directory
 class MoldenService(threading.Thread):
     """
     メインパイプラインとは独立して動作するサービス。
-    state_store.json を監視し、完了したジョブを見つけて、
+    StateStore を監視し、完了したジョブを見つけて、
     .gbw ファイルから .molden.input ファイルを生成する。
+    state_store を注入した場合はメモリ上の状態を参照し (変更があった場合のみ走査する)、
+    無い場合は state_store.json を読み込む。
     """
     
-    def __init__(self, config):
+    def __init__(self, config, state_store=None):
         super().__init__()
         self.config = config
+        self.state_store = state_store
+        self._checked_version = None
         self.logger = get_logger('molden_service')
         self.running = True
     # --- 修正後 (L20-L25) ---
@@ -54,19 +58,30 @@ class MoldenService(threading.Thread):
             
             time.sleep(self.check_interval)
     
-    def check_completed_jobs(self):
-        """
-        state_store.json を直接読み込み、
-        COMPLETED ステータスで .gbw ファイルを持つジョブを探す。
-        """
-        if not self.state_file.exists():
-            return
+    def _load_state(self):
+        """Returns: {job_id: job_info}。前回の確認から変更が無ければ None"""
+        if self.state_store is not None:
+            if self.state_store.version == self._checked_version:
+                return None
+            self._checked_version, state_data = self.state_store.snapshot()
+            return state_data
 
+        if not self.state_file.exists():
+            return None
         try:
             with open(self.state_file, 'r') as f:
-                state_data = json.load(f)
+                return json.load(f)
         except json.JSONDecodeError:
             self.logger.warning(f"Could not parse state_store.json, skipping cycle.")
+            return None
+
+    def check_completed_jobs(self):
+        """
+        StateStore (または state_store.json) から、
+        COMPLETED ステータスで .gbw ファイルを持つジョブを探す。
+        """
+        state_data = self._load_state()
+        if not state_data:
             return
 
         for job_id, info in state_data.items():
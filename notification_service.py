@@ -15,6 +15,10 @@ class NotificationThrottle:
     def __init__(self, interval_minutes=60):
         self.interval = timedelta(minutes=interval_minutes)
         self.last_sent = {}
+
+    def set_interval(self, interval_minutes):
+        """Changes the throttle window (applies to the next can_send call)."""
+        self.interval = timedelta(minutes=interval_minutes)
     
     def can_send(self, subject):
         """Checks if a notification with this subject can be sent now."""
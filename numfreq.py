@@ -0,0 +1,429 @@
+# numfreq.py
+import re
+import json
+import shutil
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from geometry import Geometry
+from pipeline_utils import ensure_directory, atomic_write, atomic_copy, bulk_write # I/Oユーティリティ
+from orca_utils import generate_orca_input # ORCAユーティリティ
+from resource_tuner import estimate_basis_functions
+
+_numfreq_logger = get_logger('numfreq')
+
+BOHR_TO_ANGSTROM = 0.529177210903
+CM1_TO_HARTREE = 4.556335252767e-6
+# sqrt(Eh / (bohr^2 amu)) を波数 (cm^-1) に換算する係数
+_HARTREE_J, _BOHR_M, _AMU_KG, _LIGHT_CM_S = 4.3597447222071e-18, 5.29177210903e-11, 1.66053906660e-27, 2.99792458e10
+AU_TO_CM1 = np.sqrt(_HARTREE_J / (_BOHR_M ** 2 * _AMU_KG)) / (2 * np.pi * _LIGHT_CM_S)
+
+# 平均原子量 (amu)。ORCA の既定と同じく同位体の平均値を使う
+ATOMIC_MASSES = {
+    'H': 1.008, 'He': 4.0026, 'Li': 6.94, 'Be': 9.0122, 'B': 10.81, 'C': 12.011, 'N': 14.007,
+    'O': 15.999, 'F': 18.998, 'Ne': 20.180, 'Na': 22.990, 'Mg': 24.305, 'Al': 26.982, 'Si': 28.085,
+    'P': 30.974, 'S': 32.06, 'Cl': 35.45, 'Ar': 39.948, 'K': 39.098, 'Ca': 40.078, 'Sc': 44.956,
+    'Ti': 47.867, 'V': 50.942, 'Cr': 51.996, 'Mn': 54.938, 'Fe': 55.845, 'Co': 58.933, 'Ni': 58.693,
+    'Cu': 63.546, 'Zn': 65.38, 'Ga': 69.723, 'Ge': 72.630, 'As': 74.922, 'Se': 78.971, 'Br': 79.904,
+    'Kr': 83.798, 'Rb': 85.468, 'Sr': 87.62, 'Y': 88.906, 'Zr': 91.224, 'Nb': 92.906, 'Mo': 95.95,
+    'Tc': 98.0, 'Ru': 101.07, 'Rh': 102.91, 'Pd': 106.42, 'Ag': 107.87, 'Cd': 112.41, 'In': 114.82,
+    'Sn': 118.71, 'Sb': 121.76, 'Te': 127.60, 'I': 126.90, 'Xe': 131.29, 'Cs': 132.91, 'Ba': 137.33,
+    'La': 138.91, 'Ce': 140.12, 'Pr': 140.91, 'Nd': 144.24, 'Pm': 145.0, 'Sm': 150.36, 'Eu': 151.96,
+    'Gd': 157.25, 'Tb': 158.93, 'Dy': 162.50, 'Ho': 164.93, 'Er': 167.26, 'Tm': 168.93, 'Yb': 173.05,
+    'Lu': 174.97, 'Hf': 178.49, 'Ta': 180.95, 'W': 183.84, 'Re': 186.21, 'Os': 190.23, 'Ir': 192.22,
+    'Pt': 195.08, 'Au': 196.97, 'Hg': 200.59, 'Tl': 204.38, 'Pb': 207.2, 'Bi': 208.98,
+    # 安定同位体の無い元素は最も長寿命な同位体の質量数
+    'Po': 209.0, 'At': 210.0, 'Rn': 222.0, 'Fr': 223.0, 'Ra': 226.0, 'Ac': 227.0, 'Th': 232.04,
+    'Pa': 231.04, 'U': 238.03, 'Np': 237.0, 'Pu': 244.0, 'Am': 243.0, 'Cm': 247.0, 'Bk': 247.0,
+    'Cf': 251.0, 'Es': 252.0, 'Fm': 257.0, 'Md': 258.0, 'No': 259.0, 'Lr': 266.0, 'Rf': 267.0,
+    'Db': 268.0, 'Sg': 269.0, 'Bh': 270.0, 'Hs': 269.0, 'Mt': 278.0, 'Ds': 281.0, 'Rg': 282.0,
+    'Cn': 285.0, 'Nh': 286.0, 'Fl': 289.0, 'Mc': 290.0, 'Lv': 293.0, 'Ts': 294.0, 'Og': 294.0,
+}
+
+# 変位ジョブの計算タイプ ('<ステップ名>-d<番号>'、d0000 は変位なしの参照構造)
+_DISPLACEMENT_PATTERN = re.compile(r"^(?P<step>.+)-d(?P<index>\d{4,})$")
+# 振動数計算のキーワード (変位ジョブでは EnGrad に置き換える)
+_FREQ_KEYWORDS = {'FREQ', 'NUMFREQ', 'ANFREQ'}
+_TERMINATION_LINE = "****ORCA TERMINATED NORMALLY****"
+
+
+def parse_displacement(calc_type):
+    """Returns: 変位ジョブなら (ステップ名, 番号)、そうでなければ None"""
+    match = _DISPLACEMENT_PATTERN.match(calc_type or '')
+    return (match.group('step'), int(match.group('index'))) if match else None
+
+
+def displacement_plan(n_atoms, central=True):
+    """
+    Returns: [(座標の添字, 符号)] (番号 1 から順)。
+    中心差分は座標ごとに +h, -h の 6N 個、前進差分は +h の 3N 個 (参照構造の勾配と組み合わせる)。
+    """
+    signs = (1, -1) if central else (1,)
+    return [(coordinate, sign) for coordinate in range(3 * n_atoms) for sign in signs]
+
+
+def read_engrad(path):
+    """
+    ORCA の .engrad ファイルを読む。
+    Returns: (エネルギー (Eh), 勾配 shape (3N,) (Eh/bohr))
+    """
+    with open(path, 'r') as f:
+        values = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    n_atoms = int(values[0])
+    energy = float(values[1])
+    gradient = np.array([float(v) for v in values[2:2 + 3 * n_atoms]])
+    if len(gradient) != 3 * n_atoms:
+        raise ValueError(f"Truncated gradient in {path}")
+    return energy, gradient
+
+
+def assemble_hessian(gradients, plan, step, reference=None):
+    """
+    変位ジョブの勾配から有限差分で Hessian (Eh/bohr^2) を組み立て、対称化する。
+    gradients: 番号 (1 から) -> 勾配、reference: 参照構造の勾配 (前進差分で必要)
+    """
+    n_coords = len(next(iter(gradients.values())))
+    plus, minus = {}, {}
+    for number, (coordinate, sign) in enumerate(plan, 1):
+        (plus if sign > 0 else minus)[coordinate] = gradients[number]
+
+    hessian = np.empty((n_coords, n_coords))
+    for coordinate in range(n_coords):
+        if coordinate in minus:
+            hessian[:, coordinate] = (plus[coordinate] - minus[coordinate]) / (2.0 * step)
+        else:
+            hessian[:, coordinate] = (plus[coordinate] - reference) / step
+    return 0.5 * (hessian + hessian.T)
+
+
+def harmonic_frequencies(hessian, geometry):
+    """
+    質量加重した Hessian から並進・回転を射影で除き、振動数 (cm^-1、虚数は負) を求める。
+    Returns: (振動数の配列 (昇順)、並進・回転の自由度の数)
+    """
+    masses = np.array([ATOMIC_MASSES[_element_symbol(symbol)] for symbol in geometry.elements])
+    sqrt_m = np.repeat(np.sqrt(masses), 3)
+    weighted = hessian / np.outer(sqrt_m, sqrt_m)
+
+    # 質量加重座標での並進・回転ベクトル
+    coords = geometry.coords / BOHR_TO_ANGSTROM
+    centered = coords - (masses[:, None] * coords).sum(axis=0) / masses.sum()
+    vectors = []
+    for axis in np.eye(3):
+        vectors.append((np.sqrt(masses)[:, None] * axis).reshape(-1))
+        vectors.append((np.sqrt(masses)[:, None] * np.cross(axis, centered)).reshape(-1))
+    u, singular, _ = np.linalg.svd(np.array(vectors).T, full_matrices=True)
+    n_external = int((singular > 1e-6 * singular.max()).sum())
+
+    # 並進・回転の補空間 (内部座標) で対角化する
+    internal = u[:, n_external:]
+    eigenvalues = np.linalg.eigvalsh(internal.T @ weighted @ internal)
+    return np.sign(eigenvalues) * np.sqrt(np.abs(eigenvalues)) * AU_TO_CM1, n_external
+
+
+def _element_symbol(symbol):
+    symbol = symbol.strip()
+    return symbol[:1].upper() + symbol[1:].lower()
+
+
+def format_hess_file(hessian, geometry, frequencies, n_external):
+    """ORCA の .hess 形式 ($hessian, $vibrational_frequencies, $atoms) の文字列 (InHess Read で読める)。"""
+    n_coords = len(hessian)
+    lines = ["", "$orca_hessian_file", "", "$hessian", str(n_coords)]
+    for start in range(0, n_coords, 5):
+        columns = range(start, min(start + 5, n_coords))
+        lines.append("          " + "".join(f"{column:>19d}" for column in columns))
+        for row in range(n_coords):
+            lines.append(f"{row:>6d}    " + "".join(f"{hessian[row, column]:>19.10E}" for column in columns))
+    all_frequencies = [0.0] * n_external + list(frequencies)
+    lines += ["", "$vibrational_frequencies", str(len(all_frequencies))]
+    lines += [f"{index:>6d}    {value:>17.6f}" for index, value in enumerate(all_frequencies)]
+    lines += ["", "$atoms", str(geometry.n_atoms)]
+    for symbol, (x, y, z) in zip(geometry.elements, geometry.coords / BOHR_TO_ANGSTROM):
+        symbol = _element_symbol(symbol)
+        lines.append(f" {symbol:<3}{ATOMIC_MASSES[symbol]:>12.5f}{x:>19.12f}{y:>19.12f}{z:>19.12f}")
+    lines += ["", "$end", ""]
+    return "\n".join(lines)
+
+
+def format_frequency_block(frequencies, n_external, zpe):
+    """extract_results が読む ORCA 形式の振動数ブロックと零点エネルギー。"""
+    separator = "-" * 24
+    lines = ["", separator, "VIBRATIONAL FREQUENCIES", separator, ""]
+    all_frequencies = [0.0] * n_external + list(frequencies)
+    for mode, value in enumerate(all_frequencies):
+        lines.append(f"   {mode:3d}:    {value:10.2f} cm**-1" + ("   ***imaginary mode***" if value < 0 else ""))
+    lines += ["", separator, "NORMAL MODES", separator, "",
+              f"Zero point energy                ...      {zpe:.8f} Eh", ""]
+    return "\n".join(lines)
+
+
+class NumericalFrequencies:
+    """
+    振動数計算のステップを、変位構造ごとの独立した勾配計算 (EnGrad) に分割するクラス
+    ([numfreq] enabled = true の場合、steps に挙げたワークフローのステップが対象)。
+
+    - 参照構造 (d0000) と、各直交座標を ±step_bohr ずつ動かした構造 (中心差分で 6N 個) を
+      通常のジョブとしてキューに登録する。ワーカープールや SLURM の空いている枠で並行に実行される
+    - 各変位ジョブの .engrad は products_dir/<分子>/<分子>_<ステップ>_numfreq/ に保存する
+    - すべての勾配が揃ったら Hessian を組み立て、並進・回転を除いて振動数を求める。
+      参照ジョブの出力に振動数ブロックを加えた <分子>_<ステップ>.out と .hess を作り、
+      通常のジョブと同じ成功処理 (結果 DB、products、後続ステップの登録) に渡す
+
+    ステップ本体のジョブ記録は分割中 'SPLIT'、組み立て中 'ASSEMBLING' となり (どちらも起動時リカバリの
+    対象外)、いずれかの変位ジョブが最終的に失敗すると PERMANENT_FAILED になる。
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, config, state_store, scheduler, handler=None):
+        self.state_store = state_store
+        self.scheduler = scheduler
+        self.handler = handler # JobCompletionHandler (Setter注入も可)
+        self.logger = _numfreq_logger
+        self.waiting_dir = Path(config['paths']['waiting_dir'])
+        self.working_dir = Path(config['paths']['working_dir'])
+        self.products_dir = Path(config['paths']['products_dir'])
+        self._lock = threading.Lock()
+        # このプロセスで組み立て中のステップ (ASSEMBLING のまま残ったものは resume で組み立て直す)
+        self._assembling = set()
+        self.apply_config(config)
+
+    def apply_config(self, config):
+        """起動時と設定の再読み込み時に [numfreq] を読み込む (分割済みのステップには影響しない)。"""
+        self.config = config
+        self.enabled = config.getboolean('numfreq', 'enabled', fallback=False)
+        self.steps = {name.strip() for name in config.get('numfreq', 'steps', fallback='freq').split(',')
+                      if name.strip()}
+        self.step_bohr = config.getfloat('numfreq', 'step_bohr', fallback=0.005)
+        self.central = config.getboolean('numfreq', 'central_differences', fallback=True)
+        self.nprocs = config.getint('numfreq', 'nprocs', fallback=1)
+        self.keywords = config.get('numfreq', 'keywords', fallback='EnGrad').strip()
+
+    def set_handler(self, handler):
+        self.handler = handler
+
+    def applies(self, step_name):
+        return self.enabled and step_name in self.steps
+
+    def job_dir(self, mol_name, step_name):
+        return self.products_dir / mol_name / f"{mol_name}_{step_name}_numfreq"
+
+    def parent_job_id(self, mol_name, step_name):
+        return str(self.waiting_dir / f"{mol_name}_{step_name}.inp")
+
+    # --- 分割 ---
+    def split(self, mol_name, step, geometry):
+        """
+        ステップを変位ジョブに分割し、入力の生成とスケジューラへの登録を行う。
+        質量の分からない元素 (ダミー原子など) を含む場合は分割せず None を返す
+        (呼び出し側は通常の解析的な振動数計算のステップとして登録する)。
+        Returns: 登録したジョブ [(inp_path, mol_name, calc_type)]、または None
+        """
+        unknown = sorted({symbol for symbol in map(_element_symbol, geometry.elements)
+                          if symbol not in ATOMIC_MASSES})
+        if unknown:
+            self.logger.warning(
+                f"No atomic mass for {', '.join(unknown)} in {mol_name}; "
+                f"running {step.name} as a single analytic frequency job."
+            )
+            return None
+        plan = displacement_plan(geometry.n_atoms, self.central)
+        job_dir = self.job_dir(mol_name, step.name)
+        ensure_directory(job_dir)
+        for stale in job_dir.glob('*.engrad'):
+            stale.unlink()
+        manifest = {
+            'molecule': mol_name, 'step': step.name, 'step_bohr': self.step_bohr, 'central': self.central,
+            'elements': geometry.elements.tolist(), 'coords': geometry.coords.tolist(),
+            'displacements': len(plan),
+        }
+        atomic_write(job_dir / self.MANIFEST, json.dumps(manifest, indent=2))
+
+        keywords = " ".join(
+            [self.keywords] + [word for word in step.keywords.split() if word.upper() not in _FREQ_KEYWORDS]
+        )
+        resources = {
+            'nprocs': self.nprocs, 'maxcore': self.config['orca'].get('maxcore', '2000'), 'source': 'numfreq',
+            'basis_functions': estimate_basis_functions(geometry.elements,
+                                                        step.basis or self.config['orca'].get('basis')),
+        }
+        inputs = []
+        for number, displaced in enumerate(self._displaced_geometries(geometry, plan)):
+            calc_type = f"{step.name}-d{number:04d}"
+            inp_path = self.waiting_dir / f"{mol_name}_{calc_type}.inp"
+            content = generate_orca_input(self.config, mol_name, displaced, calc_type=calc_type,
+                                          calc_keyword=keywords, method=step.method, basis=step.basis,
+                                          resources=resources)
+            inputs.append((inp_path, content, calc_type))
+
+        written = set(bulk_write((inp_path, content) for inp_path, content, _ in inputs))
+        jobs = [(str(inp_path), mol_name, calc_type) for inp_path, _, calc_type in inputs if inp_path in written]
+        if len(jobs) != len(inputs):
+            self.logger.error(f"Could not write every displacement input for {mol_name} ({step.name}).")
+            return []
+
+        self.state_store.add_job(mol_name, step.name, self.parent_job_id(mol_name, step.name), status='SPLIT',
+                                 **self.scheduler.tenants.job_fields(mol_name))
+        # 変位ジョブは .engrad を個別に回収するため、パッキングしない
+        self.scheduler.add_jobs_bulk(jobs, pack=False)
+        self.logger.info(
+            f"Split {step.name} of {mol_name} into {len(jobs)} gradient jobs "
+            f"({'central' if self.central else 'forward'} differences, {self.step_bohr} bohr)."
+        )
+        return jobs
+
+    def _displaced_geometries(self, geometry, plan):
+        yield geometry
+        step_angstrom = self.step_bohr * BOHR_TO_ANGSTROM
+        for coordinate, sign in plan:
+            coords = geometry.coords.copy()
+            coords[coordinate // 3, coordinate % 3] += sign * step_angstrom
+            yield Geometry(geometry.elements, coords)
+
+    def reference_geometry(self, mol_name, step_name):
+        """分割したステップの参照構造 (後続ステップの入力構造として使う)。分割していなければ None"""
+        manifest = self._read_manifest(mol_name, step_name)
+        if manifest is None:
+            return None
+        return Geometry(manifest['elements'], manifest['coords'])
+
+    def _read_manifest(self, mol_name, step_name):
+        try:
+            with open(self.job_dir(mol_name, step_name) / self.MANIFEST, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # --- 変位ジョブの完了・失敗 ---
+    def is_displacement(self, calc_type):
+        return parse_displacement(calc_type) is not None
+
+    def record_displacement(self, job_id, mol_name, calc_type, orca_path):
+        """
+        変位ジョブの成功時に JobCompletionHandler から呼ばれる。勾配を保存し、揃っていれば組み立てる。
+        Returns: 勾配を保存できたか (False の場合、ジョブは失敗として扱う)
+        """
+        step_name, number = parse_displacement(calc_type)
+        job_dir = self.job_dir(mol_name, step_name)
+        engrad = Path(orca_path).with_suffix('.engrad')
+        try:
+            read_engrad(engrad)
+            atomic_copy(engrad, job_dir / f"d{number:04d}.engrad")
+            if number == 0:
+                # 参照構造の出力と .gbw は、組み立てた出力の土台と Molden の生成に使う
+                atomic_copy(Path(orca_path).with_suffix('.out'), job_dir / 'reference.out')
+                gbw = Path(orca_path).with_suffix('.gbw')
+                if gbw.exists():
+                    atomic_copy(gbw, job_dir / 'reference.gbw')
+        except (OSError, ValueError, IndexError) as e:
+            self.logger.error(f"Could not collect the gradient of {mol_name} ({calc_type}): {e}")
+            return False
+
+        self.state_store.update_status(job_id, 'COMPLETED')
+        self.assemble_if_complete(mol_name, step_name)
+        return True
+
+    def displacement_failed(self, mol_name, calc_type, message):
+        """変位ジョブが最終的に失敗した場合、ステップ本体も失敗とする。"""
+        step_name, number = parse_displacement(calc_type)
+        parent = self.parent_job_id(mol_name, step_name)
+        with self._lock:
+            job = self.state_store.get_job(parent)
+            if job is None or job.get('status') != 'SPLIT':
+                return
+            self.state_store.update_status(
+                parent, f"PERMANENT_FAILED: displacement d{number:04d} failed ({message})"
+            )
+        self.logger.error(f"Numerical frequencies of {mol_name} ({step_name}) failed: d{number:04d}: {message}")
+
+    def resume(self):
+        """
+        起動時に呼び出し、すべての勾配が揃っているのに組み立てられていないステップを組み立てる
+        (最後の変位ジョブの完了直後にコーディネーターが停止した場合)。
+        """
+        assembled = 0
+        for job_id, info in self.state_store.items():
+            if info.get('status') in ('SPLIT', 'ASSEMBLING'):
+                assembled += bool(self.assemble_if_complete(info.get('molecule'), info.get('calc_type')))
+        return assembled
+
+    # --- 組み立て ---
+    def assemble_if_complete(self, mol_name, step_name):
+        """Returns: 組み立てて成功処理に渡した場合は True"""
+        parent = self.parent_job_id(mol_name, step_name)
+        job_dir = self.job_dir(mol_name, step_name)
+        with self._lock:
+            job = self.state_store.get_job(parent)
+            manifest = self._read_manifest(mol_name, step_name)
+            resuming = job is not None and job.get('status') == 'ASSEMBLING' and not self._assembling
+            if job is None or not (job.get('status') == 'SPLIT' or resuming) or manifest is None:
+                return False
+            expected = manifest['displacements'] + 1
+            if len(list(job_dir.glob('d*.engrad'))) < expected:
+                return False
+            # 同時に完了した他の変位ジョブが組み立てないように、先に状態を進める
+            self.state_store.update_status(parent, 'ASSEMBLING')
+            self._assembling.add(parent)
+
+        try:
+            work_dir = self._assemble(mol_name, step_name, manifest, job_dir)
+        except Exception as e:
+            self.logger.error(f"Could not assemble numerical frequencies of {mol_name} ({step_name}): {e}")
+            self.state_store.update_status(parent, f"PERMANENT_FAILED: Hessian assembly failed ({e})")
+            with self._lock:
+                self._assembling.discard(parent)
+            return False
+
+        try:
+            self.handler.handle_success(work_dir / f"{mol_name}_{step_name}.inp", mol_name, step_name,
+                                        work_dir, self.products_dir, job_id=parent)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            with self._lock:
+                self._assembling.discard(parent)
+        return True
+
+    def _assemble(self, mol_name, step_name, manifest, job_dir):
+        geometry = Geometry(manifest['elements'], manifest['coords'])
+        plan = displacement_plan(geometry.n_atoms, manifest['central'])
+        energy, reference = read_engrad(job_dir / 'd0000.engrad')
+        gradients = {number: read_engrad(job_dir / f"d{number:04d}.engrad")[1]
+                     for number in range(1, len(plan) + 1)}
+
+        hessian = assemble_hessian(gradients, plan, manifest['step_bohr'], reference=reference)
+        frequencies, n_external = harmonic_frequencies(hessian, geometry)
+        zpe = 0.5 * CM1_TO_HARTREE * frequencies[frequencies > 0].sum()
+        n_imaginary = int((frequencies < 0).sum())
+
+        atomic_write(job_dir / f"{mol_name}_{step_name}.hess",
+                     format_hess_file(hessian, geometry, frequencies, n_external))
+
+        # 通常のジョブと同じ後処理に渡すため、作業ディレクトリに出力と .gbw を用意する
+        work_dir = self.working_dir / f"{mol_name}_{step_name}"
+        ensure_directory(work_dir)
+        header = (
+            f"# Numerical frequencies assembled by the pipeline from {len(plan) + 1} gradient jobs\n"
+            f"# ({'central' if manifest['central'] else 'forward'} differences, {manifest['step_bohr']} bohr; "
+            f"residual gradient norm {np.linalg.norm(reference):.2e} Eh/bohr)\n"
+        )
+        reference_out = job_dir / 'reference.out'
+        body = reference_out.read_text(errors='ignore') if reference_out.exists() else \
+            f"FINAL SINGLE POINT ENERGY     {energy:.12f}\n"
+        # ORCA の出力と同じく、振動数は正常終了の行より前に置く
+        block = format_frequency_block(frequencies, n_external, zpe)
+        position = body.find(_TERMINATION_LINE)
+        body = body + block if position < 0 else body[:position] + block + "\n" + body[position:]
+        atomic_write(work_dir / f"{mol_name}_{step_name}.out", header + body)
+        if (job_dir / 'reference.gbw').exists():
+            atomic_copy(job_dir / 'reference.gbw', work_dir / f"{mol_name}_{step_name}.gbw")
+
+        self.logger.info(
+            f"Assembled numerical frequencies of {mol_name} ({step_name}): {len(frequencies)} modes, "
+            f"{n_imaginary} imaginary, lowest {frequencies.min():.1f} cm^-1, ZPE {zpe:.6f} Eh."
+        )
+        return work_dir
@@ -1,16 +1,75 @@
 
 # orca_job_manager.py (OrcaExecutor クラスを定義)
+import os
+import time
+import errno
+import signal
+import threading
 import subprocess
 import shutil
+from datetime import datetime
 from pathlib import Path
 
 # --- 依存関係のインポート ---
 from logging_utils import get_logger
-from pipeline_utils import ensure_directory # I/Oユーティリティ
-from orca_utils import check_orca_output # ORCAユーティリティ
+from pipeline_utils import ensure_directory, safe_write, atomic_copy # I/Oユーティリティ
+from orca_utils import ( # ORCAユーティリティ
+    check_orca_output,
+    find_checkpoint_files,
+    read_last_xyz_frame,
+    build_restart_input,
+    is_ladder_input,
+    strip_ladder,
+    summarize_ladder
+)
+from job_packing import JobPacker, count_inp_atoms # 小分子ジョブのパッキング
+from resource_usage import (
+    ProcessTreeSampler, wait_with_rusage, build_usage_record, packed_usage_record, read_inp_resources
+)
 
 _executor_logger = get_logger('orca_executor')
 
+# ORCAがこれらのシグナルで終了した場合は「失敗」ではなく「中断」とみなす
+_INTERRUPT_RETURNCODES = {
+    -int(sig) for sig in (signal.SIGINT, signal.SIGTERM, getattr(signal, 'SIGHUP', None)) if sig
+}
+# 作業ディレクトリの準備中の OSError のうち、ディスク容量不足を示すもの
+_DISK_FULL_ERRNOS = {errno.ENOSPC, getattr(errno, 'EDQUOT', errno.ENOSPC)}
+
+def signal_process_group(process, sig):
+    """ORCA のプロセスグループ (MPI の子プロセスを含む) にシグナルを送る。"""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, sig)
+        else:
+            process.send_signal(sig)
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+
+class OrcaRun:
+    """1回の ORCA 実行に関するパスと後片付けの方針をまとめたもの。"""
+
+    def __init__(self, config, inp_file, mol_name, calc_type):
+        self.inp_path = Path(inp_file)
+        self.job_id = str(self.inp_path)
+        self.mol_name = mol_name
+        self.calc_type = calc_type
+        self.work_dir = Path(config['paths']['working_dir']) / self.inp_path.stem
+        self.product_dir = Path(config['paths']['products_dir'])
+        self.orca_path = self.work_dir / self.inp_path.name
+        self.output_path = self.work_dir / f"{self.inp_path.stem}.out"
+        self.run_started = None
+        # リトライ可能な失敗の場合は、次回起動時のリカバリのため .inp を残す
+        self.keep_input = False
+        # 中断された場合は、チェックポイントとして work_dir を残す
+        self.keep_work_dir = False
+        # 実行で消費したリソース (resource_usage.build_usage_record)
+        self.resource_usage = None
+        # [orca] timeout_seconds を超えたため終了させた
+        self.timed_out = False
+
+
 class OrcaExecutor:
     """ORCAプロセスを実行し、結果をJobCompletionHandlerに渡す単一責任のクラス。"""
     
@@ -20,69 +79,470 @@ class OrcaExecutor:
         self.handler = handler # JobCompletionHandlerのインスタンスを注入
         self.orca_executable = self.config['orca']['orca_executable']
         self.logger = _executor_logger
+        self.stopping = False
+        self.packer = JobPacker(config)
+        # 実行中の ORCA プロセス (ドレイン時にシグナルを送るため)
+        self._processes = set()
+        self._processes_lock = threading.Lock()
+        # 実行中のプロセスツリーを /proc からサンプリングする間隔 (0 で無効)
+        self.usage_sample_interval = config.getfloat('orca', 'resource_sample_interval_seconds', fallback=5.0)
+        self._load_timeout(config)
+
+    def apply_config(self, config):
+        """
+        設定の再読み込み: 以降に起動する ORCA に使う値を更新する。
+        実行中のプロセスとそのサンプラー、タイムアウトには影響しない。
+        """
+        self.orca_executable = config['orca']['orca_executable']
+        self.packer = JobPacker(config)
+        self.usage_sample_interval = config.getfloat('orca', 'resource_sample_interval_seconds', fallback=5.0)
+        self._load_timeout(config)
+
+    def _load_timeout(self, config):
+        # 1回の ORCA 実行の経過時間の上限 (0 で無制限)。超えたら SIGTERM、kill_grace 秒後に SIGKILL を送る
+        self.timeout_seconds = config.getfloat('orca', 'timeout_seconds', fallback=0.0)
+        self.kill_grace = config.getfloat('shutdown', 'kill_grace_seconds', fallback=10.0)
+
+    def request_stop(self):
+        """シャットダウン中であることを通知する。以降に終了したジョブは中断として扱われる。"""
+        self.stopping = True
+
+    def running_count(self):
+        with self._processes_lock:
+            return len(self._processes)
+
+    def signal_running(self, sig):
+        """
+        実行中のすべての ORCA プロセス (MPI の子プロセスを含むプロセスグループ) にシグナルを送る。
+        Returns: シグナルを送ったプロセス数
+        """
+        with self._processes_lock:
+            processes = list(self._processes)
+        for process in processes:
+            signal_process_group(process, sig)
+        return len(processes)
+
+    def _run_orca(self, orca_input, work_dir, out_f, usage=None):
+        """
+        ORCA を独立したプロセスグループで起動し、終了を待つ。
+        (端末の Ctrl+C は ORCA に直接届かず、ドレイン処理がシグナルを制御する)
+        usage に辞書を渡すと、wall_seconds / rusage / sampled (プロセスツリーのサンプリング結果) が入る。
+        Returns: (returncode, timeout_seconds を超えて終了させたか)
+        """
+        started = time.monotonic()
+        process = subprocess.Popen(
+            [self.orca_executable, str(orca_input)],
+            cwd=work_dir,
+            stdout=out_f,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+        with self._processes_lock:
+            self._processes.add(process)
+        sampler = ProcessTreeSampler(process.pid, self.usage_sample_interval).start() if usage is not None else None
+        finished = threading.Event()
+        timed_out = threading.Event()
+        watchdog = None
+        if self.timeout_seconds > 0:
+            watchdog = threading.Thread(
+                target=self._enforce_timeout, args=(process, orca_input, finished, timed_out),
+                name=f'orca-timeout-{process.pid}', daemon=True
+            )
+            watchdog.start()
+        try:
+            returncode, rusage = wait_with_rusage(process)
+        finally:
+            finished.set()
+            sampled = sampler.stop() if sampler is not None else None
+            with self._processes_lock:
+                self._processes.discard(process)
+        if usage is not None:
+            usage.update(wall_seconds=time.monotonic() - started, rusage=rusage, sampled=sampled)
+        return returncode, timed_out.is_set()
+
+    def _enforce_timeout(self, process, orca_input, finished, timed_out):
+        """timeout_seconds 以内に終了しなければ SIGTERM を送り、kill_grace 秒後も残っていれば SIGKILL を送る。"""
+        timeout, grace = self.timeout_seconds, self.kill_grace
+        if finished.wait(timeout):
+            return
+        timed_out.set()
+        self.logger.warning(f"ORCA run {Path(orca_input).name} exceeded timeout_seconds ({timeout:.0f}s); terminating.")
+        signal_process_group(process, signal.SIGTERM)
+        if not finished.wait(grace):
+            signal_process_group(process, getattr(signal, 'SIGKILL', signal.SIGTERM))
+
+    def measure_usage(self, run, wall_seconds, rusage=None, sampled=None):
+        """実行の消費リソースを、入力の %pal/%maxcore と原子数とともに run.resource_usage にまとめる。"""
+        try:
+            nprocs, maxcore = read_inp_resources(run.orca_path)
+            n_atoms = count_inp_atoms(run.inp_path) if run.inp_path.exists() else None
+            run.resource_usage = build_usage_record(wall_seconds, rusage, sampled, nprocs, maxcore, n_atoms)
+        except Exception as e:
+            self.logger.warning(f"Could not measure resource usage for {run.mol_name}: {e}")
 
     def execute(self, inp_file, mol_name, calc_type):
         """Workerスレッドから呼び出され、ORCAジョブの実行を処理する。"""
         
+        run = self.prepare_run(inp_file, mol_name, calc_type)
+        if run is None:
+            return
+
+        # --- ORCA プロセスの実行 (Phase 2: 実行フェーズ) ---
+        try:
+            usage = {}
+            # ORCA の標準出力は実行中に書き足されるため、作業ディレクトリに直接書く
+            # (一時ファイルの置き換えは使わない。products には終了後にアトミックに保存する)
+            with open(run.output_path, 'w') as out_f:
+                returncode, run.timed_out = self._run_orca(run.orca_path, run.work_dir, out_f, usage=usage)
+        except Exception as e:
+            self.abort_run(run, e)
+            return
+
+        self.measure_usage(run, **usage)
+        self.finish_run(run, returncode)
+
+    # --- 実行の各フェーズ (スレッド/asyncio の両バックエンドで共有) ---
+    def prepare_run(self, inp_file, mol_name, calc_type):
+        """
+        Phase 1: 作業ディレクトリを準備し、状態を RUNNING にする。
+        Returns: OrcaRun。ジョブを開始しない場合は None (失敗処理と後片付けは済んでいる)。
+        """
+        if self.stopping:
+            # ドレイン開始後はジョブを開始しない (PENDING のまま次回起動時に再開される)
+            return None
+
+        run = OrcaRun(self.config, inp_file, mol_name, calc_type)
+        try:
+            ensure_directory(run.work_dir) # work_dirを作成
+            # 中断された実行が残っていれば、その最終ステップから再開する
+            if not self._prepare_restart(run.inp_path, run.work_dir, mol_name, calc_type):
+                atomic_copy(run.inp_path, run.work_dir) # inpファイルをwork_dirにコピー
+        except (IOError, OSError) as e:
+            # ファイルI/Oエラー（ディスクフル、ネットワーク切断など）
+            self.logger.error(f"File I/O error for {mol_name} (Recoverable): {e}")
+            try:
+                current_retries = self.handler.state_store.increment_retry_count(run.job_id)
+                # OSエラーはリトライ可能（RECOVERABLE、容量不足なら DISK_SPACE）として扱う
+                error_type = "DISK_SPACE" if e.errno in _DISK_FULL_ERRNOS else "RECOVERABLE"
+                is_permanent = self.handler.handle_failure(run.job_id, mol_name, f"OS Error: {e}", current_retries, error_type)
+                run.keep_input = not is_permanent
+            finally:
+                self._cleanup_run(run)
+            return None
+        except Exception as e:
+            self.abort_run(run, e)
+            return None
+
+        run.run_started = time.time()
+        self.handler.update_status_running(run.job_id, run_started=run.run_started) # 状態をRUNNINGに更新
+        return run
+
+    def finish_run(self, run, returncode):
+        """Phase 3: ORCA の終了後、中断の記録または結果の判定と委託を行い、後片付けする。"""
+        try:
+            self._record_resource_usage(run)
+            if run.timed_out and not self.stopping:
+                self._record_timeout(run)
+                return
+            if self._was_interrupted(run, returncode):
+                self._record_interruption(run.inp_path, run.mol_name, run.run_started)
+                run.keep_input = True
+                run.keep_work_dir = True
+                return
+
+            # --- 結果のチェックと委託 ---
+            run.keep_input = self._handle_result(run.inp_path, run.mol_name, run.calc_type, run.orca_path,
+                                                 run.work_dir, run.product_dir)
+        except Exception as e:
+            self._record_execution_error(run, e)
+        finally:
+            self._cleanup_run(run)
+
+    def _was_interrupted(self, run, returncode):
+        """
+        ORCA がシグナルで終了したか、ドレイン開始後に正常終了せずに終わったか。
+        ドレイン中でも正常終了した実行は、中断ではなく完了として処理する。
+        """
+        if returncode in _INTERRUPT_RETURNCODES:
+            return True
+        return self.stopping and (returncode != 0 or not check_orca_output(run.output_path)[0])
+
+    def _record_timeout(self, run):
+        """
+        timeout_seconds を超えたジョブをリトライ可能な失敗として記録する。リトライでは
+        残した作業ディレクトリから (最適化なら最終ステップから) 再開する。
+        """
+        current_retries = self.handler.state_store.increment_retry_count(run.job_id)
+        is_permanent = self.handler.handle_failure(
+            run.job_id, run.mol_name, f"Timeout: exceeded timeout_seconds ({self.timeout_seconds:.0f}s)",
+            current_retries, "RECOVERABLE"
+        )
+        run.keep_input = not is_permanent
+        run.keep_work_dir = not is_permanent
+
+    def _record_resource_usage(self, run):
+        usage = run.resource_usage
+        if not usage:
+            return
+        self.handler.state_store.update_job_fields(run.job_id, resource_usage=usage)
+        self.logger.info(
+            f"Resource usage for {run.mol_name} ({run.calc_type}): wall {usage['wall_seconds']:.0f}s, "
+            f"CPU efficiency {usage.get('cpu_efficiency', 'n/a')}, "
+            f"peak memory {usage.get('peak_tree_rss_mb', usage.get('max_rss_mb', 'n/a'))} MB"
+            f"{' (memory-bound)' if usage.get('memory_bound') else ''}"
+        )
+
+    def abort_run(self, run, error):
+        """ORCA の起動失敗など、予期せぬ実行時エラーを記録して後片付けする。"""
+        try:
+            self._record_execution_error(run, error)
+        finally:
+            self._cleanup_run(run)
+
+    def _record_execution_error(self, run, error):
+        self.logger.error(f"Execution error for {run.mol_name} (Fatal): {error}")
+        current_retries = self.handler.state_store.increment_retry_count(run.job_id)
+        error_message = f'Execution Error: {error}'
+        # 実行時例外は 'FATAL_EXECUTION' (リトライ不要) として扱う
+        self.handler.handle_failure(run.job_id, run.mol_name, error_message, current_retries, "FATAL_EXECUTION")
+        run.keep_input = False
+
+    def _cleanup_run(self, run):
+        # ガベージコレクション (Task 3.2)
+        if not run.keep_work_dir:
+            try:
+                shutil.rmtree(run.work_dir, ignore_errors=True)
+                self.logger.info(f"Cleaned up working directory: {run.work_dir}")
+            except Exception as e:
+                self.logger.error(f"Failed to cleanup working directory {run.work_dir}: {e}")
+
+        if not run.keep_input:
+            run.inp_path.unlink(missing_ok=True) # 元のinpファイルを削除
+
+    def _handle_result(self, inp_path, mol_name, calc_type, orca_path, work_dir, product_dir, finished=False):
+        """
+        ORCA の出力 (orca_path と同名の .out) を判定し、ハンドラに結果を委託する。
+        finished: パック実行で ORCA が次のジョブに進んだ (正常終了マーカーの無い) 出力か
+        Returns: 入力ファイルを残す (リトライ可能な失敗) 場合は True
+        """
+        success, message, error_type = check_orca_output(orca_path.with_suffix('.out'), finished=finished) # orca_utilsに依存
+        self._record_ladder(inp_path, mol_name, orca_path.with_suffix('.out'))
+
+        if success:
+            self.handler.handle_success(orca_path, mol_name, calc_type, work_dir, product_dir,
+                                        job_id=str(inp_path))
+            return False
+
+        current_retries = self.handler.state_store.increment_retry_count(str(inp_path))
+        # orca_utils から渡された error_type をそのまま渡す
+        is_permanent = self.handler.handle_failure(str(inp_path), mol_name, message, current_retries, error_type)
+        return not is_permanent
+
+    def _record_ladder(self, inp_path, mol_name, output_path):
+        """method ladder の段ごとの最適化サイクル数とエネルギーを、1つのジョブの記録として残す。"""
+        stages = summarize_ladder(output_path)
+        if len(stages) < 2:
+            return
+        self.handler.state_store.update_job_fields(str(inp_path), ladder=stages)
+        self.logger.info(
+            f"Method ladder for {mol_name}: " +
+            ", ".join(f"stage {stage['stage']} {stage['opt_cycles']} cycles" for stage in stages)
+        )
+
+    # --- 小分子ジョブのパッキング ---
+    def can_pack(self, inp_file):
+        """パッキング可能か (小分子で、再開用のチェックポイントが残っていない)。"""
         inp_path = Path(inp_file)
-        work_dir = Path(self.config['paths']['working_dir']) / inp_path.stem
-        # --- 修正後 (L43-L44) ---
-        # product_dir の取得
+        if (Path(self.config['paths']['working_dir']) / inp_path.stem).exists():
+            return False
+        return self.packer.is_packable(inp_file)
+
+    def execute_packed(self, jobs):
+        """
+        複数の小分子ジョブを $new_job 複合入力として1つの ORCA プロセスで実行し、
+        出力を分子ごとに分割して、各ジョブを個別に成功/失敗として処理する。
+        jobs: (inp_file, mol_name, calc_type) のリスト
+        """
+        if self.stopping:
+            return
+
+        jobs = [(str(inp_file), mol_name, calc_type) for inp_file, mol_name, calc_type in jobs]
+        inp_paths = [Path(inp_file) for inp_file, _, _ in jobs]
+        stems = [inp_path.stem for inp_path in inp_paths]
+        pack_name = f"pack_{stems[0]}_{len(jobs)}"
+        work_dir = Path(self.config['paths']['working_dir']) / pack_name
         product_dir = Path(self.config['paths']['products_dir'])
-        
-        orca_path = work_dir / inp_path.name
-        output_path = work_dir / f"{inp_path.stem}.out"
+        packed_inp = work_dir / f"{pack_name}.inp"
+        packed_out = work_dir / f"{pack_name}.out"
+
+        # ジョブごとの入力ファイルの扱い (True: 残す)。処理されなかったジョブは残して再登録する
+        keep_inputs = {str(inp_path): True for inp_path in inp_paths}
+        handled = set()
+        requeue = []
 
-        self.handler.update_status_running(str(inp_path)) # 状態をRUNNINGに更新
-        
         try:
-            # Phase 1: 準備フェーズ
             try:
-                ensure_directory(work_dir) # work_dirを作成
-                shutil.copy(inp_path, work_dir) # inpファイルをwork_dirにコピー
+                ensure_directory(work_dir)
+                if not safe_write(packed_inp, self.packer.build_compound_input(inp_paths)):
+                    raise OSError(f"Could not write packed input {packed_inp}")
             except (IOError, OSError) as e:
-                # ファイルI/Oエラー（ディスクフル、ネットワーク切断など）
-                self.logger.error(f"File I/O error for {mol_name} (Recoverable): {e}")
-                current_retries = self.handler.state_store.increment_retry_count(str(inp_path))
-                # OSエラーはリトライ可能（RECOVERABLE）として扱う
-                self.handler.handle_failure(str(inp_path), mol_name, f"OS Error: {e}", current_retries, "RECOVERABLE")
-                return # executeメソッドを終了
-
-            # --- ORCA プロセスの実行 (Phase 2: 実行フェーズ) ---
-            with open(output_path, 'w') as out_f:
-                subprocess.run(
-                    [self.orca_executable, str(orca_path)],
-                    cwd=work_dir,
-                    stdout=out_f,
-                    stderr=subprocess.STDOUT,
-                    check=False
-                )
-            
-            # --- 結果のチェック ---
-            success, message, error_type = check_orca_output(output_path) # orca_utilsに依存
-            
-            # --- 結果の委託 ---
-            if success:
-                self.handler.handle_success(orca_path, mol_name, calc_type, work_dir, product_dir)
-            else:
-                current_retries = self.handler.state_store.increment_retry_count(str(inp_path))
-                # orca_utils から渡された error_type をそのまま渡す
-                self.handler.handle_failure(str(inp_path), mol_name, message, current_retries, error_type)
-                
+                self.logger.error(f"File I/O error while packing {len(jobs)} jobs (Recoverable): {e}")
+                for inp_file, mol_name, _ in jobs:
+                    current_retries = self.handler.state_store.increment_retry_count(inp_file)
+                    is_permanent = self.handler.handle_failure(inp_file, mol_name, f"OS Error: {e}",
+                                                               current_retries, "RECOVERABLE")
+                    keep_inputs[inp_file] = not is_permanent
+                return
+
+            run_started = time.time()
+            self.handler.state_store.update_statuses_bulk({inp_file: 'RUNNING' for inp_file, _, _ in jobs},
+                                                          fields={'run_started': run_started})
+            self.logger.info(f"Running {len(jobs)} small-molecule jobs in one ORCA process ({pack_name})")
+
+            usage = {}
+            with open(packed_out, 'w') as out_f:
+                returncode, timed_out = self._run_orca(packed_inp, work_dir, out_f, usage=usage)
+            self._record_packed_usage(packed_inp, jobs, inp_paths, **usage)
+            # タイムアウトで終了させた場合、実行中だったジョブは失敗、未実行のジョブは単独で再登録される
+            interrupted = self.stopping or (returncode in _INTERRUPT_RETURNCODES and not timed_out)
+
+            outputs, finished = self.packer.split_output(packed_out, stems, work_dir)
+            for (inp_file, mol_name, calc_type), inp_path in zip(jobs, inp_paths):
+                output_path = outputs.get(inp_path.stem)
+                member_finished = inp_path.stem in finished
+                if output_path is None or (
+                    interrupted and not check_orca_output(output_path, finished=member_finished)[0]
+                ):
+                    # 前のジョブで ORCA が停止したため実行されなかった (または中断された) ジョブ
+                    requeue.append((inp_file, mol_name, calc_type))
+                    continue
+                handled.add(inp_file)
+                try:
+                    keep_inputs[inp_file] = self._handle_result(
+                        inp_path, mol_name, calc_type, work_dir / inp_path.name, work_dir, product_dir,
+                        finished=member_finished
+                    )
+                except Exception as e:
+                    self.logger.error(f"Post-processing error for packed job {mol_name} ({calc_type}): {e}")
+
+            if interrupted:
+                # パック単位のチェックポイントは作らず、未完了のジョブは次回起動時に最初から実行する
+                for inp_file, mol_name, _ in requeue:
+                    self.handler.state_store.update_status(inp_file, 'INTERRUPTED')
+                self.logger.warning(f"Packed run {pack_name} was interrupted; {len(requeue)} jobs left for restart.")
+                requeue = []
+            elif requeue:
+                self.logger.warning(f"{len(requeue)} jobs in {pack_name} did not run; re-queued individually.")
+
         except Exception as e:
-            # subprocess.run 自体の失敗など、予期せぬ実行時エラー
-            self.logger.error(f"Execution error for {mol_name} (Fatal): {e}")
-            current_retries = self.handler.state_store.increment_retry_count(str(inp_path))
-            error_message = f'Execution Error: {e}'
-            # 実行時例外は 'FATAL_EXECUTION' (リトライ不要) として扱う
-            self.handler.handle_failure(str(inp_path), mol_name, error_message, current_retries, "FATAL_EXECUTION")
-            
+            self.logger.error(f"Execution error for packed run {pack_name} (Fatal): {e}")
+            requeue = []
+            for inp_file, mol_name, _ in jobs:
+                if inp_file in handled:
+                    continue
+                current_retries = self.handler.state_store.increment_retry_count(inp_file)
+                self.handler.handle_failure(inp_file, mol_name, f'Execution Error: {e}',
+                                            current_retries, "FATAL_EXECUTION")
+                keep_inputs[inp_file] = False
+
         finally:
-            # ガベージコレクション (Task 3.2)
-            try:
-                shutil.rmtree(work_dir, ignore_errors=True)
-                self.logger.info(f"Cleaned up working directory: {work_dir}")
-            except Exception as e:
-                self.logger.error(f"Failed to cleanup working directory {work_dir}: {e}")
+            shutil.rmtree(work_dir, ignore_errors=True)
+            for inp_file, keep in keep_inputs.items():
+                self.packer.forget(inp_file)
+                if not keep:
+                    Path(inp_file).unlink(missing_ok=True)
+            if requeue and self.handler.scheduler is not None:
+                # 再登録したジョブは単独で実行させる (同じパックで再び止まるのを防ぐ)
+                self.handler.scheduler.add_jobs_bulk(requeue, is_recovery=True, pack=False)
+
+    def _record_packed_usage(self, packed_inp, jobs, inp_paths, wall_seconds, rusage=None, sampled=None):
+        """パック全体の消費リソースを、時間を等分して各ジョブの resource_usage に記録する (保存は1回)。"""
+        try:
+            nprocs, maxcore = read_inp_resources(packed_inp)
+            record = build_usage_record(wall_seconds, rusage, sampled, nprocs, maxcore)
+            self.handler.state_store.update_fields_bulk({
+                inp_file: {'resource_usage': packed_usage_record(record, len(jobs), count_inp_atoms(inp_path))}
+                for (inp_file, _, _), inp_path in zip(jobs, inp_paths)
+            })
+        except Exception as e:
+            self.logger.warning(f"Could not record resource usage for packed run {packed_inp.stem}: {e}")
+
+    # --- チェックポイント/再開 ---
+    def _prepare_restart(self, inp_path, work_dir, mol_name, calc_type):
+        """
+        前回中断された実行のファイル (.gbw / _trj.xyz / .opt) が work_dir に残っていれば、
+        最終ステップから再開する入力を書き込み True を返す。再開できない場合は False。
+        """
+        stem = inp_path.stem
+        checkpoint = find_checkpoint_files(work_dir, stem)
+
+        geometry = None
+        if calc_type == 'opt':
+            for key in ('trj', 'xyz'):
+                if checkpoint[key]:
+                    geometry = read_last_xyz_frame(checkpoint[key])
+                    if geometry is not None:
+                        break
+
+        if geometry is None and not checkpoint['gbw']:
+            return False
+
+        # ORCAは <stem>.gbw / <stem>.opt を上書きするため、別名で退避してから読み込ませる
+        gbw_name = None
+        if checkpoint['gbw']:
+            gbw_name = f"{stem}_restart.gbw"
+            if checkpoint['gbw'].name != gbw_name:
+                atomic_copy(checkpoint['gbw'], work_dir / gbw_name)
+
+        hess_name = None
+        if geometry is not None and checkpoint['opt']:
+            hess_name = f"{stem}_restart.opt"
+            if checkpoint['opt'].name != hess_name:
+                atomic_copy(checkpoint['opt'], work_dir / hess_name)
+
+        with open(inp_path, 'r') as f:
+            inp_content = f.read()
+        if is_ladder_input(inp_content):
+            # 本計算のチェックポイントがあるため、前最適化の段は繰り返さない
+            inp_content = strip_ladder(inp_content, work_dir)
+        safe_write(work_dir / inp_path.name, build_restart_input(inp_content, geometry, gbw_name, hess_name))
+
+        # 前回の出力は診断用に残し、中断までの経過時間を求める
+        job = self.handler.state_store.get_job(str(inp_path)) or {}
+        elapsed = (job.get('checkpoint') or {}).get('elapsed_seconds')
+        previous_out = work_dir / f"{stem}.out"
+        if previous_out.exists():
+            if elapsed is None and job.get('run_started'):
+                elapsed = max(0.0, previous_out.stat().st_mtime - job['run_started'])
+            previous_out.replace(work_dir / f"{stem}.interrupted.out")
+
+        saved_wall_time = job.get('saved_wall_time', 0.0) + (elapsed or 0.0)
+        self.handler.state_store.update_job_fields(
+            str(inp_path),
+            checkpoint=None,
+            saved_wall_time=round(saved_wall_time, 1),
+            restart_count=job.get('restart_count', 0) + 1
+        )
+
+        self.logger.info(
+            f"Restarting {mol_name} ({calc_type}) from checkpoint "
+            f"(geometry: {'yes' if geometry is not None else 'no'}, orbitals: {'yes' if gbw_name else 'no'}, "
+            f"hessian: {'yes' if hess_name else 'no'}). Saved wall time: {saved_wall_time:.0f}s"
+        )
+        return True
 
-            inp_path.unlink(missing_ok=True) # 元のinpファイルを削除
+    def _record_interruption(self, inp_path, mol_name, run_started):
+        """中断されたジョブを INTERRUPTED として記録する (次回起動時に再開される)。"""
+        elapsed = time.time() - run_started
+        self.handler.state_store.update_status(
+            str(inp_path),
+            'INTERRUPTED',
+            checkpoint={
+                'interrupted_at': str(datetime.now()),
+                'elapsed_seconds': round(elapsed, 1)
+            }
+        )
+        self.logger.warning(
+            f"Job for {mol_name} was interrupted after {elapsed:.0f}s. "
+            f"Working directory kept for restart."
+        )
@@ -7,6 +7,9 @@ import subprocess
 from pathlib import Path
 # 依存関係: logging_utilsからロガーを取得
 from logging_utils import get_logger
+# 圧縮された成果物 (.out.gz / .out.zst) を透過的に読むため
+from products_store import open_product_text, resolve_product_path
+from geometry import Geometry
 
 # プロット機能の条件付きインポート（元のコードの振る舞いを維持）
 try:
@@ -31,28 +34,69 @@ FATAL_INPUT_ERROR_PATTERNS = [
 FATAL_RESOURCE_ERROR_PATTERNS = [
     re.compile(r"Out of Memory", re.IGNORECASE),
     re.compile(r"Allocation failed", re.IGNORECASE),
+]
+
+# ディスク容量不足のエラーパターン (容量が戻れば再実行できるため、致命的とはしない)
+DISK_SPACE_ERROR_PATTERNS = [
     re.compile(r"No space left on device", re.IGNORECASE),
     re.compile(r"Disk quota exceeded", re.IGNORECASE),
 ]
 
+# 出力ファイルの座標ブロック
+_SUCCESS_COORDS_PATTERN = re.compile(
+    r"CARTESIAN COORDINATES \(ANGSTROEM\)\s*\n-+\n(.*?)\n-{10,}",
+    re.DOTALL
+)
+_FAILURE_COORDS_PATTERN = re.compile(
+    r"FINAL COORDINATES \(CARTESIAN\)\n-+\n[^\n]*\n-+\n(.*?)\n-{10,}",
+    re.DOTALL
+)
+
+# 結果抽出用のパターン
+# 複合入力 ($new_job) の各ジョブの開始時に ORCA が出力する区切り
+_JOB_MARKER_PATTERN = re.compile(r"^\s*\$+\s*JOB NUMBER\s+(\d+)\s*\$+\s*$", re.MULTILINE)
+_OPT_CYCLE_PATTERN = re.compile(r"GEOMETRY OPTIMIZATION CYCLE\s+(\d+)")
+# 安価な方法による前最適化を含む入力 (method ladder) のヘッダ
+LADDER_HEADER = "# Ladder:"
+_FINAL_ENERGY_PATTERN = re.compile(r"FINAL SINGLE POINT ENERGY\s+(-?\d+\.\d+)")
+_FREQUENCY_LINE_PATTERN = re.compile(r"^\s*\d+:\s+(-?\d+\.\d+)\s+cm\*\*-1", re.MULTILINE)
+_THERMO_PATTERNS = {
+    'zpe': re.compile(r"Zero point energy\s+\.{3}\s+(-?\d+\.\d+)\s+Eh"),
+    'enthalpy': re.compile(r"Total [Ee]nthalpy\s+\.{3}\s+(-?\d+\.\d+)\s+Eh"),
+    'gibbs': re.compile(r"Final Gibbs free energy\s+\.{3}\s+(-?\d+\.\d+)\s+Eh"),
+}
+_RUN_TIME_PATTERN = re.compile(
+    r"TOTAL RUN TIME:\s+(\d+) days\s+(\d+) hours\s+(\d+) minutes\s+(\d+) seconds\s+(\d+) msec"
+)
+
 # --- ORCA INPUT GENERATION ---
 
-def generate_orca_input(config, mol_name, atoms, coords, calc_type='opt'):
-    """Generates the content for an ORCA input file."""
+def generate_orca_input(config, mol_name, geometry, calc_type='opt', calc_keyword=None, method=None, basis=None,
+                        resources=None):
+    """
+    Generates the content for an ORCA input file from a Geometry.
+
+    calc_keyword/method/basis override the defaults (used by workflow steps);
+    by default 'opt' → OPT, 'freq' → FREQ and method/basis come from [orca].
+    resources (ResourceTuner.choose) overrides %pal nprocs / %maxcore and is noted in the header.
+    """
     
-    num_cores = config['orca']['nprocs']
+    num_cores = resources['nprocs'] if resources else config['orca']['nprocs']
+    maxcore = resources['maxcore'] if resources else config['orca'].get('maxcore', '2000')
     
-    method = config['orca'].get('method', 'B3LYP')
-    basis = config['orca'].get('basis', 'def2-SVP')
+    method = method or config['orca'].get('method', 'B3LYP')
+    basis = basis or config['orca'].get('basis', 'def2-SVP')
     
-    if calc_type == 'opt':
+    if calc_keyword is not None:
+        calc_type_keyword = calc_keyword
+    elif calc_type == 'opt':
         calc_type_keyword = 'OPT'
     elif calc_type == 'freq':
         calc_type_keyword = 'FREQ'
     else:
         calc_type_keyword = ''
     
-    calc_keywords = f"{calc_type_keyword} {method} {basis} TightSCF"
+    calc_keywords = " ".join(part for part in (calc_type_keyword, method, basis, "TightSCF") if part)
     
     optional_keywords = []
     
@@ -68,53 +112,194 @@ def generate_orca_input(config, mol_name, atoms, coords, calc_type='opt'):
     if optional_keywords:
         calc_keywords += " " + " ".join(optional_keywords)
     
+    # 自動調整した場合は、選んだ根拠をヘッダに残す
+    resource_note = ""
+    if resources:
+        resource_note = (f"# Resources: auto-tuned ({resources['source']}, "
+                         f"~{resources['basis_functions']} basis functions)\n")
+
+    charge, multiplicity = config['orca']['charge'], config['orca']['multiplicity']
+    ladder = _ladder_methods(config, calc_type, calc_type_keyword)
+    if ladder:
+        return _build_ladder_input(config, mol_name, calc_type, geometry, ladder, calc_keywords,
+                                   num_cores, maxcore, resource_note)
+
     # 入力ファイルの生成
     input_content = f"""# ORCA Input generated by pipeline
 # Molecule: {mol_name} | Type: {calc_type}
-
+{resource_note}
 ! {calc_keywords}
 
 %pal nprocs {num_cores} end
-%maxcore {config['orca'].get('maxcore', '2000')}
+%maxcore {maxcore}
 
-* xyz {config['orca']['charge']} {config['orca']['multiplicity']}
+* xyz {charge} {multiplicity}
 """
-    for atom, coord in zip(atoms, coords):
-        input_content += f"  {atom} {coord[0]:.6f} {coord[1]:.6f} {coord[2]:.6f}\n"
-        
-    input_content += "*\n"
-    
-    return input_content
+    # 座標ブロックは1回の join で生成する (大きな系での繰り返し連結を避ける)
+    return input_content + geometry.to_coordinate_block() + "*\n"
+
+
+def _ladder_methods(config, calc_type, calc_type_keyword):
+    """[ladder] が calc_type に適用される (構造最適化である) 場合、安価な方法のリストを返す。"""
+    if not config.getboolean('ladder', 'enabled', fallback=False):
+        return []
+    steps = [name.strip() for name in config.get('ladder', 'steps', fallback='opt').split(',') if name.strip()]
+    if calc_type not in steps or 'OPT' not in calc_type_keyword.upper().split():
+        return []
+    return [method.strip() for method in config.get('ladder', 'methods', fallback='XTB2').split(',') if method.strip()]
+
+
+def _build_ladder_input(config, mol_name, calc_type, geometry, ladder, calc_keywords, num_cores, maxcore,
+                        resource_note):
+    """
+    安価な方法で順に前最適化し、その構造 (と最後の段のヘシアン) から本計算の最適化を続ける
+    $new_job 複合入力を作る。1つの ORCA プロセス・1つのジョブとして実行される。
+    前段のファイルは 'ladder<n>_<stem>' という名前で出力し、本計算のチェックポイント
+    (<stem>*.gbw など) と混同されないようにする。
+    """
+    stem = f"{mol_name}_{calc_type}"
+    charge, multiplicity = config['orca']['charge'], config['orca']['multiplicity']
+    keywords = config.get('ladder', 'keywords', fallback='Opt').strip()
+    use_hessian = config.getboolean('ladder', 'hessian', fallback=True)
+    resources = f"%pal nprocs {num_cores} end\n%maxcore {maxcore}\n"
+
+    parts = [f"""# ORCA Input generated by pipeline
+# Molecule: {mol_name} | Type: {calc_type}
+{LADDER_HEADER} {' -> '.join(ladder)} -> {calc_keywords}
+{resource_note}"""]
+    previous = None
+    for number, method in enumerate(ladder, 1):
+        base = f"ladder{number}_{stem}"
+        stage_keywords = f"{method} {keywords}"
+        if use_hessian and number == len(ladder):
+            stage_keywords += " Freq"
+        if previous is None:
+            coordinates = f"* xyz {charge} {multiplicity}\n" + geometry.to_coordinate_block() + "*\n"
+        else:
+            coordinates = f"* xyzfile {charge} {multiplicity} {previous}.xyz\n"
+        parts.append(f'! {stage_keywords}\n%base "{base}"\n{resources}\n{coordinates}')
+        previous = base
+
+    hessian = f'%geom InHess Read InHessName "{previous}.hess" end\n' if use_hessian else ""
+    parts.append(f'! {calc_keywords}\n%base "{stem}"\n{resources}{hessian}\n'
+                 f"* xyzfile {charge} {multiplicity} {previous}.xyz\n")
+    return parts[0] + "\n$new_job\n".join(parts[1:])
+
+
+def is_ladder_input(inp_content):
+    return LADDER_HEADER in inp_content
+
+
+def strip_ladder(inp_content, work_dir):
+    """
+    method ladder の入力から本計算の段だけを取り出す (中断された本計算の再開用)。
+    '* xyzfile' は前段の最終構造 (work_dir に無ければ最初の段の入力構造) の座標ブロックに置き換え、
+    前段のヘシアンの読み込みは、そのファイルが残っている場合のみ残す。
+    """
+    header = [line for line in inp_content.splitlines() if line.startswith('#')]
+    stages = re.split(r"^\s*\$new_job\s*$", inp_content, flags=re.MULTILINE)
+    first, final = stages[0], stages[-1]
+
+    out_lines = list(header)
+    for line in final.splitlines():
+        stripped = line.strip()
+        if stripped.startswith('#'):
+            continue
+        match = re.match(r"\*\s*xyzfile\s+(\S+)\s+(\S+)\s+(\S+)", stripped, re.IGNORECASE)
+        if match:
+            geometry = read_last_xyz_frame(Path(work_dir) / match.group(3))
+            if geometry is None:
+                block = re.search(r"^\*\s*xyz\s.*?^\*\s*$", first, re.MULTILINE | re.DOTALL | re.IGNORECASE)
+                geometry = Geometry.from_atom_lines(block.group(0).splitlines()[1:-1])
+            out_lines.append(f"* xyz {match.group(1)} {match.group(2)}")
+            out_lines.extend(geometry.to_atom_lines())
+            out_lines.append("*")
+            continue
+        hess = re.search(r'InHessName\s+"([^"]+)"', line, re.IGNORECASE)
+        if hess and not (Path(work_dir) / hess.group(1)).exists():
+            continue
+        out_lines.append(line)
+    return "\n".join(out_lines) + "\n"
+
+
+def _last_job(content):
+    """複合入力の出力のうち最後のジョブ (ladder では本計算) の部分を返す。"""
+    start = 0
+    for match in _JOB_MARKER_PATTERN.finditer(content):
+        start = match.start()
+    return content[start:]
+
+
+def summarize_ladder(output_path):
+    """
+    method ladder の出力から段ごとの最適化サイクル数と最終エネルギーを集計する。
+    Returns: [{'stage', 'opt_cycles', 'final_energy'}] (複合ジョブでなければ空のリスト)
+    """
+    path = Path(output_path)
+    if resolve_product_path(path) is None:
+        return []
+    with open_product_text(path) as f:
+        content = f.read()
+    starts = [match.start() for match in _JOB_MARKER_PATTERN.finditer(content)]
+    if not starts:
+        return []
+    stages = []
+    for number, start in enumerate(starts, 1):
+        segment = content[start:starts[number] if number < len(starts) else len(content)]
+        energies = _FINAL_ENERGY_PATTERN.findall(segment)
+        stages.append({
+            'stage': number,
+            'opt_cycles': len(_OPT_CYCLE_PATTERN.findall(segment)),
+            'final_energy': float(energies[-1]) if energies else None,
+        })
+    return stages
 
 
 def parse_xyz(xyz_content):
-    """Parses XYZ file content into atom list and coordinate list."""
+    """Parses XYZ file content into a Geometry (empty if nothing could be parsed)."""
     lines = xyz_content.strip().split('\n')
     if len(lines) < 3:
         _orca_utils_logger.error("XYZ file is too short.")
-        return [], []
-
-    atoms = []
-    coords = []
-    for line in lines[2:]:
-        parts = line.split()
-        if len(parts) >= 4:
-            try:
-                atom = parts[0]
-                coord = [float(parts[1]), float(parts[2]), float(parts[3])]
-                atoms.append(atom)
-                coords.append(coord)
-            except ValueError:
-                continue
-    
-    return atoms, coords
+        return Geometry.empty()
+
+    return Geometry.from_atom_lines(lines[2:])
+
+def parse_xyz_frames(xyz_content):
+    """
+    Parses every complete frame of a multi-frame XYZ file (e.g. a conformer ensemble).
+
+    Returns:
+        list of (comment line, Geometry); an incomplete trailing frame is ignored
+    """
+    lines = xyz_content.splitlines()
+    frames = []
+    i = 0
+    while i < len(lines):
+        if not lines[i].strip():
+            i += 1
+            continue
+        try:
+            n_atoms = int(lines[i].strip())
+        except ValueError:
+            break
+        if n_atoms <= 0 or i + 2 + n_atoms > len(lines):
+            break
+        geometry = Geometry.from_atom_lines(lines[i + 2:i + 2 + n_atoms])
+        if geometry.n_atoms != n_atoms:
+            break
+        frames.append((lines[i + 1].strip(), geometry))
+        i += 2 + n_atoms
+    return frames
 
 # --- ORCA OUTPUT UTILITIES ---
 
-def check_orca_output(output_path):
+def check_orca_output(output_path, finished=False):
     """
     Checks ORCA output file for success/failure and classifies error type.
-    Returns: (success (bool), message (str), error_type ('RECOVERABLE', 'FATAL_INPUT', 'FATAL_RESOURCE'))
+    finished=True は $new_job 複合入力 (パック実行) の途中のジョブのように、ORCA が次のジョブに
+    進んだため正常終了マーカーを持たない出力を表す。エラーが見つからない場合のみ正常終了とみなす
+    (SCF の非収束などを許容して ORCA が続行したジョブは失敗として判定される)。
+    Returns: (success (bool), message (str), error_type ('RECOVERABLE', 'DISK_SPACE', 'FATAL_INPUT', 'FATAL_RESOURCE'))
     """
     output_path = Path(output_path)
     if not output_path.exists():
@@ -125,32 +310,60 @@ def check_orca_output(output_path):
 
     # 1. 成功のチェック
     if re.search(r"ORCA TERMINATED NORMALLY", content, re.IGNORECASE):
-        if 'opt' in output_path.stem:
-            if re.search(r"THE OPTIMIZATION HAS CONVERGED", content):
-                return True, "Optimization successful.", "N/A"
-            else:
-                return False, "Optimization failed to converge.", "RECOVERABLE"
-        return True, "Job successful (terminated normally).", "N/A"
-
-    # 2. 失敗のチェック (致命的エラー: リソース)
+        return _check_convergence(content)
+
+    # 2-5. 失敗の分類
+    failure = _classify_failure(content)
+    if failure is not None:
+        return failure
+    if finished:
+        return _check_convergence(content)
+
+    return False, "ORCA job did not terminate normally.", "RECOVERABLE"
+
+
+def _check_convergence(content):
+    """正常終了した出力の判定 (構造最適化であれば収束したか)。"""
+    # 構造最適化かどうかはファイル名ではなく出力内容で判定する
+    # (分子名やワークフローのステップ名に 'opt' が含まれる場合の誤判定を防ぐ)
+    # 複合入力 (method ladder) では、前段ではなく最後のジョブの収束を判定する
+    final_job = _last_job(content)
+    if re.search(r"GEOMETRY OPTIMIZATION CYCLE", final_job):
+        if re.search(r"THE OPTIMIZATION HAS CONVERGED", final_job):
+            return True, "Optimization successful.", "N/A"
+        else:
+            return False, "Optimization failed to converge.", "RECOVERABLE"
+    return True, "Job successful (terminated normally).", "N/A"
+
+
+def _classify_failure(content):
+    """正常終了していない出力のエラーを分類する。Returns: (False, message, error_type)、該当が無ければ None"""
+    # 2. 失敗のチェック (ディスク容量不足)
+    for pattern in DISK_SPACE_ERROR_PATTERNS:
+        match = pattern.search(content)
+        if match:
+            message = match.group(0).strip()
+            return False, f"Disk Space Error: {message}", "DISK_SPACE"
+
+    # 3. 失敗のチェック (致命的エラー: リソース)
     for pattern in FATAL_RESOURCE_ERROR_PATTERNS:
         match = pattern.search(content)
         if match:
             message = match.group(0).strip()
             return False, f"Fatal Resource Error: {message}", "FATAL_RESOURCE"
 
-    # 3. 失敗のチェック (致命的エラー: 入力ミス)
+    # 4. 失敗のチェック (致命的エラー: 入力ミス)
     for pattern in FATAL_INPUT_ERROR_PATTERNS:
         match = pattern.search(content)
         if match:
             message = match.group(0).strip()
             return False, f"Fatal Input Error: {message}", "FATAL_INPUT"
 
-    # 4. その他の失敗 (リトライ可能とみなす)
+    # 5. その他の失敗 (リトライ可能とみなす)
     if re.search(r"SCF NOT CONVERGED", content, re.IGNORECASE):
         return False, "SCF failed to converge.", "RECOVERABLE"
 
-    return False, "ORCA job did not terminate normally.", "RECOVERABLE"
+    return None
 
 
 def extract_final_structure(output_path):
@@ -161,46 +374,43 @@ def extract_final_structure(output_path):
     and failed optimization (FINAL COORDINATES (CARTESIAN)) cases.
     
     Returns:
-        tuple: (atoms, coords) where atoms is a list of element symbols
-               and coords is a list of [x, y, z] coordinates, or (None, None) if not found
+        Geometry, or None if no coordinate block is found
     """
     output_path = Path(output_path)
-    if not output_path.exists():
+    if resolve_product_path(output_path) is None:
         _orca_utils_logger.warning(f"Output file not found: {output_path}")
-        return None, None
+        return None
     
-    with open(output_path, 'r', errors='ignore') as f:
+    with open_product_text(output_path) as f:
         content = f.read()
 
+    return _find_final_structure(content, output_path.name)
+
+
+def _find_final_structure(content, source_name):
+    """Finds the last coordinate block in ORCA output text (see extract_final_structure)."""
     # パターン1: 成功時の座標ブロック (CARTESIAN COORDINATES (ANGSTROEM))
-    success_pattern = re.compile(
-        r"CARTESIAN COORDINATES \(ANGSTROEM\)\s*\n-+\n(.*?)\n-{10,}",
-        re.DOTALL
-    )
-    
-    match = success_pattern.search(content)
+    # 最適化では各ステップごとに出力されるため、最後のブロックを最終構造とする
+    match = None
+    for match in _SUCCESS_COORDS_PATTERN.finditer(content):
+        pass
     
     if match:
-        _orca_utils_logger.debug(f"Found successful optimization coordinates in {output_path.name}")
+        _orca_utils_logger.debug(f"Found successful optimization coordinates in {source_name}")
         coords_block = match.group(1).strip()
         return _parse_coordinate_block(coords_block, format_type='success')
     
     # パターン2: 失敗時の座標ブロック (FINAL COORDINATES (CARTESIAN))
-    failure_pattern = re.compile(
-        r"FINAL COORDINATES \(CARTESIAN\)\n-+\n[^\n]*\n-+\n(.*?)\n-{10,}",
-        re.DOTALL
-    )
-    
-    match = failure_pattern.search(content)
+    match = _FAILURE_COORDS_PATTERN.search(content)
     
     if match:
-        _orca_utils_logger.debug(f"Found final (non-converged) coordinates in {output_path.name}")
+        _orca_utils_logger.debug(f"Found final (non-converged) coordinates in {source_name}")
         coords_block = match.group(1).strip()
         return _parse_coordinate_block(coords_block, format_type='failure')
     
     # どちらのパターンも見つからなかった場合
-    _orca_utils_logger.warning(f"Could not find coordinate block in {output_path.name}")
-    return None, None
+    _orca_utils_logger.warning(f"Could not find coordinate block in {source_name}")
+    return None
 
 
 def _parse_coordinate_block(coords_block, format_type='success'):
@@ -212,60 +422,178 @@ def _parse_coordinate_block(coords_block, format_type='success'):
         format_type: 'success' for ANGSTROEM format, 'failure' for CARTESIAN format
     
     Returns:
-        tuple: (atoms, coords) lists
+        Geometry, or None if no valid coordinates are found
     """
-    atoms = []
-    coords = []
-    
-    for line in coords_block.split('\n'):
-        parts = line.split()
-        
-        # 成功時のフォーマット: Element X Y Z
-        if format_type == 'success' and len(parts) >= 4:
-            try:
-                atom = parts[0]
-                coord = [float(parts[1]), float(parts[2]), float(parts[3])]
-                atoms.append(atom)
-                coords.append(coord)
-            except (ValueError, IndexError):
-                continue
-        
-        # ★★★ ここからが修正点 ★★★
-        # 失敗時のフォーマット: (Index) Element X Y Z
-        elif format_type == 'failure' and len(parts) >= 4: # 実際には 5 >= 4
-            try:
-                # 失敗時は Index(0) Element(1) X(2) Y(3) Z(4) の形式
-                # ...ですが、ORCA 5.0.4では Index Element X Y Z のようです。
-                # 確実性を高めるため、最後の3つを座標とし、その前を元素記号とします。
-                
-                atom = parts[-4] # 元素記号
-                x = float(parts[-3]) # X座標
-                y = float(parts[-2]) # Y座標
-                z = float(parts[-1]) # Z座標
-                
-                coord = [x, y, z]
-                atoms.append(atom)
-                coords.append(coord)
-                
-            except (ValueError, IndexError):
-                # ヘッダー行などをスキップ
-                continue
-        # ★★★ 修正点ここまで ★★★
+    # 成功時のフォーマット: Element X Y Z
+    # 失敗時のフォーマット: (Index) Element X Y Z → 最後の3つを座標とし、その前を元素記号とする
+    element_column = 0 if format_type == 'success' else -4
+    geometry = Geometry.from_atom_lines(coords_block.split('\n'), element_column=element_column)
     
-    if not atoms:
+    if not geometry.n_atoms:
         _orca_utils_logger.warning("No valid coordinates found in block")
-        return None, None
+        return None
     
-    return atoms, coords
+    return geometry
+
+
+def extract_results(output_path):
+    """
+    Parses the quantities stored in the results database from an ORCA output file.
+
+    Returns:
+        dict with keys 'final_energy', 'energies', 'geometry', 'frequencies',
+        'zpe', 'enthalpy', 'gibbs', 'wall_time' (missing values are None / empty lists),
+        or None if the output file does not exist.
+    """
+    output_path = Path(output_path)
+    if resolve_product_path(output_path) is None:
+        _orca_utils_logger.warning(f"Output file not found: {output_path}")
+        return None
+
+    with open_product_text(output_path) as f:
+        # 複合入力 (method ladder) では本計算の部分のみを対象にする
+        content = _last_job(f.read())
+
+    energies = [float(e) for e in _FINAL_ENERGY_PATTERN.findall(content)]
+    geometry = _find_final_structure(content, output_path.name)
+
+    # 振動数ブロックは最後に出力されたものを使用
+    frequencies = []
+    freq_start = content.rfind("VIBRATIONAL FREQUENCIES")
+    if freq_start != -1:
+        freq_end = content.find("NORMAL MODES", freq_start)
+        freq_block = content[freq_start:freq_end if freq_end != -1 else None]
+        frequencies = [float(v) for v in _FREQUENCY_LINE_PATTERN.findall(freq_block)]
+
+    results = {
+        'final_energy': energies[-1] if energies else None,
+        'energies': energies,
+        'geometry': geometry,
+        'frequencies': frequencies,
+        'wall_time': None,
+    }
+
+    for key, pattern in _THERMO_PATTERNS.items():
+        matches = pattern.findall(content)
+        results[key] = float(matches[-1]) if matches else None
+
+    match = _RUN_TIME_PATTERN.search(content)
+    if match:
+        days, hours, minutes, seconds, msec = (int(v) for v in match.groups())
+        results['wall_time'] = days * 86400 + hours * 3600 + minutes * 60 + seconds + msec / 1000.0
+
+    return results
+
+
+# --- CHECKPOINT / RESTART UTILITIES ---
+
+def find_checkpoint_files(work_dir, basename):
+    """
+    Finds the latest restart files left by an interrupted ORCA run in work_dir.
+
+    Returns:
+        dict: {'gbw', 'trj', 'xyz', 'opt'} -> Path or None.
+              'trj' is the optimization trajectory (<basename>_trj.xyz),
+              'xyz' is the current geometry written by ORCA (<basename>.xyz).
+    """
+    work_dir = Path(work_dir)
+
+    def _latest(pattern):
+        candidates = [p for p in work_dir.glob(pattern) if p.is_file() and p.stat().st_size > 0]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda p: p.stat().st_mtime)
+
+    return {
+        'gbw': _latest(f"{basename}*.gbw"),
+        'trj': _latest(f"{basename}*_trj.xyz"),
+        'xyz': _latest(f"{basename}.xyz"),
+        'opt': _latest(f"{basename}*.opt"),
+    }
+
+
+def read_last_xyz_frame(xyz_path):
+    """
+    Reads the last frame of a (multi-frame) XYZ file such as <basename>_trj.xyz.
+
+    Returns:
+        Geometry, or None if no complete frame is found
+    """
+    xyz_path = Path(xyz_path)
+    if not xyz_path.exists():
+        return None
+
+    with open(xyz_path, 'r', errors='ignore') as f:
+        lines = f.read().splitlines()
+
+    last_frame = None
+    i = 0
+    while i < len(lines):
+        try:
+            n_atoms = int(lines[i].strip())
+        except ValueError:
+            break
+        if i + 2 + n_atoms > len(lines):
+            break # 書き込み途中のフレームは無視
+        last_frame = (i + 2, i + 2 + n_atoms)
+        i += 2 + n_atoms
+
+    if last_frame is None:
+        return None
+
+    geometry = Geometry.from_atom_lines(lines[last_frame[0]:last_frame[1]])
+    return geometry if geometry.n_atoms else None
+
+
+def build_restart_input(inp_content, geometry=None, gbw_name=None, hess_name=None):
+    """
+    Rewrites an ORCA input so that it restarts from saved progress.
+
+    - geometry replaces the '* xyz' coordinate block (last optimization step)
+    - gbw_name adds MORead/%moinp to reuse the converged orbitals
+    - hess_name reads the optimizer Hessian from a previous .opt file
+    """
+    out_lines = []
+    in_coords = False
+    keyword_line_seen = False
+
+    for line in inp_content.splitlines():
+        stripped = line.strip()
+
+        if in_coords:
+            if stripped == '*':
+                in_coords = False
+                out_lines.append(line)
+            continue
+
+        if stripped.startswith('!') and not keyword_line_seen:
+            keyword_line_seen = True
+            out_lines.append(line)
+            if gbw_name:
+                out_lines.append('! MORead')
+                out_lines.append(f'%moinp "{gbw_name}"')
+            if hess_name:
+                out_lines.append(f'%geom InHess Read InHessName "{hess_name}" end')
+            continue
+
+        if stripped.lower().startswith('* xyz') and geometry is not None:
+            out_lines.append(line)
+            out_lines.extend(geometry.to_atom_lines())
+            in_coords = True
+            continue
+
+        out_lines.append(line)
+
+    return "\n".join(out_lines) + "\n"
 
 
 # --- PLOTTING UTILITIES ---
 
 def _get_energy_data(output_path):
     path = Path(output_path)
-    if not path.exists():
+    if resolve_product_path(path) is None:
         return []
-    with open(path, 'r', errors='ignore') as f:
+    with open_product_text(path) as f:
         content = f.read()
     
     energies = re.findall(r"E_(\d+)\s*=\s*([-\d\.]+)", content)
@@ -0,0 +1,327 @@
+# products_store.py
+import os
+import io
+import gzip
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from pipeline_utils import ensure_directory, atomic_writer
+
+# zstd 圧縮の条件付きインポート（無い場合は gzip を使用）
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+_products_logger = get_logger('products_store')
+
+# 圧縮形式ごとのファイル拡張子
+COMPRESSED_SUFFIXES = {'zstd': '.zst', 'gzip': '.gz'}
+
+# コピー/ハッシュ計算時のチャンクサイズ
+_CHUNK_SIZE = 1024 * 1024
+
+# ハードリンクできずにコピーした .gbw の記録 (共有オブジェクトと同じ場所の <digest>.copies)
+_COPIES_SUFFIX = '.copies'
+
+
+def resolve_product_path(path):
+    """
+    論理パス (例: products/mol/mol_opt.out) に対応する実ファイルを返す。
+    非圧縮 → .zst → .gz の順に探し、見つからなければ None を返す。
+    """
+    path = Path(path)
+    if path.exists():
+        return path
+    for suffix in ('.zst', '.gz'):
+        candidate = path.with_name(path.name + suffix)
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def open_product_text(path):
+    """
+    論理パスのファイルをテキストモードで開く。圧縮されていれば透過的に展開する。
+    ファイルが存在しない場合は FileNotFoundError を送出する。
+    """
+    actual = resolve_product_path(path)
+    if actual is None:
+        raise FileNotFoundError(f"Product file not found: {path}")
+
+    if actual.suffix == '.gz':
+        return gzip.open(actual, 'rt', errors='ignore')
+    if actual.suffix == '.zst':
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError(f"zstandard is required to read {actual.name}")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(actual, 'rb'), closefd=True)
+        return io.TextIOWrapper(reader, errors='ignore')
+    return open(actual, 'r', errors='ignore')
+
+
+class ProductsStore:
+    """
+    products_dir への結果保存を担当するクラス。
+    .out は圧縮して保存し、.gbw は内容ハッシュでアドレス指定した共有オブジェクトへの
+    ハードリンクとして保存する (同一内容の .gbw はディスク上で1つだけになる)。
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.logger = _products_logger
+        self.products_dir = Path(config['paths']['products_dir'])
+        self.objects_dir = self.products_dir / '.objects'
+
+        compression = config.get('products', 'compression', fallback='gzip').strip().lower()
+        if compression == 'zstd' and not ZSTD_AVAILABLE:
+            self.logger.warning("zstandard not available. Falling back to gzip compression.")
+            compression = 'gzip'
+        if compression not in ('zstd', 'gzip', 'none'):
+            self.logger.warning(f"Unknown products compression '{compression}', defaulting to gzip.")
+            compression = 'gzip'
+        self.compression = compression
+
+        # 保持ポリシー (0 は無制限)
+        self.retention_days = config.getfloat('products', 'retention_days', fallback=0)
+        self.max_object_bytes = int(config.getfloat('products', 'max_gbw_gb', fallback=0) * 1024 ** 3)
+        self.prune_interval = config.getint('products', 'prune_interval_minutes', fallback=60) * 60
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+
+    # --- 保存 ---
+    def store_output(self, src_path, mol_name):
+        """
+        .out ファイルをストリーミング圧縮して products_dir/<mol>/ に保存する。
+        Returns: 論理パス (圧縮拡張子を含まない products_dir/<mol>/<name>.out)
+        """
+        src_path = Path(src_path)
+        mol_dir = self.products_dir / mol_name
+        ensure_directory(mol_dir)
+        logical_path = mol_dir / src_path.name
+
+        # 以前の保存形式のファイルが残っていれば削除 (読み出し時の取り違え防止)
+        for suffix in ('', '.gz', '.zst'):
+            logical_path.with_name(logical_path.name + suffix).unlink(missing_ok=True)
+
+        suffix = COMPRESSED_SUFFIXES.get(self.compression, '')
+        target = logical_path.with_name(logical_path.name + suffix)
+
+        with open(src_path, 'rb') as src, atomic_writer(target, 'wb') as raw:
+            if self.compression == 'zstd':
+                with zstandard.ZstdCompressor(level=10).stream_writer(raw, closefd=False) as dst:
+                    shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+            elif self.compression == 'gzip':
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as dst:
+                    shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+            else:
+                shutil.copyfileobj(src, raw, _CHUNK_SIZE)
+
+        return logical_path
+
+    def store_gbw(self, src_path, mol_name):
+        """
+        .gbw ファイルを内容ハッシュ (SHA-256) で共有オブジェクトとして保存し、
+        products_dir/<mol>/<name>.gbw にハードリンクする。
+        ハードリンクできない場合はコピーし、オブジェクトの .copies に記録する
+        (コピーも参照として数え、prune で共有オブジェクトが削除されないようにする)。
+        Returns: products_dir/<mol>/<name>.gbw
+        """
+        src_path = Path(src_path)
+        digest = self._hash_file(src_path)
+        object_path = self.objects_dir / digest[:2] / f"{digest}.gbw"
+
+        mol_dir = self.products_dir / mol_name
+        ensure_directory(mol_dir)
+        link_path = mol_dir / src_path.name
+
+        # prune と並行して、削除中のオブジェクトにリンクしないようにする
+        with self._lock:
+            if not object_path.exists():
+                with open(src_path, 'rb') as src, atomic_writer(object_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+            else:
+                self.logger.info(f"Deduplicated {src_path.name} (object {digest[:12]})")
+
+            link_path.unlink(missing_ok=True)
+            try:
+                os.link(object_path, link_path)
+            except OSError:
+                # ハードリンク不可 (別ファイルシステム等) の場合は通常コピー
+                with open(object_path, 'rb') as src, atomic_writer(link_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+                self._record_copy(object_path, link_path)
+
+        return link_path
+
+    def _record_copy(self, object_path, copy_path):
+        """コピーの inode と products_dir からの相対パスを <digest>.copies に追記する (ロックを保持して呼ぶ)。"""
+        manifest = object_path.with_suffix(_COPIES_SUFFIX)
+        copies = [line for line in self._read_copies(object_path) if line[1] != copy_path]
+        copies.append((copy_path.stat().st_ino, copy_path))
+        with atomic_writer(manifest, 'w') as f:
+            for ino, path in copies:
+                f.write(f"{ino}\t{path.relative_to(self.products_dir)}\n")
+
+    def _read_copies(self, object_path):
+        """Returns: まだ存在するコピーの (inode, パス) のリスト (置き換えられたコピーは除く)"""
+        manifest = object_path.with_suffix(_COPIES_SUFFIX)
+        copies = []
+        try:
+            with open(manifest, 'r') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return copies
+        for line in lines:
+            ino, _, relative = line.partition('\t')
+            path = self.products_dir / relative
+            try:
+                if relative and path.stat().st_ino == int(ino):
+                    copies.append((int(ino), path))
+            except (OSError, ValueError):
+                continue
+        return copies
+
+    @staticmethod
+    def _hash_file(path):
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    # --- 保持ポリシー ---
+    def maybe_prune(self):
+        """前回の実行から prune_interval 以上経過していれば prune を実行する。"""
+        now = time.time()
+        if now - self._last_prune < self.prune_interval:
+            return 0
+        self._last_prune = now
+        return self.prune()
+
+    def prune(self, retention_days=None, max_object_bytes=None):
+        """
+        中間ファイル (.gbw) を保持ポリシーに従って削除する。
+        Molden 変換済み (または変換失敗済み) のリンクのみが対象で、未変換のリンクは残す。
+        1. retention_days を超えたリンク
+        2. 共有オブジェクトの合計が max_object_bytes を超える場合は、古いリンクから順に
+        3. どこからも参照されなくなった共有オブジェクト
+        Returns: 解放したバイト数
+        """
+        retention_days = self.retention_days if retention_days is None else retention_days
+        max_object_bytes = self.max_object_bytes if max_object_bytes is None else max_object_bytes
+
+        with self._lock:
+            # オブジェクトのサイズと参照数は1回の走査で求め、以降はリンクの削除に合わせて更新する
+            objects, by_inode = self._collect_objects()
+            links = [link for link in self._collect_gbw_links() if self._is_processed(link[0])]
+            now = time.time()
+            freed = 0
+
+            if retention_days:
+                cutoff = now - retention_days * 86400
+                expired = [link for link in links if link[1] < cutoff]
+                for link in expired:
+                    freed += self._remove_link(link, by_inode)
+                links = [link for link in links if link[1] >= cutoff]
+
+            freed += self._collect_garbage(objects)
+
+            if max_object_bytes:
+                total = sum(obj.size for obj in objects if obj.refs > 0)
+                for link in sorted(links, key=lambda item: item[1]):
+                    if total <= max_object_bytes:
+                        break
+                    released = self._remove_link(link, by_inode)
+                    total -= released
+                    freed += released
+
+        if freed:
+            self.logger.info(f"Pruned products store: freed {freed / 1024 ** 2:.1f} MiB")
+        return freed
+
+    @staticmethod
+    def _is_processed(link_path):
+        """Molden への変換が済んだ (または失敗した) .gbw か。"""
+        base = link_path.with_suffix('')
+        return (base.with_name(base.name + '.molden.input').exists() or
+                base.with_name(base.name + '.molden_failed').exists())
+
+    def _collect_gbw_links(self):
+        """Returns: [(リンクのパス, mtime, (st_dev, st_ino))]"""
+        links = []
+        if not self.products_dir.is_dir():
+            return links
+        with os.scandir(self.products_dir) as mol_entries:
+            for mol_entry in mol_entries:
+                if not mol_entry.is_dir() or mol_entry.name == self.objects_dir.name:
+                    continue
+                with os.scandir(mol_entry.path) as entries:
+                    for entry in entries:
+                        if entry.name.endswith('.gbw') and entry.is_file():
+                            stat = entry.stat()
+                            links.append((Path(entry.path), stat.st_mtime, (stat.st_dev, stat.st_ino)))
+        return links
+
+    def _iter_objects(self):
+        if not self.objects_dir.is_dir():
+            return
+        for bucket in os.scandir(self.objects_dir):
+            if bucket.is_dir():
+                for entry in os.scandir(bucket.path):
+                    if entry.name.endswith('.gbw') and entry.is_file():
+                        yield entry
+
+    def _collect_objects(self):
+        """
+        共有オブジェクトのサイズと参照数 (ハードリンク + 記録されたコピー) を集める。
+        Returns: (オブジェクトのリスト, {リンク/コピーの (st_dev, st_ino): オブジェクト})
+        """
+        objects = []
+        by_inode = {}
+        for entry in self._iter_objects():
+            stat = entry.stat()
+            obj = _StoredObject(Path(entry.path), stat.st_size, stat.st_nlink - 1)
+            objects.append(obj)
+            by_inode[(stat.st_dev, stat.st_ino)] = obj
+            for ino, copy_path in self._read_copies(obj.path):
+                obj.refs += 1
+                by_inode[(copy_path.stat().st_dev, ino)] = obj
+        return objects, by_inode
+
+    def _remove_link(self, link, by_inode):
+        """リンク (またはコピー) を削除し、最後の参照だった共有オブジェクトも削除する。Returns: 解放したバイト数"""
+        link_path, _, inode = link
+        link_path.unlink(missing_ok=True)
+        obj = by_inode.get(inode)
+        if obj is None:
+            return 0
+        obj.refs -= 1
+        return self._delete_object(obj) if obj.refs <= 0 else 0
+
+    def _collect_garbage(self, objects):
+        """参照されていない (リンク数が1でコピーも無い) オブジェクトを削除する。"""
+        return sum(self._delete_object(obj) for obj in objects if obj.refs <= 0 and not obj.deleted)
+
+    def _delete_object(self, obj):
+        obj.deleted = True
+        obj.path.unlink(missing_ok=True)
+        obj.path.with_suffix(_COPIES_SUFFIX).unlink(missing_ok=True)
+        return obj.size
+
+
+class _StoredObject:
+    """prune 中の共有オブジェクトのサイズと参照数。"""
+
+    __slots__ = ('path', 'size', 'refs', 'deleted')
+
+    def __init__(self, path, size, refs):
+        self.path = path
+        self.size = size
+        self.refs = refs
+        self.deleted = False
@@ -0,0 +1,149 @@
+# resource_tuner.py
+import os
+import math
+import time
+import threading
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from resource_usage import ResourceUsageStats, size_bucket
+
+_tuner_logger = get_logger('resource_tuner')
+
+# 元素 -> 周期 (これ以降の元素は第5周期として扱う)
+_PERIODS = {}
+for _period, _symbols in enumerate((
+    ('H', 'He'),
+    ('Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne'),
+    ('Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar'),
+    ('K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr'),
+), start=1):
+    for _symbol in _symbols:
+        _PERIODS[_symbol] = _period
+
+# 基底関数系 -> 周期ごとの1原子あたりの基底関数の数 (球面調和関数、第1..5周期の概数)
+BASIS_FUNCTIONS_PER_ATOM = {
+    'sto-3g': (1, 5, 9, 18, 27),
+    '6-31g': (2, 9, 13, 22, 30),
+    '6-31g*': (2, 15, 19, 28, 36),
+    '6-31g**': (5, 15, 19, 28, 36),
+    '6-311g**': (6, 18, 22, 32, 40),
+    'def2-svp': (5, 14, 18, 27, 30),
+    'def2-svpd': (6, 19, 23, 32, 36),
+    'def2-tzvp': (6, 31, 37, 50, 55),
+    'def2-tzvpp': (14, 31, 37, 50, 55),
+    'def2-qzvp': (30, 55, 63, 90, 95),
+    'cc-pvdz': (5, 14, 18, 27, 30),
+    'cc-pvtz': (14, 30, 34, 59, 64),
+    'cc-pvqz': (30, 55, 59, 100, 105),
+}
+_BASIS_ALIASES = {'6-31g(d)': '6-31g*', '6-31g(d,p)': '6-31g**', '6-311g(d,p)': '6-311g**'}
+_DEFAULT_BASIS = 'def2-svp'
+
+
+def estimate_basis_functions(elements, basis):
+    """元素ごとの基底関数の数を数え上げ、分子全体の基底関数の数を概算する。"""
+    key = (basis or _DEFAULT_BASIS).strip().lower()
+    key = _BASIS_ALIASES.get(key, key)
+    per_period = BASIS_FUNCTIONS_PER_ATOM.get(key)
+    if per_period is None:
+        # 未知の基底は def2-SVP 相当として扱う (ma-/aug- 等の修飾は1.3倍)
+        base = key.replace('ma-', '').replace('aug-', '')
+        per_period = BASIS_FUNCTIONS_PER_ATOM.get(base, BASIS_FUNCTIONS_PER_ATOM[_DEFAULT_BASIS])
+        if base != key:
+            per_period = tuple(int(n * 1.3) for n in per_period)
+
+    counts = {}
+    for symbol in elements:
+        counts[symbol] = counts.get(symbol, 0) + 1
+    return sum(per_period[_PERIODS.get(symbol.capitalize(), 5) - 1] * n for symbol, n in counts.items())
+
+
+def find_basis(keywords):
+    """'!' 行のキーワードから既知の基底関数系を探す (見つからなければ None)。"""
+    for token in keywords:
+        key = token.strip().lower()
+        if key in BASIS_FUNCTIONS_PER_ATOM or key in _BASIS_ALIASES:
+            return token
+    return None
+
+
+def _node_memory_mb():
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class ResourceTuner:
+    """
+    ジョブごとに %pal nprocs と %maxcore を決めるクラス ([tuning] enabled = true の場合)。
+
+    - 基底関数の数 (元素数 × 基底関数系) から、コア数とコアあたりのメモリを見積もる
+    - 同じ分子サイズ・計算タイプの完了ジョブの実績 (resource_usage) が十分にあればそれを優先する
+    - いずれもノードの上限 (max_nprocs、ノードのメモリ / max_parallel_jobs) 内に収める
+
+    選んだ値は .inp に書かれ、実行後の resource_usage に記録されるため、実績とともに推定が改善される。
+    """
+
+    def __init__(self, config, state_store=None):
+        self.config = config
+        self.logger = _tuner_logger
+        self.enabled = config.getboolean('tuning', 'enabled', fallback=False)
+        self.default_nprocs = config.getint('orca', 'nprocs', fallback=1)
+        self.default_maxcore = config.getint('orca', 'maxcore', fallback=2000)
+        self.min_nprocs = max(1, config.getint('tuning', 'min_nprocs', fallback=1))
+        self.max_nprocs = max(self.min_nprocs, config.getint('tuning', 'max_nprocs', fallback=self.default_nprocs))
+        self.basis_functions_per_core = config.getint('tuning', 'basis_functions_per_core', fallback=150)
+        self.min_maxcore = config.getint('tuning', 'min_maxcore_mb', fallback=500)
+        # 基底関数の数の2乗あたりのメモリ (バイト)。SCF の行列・積分バッファの大きさの目安
+        self.bytes_per_bf2 = config.getfloat('tuning', 'memory_bytes_per_bf2', fallback=128.0)
+
+        max_parallel = max(1, config.getint('orca', 'max_parallel_jobs', fallback=1))
+        node_memory = config.getint('tuning', 'node_memory_mb', fallback=_node_memory_mb() or 0)
+        # ORCA の実メモリは maxcore の約1.25倍になるため、その分を見込んで並列ジョブで等分する
+        self.job_memory_cap = int(node_memory * 0.9 / max_parallel / 1.25) if node_memory else None
+
+        self.usage_stats = ResourceUsageStats(state_store) if state_store is not None else None
+        self.history_ttl = config.getfloat('tuning', 'history_refresh_seconds', fallback=300.0)
+        self._history = {}
+        self._history_lock = threading.Lock()
+
+    def choose(self, geometry, calc_type=None, basis=None):
+        """
+        Returns: {'nprocs', 'maxcore', 'basis_functions', 'source'}。無効な場合は None
+        """
+        if not self.enabled:
+            return None
+
+        basis_functions = estimate_basis_functions(geometry.elements, basis or self.config['orca'].get('basis'))
+        nprocs = math.ceil(basis_functions / max(1, self.basis_functions_per_core))
+        maxcore = math.ceil(basis_functions ** 2 * self.bytes_per_bf2 / (1024 * 1024) / 100.0) * 100
+        source = 'model'
+
+        history = self._history_suggestion(geometry.n_atoms, calc_type)
+        if history:
+            nprocs = history.get('nprocs', nprocs)
+            maxcore = history.get('maxcore', maxcore)
+            source = 'history'
+
+        nprocs = min(self.max_nprocs, max(self.min_nprocs, nprocs))
+        maxcore = max(self.min_maxcore, maxcore)
+        if self.job_memory_cap:
+            maxcore = max(self.min_maxcore, min(maxcore, self.job_memory_cap // nprocs))
+        return {'nprocs': nprocs, 'maxcore': maxcore, 'basis_functions': basis_functions, 'source': source}
+
+    def _history_suggestion(self, n_atoms, calc_type):
+        """StateStore の集計は全ジョブを走査するため、区分ごとに history_ttl 秒キャッシュする。"""
+        if self.usage_stats is None:
+            return None
+        key = (size_bucket(n_atoms), calc_type)
+        now = time.monotonic()
+        with self._history_lock:
+            cached = self._history.get(key)
+            if cached is not None and now - cached[0] < self.history_ttl:
+                return cached[1]
+        suggestion = self.usage_stats.suggest(n_atoms, calc_type, max_nprocs=self.max_nprocs)
+        with self._history_lock:
+            self._history[key] = (now, suggestion)
+        return suggestion
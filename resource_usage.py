@@ -0,0 +1,400 @@
+# resource_usage.py
+import os
+import re
+import sys
+import math
+import time
+import threading
+from pathlib import Path
+from statistics import median
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+
+_usage_logger = get_logger('resource_usage')
+
+# /proc によるプロセスツリーのサンプリングは Linux のみ
+PROC_AVAILABLE = os.path.isdir('/proc/self')
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+# ru_maxrss の単位は Linux では KB、macOS では bytes
+_MAXRSS_TO_MB = 1.0 / (1024 * 1024) if sys.platform == 'darwin' else 1.0 / 1024
+
+# 分子サイズ (原子数) の区分の上限
+SIZE_BUCKETS = (10, 25, 50, 100, 200)
+
+# 推奨値を出すのに必要な完了ジョブ数
+MIN_SAMPLES = 5
+
+_PAL_PATTERN = re.compile(r"%pal\s+nprocs\s+(\d+)", re.IGNORECASE)
+_MAXCORE_PATTERN = re.compile(r"%maxcore\s+(\d+)", re.IGNORECASE)
+# パック実行の記録のうち、メンバーで等分する量
+_SHARED_USAGE_FIELDS = ('wall_seconds', 'cpu_user_seconds', 'cpu_system_seconds')
+
+
+def size_bucket(n_atoms):
+    """原子数を '1-10', '11-25', ..., '>200' の区分名にする。"""
+    if n_atoms is None:
+        return 'unknown'
+    lower = 1
+    for upper in SIZE_BUCKETS:
+        if n_atoms <= upper:
+            return f"{lower}-{upper}"
+        lower = upper + 1
+    return f">{SIZE_BUCKETS[-1]}"
+
+
+def read_inp_resources(inp_path):
+    """.inp の %pal nprocs と %maxcore を読む。Returns: (nprocs, maxcore)、記述が無ければ None"""
+    try:
+        text = Path(inp_path).read_text(errors='ignore')
+    except OSError:
+        return None, None
+    pal = _PAL_PATTERN.search(text)
+    maxcore = _MAXCORE_PATTERN.search(text)
+    return (int(pal.group(1)) if pal else None), (int(maxcore.group(1)) if maxcore else None)
+
+
+def wait_with_rusage(process):
+    """
+    Popen の終了を os.wait4 で待ち、(returncode, rusage) を返す。
+    rusage には ORCA が待ち合わせた子プロセス (MPI のランク) の分も含まれる。
+    os.wait4 が使えない環境では rusage は None。
+    """
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # 他の場所で回収済み
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, rusage
+
+
+class ProcessTreeSampler:
+    """
+    実行中の ORCA のプロセスツリー (mpirun と各ランク) を /proc から定期的にサンプリングし、
+    CPU 使用コア数、ツリー全体のピーク RSS、I/O バイト数を記録する。
+    """
+
+    def __init__(self, pid, interval=5.0):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_cores = 0.0
+        self.samples = 0
+        # pid -> 最後に観測した (cpu ticks, read_bytes, write_bytes)。終了したプロセスの分も残す
+        self._last_seen = {}
+        self._previous = None
+        self._stop = threading.Event()
+        self._thread = None
+        # sample() と summary() の排他 (SharedProcessSampler では別スレッドから呼ばれる)
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not PROC_AVAILABLE or self.interval <= 0:
+            return self
+        self._thread = threading.Thread(target=self._run, name=f'usage-sampler-{self.pid}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """サンプリングを止め、集計結果を返す。"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        return self.summary()
+
+    def summary(self):
+        """これまでのサンプリングの集計結果 (サンプルが無ければ空の辞書)。"""
+        with self._lock:
+            if not self.samples:
+                return {}
+            read_bytes = sum(seen[1] for seen in self._last_seen.values())
+            write_bytes = sum(seen[2] for seen in self._last_seen.values())
+            return {
+                'peak_tree_rss_mb': round(self.peak_rss / (1024 * 1024), 1),
+                'peak_cpu_cores': round(self.peak_cores, 2),
+                'read_mb': round(read_bytes / (1024 * 1024), 1),
+                'write_mb': round(write_bytes / (1024 * 1024), 1),
+                'samples': self.samples,
+            }
+
+    def _run(self):
+        self.sample()
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        with self._lock:
+            self._sample()
+
+    def _sample(self):
+        now = time.monotonic()
+        rss_total = 0
+        for pid in self._tree_pids():
+            stat = self._read_stat(pid)
+            if stat is None:
+                continue
+            ticks, rss_pages = stat
+            read_bytes, write_bytes = self._read_io(pid)
+            self._last_seen[pid] = (ticks, read_bytes, write_bytes)
+            rss_total += rss_pages * _PAGE_SIZE
+        if rss_total == 0:
+            return
+
+        cpu_ticks = sum(seen[0] for seen in self._last_seen.values())
+        if self._previous is not None:
+            elapsed = now - self._previous[0]
+            if elapsed > 0:
+                cores = (cpu_ticks - self._previous[1]) / _CLOCK_TICKS / elapsed
+                self.peak_cores = max(self.peak_cores, cores)
+        self._previous = (now, cpu_ticks)
+        self.peak_rss = max(self.peak_rss, rss_total)
+        self.samples += 1
+
+    def _tree_pids(self):
+        pids, pending = [], [self.pid]
+        while pending:
+            pid = pending.pop()
+            pids.append(pid)
+            try:
+                for task in os.listdir(f"/proc/{pid}/task"):
+                    with open(f"/proc/{pid}/task/{task}/children") as f:
+                        pending.extend(int(child) for child in f.read().split())
+            except (OSError, ValueError):
+                continue
+        return pids
+
+    @staticmethod
+    def _read_stat(pid):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # comm (2番目の欄) は空白を含み得るため ')' の後ろから数える
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            return None
+        # utime, stime は 14, 15 番目、rss は 24 番目の欄
+        return int(fields[11]) + int(fields[12]), int(fields[21])
+
+    @staticmethod
+    def _read_io(pid):
+        read_bytes = write_bytes = 0
+        try:
+            with open(f"/proc/{pid}/io") as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key == 'read_bytes':
+                        read_bytes = int(value)
+                    elif key == 'write_bytes':
+                        write_bytes = int(value)
+        except (OSError, ValueError):
+            pass
+        return read_bytes, write_bytes
+
+
+class SharedProcessSampler:
+    """
+    複数の ORCA のプロセスツリーを1つのスレッドでサンプリングする (asyncio バックエンド用)。
+    ジョブごとにスレッドを作らず、remove() はスレッドを待ち合わせないためイベントループから呼べる。
+    """
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self._samplers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, pid):
+        """pid のプロセスツリーを次の周期からサンプリングする。Returns: ProcessTreeSampler"""
+        sampler = ProcessTreeSampler(pid, self.interval)
+        if not PROC_AVAILABLE or self.interval <= 0:
+            return sampler
+        with self._lock:
+            self._samplers.add(sampler)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='usage-sampler', daemon=True)
+                self._thread.start()
+        return sampler
+
+    def remove(self, sampler):
+        """サンプリングをやめ、集計結果を返す。"""
+        with self._lock:
+            self._samplers.discard(sampler)
+        return sampler.summary()
+
+    def _run(self):
+        while True:
+            # interval は設定の再読み込みで変わり得る (0 以下の間は新しいジョブを登録しない)
+            time.sleep(self.interval if self.interval > 0 else 1.0)
+            with self._lock:
+                samplers = list(self._samplers)
+            for sampler in samplers:
+                sampler.sample()
+
+
+def build_usage_record(wall_seconds, rusage=None, sampled=None, nprocs=None, maxcore=None, n_atoms=None):
+    """StateStore のジョブに 'resource_usage' として保存する辞書を作る。"""
+    record = {
+        'wall_seconds': round(wall_seconds, 2),
+        'nprocs': nprocs,
+        'maxcore': maxcore,
+        'n_atoms': n_atoms,
+    }
+    cpu_seconds = None
+    if rusage is not None:
+        cpu_seconds = rusage.ru_utime + rusage.ru_stime
+        record.update({
+            'cpu_user_seconds': round(rusage.ru_utime, 2),
+            'cpu_system_seconds': round(rusage.ru_stime, 2),
+            # 単一プロセスの最大 RSS (ランクごとの最大値)
+            'max_rss_mb': round(rusage.ru_maxrss * _MAXRSS_TO_MB, 1),
+            'major_page_faults': rusage.ru_majflt,
+        })
+    if sampled:
+        record.update(sampled)
+
+    if cpu_seconds is not None and wall_seconds > 0:
+        record['cpu_cores_used'] = round(cpu_seconds / wall_seconds, 2)
+        if nprocs:
+            record['cpu_efficiency'] = round(cpu_seconds / (wall_seconds * nprocs), 3)
+
+    peak_mb = peak_memory_mb(record)
+    if peak_mb is not None and nprocs and maxcore:
+        # ORCA に許した作業メモリ (nprocs × maxcore) をほぼ使い切っているか
+        record['memory_bound'] = peak_mb >= 0.9 * nprocs * maxcore
+    return record
+
+
+def packed_usage_record(record, members, n_atoms=None):
+    """
+    パック実行 (1つの ORCA プロセスで members 個のジョブを順に実行) の記録から1ジョブ分の記録を作る。
+    時間はジョブ数で等分し、メモリ・効率はパック全体の値のまま 'packed_jobs' とともに記録する。
+    """
+    share = dict(record, n_atoms=n_atoms, packed_jobs=members)
+    for field in _SHARED_USAGE_FIELDS:
+        if share.get(field) is not None:
+            share[field] = round(share[field] / members, 2)
+    return share
+
+
+def peak_memory_mb(record):
+    """
+    ジョブ全体のピークメモリ [MB]。サンプリング間隔より短いピークを逃さないよう ru_maxrss とも比べ、
+    サンプリングが無ければ ru_maxrss × nprocs で近似する。
+    """
+    tree = record.get('peak_tree_rss_mb')
+    single = record.get('max_rss_mb')
+    if single is None:
+        return tree
+    if not tree:
+        return single * (record.get('nprocs') or 1)
+    return max(tree, single)
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+class ResourceUsageStats:
+    """
+    StateStore に記録された resource_usage を分子サイズの区分ごとに集計し、
+    %pal nprocs / %maxcore の推奨値を求める。
+    """
+
+    def __init__(self, state_store, logger=None):
+        self.state_store = state_store
+        self.logger = logger or _usage_logger
+
+    def records(self, calc_type=None):
+        """完了したジョブの (区分, resource_usage) を返す。"""
+        found = []
+        for _, job_info in self.state_store.items():
+            usage = job_info.get('resource_usage')
+            # パック実行の記録は等分した推定値のため、推奨値の根拠にしない
+            if not usage or usage.get('packed_jobs') or job_info.get('status') != 'COMPLETED':
+                continue
+            if calc_type is not None and job_info.get('calc_type') != calc_type:
+                continue
+            found.append((size_bucket(usage.get('n_atoms')), usage))
+        return found
+
+    def summary(self, calc_type=None):
+        """区分ごとの集計 {区分: {...}}"""
+        groups = {}
+        for bucket, usage in self.records(calc_type):
+            groups.setdefault(bucket, []).append(usage)
+
+        summary = {}
+        for bucket, usages in groups.items():
+            efficiencies = [u['cpu_efficiency'] for u in usages if u.get('cpu_efficiency') is not None]
+            peaks = [peak_memory_mb(u) for u in usages if peak_memory_mb(u) is not None]
+            summary[bucket] = {
+                'jobs': len(usages),
+                'median_wall_seconds': round(median(u['wall_seconds'] for u in usages), 1),
+                'median_cpu_efficiency': round(median(efficiencies), 3) if efficiencies else None,
+                'p95_peak_memory_mb': round(_percentile(peaks, 0.95), 1) if peaks else None,
+                'memory_bound_jobs': sum(1 for u in usages if u.get('memory_bound')),
+            }
+        return summary
+
+    def suggest(self, n_atoms, calc_type=None, max_nprocs=None):
+        """
+        同じ区分の完了ジョブの実績から {'nprocs': N, 'maxcore': MB} を推奨する。
+        実績が MIN_SAMPLES 件未満の場合は None。
+        - nprocs: 平均使用コア数の75パーセンタイルを効率80%で割った値 (max_nprocs 以下)
+        - maxcore: コアあたりのピークメモリの95パーセンタイルに25%の余裕を加えた値 (100MB単位)
+        """
+        bucket = size_bucket(n_atoms)
+        usages = [u for b, u in self.records(calc_type) if b == bucket]
+        if len(usages) < MIN_SAMPLES:
+            return None
+
+        suggestion = {}
+        cores_used = [u['cpu_cores_used'] for u in usages if u.get('cpu_cores_used') is not None]
+        if len(cores_used) >= MIN_SAMPLES:
+            nprocs = max(1, math.ceil(_percentile(cores_used, 0.75) / 0.8))
+            suggestion['nprocs'] = min(nprocs, max_nprocs) if max_nprocs else nprocs
+
+        per_core = [peak_memory_mb(u) / u['nprocs'] for u in usages
+                    if peak_memory_mb(u) is not None and u.get('nprocs')]
+        if len(per_core) >= MIN_SAMPLES:
+            suggestion['maxcore'] = max(256, int(math.ceil(_percentile(per_core, 0.95) * 1.25 / 100.0)) * 100)
+
+        return suggestion or None
+
+    def log_summary(self, config):
+        """起動時に、区分ごとの実績と設定値との差を記録する。"""
+        summary = self.summary()
+        if not summary:
+            return
+        nprocs = config.getint('orca', 'nprocs', fallback=1)
+        maxcore = config.getint('orca', 'maxcore', fallback=2000)
+        for bucket in sorted(summary, key=_bucket_order):
+            stats = summary[bucket]
+            line = (
+                f"Resource usage [{bucket} atoms]: {stats['jobs']} jobs, "
+                f"median wall {stats['median_wall_seconds']}s, "
+                f"median CPU efficiency {stats['median_cpu_efficiency']}, "
+                f"p95 peak memory {stats['p95_peak_memory_mb']} MB, "
+                f"memory-bound {stats['memory_bound_jobs']}"
+            )
+            representative = SIZE_BUCKETS[-1] + 1 if bucket.startswith('>') else (
+                int(bucket.split('-')[1]) if '-' in bucket else None)
+            suggestion = self.suggest(representative, max_nprocs=nprocs)
+            if suggestion and (suggestion.get('nprocs', nprocs) != nprocs or
+                               suggestion.get('maxcore', maxcore) != maxcore):
+                line += (f" -> suggested nprocs={suggestion.get('nprocs', nprocs)}, "
+                         f"maxcore={suggestion.get('maxcore', maxcore)} "
+                         f"(configured {nprocs}/{maxcore})")
+            self.logger.info(line)
+
+
+def _bucket_order(bucket):
+    if bucket.startswith('>'):
+        return SIZE_BUCKETS[-1] + 1
+    if '-' in bucket:
+        return int(bucket.split('-')[0])
+    return sys.maxsize
@@ -0,0 +1,185 @@
+# results_db.py
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from pipeline_utils import ensure_directory
+from geometry import Geometry
+
+_results_logger = get_logger('results_db')
+
+# 配列は little-endian float64 の BLOB として保存する
+_FLOAT_DTYPE = np.dtype('<f8')
+
+# スカラー列 (load_energies で取得可能な列)
+SCALAR_FIELDS = ('final_energy', 'zpe', 'enthalpy', 'gibbs', 'wall_time', 'n_atoms')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id       TEXT,  -- StateStore のキー (元の .inp のパス)
+    molecule     TEXT NOT NULL,
+    calc_type    TEXT NOT NULL,
+    final_energy REAL,
+    zpe          REAL,
+    enthalpy     REAL,
+    gibbs        REAL,
+    wall_time    REAL,
+    n_atoms      INTEGER,
+    elements     TEXT,
+    coords       BLOB,
+    energies     BLOB,
+    frequencies  BLOB,
+    created      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_mol_calc ON results (molecule, calc_type, id);
+CREATE INDEX IF NOT EXISTS idx_results_calc ON results (calc_type, id);
+"""
+
+
+def default_results_db_path(config):
+    """設定ファイルの [paths] results_db、未指定なら state_dir/results.sqlite を返す。"""
+    state_dir = Path(config['paths'].get('state_dir', 'folders/state'))
+    return Path(config['paths'].get('results_db', str(state_dir / 'results.sqlite')))
+
+
+def _to_blob(values):
+    return np.asarray(values, dtype=_FLOAT_DTYPE).tobytes()
+
+
+def _from_blob(blob, shape=(-1,)):
+    if blob is None:
+        return np.empty(0, dtype=np.float64)
+    return np.frombuffer(blob, dtype=_FLOAT_DTYPE).reshape(shape)
+
+
+class ResultsDatabase:
+    """
+    計算結果 (最終エネルギー、エネルギー推移、最終構造、振動数、熱化学量、実行時間) を
+    SQLite に追記専用で保存し、NumPy 配列として一括で読み出すためのクラス。
+    同じ分子/計算タイプが複数回記録された場合は、最新の行が有効となる。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        ensure_directory(self.db_path.parent)
+        self.logger = _results_logger
+        self._lock = threading.Lock()
+        # (calc_type, field) -> 列キャッシュ (load_energies 用)
+        self._column_cache = {}
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- 書き込み ---
+    def record(self, job_id, molecule, calc_type, results):
+        """extract_results の戻り値を1行として追記する。"""
+        geometry = results.get('geometry')
+        frequencies = results.get('frequencies') or []
+        energies = results.get('energies') or []
+
+        row = (
+            job_id, molecule, calc_type,
+            results.get('final_energy'), results.get('zpe'), results.get('enthalpy'),
+            results.get('gibbs'), results.get('wall_time'),
+            geometry.n_atoms if geometry is not None else 0,
+            " ".join(geometry.elements.tolist()) if geometry is not None else "",
+            _to_blob(geometry.coords) if geometry is not None else None,
+            _to_blob(energies) if energies else None,
+            _to_blob(frequencies) if frequencies else None,
+            time.time(),
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO results (job_id, molecule, calc_type, final_energy, zpe, enthalpy, "
+                "gibbs, wall_time, n_atoms, elements, coords, energies, frequencies, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row
+            )
+            self._conn.commit()
+
+    # --- 読み出し ---
+    def load_energies(self, calc_type='opt', molecules=None, field='final_energy'):
+        """
+        指定した計算タイプの最新結果から、スカラー列をベクトルとして読み出す。
+        列はメモリ上にキャッシュされ、2回目以降は前回以降に追記された行のみを読み込む。
+
+        Returns:
+            tuple: (molecules ndarray[str], values ndarray[float64]) 値が無い場合は NaN
+        """
+        if field not in SCALAR_FIELDS:
+            raise ValueError(f"Unknown field '{field}'. Choose from {SCALAR_FIELDS}.")
+
+        with self._lock:
+            names, values = self._refresh_column(calc_type, field)
+
+        if molecules is not None:
+            mask = np.isin(names, np.asarray(list(molecules), dtype=str))
+            return names[mask], values[mask]
+        return names, values
+
+    def _refresh_column(self, calc_type, field):
+        """(calc_type, field) の列キャッシュを差分更新し、(names, values) を返す。_lock 保持中に呼ぶこと。"""
+        cache = self._column_cache.get((calc_type, field))
+        if cache is None:
+            cache = {'last_id': 0, 'index': {}, 'names': [], 'values': [], 'arrays': None}
+            self._column_cache[(calc_type, field)] = cache
+
+        rows = self._conn.execute(
+            f"SELECT id, molecule, {field} FROM results WHERE calc_type = ? AND id > ? ORDER BY id",
+            (calc_type, cache['last_id'])
+        ).fetchall()
+
+        if rows or cache['arrays'] is None:
+            index, names, values = cache['index'], cache['names'], cache['values']
+            for row_id, molecule, value in rows:
+                position = index.get(molecule)
+                if position is None:
+                    index[molecule] = len(names)
+                    names.append(molecule)
+                    values.append(value)
+                else:
+                    values[position] = value # 同じ分子は最新の行で上書き
+            if rows:
+                cache['last_id'] = rows[-1][0]
+            # None は float64 への変換で NaN になる
+            cache['arrays'] = (np.array(names, dtype=str), np.array(values, dtype=np.float64))
+
+        return cache['arrays']
+
+    def _latest_row(self, molecule, calc_type, columns):
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT {columns} FROM results WHERE molecule = ? AND calc_type = ? "
+                f"ORDER BY id DESC LIMIT 1",
+                (molecule, calc_type)
+            ).fetchone()
+
+    def load_geometry(self, molecule, calc_type='opt'):
+        """最新の最終構造を Geometry で返す。無ければ None。"""
+        row = self._latest_row(molecule, calc_type, "elements, coords")
+        if row is None or row[1] is None:
+            return None
+        return Geometry(row[0].split(), _from_blob(row[1], (-1, 3)))
+
+    def load_energy_trajectory(self, molecule, calc_type='opt'):
+        """最適化の各ステップのエネルギー (ndarray[float64]) を返す。"""
+        row = self._latest_row(molecule, calc_type, "energies")
+        return _from_blob(row[0]) if row else np.empty(0, dtype=np.float64)
+
+    def load_frequencies(self, molecule, calc_type='freq'):
+        """振動数 (cm^-1, ndarray[float64]) を返す。"""
+        row = self._latest_row(molecule, calc_type, "frequencies")
+        return _from_blob(row[0]) if row else np.empty(0, dtype=np.float64)
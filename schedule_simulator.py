@@ -0,0 +1,535 @@
+# schedule_simulator.py
+import sys
+import json
+import heapq
+import bisect
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta
+from queue import Empty
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger, set_log_level
+from config_utils import load_config
+from state_store import StateStore
+from job_queue import JobQueue
+from job_packing import JobPacker, collect_pack
+from job_handler import is_permanent_failure
+from tenants import TenantRegistry
+from workflow import WorkflowDefinition
+from numfreq import parse_displacement
+
+_simulator_logger = get_logger('schedule_simulator')
+
+# 比較できる配布方針
+#   fifo           - 現在の JobQueue (テナントごとの FIFO と公平配分)
+#   largest-first  - 原子数の多いジョブから (テナント内の順序のみ変える)
+#   smallest-first - 原子数の少ないジョブから
+#   packing        - fifo に加えて小分子ジョブを [packing] の設定でまとめて実行する
+POLICIES = ('fifo', 'largest-first', 'smallest-first', 'packing')
+
+# 試行を終える状態 (INTERRUPTED は次の試行に続けて数える)
+_ATTEMPT_END_STATUSES = ('COMPLETED', 'FAILED', 'PERMANENT_FAILED', 'INTERRUPTED')
+
+
+def _status_category(status):
+    return (status or '').split(':', 1)[0].strip().upper()
+
+
+def _timestamp(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class TraceAttempt:
+    """過去の1回の実行 (runtime 秒、結果、リトライ判定に使う error_type、パックのジョブ数)。"""
+
+    __slots__ = ('runtime', 'status', 'error_type', 'pack_size')
+
+    def __init__(self, runtime, status, error_type=None, pack_size=1):
+        self.runtime = runtime
+        self.status = status
+        self.error_type = error_type
+        self.pack_size = pack_size
+
+
+class TraceJob:
+    """StateStore の1ジョブの記録から取り出した、再生に必要な情報。"""
+
+    __slots__ = ('job_id', 'molecule', 'calc_type', 'tenant', 'n_atoms', 'packed', 'submitted',
+                 'attempts', 'waits', 'finished', 'split')
+
+    def __init__(self, job_id, molecule, calc_type, tenant=None, n_atoms=None, submitted=0.0):
+        self.job_id = job_id
+        self.molecule = molecule
+        self.calc_type = calc_type
+        self.tenant = tenant
+        self.n_atoms = n_atoms
+        # 過去にパック実行された (原子数の記録は無いが、パッキングの対象になる小分子)
+        self.packed = False
+        self.submitted = submitted
+        self.attempts = []
+        # 実績の待ち時間 (PENDING から RUNNING まで、試行ごと) と最後の試行の終了時刻
+        self.waits = []
+        self.finished = None
+        # 数値振動数で変位ジョブに分割された親ジョブ (自身は実行されず、変位ジョブの完了で完了する)
+        self.split = False
+
+    @property
+    def queue_job(self):
+        return (self.job_id, self.molecule, self.calc_type)
+
+    def attempt(self, index):
+        """index 回目の試行 (記録より多くリトライする場合は最後の試行を繰り返す)。"""
+        return self.attempts[min(index, len(self.attempts) - 1)]
+
+
+def _read_attempts(timeline):
+    """
+    timeline から実行の試行を取り出す。
+    Returns: ([(RUNNING の時刻文字列, 開始, 終了, 状態, 中断までの実行時間)], [待ち時間], 最後の終了時刻)
+    RUNNING の次が PENDING (パック内で実行されず再登録された) の場合は試行に数えない。
+    """
+    attempts, waits = [], []
+    carried = 0.0
+    queued = None
+    finished = None
+    for index, (status, time_text) in enumerate(timeline):
+        category = _status_category(status)
+        now = _timestamp(time_text)
+        if category == 'PENDING':
+            queued = now if queued is None else queued
+        if category != 'RUNNING' or index + 1 >= len(timeline) or now is None:
+            continue
+        if queued is not None:
+            waits.append(max(0.0, now - queued))
+            queued = None
+        next_status, next_time = timeline[index + 1]
+        next_category, ended = _status_category(next_status), _timestamp(next_time)
+        if next_category not in _ATTEMPT_END_STATUSES or ended is None:
+            continue
+        if next_category == 'INTERRUPTED':
+            carried += max(0.0, ended - now)
+            continue
+        attempts.append((time_text, now, ended, next_category, carried))
+        carried = 0.0
+        finished = ended
+    return attempts, waits, finished
+
+
+def _packed_usage(info):
+    usage = info.get('resource_usage')
+    return not usage or bool(usage.get('packed_jobs'))
+
+
+def load_trace(items, since=None):
+    """
+    StateStore のジョブ (items() の結果) から再生用の TraceJob のリストを作る。
+
+    - 実行時間は timeline の RUNNING から終了までの時間 (後処理を含む、ワーカーを占有した時間)。
+      中断 (INTERRUPTED) された実行はチェックポイントから再開した試行に合算する
+    - パック実行されたジョブ (resource_usage の packed_jobs、または古い記録では resource_usage が無く、
+      複数のジョブの RUNNING が同じ時刻) は、パック全体の時間を等分する
+    - 失敗した試行の error_type: FAILED はリトライ可能 (RECOVERABLE)。PERMANENT_FAILED は、
+      それまでにリトライ可能な失敗があればリトライの上限 (RECOVERABLE)、無ければ FATAL_INPUT とみなす
+    - 一度も実行を終えていないジョブ (実行中・未実行) は含めない
+    since: これより前 (epoch 秒) に登録されたジョブを除く
+    """
+    raw = []
+    pack_members = {}
+    for job_id, info in items:
+        timeline = info.get('timeline') or []
+        if not timeline:
+            continue
+        submitted = _timestamp(timeline[0][1])
+        if submitted is None or (since is not None and submitted < since):
+            continue
+        attempts, waits, finished = _read_attempts(timeline)
+        split = any(_status_category(status) == 'SPLIT' for status, _ in timeline)
+        if not attempts and not split:
+            continue
+        raw.append((job_id, info, submitted, attempts, waits, finished, split))
+        # パック実行の記録 (以前のバージョンでは resource_usage が記録されない)
+        if _packed_usage(info):
+            for started_text, started, ended, _, _ in attempts:
+                pack_members.setdefault(started_text, []).append(ended)
+
+    trace = []
+    for job_id, info, submitted, attempts, waits, finished, split in raw:
+        usage = info.get('resource_usage') or {}
+        job = TraceJob(job_id, info.get('molecule'), info.get('calc_type'), info.get('tenant'),
+                       usage.get('n_atoms'), submitted)
+        job.waits, job.finished, job.split = waits, finished, split
+        retryable_failures = 0
+        for started_text, started, ended, status, carried in attempts:
+            members = pack_members.get(started_text, ()) if _packed_usage(info) else ()
+            if len(members) > 1:
+                job.packed = True
+                runtime = (max(members) - started) / len(members)
+            else:
+                runtime = ended - started
+            if status == 'FAILED':
+                error_type = 'RECOVERABLE'
+                retryable_failures += 1
+            elif status == 'PERMANENT_FAILED':
+                error_type = 'RECOVERABLE' if retryable_failures else 'FATAL_INPUT'
+            else:
+                error_type = None
+            job.attempts.append(TraceAttempt(max(0.0, runtime) + carried, status, error_type, max(1, len(members))))
+        trace.append(job)
+
+    if trace:
+        origin = min(job.submitted for job in trace)
+        for job in trace:
+            job.submitted -= origin
+            if job.finished is not None:
+                job.finished -= origin
+    return trace
+
+
+class PriorityJobQueue(JobQueue):
+    """
+    テナント内のジョブを priority(job) の小さい順に並べる JobQueue (同じ値なら到着順)。
+    テナント間の公平配分と、requeue_front で先頭に戻す動作は JobQueue と同じ。
+    """
+
+    def __init__(self, priority, tenants=None):
+        super().__init__(tenants)
+        self.priority = priority
+
+    def _push(self, job, front=False):
+        super()._push(job, front)
+        if front:
+            return
+        # 先頭に戻すのは先頭から取り出したジョブのみのため、キューは常に priority の順に並んでいる
+        queue = self._queues[self._tenant(job)]
+        queue.pop()
+        queue.insert(bisect.bisect_right(queue, self.priority(job), key=self.priority), job)
+
+
+class SimulationResult:
+    """1つの方針での再生結果 (時間はすべて秒)。"""
+
+    def __init__(self, policy, workers):
+        self.policy = policy
+        self.workers = workers
+        self.makespan = 0.0
+        self.busy_seconds = 0.0
+        self.waits = []
+        self.runs = 0
+        self.completed = 0
+        self.failed = 0
+        self.not_released = 0
+
+    @property
+    def mean_wait(self):
+        return sum(self.waits) / len(self.waits) if self.waits else 0.0
+
+    @property
+    def p95_wait(self):
+        waits = sorted(self.waits)
+        return waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+
+    @property
+    def utilization(self):
+        capacity = self.workers * self.makespan
+        return self.busy_seconds / capacity if capacity > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            'policy': self.policy,
+            'workers': self.workers,
+            'makespan_seconds': round(self.makespan, 1),
+            'mean_wait_seconds': round(self.mean_wait, 1),
+            'p95_wait_seconds': round(self.p95_wait, 1),
+            'utilization': round(self.utilization, 3),
+            'orca_runs': self.runs,
+            'completed': self.completed,
+            'failed': self.failed,
+            'not_released': self.not_released,
+        }
+
+
+def recorded_result(trace, workers):
+    """記録された実績 (実際の makespan、待ち時間、worker 数 workers での稼働率) を同じ形式で返す。"""
+    result = SimulationResult('recorded', workers)
+    finished = [job.finished for job in trace if job.finished is not None]
+    result.makespan = max(finished, default=0.0)
+    runs = 0.0
+    for job in trace:
+        if job.split:
+            continue
+        result.waits.append(sum(job.waits))
+        result.busy_seconds += sum(attempt.runtime for attempt in job.attempts)
+        runs += sum(1.0 / attempt.pack_size for attempt in job.attempts)
+        final = job.attempts[-1].status
+        result.completed += final == 'COMPLETED'
+        result.failed += final == 'PERMANENT_FAILED'
+    result.runs = round(runs)
+    return result
+
+
+class ScheduleSimulator:
+    """
+    記録されたジョブを、模擬時計の離散イベントシミュレーションで配布方針ごとに再生するクラス。
+
+    - 配布には JobQueue (テナントの公平配分を含む) をそのまま使い、packing 方針では
+      JobScheduler と同じ collect_pack でパックを作る。パック内で失敗したジョブの後ろのジョブは
+      実行されずに単独実行としてキューの末尾に戻る (OrcaExecutor.execute_packed と同じ)
+    - 失敗した試行は JobCompletionHandler と同じ is_permanent_failure で判定し、リトライ可能なら
+      retry_delay 秒後にキューの末尾に戻す (実際のパイプラインでは次回起動時のリカバリで再登録される)
+    - ワークフローの後続ステップ (freq など) と数値振動数の変位ジョブは、依存するステップが
+      シミュレーション内で完了した時点で到着する。ルートのジョブは記録された登録時刻に到着する
+    - パックの実行時間は、各ジョブの実行時間の和から ORCA の起動時間 (startup_overhead) を
+      2つ目以降のジョブの分だけ差し引いたもの
+    """
+
+    def __init__(self, config, trace, policy='fifo', workers=None, retry_delay=0.0, startup_overhead=2.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy '{policy}' (expected one of {', '.join(POLICIES)}).")
+        self.config = config
+        self.trace = trace
+        self.policy = policy
+        self.workers = max(1, int(workers or config['orca']['max_parallel_jobs']))
+        self.retry_delay = retry_delay
+        self.startup_overhead = startup_overhead
+        self.max_retries = config.getint('orca', 'max_retries', fallback=3)
+        self.logger = _simulator_logger
+
+        self.jobs = {job.job_id: job for job in trace}
+        self.tenants = TenantRegistry(config)
+        for job in trace:
+            if job.tenant:
+                self.tenants.assign([job.molecule], job.tenant)
+        if policy in ('largest-first', 'smallest-first'):
+            sign = -1 if policy == 'largest-first' else 1
+            self.queue = PriorityJobQueue(lambda job: sign * (self.jobs[job[0]].n_atoms or 0), self.tenants)
+        else:
+            self.queue = JobQueue(self.tenants)
+        self.packer = None
+        if policy == 'packing':
+            self.packer = JobPacker(config)
+            self.packer.enabled = True
+        self._build_dependencies(WorkflowDefinition.from_config(config))
+
+    def _build_dependencies(self, definition):
+        """ジョブ -> 完了を待つジョブの集合、と、その逆引き。"""
+        by_step = {(job.molecule, job.calc_type): job.job_id for job in self.trace}
+        self.parts = {} # 分割された親ジョブ -> 変位ジョブ
+        self.waiting_on = {}
+        self.dependents = {}
+        for job in self.trace:
+            displacement = parse_displacement(job.calc_type)
+            step = displacement[0] if displacement else job.calc_type
+            if displacement and (job.molecule, step) in by_step:
+                self.parts.setdefault(by_step[(job.molecule, step)], set()).add(job.job_id)
+            workflow_step = definition.steps.get(step)
+            dependencies = {
+                by_step[(job.molecule, name)] for name in (workflow_step.depends_on if workflow_step else ())
+                if (job.molecule, name) in by_step
+            }
+            if dependencies:
+                self.waiting_on[job.job_id] = dependencies
+        # 分割された親ジョブは、依存するステップではなく変位ジョブの完了を待つ
+        for parent, parts in self.parts.items():
+            self.waiting_on[parent] = set(parts)
+        for job_id, dependencies in self.waiting_on.items():
+            for dependency in dependencies:
+                self.dependents.setdefault(dependency, []).append(job_id)
+
+    # --- シミュレーション ---
+    def run(self):
+        result = SimulationResult(self.policy, self.workers)
+        self.result = result
+        self.clock = 0.0
+        self.idle = self.workers
+        self.retries = {}
+        self.ready_at = {}
+        self.waits = {}
+        self.unpackable = set()
+        self._events = []
+        self._sequence = 0
+
+        for job in self.trace:
+            # 変位ジョブの記録が無い分割された親ジョブは再生しない
+            if job.job_id not in self.waiting_on and not job.split:
+                self._schedule(job.submitted, 'arrive', [job.job_id])
+
+        while self._events:
+            self.clock, _, kind, payload = heapq.heappop(self._events)
+            if kind == 'arrive':
+                for job_id in payload:
+                    self.ready_at[job_id] = self.clock
+                self.queue.put_many([self.jobs[job_id].queue_job for job_id in payload])
+            else:
+                self._finish(*payload)
+            # 同時刻のイベントをすべて処理してから配布する
+            if not self._events or self._events[0][0] > self.clock:
+                self._dispatch()
+
+        result.makespan = self.clock
+        result.waits = [self.waits[job.job_id] for job in self.trace if job.job_id in self.waits]
+        result.not_released = sum(1 for job in self.trace if not job.split and job.job_id not in self.waits)
+        return result
+
+    def _schedule(self, time, kind, payload):
+        self._sequence += 1
+        heapq.heappush(self._events, (time, self._sequence, kind, payload))
+
+    def _packable(self, queue_job):
+        job = self.jobs[queue_job[0]]
+        # 数値振動数の変位ジョブは .engrad を個別に回収するため、パッキングしない (NumericalFrequencies.split)
+        if job.job_id in self.unpackable or parse_displacement(job.calc_type):
+            return False
+        return job.n_atoms <= self.packer.max_atoms if job.n_atoms is not None else job.packed
+
+    def _dispatch(self):
+        while self.idle:
+            try:
+                first = self.queue.get_nowait()
+            except Empty:
+                return
+            pack = [first]
+            if self.packer is not None:
+                if self._packable(first):
+                    pack = collect_pack(self.queue, first, self.packer, self._packable)
+                else:
+                    self.unpackable.discard(first[0])
+
+            ran, runtimes, skipped = [], [], []
+            for queue_job in pack:
+                if skipped or (ran and self._attempt(ran[-1]).status != 'COMPLETED'):
+                    # 前のジョブで ORCA が停止したため実行されない
+                    skipped.append(queue_job[0])
+                    continue
+                job_id = queue_job[0]
+                ran.append(job_id)
+                runtimes.append(self._attempt(job_id).runtime)
+                self.waits[job_id] = self.waits.get(job_id, 0.0) + self.clock - self.ready_at[job_id]
+
+            duration = sum(runtimes) - self.startup_overhead * (len(runtimes) - 1)
+            duration = max(duration, max(runtimes))
+            self.idle -= 1
+            self.result.runs += 1
+            self.result.busy_seconds += duration
+            self._schedule(self.clock + duration, 'finish', (pack, ran, skipped))
+
+    def _attempt(self, job_id):
+        return self.jobs[job_id].attempt(self.retries.get(job_id, 0))
+
+    def _finish(self, pack, ran, skipped):
+        self.idle += 1
+        self.queue.task_done(pack)
+        for job_id in ran:
+            attempt = self._attempt(job_id)
+            if attempt.status == 'COMPLETED':
+                self._completed(job_id)
+                continue
+            self.retries[job_id] = self.retries.get(job_id, 0) + 1
+            if is_permanent_failure(self.retries[job_id], self.max_retries, attempt.error_type):
+                self._failed(job_id)
+            else:
+                self._schedule(self.clock + self.retry_delay, 'arrive', [job_id])
+        if skipped:
+            # 再登録したジョブは単独で実行する (同じパックで再び止まるのを防ぐ)
+            self.unpackable.update(skipped)
+            self._schedule(self.clock, 'arrive', skipped)
+
+    def _completed(self, job_id):
+        self.result.completed += not self.jobs[job_id].split
+        released = []
+        for dependent in self.dependents.get(job_id, ()):
+            waiting = self.waiting_on.get(dependent)
+            if waiting is None:
+                continue
+            waiting.discard(job_id)
+            if waiting:
+                continue
+            del self.waiting_on[dependent]
+            if self.jobs[dependent].split:
+                self._completed(dependent)
+            else:
+                released.append(dependent)
+        if released:
+            self._schedule(self.clock, 'arrive', released)
+
+    def _failed(self, job_id):
+        """永久に失敗したジョブを数える。その完了を待っていたジョブは到着しない (not_run に数える)。"""
+        self.result.failed += 1
+
+
+def format_results(results, trace, source):
+    lines = [
+        f"Replayed {sum(1 for job in trace if not job.split)} jobs "
+        f"({len({job.molecule for job in trace})} molecules) from {source}",
+        f"{'policy':<16}{'makespan_s':>12}{'mean_wait_s':>13}{'p95_wait_s':>12}{'utilization':>13}"
+        f"{'orca_runs':>11}{'completed':>11}{'failed':>8}{'not_run':>9}",
+    ]
+    for result in results:
+        lines.append(
+            f"{result.policy:<16}{result.makespan:>12.0f}{result.mean_wait:>13.1f}{result.p95_wait:>12.1f}"
+            f"{result.utilization:>13.1%}{result.runs:>11}{result.completed:>11}{result.failed:>8}"
+            f"{result.not_released:>9}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """
+    記録されたジョブを配布方針ごとに再生し、makespan・平均待ち時間・稼働率を比較する。
+    例: python schedule_simulator.py --days 30 --policies fifo,largest-first,packing
+    """
+    parser = argparse.ArgumentParser(description="Replay recorded jobs under different scheduling policies.")
+    parser.add_argument('--config', default='config.txt')
+    parser.add_argument('--state', help='state_store.json (default: [paths] state_dir/state_store.json)')
+    parser.add_argument('--policies', default=','.join(POLICIES))
+    parser.add_argument('--workers', type=int, help='parallel jobs (default: [orca] max_parallel_jobs)')
+    parser.add_argument('--days', type=float, help='only jobs submitted in the last N days of the record')
+    parser.add_argument('--retry-delay', type=float, default=0.0,
+                        help='seconds before a retryable failure is queued again')
+    parser.add_argument('--startup-overhead', type=float, default=2.0,
+                        help='ORCA start-up seconds saved per additional job in a pack')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    set_log_level('WARNING')
+    config = load_config(args.config)
+    state_path = Path(args.state or Path(config['paths'].get('state_dir', 'folders/state')) / 'state_store.json')
+    if not state_path.exists():
+        print(f"State file not found: {state_path}", file=sys.stderr)
+        return 1
+    items = StateStore(state_file=str(state_path)).items()
+
+    since = None
+    if args.days:
+        submitted = [_timestamp(info['timeline'][0][1]) for _, info in items if info.get('timeline')]
+        latest = max((value for value in submitted if value is not None), default=None)
+        if latest is not None:
+            since = (datetime.fromtimestamp(latest) - timedelta(days=args.days)).timestamp()
+    trace = load_trace(items, since=since)
+    if not trace:
+        print(f"No finished jobs to replay in {state_path}", file=sys.stderr)
+        return 1
+
+    policies = [policy.strip() for policy in args.policies.split(',') if policy.strip()]
+    try:
+        simulators = [
+            ScheduleSimulator(config, trace, policy, args.workers, args.retry_delay, args.startup_overhead)
+            for policy in policies
+        ]
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    results = [recorded_result(trace, simulators[0].workers)] + [simulator.run() for simulator in simulators]
+
+    if args.json:
+        print(json.dumps([result.to_dict() for result in results], indent=2))
+    else:
+        print(format_results(results, trace, state_path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
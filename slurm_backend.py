@@ -0,0 +1,513 @@
+# slurm_backend.py
+import re
+import time
+import signal
+import threading
+import subprocess
+from pathlib import Path
+from queue import Empty
+from concurrent.futures import ThreadPoolExecutor
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from pipeline_utils import ensure_directory, safe_write # I/Oユーティリティ
+from orca_job_manager import OrcaExecutor
+from job_scheduler import JobScheduler
+from resource_usage import read_inp_resources
+
+_slurm_logger = get_logger('slurm_backend')
+
+# squeue に表示される (まだ終了していない) 状態
+SLURM_ACTIVE_STATES = (
+    'PENDING', 'CONFIGURING', 'RUNNING', 'COMPLETING', 'SUSPENDED', 'REQUEUED',
+    'REQUEUE_HOLD', 'REQUEUE_FED', 'RESIZING', 'SIGNALING', 'STAGE_OUT',
+)
+
+# 終了状態 -> 結果の扱い
+#   CHECK_OUTPUT   : check_orca_output で出力を判定する (ORCA 自身のエラー分類を使う)
+#   FATAL_RESOURCE : リソース不足として失敗させる (出力にエラーが残らないため)
+#   INTERRUPTED    : 中断として記録し、作業ディレクトリから再開する
+SLURM_STATE_OUTCOMES = {
+    'COMPLETED': 'CHECK_OUTPUT',
+    'FAILED': 'CHECK_OUTPUT',
+    'OUT_OF_MEMORY': 'FATAL_RESOURCE',
+    'TIMEOUT': 'INTERRUPTED',
+    'PREEMPTED': 'INTERRUPTED',
+    'NODE_FAIL': 'INTERRUPTED',
+    'BOOT_FAIL': 'INTERRUPTED',
+    'DEADLINE': 'INTERRUPTED',
+    'CANCELLED': 'INTERRUPTED',
+}
+
+# コーディネーターの実行中に自動で再投入する中断 (CANCELLED は利用者の操作なので次回起動時まで待つ)
+SLURM_REQUEUE_STATES = ('TIMEOUT', 'PREEMPTED', 'NODE_FAIL', 'BOOT_FAIL')
+
+# squeue/sacct のどちらにも現れないタスクを消失とみなすまでのポーリング回数
+_LOST_AFTER_POLLS = 10
+
+_ARRAY_RANGE_PATTERN = re.compile(r"^(\d+)_\[([^\]]+)\]$")
+
+
+class SlurmError(RuntimeError):
+    """sbatch / squeue / sacct / scancel の実行に失敗した。"""
+
+
+def parse_exit_code(exit_code):
+    """sacct の ExitCode ('rc:signal') を subprocess 形式の returncode にする。"""
+    rc, _, sig = str(exit_code).partition(':')
+    try:
+        rc, sig = int(rc or 0), int(sig or 0)
+    except ValueError:
+        return 1
+    return -sig if sig else rc
+
+
+def expand_task_ids(job_field):
+    """'123_4' -> ['123_4'], '123_[4-6,9%2]' -> ['123_4', '123_5', '123_6', '123_9']"""
+    match = _ARRAY_RANGE_PATTERN.match(job_field)
+    if not match:
+        return [job_field]
+    array_id, spec = match.groups()
+    task_ids = []
+    for part in spec.split('%')[0].split(','):
+        first, _, last = part.partition('-')
+        if first.isdigit():
+            task_ids.extend(f"{array_id}_{i}" for i in range(int(first), int(last or first) + 1))
+    return task_ids
+
+
+class SlurmCommands:
+    """SLURM のコマンドラインツールの呼び出し (すべて複数ジョブを1回でまとめて扱う)。"""
+
+    def __init__(self, config):
+        self.sbatch_cmd = config.get('slurm', 'sbatch', fallback='sbatch')
+        self.squeue_cmd = config.get('slurm', 'squeue', fallback='squeue')
+        self.sacct_cmd = config.get('slurm', 'sacct', fallback='sacct')
+        self.scancel_cmd = config.get('slurm', 'scancel', fallback='scancel')
+        self.timeout = config.getfloat('slurm', 'command_timeout_seconds', fallback=60.0)
+
+    def _run(self, args, cwd=None):
+        try:
+            result = subprocess.run(args, cwd=cwd, capture_output=True, text=True, timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise SlurmError(f"{args[0]} failed: {e}") from e
+        if result.returncode != 0:
+            raise SlurmError(f"{args[0]} exited with {result.returncode}: {result.stderr.strip()}")
+        return result.stdout
+
+    def submit(self, script_path, cwd):
+        """sbatch --parsable で投入し、(配列) ジョブ ID を返す。"""
+        output = self._run([self.sbatch_cmd, '--parsable', str(script_path)], cwd=cwd).strip()
+        # --parsable の出力は 'jobid' または 'jobid;cluster'
+        job_id = output.split(';')[0].strip()
+        if not job_id.isdigit():
+            raise SlurmError(f"Unexpected sbatch output: {output!r}")
+        return job_id
+
+    def active_tasks(self, array_ids):
+        """squeue 1回で、まだ終了していないタスクの {task_id: state} を返す。"""
+        output = self._run([self.squeue_cmd, '--noheader', '--array', '--format=%i|%T',
+                            f"--jobs={','.join(array_ids)}"])
+        tasks = {}
+        for line in output.splitlines():
+            job_field, _, state = line.strip().partition('|')
+            for task_id in expand_task_ids(job_field.strip()):
+                tasks[task_id] = state.strip().split()[0] if state.strip() else 'PENDING'
+        return tasks
+
+    def accounting(self, array_ids):
+        """sacct 1回で、タスクの {task_id: (state, exit_code)} を返す。"""
+        output = self._run([self.sacct_cmd, '--noheader', '--parsable2', '--allocations',
+                            '--format=JobID,State,ExitCode', f"--jobs={','.join(array_ids)}"])
+        tasks = {}
+        for line in output.splitlines():
+            fields = line.strip().split('|')
+            if len(fields) < 3:
+                continue
+            # 'CANCELLED by 1000' のような表記は先頭の語だけを使う
+            state = fields[1].split()[0] if fields[1] else 'PENDING'
+            for task_id in expand_task_ids(fields[0]):
+                tasks[task_id] = (state, fields[2])
+        return tasks
+
+    def cancel(self, ids, signal_name=None, pending_only=False):
+        args = [self.scancel_cmd]
+        if signal_name:
+            args += [f"--signal={signal_name}", '--full']
+        if pending_only:
+            args.append('--state=PENDING')
+        self._run(args + list(ids))
+
+
+class SlurmExecutor(OrcaExecutor):
+    """
+    ORCA を SLURM の配列ジョブとして実行する実行器。
+    準備・結果処理は OrcaExecutor と共通で、working_dir は計算ノードと共有されている必要がある。
+    """
+
+    def __init__(self, config, handler, commands=None):
+        super().__init__(config, handler)
+        self.commands = commands or SlurmCommands(config)
+        self.batch_root = Path(config['paths']['working_dir']) / '_slurm'
+        self._load_submit_options(config)
+        # SLURM のタスク ID ('<array>_<index>') -> OrcaRun
+        self.tasks = {}
+        self._tasks_lock = threading.Lock()
+        self._unseen = {}
+        self._batch_counter = 0
+
+    def _load_submit_options(self, config):
+        # 入力に %maxcore が無い場合の値 (%pal が無ければ ORCA は1コアで実行される)
+        self.default_maxcore = config.getint('orca', 'maxcore', fallback=2000)
+        # 固定のコアあたりメモリ (未指定ならジョブの %maxcore から求める)
+        self.mem_per_cpu_override = config.getint('slurm', 'mem_per_cpu_mb', fallback=0) or None
+        self.partition = config.get('slurm', 'partition', fallback='').strip()
+        self.account = config.get('slurm', 'account', fallback='').strip()
+        self.time_limit = config.get('slurm', 'time_limit', fallback='').strip()
+        self.extra_options = [opt.strip() for opt in config.get('slurm', 'extra_options', fallback='').split(';')
+                              if opt.strip()]
+        self.orca_on_nodes = config.get('slurm', 'orca_executable', fallback=self.orca_executable)
+
+    def apply_config(self, config):
+        """設定の再読み込み: 以降に投入する配列ジョブの sbatch オプションを更新する。"""
+        super().apply_config(config)
+        self._load_submit_options(config)
+
+    # --- OrcaExecutor のインターフェース ---
+    def running_count(self):
+        with self._tasks_lock:
+            return len(self.tasks)
+
+    def signal_running(self, sig):
+        """投入済みのタスクに scancel でシグナルを送る。待機中のタスクは取り消す。"""
+        with self._tasks_lock:
+            task_ids = list(self.tasks)
+        if not task_ids:
+            return 0
+        try:
+            if sig == getattr(signal, 'SIGKILL', None):
+                self.commands.cancel(task_ids)
+            else:
+                self.commands.cancel(task_ids, signal_name=signal.Signals(sig).name[3:])
+                self.commands.cancel(task_ids, pending_only=True)
+        except SlurmError as e:
+            self.logger.error(f"Failed to signal SLURM tasks: {e}")
+        return len(task_ids)
+
+    # --- 投入 ---
+    def submit_batch(self, jobs):
+        """
+        ジョブをまとめて準備し、入力の %pal nprocs / %maxcore (ResourceTuner や [numfreq] が
+        ジョブごとに決める) が同じジョブごとに1つの配列ジョブとして投入する。
+        Returns: 投入したジョブの job_id の集合
+        """
+        groups = {}
+        for run in (self.prepare_run(*job) for job in jobs):
+            if run is not None:
+                groups.setdefault(self._run_resources(run), []).append(run)
+
+        submitted = set()
+        for (cpus, mem_per_cpu), runs in groups.items():
+            submitted |= self._submit_array(runs, cpus, mem_per_cpu)
+        return submitted
+
+    def _run_resources(self, run):
+        """Returns: (--cpus-per-task, --mem-per-cpu [MB]) をジョブの入力から決める"""
+        nprocs, maxcore = read_inp_resources(run.orca_path)
+        if self.mem_per_cpu_override:
+            mem_per_cpu = self.mem_per_cpu_override
+        else:
+            # ORCA の maxcore はコアあたりの作業メモリのため、プロセス自体の分の余裕を持たせる
+            mem_per_cpu = int((maxcore or self.default_maxcore) * 1.25)
+        return nprocs or 1, mem_per_cpu
+
+    def _submit_array(self, runs, cpus, mem_per_cpu):
+        self._batch_counter += 1
+        batch_dir = (self.batch_root / f"batch_{int(time.time())}_{self._batch_counter}").resolve()
+        try:
+            ensure_directory(batch_dir)
+            script_path = self._write_batch_files(batch_dir, runs, cpus, mem_per_cpu)
+            array_id = self.commands.submit(script_path, cwd=batch_dir)
+        except (SlurmError, OSError) as e:
+            self.logger.error(f"Failed to submit {len(runs)} jobs to SLURM: {e}")
+            for run in runs:
+                self._fail_run(run, f"Submission Error: {e}", "RECOVERABLE")
+            return set()
+
+        task_ids = {}
+        with self._tasks_lock:
+            for index, run in enumerate(runs):
+                task_id = f"{array_id}_{index}"
+                self.tasks[task_id] = run
+                task_ids[run.job_id] = {'slurm_job_id': task_id}
+        self.handler.state_store.update_fields_bulk(task_ids)
+        self.logger.info(
+            f"Submitted SLURM array job {array_id} with {len(runs)} tasks "
+            f"({cpus} CPUs, {mem_per_cpu} MB per CPU)."
+        )
+        return set(task_ids)
+
+    def _write_batch_files(self, batch_dir, runs, cpus, mem_per_cpu):
+        manifest = "".join(f"{run.work_dir.resolve()}|{run.orca_path.name}\n" for run in runs)
+        safe_write(batch_dir / 'manifest.txt', manifest)
+
+        directives = [
+            f"--job-name=orca_{batch_dir.name}",
+            f"--array=0-{len(runs) - 1}",
+            f"--cpus-per-task={cpus}",
+            f"--mem-per-cpu={mem_per_cpu}M",
+            f"--output={batch_dir}/task_%a.log",
+        ]
+        if self.time_limit:
+            directives.append(f"--time={self.time_limit}")
+        if self.partition:
+            directives.append(f"--partition={self.partition}")
+        if self.account:
+            directives.append(f"--account={self.account}")
+        directives.extend(self.extra_options)
+
+        script = "#!/bin/bash\n" + "".join(f"#SBATCH {d}\n" for d in directives) + f"""
+# manifest.txt の (SLURM_ARRAY_TASK_ID + 1) 行目: <作業ディレクトリ>|<入力ファイル名>
+LINE=$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" "{batch_dir}/manifest.txt")
+WORK_DIR="${{LINE%%|*}}"
+INPUT="${{LINE#*|}}"
+cd "$WORK_DIR" || exit 2
+# exec によりシグナル (scancel --signal) が ORCA に直接届く
+exec "{self.orca_on_nodes}" "$INPUT" > "${{INPUT%.inp}}.out" 2>&1
+"""
+        script_path = batch_dir / 'submit.sh'
+        safe_write(script_path, script)
+        return script_path
+
+    # --- 監視 ---
+    def poll(self):
+        """
+        squeue/sacct をそれぞれ最大1回呼び、終了したタスクを [(run, state, exit_code)] で返す。
+        """
+        with self._tasks_lock:
+            tracked = list(self.tasks)
+        if not tracked:
+            return []
+
+        try:
+            active = self.commands.active_tasks(sorted({t.split('_')[0] for t in tracked}))
+            missing = [t for t in tracked if t not in active]
+            accounting = self.commands.accounting(sorted({t.split('_')[0] for t in missing})) if missing else {}
+        except SlurmError as e:
+            self.logger.warning(f"SLURM polling failed (will retry): {e}")
+            return []
+
+        finished = []
+        for task_id in missing:
+            state, exit_code = accounting.get(task_id, (None, None))
+            if state is None or state in SLURM_ACTIVE_STATES:
+                # sacct への反映が遅れている場合がある
+                self._unseen[task_id] = self._unseen.get(task_id, 0) + 1
+                if self._unseen[task_id] < _LOST_AFTER_POLLS:
+                    continue
+                self.logger.warning(f"SLURM task {task_id} disappeared from squeue and sacct; treating as NODE_FAIL.")
+                state, exit_code = 'NODE_FAIL', '0:0'
+            finished.append((task_id, state, exit_code))
+
+        results = []
+        with self._tasks_lock:
+            for task_id, state, exit_code in finished:
+                self._unseen.pop(task_id, None)
+                run = self.tasks.pop(task_id, None)
+                if run is not None:
+                    results.append((run, state, exit_code))
+        return results
+
+    def finish_task(self, run, state, exit_code):
+        """
+        終了したタスクの SLURM の状態を結果の扱いに対応付けて処理する。
+        Returns: 自動で再投入すべき場合は (inp_file, mol_name, calc_type)、それ以外は None
+        """
+        outcome = SLURM_STATE_OUTCOMES.get(state, 'CHECK_OUTPUT')
+        if self.stopping and state != 'COMPLETED':
+            # ドレイン中に送ったシグナル (scancel --signal) で終了した
+            outcome = 'INTERRUPTED'
+
+        if outcome == 'INTERRUPTED':
+            requeue = state in SLURM_REQUEUE_STATES and not self.stopping
+            job = self.handler.state_store.get_job(run.job_id) or {}
+            if requeue and job.get('restart_count', 0) >= self.handler.max_retries:
+                self._fail_run(run, f"SLURM {state} (restart limit reached)", "RECOVERABLE")
+                return None
+            self._interrupt_run(run, state)
+            return (run.job_id, run.mol_name, run.calc_type) if requeue else None
+
+        if outcome == 'FATAL_RESOURCE':
+            self._fail_run(run, f"Fatal Resource Error: SLURM {state}", "FATAL_RESOURCE")
+        elif state == 'COMPLETED':
+            self._check_output(run)
+        else:
+            self.finish_run(run, parse_exit_code(exit_code))
+        return None
+
+    def _check_output(self, run):
+        """ドレイン中でも、正常終了したタスクの結果は通常どおり処理する。"""
+        try:
+            run.keep_input = self._handle_result(run.inp_path, run.mol_name, run.calc_type, run.orca_path,
+                                                 run.work_dir, run.product_dir)
+        except Exception as e:
+            self._record_execution_error(run, e)
+        finally:
+            self._cleanup_run(run)
+
+    def _interrupt_run(self, run, state):
+        try:
+            self._record_interruption(run.inp_path, run.mol_name, run.run_started)
+            self.logger.warning(f"SLURM task for {run.mol_name} ({run.calc_type}) ended with {state}.")
+            run.keep_input = True
+            run.keep_work_dir = True
+        finally:
+            self._cleanup_run(run)
+
+    def _fail_run(self, run, message, error_type):
+        try:
+            current_retries = self.handler.state_store.increment_retry_count(run.job_id)
+            is_permanent = self.handler.handle_failure(run.job_id, run.mol_name, message, current_retries, error_type)
+            run.keep_input = not is_permanent
+        finally:
+            self._cleanup_run(run)
+
+
+class SlurmJobScheduler(JobScheduler):
+    """
+    キューのジョブを配列ジョブにまとめて sbatch で投入し、squeue/sacct の一括ポーリングで
+    終了を検出するスケジューラ。max_parallel_jobs は投入済みで未終了のタスク数の上限になる。
+    """
+
+    def __init__(self, config, state_store, executor):
+        super().__init__(config, state_store, executor)
+        self.array_max_size = max(1, config.getint('slurm', 'array_max_size', fallback=500))
+        self.batch_wait = config.getfloat('slurm', 'batch_wait_seconds', fallback=5.0)
+        self.poll_interval = config.getfloat('slurm', 'poll_interval_seconds', fallback=30.0)
+        self.post_processing_threads = config.getint('orca', 'post_processing_threads', fallback=4)
+        self._capacity = threading.Condition()
+        self._wake_poller = threading.Event()
+        self._submitter = None
+        self._poller = None
+        if self.executor.packer.enabled:
+            self.logger.warning("[packing] is not used by the SLURM backend; jobs are submitted as array tasks.")
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self._submitter = threading.Thread(target=self._submit_loop, name='slurm-submitter', daemon=True)
+        self._poller = threading.Thread(target=self._poll_loop, name='slurm-poller', daemon=True)
+        self._submitter.start()
+        self._poller.start()
+        self.logger.info(
+            f"SlurmJobScheduler started (max outstanding tasks: {self.num_threads}, "
+            f"array size: {self.array_max_size}, poll interval: {self.poll_interval:.0f}s)."
+        )
+
+    def _submit_loop(self):
+        while True:
+            job = self.job_queue.get()
+            if job is None:
+                break
+
+            # 後続のジョブを同じ配列ジョブにまとめるため、少し待ってから集める
+            if self.batch_wait > 0 and not self.job_queue.closed:
+                time.sleep(self.batch_wait)
+
+            with self._capacity:
+                while self.executor.running_count() >= self.num_threads and not self.job_queue.closed:
+                    self._capacity.wait()
+                room = max(1, min(self.array_max_size, self.num_threads - self.executor.running_count()))
+
+            batch = [job]
+            while len(batch) < room:
+                try:
+                    batch.append(self.job_queue.get_nowait())
+                except Empty:
+                    break
+
+            if self.job_queue.closed:
+                # ドレイン中: 投入せず PENDING のまま次回起動時に再開する
+                self.logger.info(f"Scheduler is draining; {len(batch)} jobs left unsubmitted as PENDING.")
+                break
+            batch = self._admit_batch(batch)
+            if not batch:
+                continue
+            submitted = set()
+            try:
+                submitted = self.executor.submit_batch(batch)
+            except Exception as e:
+                self.logger.error(f"SLURM submission loop experienced unhandled error: {e}")
+            # 投入しなかったジョブ (準備で失敗したものなど) はテナントの実行中のジョブ数から外す
+            self.job_queue.task_done([job for job in batch if str(job[0]) not in submitted])
+            self._wake_poller.set()
+
+    def _admit_batch(self, batch):
+        """
+        ディスク容量を確認し、先頭から容量の足りる分だけを返す。残りはキューの先頭に戻し、
+        1件も投入できない場合は次の確認まで待つ。
+        """
+        if self.disk_guard is None:
+            return batch
+        admitted = []
+        for job in batch:
+            if not self.disk_guard.admit(str(job[0]), job[2]):
+                break
+            admitted.append(job)
+        if len(admitted) < len(batch):
+            self.job_queue.requeue_front(batch[len(admitted):])
+        if not admitted:
+            self.disk_guard.wait()
+        return admitted
+
+    def _poll_loop(self):
+        with ThreadPoolExecutor(max_workers=self.post_processing_threads, thread_name_prefix='slurm-post') as pool:
+            while True:
+                # ドレイン中は終了を早く検出するため短い間隔でポーリングする
+                self._wake_poller.wait(1.0 if self.job_queue.closed else self.poll_interval)
+                self._wake_poller.clear()
+
+                if self.job_queue.closed and not self.executor.running_count() and \
+                        not (self._submitter and self._submitter.is_alive()):
+                    break
+
+                for run, state, exit_code in self.executor.poll():
+                    pool.submit(self._finish, run, state, exit_code)
+
+    def _finish(self, run, state, exit_code):
+        try:
+            requeue = self.executor.finish_task(run, state, exit_code)
+            if requeue is not None:
+                self.logger.info(f"Re-queueing {run.mol_name} ({run.calc_type}) after SLURM {state}.")
+                self.add_jobs_bulk([requeue], is_recovery=True)
+        except Exception as e:
+            self.logger.error(f"Post-processing error for SLURM task of {run.mol_name}: {e}")
+        finally:
+            self.job_queue.task_done([(run.job_id, run.mol_name, run.calc_type)])
+            with self._capacity:
+                self._capacity.notify_all()
+
+    def _close_queue(self):
+        super()._close_queue()
+        with self._capacity:
+            self._capacity.notify_all()
+        self._wake_poller.set()
+
+    def apply_config(self, config):
+        super().apply_config(config)
+        self.array_max_size = max(1, config.getint('slurm', 'array_max_size', fallback=500))
+        self.batch_wait = config.getfloat('slurm', 'batch_wait_seconds', fallback=5.0)
+        self.poll_interval = config.getfloat('slurm', 'poll_interval_seconds', fallback=30.0)
+        self._wake_poller.set()
+
+    def _release_worker_slot(self):
+        # 上限は num_threads で判定しているため、減らすだけで次の投入から反映される
+        pass
+
+    def _add_worker_slots(self, count):
+        with self._capacity:
+            self._capacity.notify_all()
+
+    def _alive_workers(self):
+        return [thread for thread in (self._submitter, self._poller) if thread is not None and thread.is_alive()]
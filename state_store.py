@@ -4,13 +4,38 @@ from pathlib import Path
 from datetime import datetime
 # 依存関係: logging_utilsからロガーを取得
 from logging_utils import get_logger
+from pipeline_utils import atomic_write, GroupCommitWriter
+from diagnostics import TimedLock
+
+# ジョブごとに保持するステータス遷移の最大件数 (リトライを繰り返すジョブでも状態ファイルが肥大化しないように)
+TIMELINE_LIMIT = 20
+
+
+def _append_timeline(job, status, timestamp):
+    """ジョブの timeline ([status, 時刻] のリスト) にステータスの遷移を追記する。"""
+    timeline = job.setdefault('timeline', [])
+    if timeline and timeline[-1][0] == status:
+        return
+    timeline.append([status, timestamp])
+    del timeline[:-TIMELINE_LIMIT]
 
 class StateStore:
-    """Manages the state of running and completed jobs."""
+    """
+    Manages the state of running and completed jobs.
+    ワーカー、ハンドラ、Molden 監視などのスレッドから同時に呼ばれるため、すべての操作は
+    lock (待ち時間と保持時間を操作ごとに集計する) の下で行う。
+    """
     def __init__(self, state_file='state_store.json'):
         self.state_file = Path(state_file)
         self.job_info = {}
+        # 分子名 -> その分子のジョブ ID (登録順)。分子ごとの問い合わせで全ジョブを走査しないための索引
+        self._by_molecule = {}
+        self.lock = TimedLock('StateStore')
+        # 変更のたびに増える番号 (status_api のスナップショットが変更の有無を判定するため)
+        self.version = 0
         self.logger = get_logger('state_store')
+        # [io] fsync = group では、保存要求を別スレッドで group_commit_interval ごとの1回の書き込みにまとめる
+        self._writer = GroupCommitWriter(self._write_state, on_error=self._log_save_error, name='state-writer')
         self._load_state()
 
     def _load_state(self):
@@ -23,51 +48,181 @@ class StateStore:
             except Exception as e:
                 self.logger.error(f"Failed to load state file: {e}")
                 self.job_info = {}
+        for job_id, job in self.job_info.items():
+            self._by_molecule.setdefault(job.get('molecule'), {})[job_id] = None
 
     def _save_state(self):
-        """Saves current state to file."""
+        """
+        Saves current state to file (atomically: a crash never leaves a truncated state file).
+        fsync = group の場合は保存を要求するだけで、書き込みは GroupCommitWriter がまとめて行う。
+        """
+        self.version += 1
         try:
-            with open(self.state_file, 'w') as f:
-                json.dump(self.job_info, f, indent=4)
+            self._writer.request()
         except Exception as e:
-            self.logger.error(f"Failed to save state file: {e}")
+            self._log_save_error(e)
+
+    def _write_state(self, fsync=None):
+        with self.lock.hold('write_state'):
+            content = json.dumps(self.job_info, indent=4)
+        atomic_write(self.state_file, content, fsync=fsync)
+
+    def flush(self):
+        """保留中の保存 (group commit) を書き込む。"""
+        try:
+            self._writer.flush()
+        except Exception as e:
+            self._log_save_error(e)
+
+    def _log_save_error(self, error):
+        self.logger.error(f"Failed to save state file: {error}")
+
+    def _upsert_job(self, mol_name, calc_type, orca_path, status, start_time, fields=None):
+        """Adds or updates a job entry in memory without saving."""
+        job_id = orca_path
 
-    def add_job(self, mol_name, calc_type, orca_path, status='PENDING'):
-        """Adds or updates a job entry."""
-        job_id = orca_path 
-        
-        # ★★★ ここからが変更点 ★★★
         # 既存のジョブ情報（特にリトライ回数）を保持しつつ更新
         existing_job = self.job_info.get(job_id, {})
+        previous_molecule = existing_job.get('molecule', mol_name)
+        if previous_molecule != mol_name:
+            self._by_molecule.get(previous_molecule, {}).pop(job_id, None)
+        self._by_molecule.setdefault(mol_name, {})[job_id] = None
         existing_job.update({
             'molecule': mol_name,
             'calc_type': calc_type,
             'orca_path': orca_path,
             'status': status,
-            'start_time': str(datetime.now())
+            'start_time': start_time
         })
-        
+        if fields:
+            existing_job.update(fields)
+        _append_timeline(existing_job, status, start_time)
+
         # 新規ジョブの場合のみリトライ回数を初期化
         if 'retry_count' not in existing_job:
             existing_job['retry_count'] = 0
-            
+
         self.job_info[job_id] = existing_job
-        # ★★★ 変更点ここまで ★★★
-        
-        self._save_state()
-        
+
+    def add_job(self, mol_name, calc_type, orca_path, status='PENDING', **fields):
+        """Adds or updates a job entry (fields: 追加で記録する属性。テナントなど)."""
+        with self.lock.hold('add_job'):
+            self._upsert_job(mol_name, calc_type, orca_path, status, str(datetime.now()), fields)
+            self._save_state()
+
+    def add_jobs_bulk(self, jobs, status='PENDING', fields=None):
+        """
+        複数のジョブを登録し、状態ファイルへの保存を1回にまとめます。
+        jobs: (mol_name, calc_type, orca_path) のイテラブル
+        fields: {orca_path: {属性: 値}} (追加で記録する属性。テナントなど)
+        Returns: 登録したジョブ数
+        """
+        start_time = str(datetime.now())
+        count = 0
+        fields = fields or {}
+        with self.lock.hold('add_jobs_bulk'):
+            for mol_name, calc_type, orca_path in jobs:
+                self._upsert_job(mol_name, calc_type, orca_path, status, start_time, fields.get(orca_path))
+                count += 1
+
+            if count:
+                self._save_state()
+        return count
+
     def get_job(self, job_id):
         """Retrieves a job by its ID."""
-        return self.job_info.get(job_id)
+        with self.lock.hold('get_job'):
+            return self.job_info.get(job_id)
 
-    def update_status(self, job_id, status):
-        """Updates the status of a job."""
-        if job_id in self.job_info:
-            self.job_info[job_id]['status'] = status
-            self._save_state()
-            return True
+    def items(self):
+        """
+        全ジョブの (job_id, job_info) のリストを返します。
+        他スレッドの登録と競合せずに全件を走査するため、job_info を直接走査せずにこれを使う。
+        """
+        with self.lock.hold('items'):
+            return list(self.job_info.items())
+
+    def molecule_items(self, mol_name):
+        """1つの分子の (job_id, job_info) のリスト (全ジョブを走査しない)。"""
+        with self.lock.hold('molecule_items'):
+            return [(job_id, self.job_info[job_id]) for job_id in self._by_molecule.get(mol_name, ())]
+
+    def update_status(self, job_id, status, **fields):
+        """Updates the status of a job (and optional extra fields) with one save."""
+        with self.lock.hold('update_status'):
+            if job_id in self.job_info:
+                self.job_info[job_id]['status'] = status
+                self.job_info[job_id].update(fields)
+                _append_timeline(self.job_info[job_id], status, str(datetime.now()))
+                self._save_state()
+                return True
+        return False
+
+    def update_job_fields(self, job_id, **fields):
+        """
+        ステータス以外のジョブ属性 (チェックポイント情報など) を更新します。
+        """
+        with self.lock.hold('update_job_fields'):
+            if job_id in self.job_info:
+                self.job_info[job_id].update(fields)
+                self._save_state()
+                return True
         return False
         
+    def update_statuses_bulk(self, updates, fields=None):
+        """
+        複数ジョブのステータスを更新し、保存を1回にまとめます。
+        updates: {job_id: status} の辞書
+        fields: 全ジョブに同時に記録する属性 (run_started など)
+        Returns: 更新したジョブ数
+        """
+        count = 0
+        now = str(datetime.now())
+        with self.lock.hold('update_statuses_bulk'):
+            for job_id, status in updates.items():
+                if job_id in self.job_info:
+                    self.job_info[job_id]['status'] = status
+                    if fields:
+                        self.job_info[job_id].update(fields)
+                    _append_timeline(self.job_info[job_id], status, now)
+                    count += 1
+
+            if count:
+                self._save_state()
+        return count
+
+    def update_fields_bulk(self, updates):
+        """
+        複数ジョブの属性を更新し、保存を1回にまとめます。
+        updates: {job_id: {field: value}} の辞書
+        Returns: 更新したジョブ数
+        """
+        count = 0
+        with self.lock.hold('update_fields_bulk'):
+            for job_id, fields in updates.items():
+                if job_id in self.job_info:
+                    self.job_info[job_id].update(fields)
+                    count += 1
+
+            if count:
+                self._save_state()
+        return count
+
+    def snapshot(self):
+        """
+        読み取り専用の利用者 (status_api, MoldenService) 向けに、全ジョブのコピーを返します。
+        Returns: (version, {job_id: job_info のコピー})
+        """
+        copies = {}
+        with self.lock.hold('snapshot'):
+            version = self.version
+            for job_id, info in self.job_info.items():
+                copy = dict(info)
+                if 'timeline' in copy:
+                    copy['timeline'] = list(copy['timeline'])
+                copies[job_id] = copy
+        return version, copies
+
     def _same_job(self, job1, job2):
         """Check if two job infos represent the same job"""
         return (job1.get('molecule') == job2.get('molecule') and 
@@ -75,11 +230,24 @@ class StateStore:
 
     def has_pending_or_running(self, new_job_info):
         """Checks if a similar job is already running or pending."""
-        for job_id, job_info in self.job_info.items():
-            if job_info['status'] in ['PENDING', 'RUNNING'] and self._same_job(job_info, new_job_info):
-                return True
+        with self.lock.hold('has_pending_or_running'):
+            for job_id in self._by_molecule.get(new_job_info.get('molecule'), ()):
+                job_info = self.job_info[job_id]
+                if job_info['status'] in ['PENDING', 'RUNNING'] and self._same_job(job_info, new_job_info):
+                    return True
         return False
 
+    def active_job_keys(self):
+        """
+        PENDING / RUNNING のジョブの (molecule, calc_type) の集合を返します。
+        複数のジョブの重複チェックを1回の走査で行うため (has_pending_or_running をジョブごとに呼ばない)。
+        """
+        with self.lock.hold('active_job_keys'):
+            return {
+                (job_info.get('molecule'), job_info.get('calc_type'))
+                for job_info in self.job_info.values() if job_info['status'] in ('PENDING', 'RUNNING')
+            }
+
     def get_jobs_by_status(self, status):
         """
         指定されたステータスを持つすべてのジョブを取得します。
@@ -89,9 +257,10 @@ class StateStore:
         target_status = status.upper()
         
         # job_id (orca_path) と job_info の両方を返す
-        for job_id, job_info in self.job_info.items():
-            if job_info.get('status', '').upper() == target_status:
-                found_jobs.append((job_id, job_info))
+        with self.lock.hold('get_jobs_by_status'):
+            for job_id, job_info in self.job_info.items():
+                if job_info.get('status', '').upper() == target_status:
+                    found_jobs.append((job_id, job_info))
                 
         return found_jobs
 
@@ -101,11 +270,12 @@ class StateStore:
         ジョブのリトライ回数を1増やします。
         (仕様書2.3.1に基づく追加機能)
         """
-        if job_id in self.job_info:
-            current_count = self.job_info[job_id].get('retry_count', 0)
-            self.job_info[job_id]['retry_count'] = current_count + 1
-            self._save_state()
-            return self.job_info[job_id]['retry_count']
+        with self.lock.hold('increment_retry_count'):
+            if job_id in self.job_info:
+                current_count = self.job_info[job_id].get('retry_count', 0)
+                self.job_info[job_id]['retry_count'] = current_count + 1
+                self._save_state()
+                return self.job_info[job_id]['retry_count']
         return 0
 
     def get_retry_count(self, job_id):
@@ -113,7 +283,8 @@ class StateStore:
         現在のリトライ回数を取得します。
         (仕様書2.3.3の実装に必要)
         """
-        if job_id in self.job_info:
-            return self.job_info[job_id].get('retry_count', 0)
+        with self.lock.hold('get_retry_count'):
+            if job_id in self.job_info:
+                return self.job_info[job_id].get('retry_count', 0)
         return 0
     # ★★★ 変更点ここまで ★★★
@@ -0,0 +1,353 @@
+# status_api.py
+import json
+import time
+import threading
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from tenants import DEFAULT_TENANT
+
+_status_logger = get_logger('status_api')
+
+# 一覧に含めるジョブの属性 (詳細は /jobs/<molecule> で返す)
+SUMMARY_FIELDS = ('molecule', 'calc_type', 'status', 'start_time', 'retry_count', 'tenant')
+# 1つのスナップショットに対してキャッシュするレスポンスの数
+RESPONSE_CACHE_SIZE = 256
+# テナントのスループットを数える期間 (秒)
+THROUGHPUT_WINDOW_SECONDS = 3600
+
+
+def _timestamp(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+def status_name(status):
+    """'FAILED: <理由>' のような状態から理由を除いた名前 ('FAILED')。"""
+    return str(status).split(':', 1)[0]
+
+
+def queue_wait_seconds(timeline):
+    """最後に実行を開始するまでの待ち時間 (最後の PENDING から RUNNING まで)。未実行なら None。"""
+    for index in range(len(timeline) - 1, 0, -1):
+        if timeline[index][0] == 'RUNNING' and timeline[index - 1][0] == 'PENDING':
+            started, queued = _timestamp(timeline[index][1]), _timestamp(timeline[index - 1][1])
+            return max(0.0, started - queued) if started is not None and queued is not None else None
+    return None
+
+
+class StatusSnapshot:
+    """ある時点の StateStore とキューの読み取り専用ビュー (集計と索引は作成時に1回だけ計算する)。"""
+
+    def __init__(self, version, jobs, queued, running, parallel_jobs, tenants=None, epoch=0):
+        self.version = version
+        # StateStore.version は起動ごとに 0 から数え直すため、ETag にはプロセスの起動時刻を含める
+        self.epoch = epoch
+        self.taken_at = str(datetime.now())
+        self.jobs = jobs
+        self.queue = [str(job[0]) for job in queued]
+        self.queue_positions = {job_id: position for position, job_id in enumerate(self.queue)}
+        self.running = running
+        self.parallel_jobs = parallel_jobs
+        # テナント -> {'weight', 'max_running', 'queued', 'running'} (スケジューラの現在値)
+        self.tenants = tenants or {}
+        self._tenant_metrics = None
+        self.by_status = Counter(status_name(info.get('status', 'UNKNOWN')) for info in jobs.values())
+        self.by_calc_type = {}
+        self.by_molecule = {}
+        for job_id, info in jobs.items():
+            calc_counts = self.by_calc_type.setdefault(info.get('calc_type'), Counter())
+            calc_counts[status_name(info.get('status', 'UNKNOWN'))] += 1
+            self.by_molecule.setdefault(info.get('molecule'), []).append(job_id)
+
+    @property
+    def etag(self):
+        return f'"{self.epoch}-{self.version}"'
+
+    def summary(self, job_id):
+        info = self.jobs[job_id]
+        entry = {'job_id': job_id}
+        entry.update({field: info.get(field) for field in SUMMARY_FIELDS})
+        entry['queue_position'] = self.queue_positions.get(job_id)
+        return entry
+
+    def tenant_metrics(self):
+        """
+        テナントごとの件数、待ち時間、スループット、ORCA の実行時間 (コア時間) を集計する
+        (スナップショットごとに最初の要求時に1回だけ計算する)。
+        """
+        if self._tenant_metrics is not None:
+            return self._tenant_metrics
+        now = time.time()
+        accounts = {}
+        for name in self.tenants:
+            accounts[name] = {'by_status': Counter(), 'waits': [], 'recent': 0, 'core_seconds': 0.0}
+        for info in self.jobs.values():
+            account = accounts.setdefault(info.get('tenant') or DEFAULT_TENANT,
+                                          {'by_status': Counter(), 'waits': [], 'recent': 0, 'core_seconds': 0.0})
+            status = str(info.get('status', 'UNKNOWN'))
+            account['by_status'][status_name(status)] += 1
+            timeline = info.get('timeline') or []
+            wait = queue_wait_seconds(timeline)
+            if wait is not None:
+                account['waits'].append(wait)
+            if status == 'COMPLETED' and timeline and timeline[-1][0] == 'COMPLETED':
+                finished = _timestamp(timeline[-1][1])
+                if finished is not None and now - finished <= THROUGHPUT_WINDOW_SECONDS:
+                    account['recent'] += 1
+            usage = info.get('resource_usage') or {}
+            if usage.get('wall_seconds'):
+                account['core_seconds'] += usage['wall_seconds'] * (usage.get('nprocs') or 1)
+
+        metrics = {}
+        for name, account in sorted(accounts.items()):
+            waits = sorted(account['waits'])
+            scheduler = self.tenants.get(name, {})
+            metrics[name] = {
+                'weight': scheduler.get('weight'),
+                'max_running': scheduler.get('max_running'),
+                'queued': scheduler.get('queued', 0),
+                'running': scheduler.get('running', 0),
+                'by_status': dict(account['by_status']),
+                'queue_wait_seconds': {
+                    'samples': len(waits),
+                    'p50': _percentile(waits, 0.5),
+                    'p95': _percentile(waits, 0.95),
+                    'max': waits[-1] if waits else None,
+                },
+                'completed_last_hour': account['recent'],
+                'throughput_per_hour': account['recent'] * 3600.0 / THROUGHPUT_WINDOW_SECONDS,
+                'core_hours': round(account['core_seconds'] / 3600.0, 3),
+            }
+        self._tenant_metrics = metrics
+        return metrics
+
+    def detail(self, job_id):
+        entry = dict(self.jobs[job_id])
+        entry['job_id'] = job_id
+        entry['queue_position'] = self.queue_positions.get(job_id)
+        entry.setdefault('timeline', [[entry.get('status'), entry.get('start_time')]])
+        return entry
+
+
+class StatusService:
+    """
+    StateStore とジョブキューを読み取り専用で公開するローカル HTTP/JSON API ([status_api])。
+
+    GET /status                      ステータス・計算タイプごとの件数、キュー長、実行中のジョブ数
+    GET /jobs?status=&molecule=&calc_type=&offset=&limit=
+                                     条件に合うジョブの一覧 (ページ分割)
+    GET /jobs/<molecule>             分子のすべてのジョブ (ステータスの遷移とキュー内の位置を含む)
+    GET /queue?offset=&limit=        実行待ちのジョブ (実行される見込みの順)
+    GET /tenants                     テナントごとの件数、キューの待ち時間 (p50/p95)、直近1時間の
+                                     スループット、ORCA の実行時間 (コア時間) ([tenants])
+
+    応答はメモリ上のスナップショットから作られ、状態ファイルは読まない。スナップショットは
+    StateStore.version が変わったときだけ (最短 refresh_interval 秒ごとに) 作り直し、
+    応答はスナップショットごとにキャッシュする。ETag はサービスの起動時刻とスナップショットの版で、
+    If-None-Match が一致すれば本文なしの 304 を返す。
+    /status と /jobs?status= のステータスは理由を除いた名前 (FAILED、PERMANENT_FAILED など)。
+    """
+
+    def __init__(self, config, state_store, scheduler):
+        self.state_store = state_store
+        self.scheduler = scheduler
+        self.logger = _status_logger
+        self.host = config.get('status_api', 'host', fallback='127.0.0.1')
+        self.port = config.getint('status_api', 'port', fallback=8765)
+        self.page_size = max(1, config.getint('status_api', 'page_size', fallback=100))
+        self.max_page_size = max(self.page_size, config.getint('status_api', 'max_page_size', fallback=1000))
+        self.refresh_interval = config.getfloat('status_api', 'refresh_interval_seconds', fallback=1.0)
+        self.epoch = int(time.time() * 1000)
+        self._snapshot = None
+        self._refreshed_at = 0.0
+        self._responses = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    # --- スナップショット ---
+    def current(self):
+        """最新のスナップショットを返す (変更が無ければ作り直さない)。"""
+        with self._lock:
+            now = time.monotonic()
+            stale = self._snapshot is None or (
+                self.state_store.version != self._snapshot.version
+                and now - self._refreshed_at >= self.refresh_interval
+            )
+            if stale:
+                version, jobs = self.state_store.snapshot()
+                executor = getattr(self.scheduler, 'executor', None)
+                self._snapshot = StatusSnapshot(
+                    version, jobs,
+                    queued=self.scheduler.job_queue.snapshot(),
+                    running=executor.running_count() if executor is not None else None,
+                    parallel_jobs=self.scheduler.num_threads,
+                    tenants=self._tenant_state(),
+                    epoch=self.epoch,
+                )
+                self._refreshed_at = now
+                self._responses = {}
+            return self._snapshot
+
+    def _tenant_state(self):
+        registry = getattr(self.scheduler, 'tenants', None)
+        if registry is None:
+            return {}
+        counts = self.scheduler.job_queue.tenant_counts()
+        return {
+            name: dict(counts.get(name, {'queued': 0, 'running': 0}),
+                       weight=tenant.weight, max_running=tenant.max_running)
+            for name, tenant in registry.tenants.items()
+        }
+
+    def respond(self, target):
+        """
+        GET の対象 (パスとクエリ) に対する応答を返す。
+        Returns: (HTTP ステータス, 本文 bytes, ETag)
+        """
+        snapshot = self.current()
+        with self._lock:
+            cached = self._responses.get(target) if snapshot is self._snapshot else None
+        if cached is not None:
+            return cached
+
+        parts = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        try:
+            status, payload = self._route(snapshot, unquote(parts.path).rstrip('/') or '/', query)
+        except ValueError as e:
+            status, payload = 400, {'error': str(e)}
+        response = (status, json.dumps(payload, ensure_ascii=False).encode('utf-8'), snapshot.etag)
+
+        with self._lock:
+            if snapshot is self._snapshot:
+                if len(self._responses) >= RESPONSE_CACHE_SIZE:
+                    self._responses.clear()
+                self._responses[target] = response
+        return response
+
+    def _route(self, snapshot, path, query):
+        if path == '/status':
+            return 200, self._status(snapshot)
+        if path == '/jobs':
+            return 200, self._jobs(snapshot, query)
+        if path.startswith('/jobs/'):
+            molecule = path[len('/jobs/'):]
+            if molecule not in snapshot.by_molecule:
+                return 404, {'error': f"Unknown molecule '{molecule}'"}
+            return 200, {
+                'version': snapshot.version,
+                'molecule': molecule,
+                'jobs': [snapshot.detail(job_id) for job_id in snapshot.by_molecule[molecule]],
+            }
+        if path == '/tenants':
+            return 200, {'version': snapshot.version, 'taken_at': snapshot.taken_at,
+                         'tenants': snapshot.tenant_metrics()}
+        if path == '/queue':
+            offset, limit = self._page(query)
+            return 200, {
+                'version': snapshot.version,
+                'total': len(snapshot.queue),
+                'offset': offset,
+                'jobs': [snapshot.summary(job_id) if job_id in snapshot.jobs else {'job_id': job_id}
+                         for job_id in snapshot.queue[offset:offset + limit]],
+            }
+        return 404, {'error': f"Unknown endpoint '{path}'"}
+
+    def _status(self, snapshot):
+        status = {
+            'version': snapshot.version,
+            'taken_at': snapshot.taken_at,
+            'total_jobs': len(snapshot.jobs),
+            'by_status': dict(snapshot.by_status),
+            'by_calc_type': {str(calc_type): dict(counts) for calc_type, counts in snapshot.by_calc_type.items()},
+            'queued': len(snapshot.queue),
+            'running': snapshot.running,
+            'parallel_jobs': snapshot.parallel_jobs,
+        }
+        if len(snapshot.tenants) > 1:
+            status['by_tenant'] = {name: {'queued': tenant['queued'], 'running': tenant['running']}
+                                   for name, tenant in snapshot.tenants.items()}
+        return status
+
+    def _jobs(self, snapshot, query):
+        offset, limit = self._page(query)
+        status = query.get('status', '').upper()
+        calc_type = query.get('calc_type')
+        molecule = query.get('molecule')
+        job_ids = snapshot.by_molecule.get(molecule, []) if molecule else snapshot.jobs.keys()
+        matched = [
+            job_id for job_id in job_ids
+            if (not status or status_name(snapshot.jobs[job_id].get('status', '')).upper() == status)
+            and (not calc_type or snapshot.jobs[job_id].get('calc_type') == calc_type)
+        ]
+        return {
+            'version': snapshot.version,
+            'total': len(matched),
+            'offset': offset,
+            'jobs': [snapshot.summary(job_id) for job_id in matched[offset:offset + limit]],
+        }
+
+    def _page(self, query):
+        try:
+            offset = int(query.get('offset', 0))
+            limit = int(query.get('limit', self.page_size))
+        except ValueError:
+            raise ValueError("offset and limit must be integers")
+        if offset < 0 or limit < 1:
+            raise ValueError("offset must be >= 0 and limit >= 1")
+        return offset, min(limit, self.max_page_size)
+
+    # --- HTTP サーバ ---
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body, etag = service.respond(self.path)
+                if status == 200 and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                service.logger.debug(f"{self.address_string()} {format % args}")
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            self.logger.error(f"Could not start status API on {self.host}:{self.port}: {e}")
+            return False
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='status-api', daemon=True)
+        self._thread.start()
+        self.logger.info(f"Status API listening on http://{self.host}:{self._server.server_address[1]}/status")
+        return True
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def join(self, timeout=None):
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
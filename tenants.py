@@ -0,0 +1,164 @@
+# tenants.py
+import re
+import threading
+from pathlib import Path
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+
+_tenant_logger = get_logger('tenants')
+
+# [paths] input_dir に投入された分子のテナント
+DEFAULT_TENANT = 'default'
+_TENANT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+# default 以外のテナントの分子名は '<テナント>@<XYZ の名前>' (テナント名には使えない文字で区切る)
+MOLECULE_SEPARATOR = '@'
+
+
+def qualified_name(tenant, mol_name):
+    """
+    テナントの分子名。waiting_dir / working_dir / products_dir のファイル名と StateStore の
+    'molecule' に使い、別のテナントが同じ名前の XYZ を投入しても衝突しない。
+    default テナントの分子名は XYZ の名前のまま。
+    """
+    if not tenant or tenant == DEFAULT_TENANT:
+        return mol_name
+    return f"{tenant}{MOLECULE_SEPARATOR}{mol_name}"
+
+
+def split_qualified_name(name, tenant_names):
+    """Returns: (テナント, XYZ の名前)。tenant_names に無い接頭辞は分子名の一部とみなす。"""
+    tenant, sep, mol_name = name.partition(MOLECULE_SEPARATOR)
+    if sep and mol_name and tenant in tenant_names and tenant != DEFAULT_TENANT:
+        return tenant, mol_name
+    return DEFAULT_TENANT, name
+
+
+class Tenant:
+    """入力ディレクトリ (ユーザー/プロジェクト) ごとの配分の設定。"""
+
+    __slots__ = ('name', 'input_dir', 'weight', 'max_running')
+
+    def __init__(self, name, input_dir, weight=1.0, max_running=0):
+        self.name = name
+        self.input_dir = input_dir
+        self.weight = weight
+        # 同時に実行するジョブ数の上限 (0 なら上限なし)
+        self.max_running = max_running
+
+    def __repr__(self):
+        return f"Tenant({self.name}, weight={self.weight}, max_running={self.max_running})"
+
+
+def tenants_from_config(config):
+    """
+    [tenants] names と [tenants.<name>] からテナントを読む。[paths] input_dir は常に
+    'default' テナントで、[tenants.default] があればその weight / max_running を使う。
+    Returns: {名前: Tenant} (default が先頭)
+    """
+    names = [name.strip() for name in config.get('tenants', 'names', fallback='').split(',') if name.strip()]
+    tenants = {}
+    input_dirs = {}
+    for name in [DEFAULT_TENANT] + [name for name in names if name != DEFAULT_TENANT]:
+        if not _TENANT_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid tenant name '{name}' (letters, digits, '_', '.', '-').")
+        section = f"tenants.{name}"
+        if name == DEFAULT_TENANT:
+            input_dir = config['paths']['input_dir']
+        elif config.has_option(section, 'input_dir'):
+            input_dir = config.get(section, 'input_dir')
+        else:
+            raise ValueError(f"Tenant '{name}' needs [{section}] input_dir.")
+        try:
+            weight = config.getfloat(section, 'weight', fallback=1.0)
+            max_running = config.getint(section, 'max_running', fallback=0)
+        except ValueError:
+            raise ValueError(f"[{section}] weight must be a number and max_running an integer.")
+        if weight <= 0 or max_running < 0:
+            raise ValueError(f"[{section}] weight must be > 0 and max_running >= 0.")
+
+        resolved = str(Path(input_dir).resolve())
+        if resolved in input_dirs:
+            raise ValueError(f"Tenants '{input_dirs[resolved]}' and '{name}' share the input directory {input_dir}.")
+        input_dirs[resolved] = name
+        tenants[name] = Tenant(name, input_dir, weight, max_running)
+    return tenants
+
+
+class TenantRegistry:
+    """
+    テナントの設定と、分子名 -> (テナント, XYZ の名前) の対応を保持するクラス ([tenants])。
+
+    テナントは XYZ を取り込んだ入力ディレクトリで決まり、その分子の後続ステップ
+    (freq、数値振動数の変位ジョブ、リトライ) も同じテナントに属する。default 以外のテナントの
+    分子名は qualified_name で名前空間を分けるため、同じ名前の XYZ も別の分子として扱う。
+    対応は StateStore のジョブの 'tenant' に記録され、再起動時にそこから復元する。
+    """
+
+    def __init__(self, config, state_store=None):
+        self.logger = _tenant_logger
+        self.tenants = tenants_from_config(config)
+        self._molecules = {}
+        self._lock = threading.Lock()
+        if state_store is not None:
+            for _, job in state_store.items():
+                if job.get('tenant'):
+                    self._molecules[job.get('molecule')] = self._key(job.get('molecule'), job['tenant'])
+
+    @property
+    def enabled(self):
+        """default 以外のテナントが設定されているか (されていなければ 'tenant' を記録しない)。"""
+        return len(self.tenants) > 1
+
+    def apply_config(self, config):
+        """
+        設定の再読み込み: 既存のテナントの weight / max_running を更新する。
+        テナントの追加・削除と入力ディレクトリの変更は再起動が必要。
+        """
+        tenants = tenants_from_config(config)
+        if list(tenants) != list(self.tenants) or any(
+            tenants[name].input_dir != tenant.input_dir for name, tenant in self.tenants.items()
+        ):
+            self.logger.warning("Tenants or their input directories changed; restart the pipeline to apply them.")
+        for name, tenant in self.tenants.items():
+            if name in tenants:
+                tenant.weight, tenant.max_running = tenants[name].weight, tenants[name].max_running
+
+    @staticmethod
+    def _key(mol_name, tenant):
+        prefix = qualified_name(tenant, '')
+        if prefix and mol_name.startswith(prefix):
+            return tenant, mol_name[len(prefix):]
+        return tenant, mol_name
+
+    def assign(self, mol_names, tenant):
+        """取り込んだ分子 (qualified_name で名前空間を分けた名前) をテナントに割り当てる。"""
+        tenant = tenant or DEFAULT_TENANT
+        with self._lock:
+            for mol_name in mol_names:
+                self._molecules[mol_name] = self._key(mol_name, tenant)
+
+    def molecule_key(self, mol_name):
+        """
+        Returns: (テナント, XYZ の名前)。StateStore に記録の無い分子 (リカバリで採用した .inp など) は
+        分子名の接頭辞から判断する。
+        """
+        with self._lock:
+            key = self._molecules.get(mol_name)
+        return key if key is not None else split_qualified_name(mol_name, self.tenants)
+
+    def tenant_of(self, mol_name):
+        return self.molecule_key(mol_name)[0]
+
+    def job_fields(self, mol_name):
+        """StateStore のジョブに記録する属性 ({'tenant': 名前}、テナントが無効なら空)。"""
+        return {'tenant': self.tenant_of(mol_name)} if self.enabled else {}
+
+    def weight(self, name):
+        tenant = self.tenants.get(name)
+        return tenant.weight if tenant is not None else 1.0
+
+    def max_running(self, name):
+        # 設定から削除されたテナントのジョブは上限なしで実行する
+        tenant = self.tenants.get(name)
+        return tenant.max_running if tenant is not None else 0
@@ -0,0 +1,68 @@
+# tests/test_status_api.py
+import sys
+import json
+import configparser
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from state_store import StateStore
+from status_api import StatusService
+
+
+class _Queue:
+    def snapshot(self):
+        return []
+
+    def tenant_counts(self):
+        return {}
+
+
+class _Scheduler:
+    job_queue = _Queue()
+    num_threads = 4
+
+
+def _service(tmp_path):
+    store = StateStore(tmp_path / 'state.json')
+    store.add_jobs_bulk([
+        ('mol1', 'opt', str(tmp_path / 'mol1_opt.inp')),
+        ('mol2', 'opt', str(tmp_path / 'mol2_opt.inp')),
+        ('mol3', 'opt', str(tmp_path / 'mol3_opt.inp')),
+        ('mol4', 'opt', str(tmp_path / 'mol4_opt.inp')),
+    ])
+    store.update_status(str(tmp_path / 'mol1_opt.inp'), 'FAILED: SCF failed to converge.')
+    store.update_status(str(tmp_path / 'mol2_opt.inp'), 'FAILED: Timeout: exceeded timeout_seconds (60s)')
+    store.update_status(str(tmp_path / 'mol3_opt.inp'), 'PERMANENT_FAILED: Input file missing at recovery')
+    return StatusService(configparser.ConfigParser(), store, _Scheduler())
+
+
+def _get(service, target):
+    status, body, _ = service.respond(target)
+    assert status == 200
+    return json.loads(body)
+
+
+def test_status_counts_failed_jobs_without_reasons(tmp_path):
+    status = _get(_service(tmp_path), '/status')
+    assert status['by_status'] == {'FAILED': 2, 'PERMANENT_FAILED': 1, 'PENDING': 1}
+    assert status['by_calc_type'] == {'opt': {'FAILED': 2, 'PERMANENT_FAILED': 1, 'PENDING': 1}}
+
+
+def test_jobs_filter_matches_failed_statuses(tmp_path):
+    service = _service(tmp_path)
+    failed = _get(service, '/jobs?status=FAILED')
+    assert failed['total'] == 2
+    assert {job['molecule'] for job in failed['jobs']} == {'mol1', 'mol2'}
+    assert _get(service, '/jobs?status=permanent_failed')['total'] == 1
+    assert _get(service, '/jobs?status=PENDING')['total'] == 1
+
+
+def test_etag_differs_between_processes(tmp_path):
+    # 再起動後の StateStore は同じ版から数え直す
+    (tmp_path / 'before').mkdir()
+    (tmp_path / 'after').mkdir()
+    first, second = _service(tmp_path / 'before'), _service(tmp_path / 'after')
+    second.epoch = first.epoch + 1
+    assert first.current().version == second.current().version
+    assert first.respond('/status')[2] != second.respond('/status')[2]
@@ -0,0 +1,289 @@
+# workflow.py
+import traceback
+from pathlib import Path
+
+# --- 依存関係のインポート ---
+from logging_utils import get_logger
+from pipeline_utils import bulk_write # I/Oユーティリティ
+from orca_utils import generate_orca_input, extract_final_structure # ORCAユーティリティ
+
+_workflow_logger = get_logger('workflow')
+
+# [workflow] セクションが無い場合の既定ワークフロー (従来の opt → freq 連鎖と同じ)
+DEFAULT_WORKFLOW = {
+    'opt': {'keywords': 'OPT'},
+    'freq': {'depends_on': 'opt', 'keywords': 'FREQ'},
+}
+
+
+class WorkflowStep:
+    """ワークフローの1ステップ (= 1つの ORCA 計算タイプ)。"""
+
+    def __init__(self, name, depends_on=None, keywords='', method=None, basis=None, geometry_from=None):
+        self.name = name
+        self.depends_on = list(depends_on or [])
+        self.keywords = keywords
+        self.method = method
+        self.basis = basis
+        # 入力構造を取得するステップ (既定: 最初の依存ステップ。ルートは入力XYZを使う)
+        self.geometry_from = geometry_from or (self.depends_on[0] if self.depends_on else None)
+
+    def __repr__(self):
+        return f"WorkflowStep({self.name}, depends_on={self.depends_on})"
+
+
+class WorkflowDefinition:
+    """
+    設定ファイルで宣言された計算ワークフローの DAG。
+
+    [workflow]
+    steps = opt, freq, sp
+
+    [workflow.sp]
+    depends_on = opt
+    method = DLPNO-CCSD(T)
+    basis = def2-TZVP
+    keywords = TightPNO
+    """
+
+    def __init__(self, steps):
+        self.steps = {step.name: step for step in steps}
+        self._successors = {name: [] for name in self.steps}
+        for step in steps:
+            for dependency in step.depends_on:
+                if dependency not in self.steps:
+                    raise ValueError(f"Workflow step '{step.name}' depends on unknown step '{dependency}'.")
+                self._successors[dependency].append(step.name)
+            if step.geometry_from and step.geometry_from not in step.depends_on:
+                raise ValueError(
+                    f"Workflow step '{step.name}' takes its geometry from '{step.geometry_from}', "
+                    f"which is not one of its dependencies."
+                )
+        self.order = self._topological_order()
+        # %pal nprocs / %maxcore をジョブごとに決める ResourceTuner (set_resource_tuner で注入)
+        self.resource_tuner = None
+        # コンフォマーアンサンブルを絞り込む ConformerScreen (set_conformer_screen で注入)
+        self.conformer_screen = None
+        # 取り込み時に XYZ を検証する InputValidator (set_input_validator で注入)
+        self.input_validator = None
+
+    def set_resource_tuner(self, tuner):
+        self.resource_tuner = tuner
+
+    def set_conformer_screen(self, screen):
+        self.conformer_screen = screen
+
+    def set_input_validator(self, validator):
+        self.input_validator = validator
+
+    def update_step_options(self, other):
+        """
+        設定の再読み込み: DAG の形 (ステップと依存関係) が同じ場合に限り、other の
+        keywords / method / basis をこの定義に反映する (以降に生成する .inp から使われる)。
+        Returns: 反映したか (形が変わった場合は False。再起動が必要)
+        """
+        if list(self.steps) != list(other.steps) or any(
+            (step.depends_on, step.geometry_from) != (other.steps[name].depends_on, other.steps[name].geometry_from)
+            for name, step in self.steps.items()
+        ):
+            return False
+        for name, step in self.steps.items():
+            new = other.steps[name]
+            step.keywords, step.method, step.basis = new.keywords, new.method, new.basis
+        return True
+
+    @classmethod
+    def from_config(cls, config):
+        """[workflow] セクションから DAG を構築する。セクションが無ければ既定の opt → freq。"""
+        if not config.has_section('workflow'):
+            return cls([WorkflowStep(name, **_parse_step_options(options))
+                        for name, options in DEFAULT_WORKFLOW.items()])
+
+        names = [name.strip() for name in config.get('workflow', 'steps', fallback='').split(',') if name.strip()]
+        if not names:
+            raise ValueError("[workflow] section must define 'steps'.")
+
+        steps = []
+        for name in names:
+            section = f"workflow.{name}"
+            options = dict(config.items(section)) if config.has_section(section) else {}
+            # opt / freq は keywords を省略可能
+            options.setdefault('keywords', DEFAULT_WORKFLOW.get(name, {}).get('keywords', ''))
+            steps.append(WorkflowStep(name, **_parse_step_options(options)))
+        return cls(steps)
+
+    def _topological_order(self):
+        in_degree = {name: len(step.depends_on) for name, step in self.steps.items()}
+        ready = [name for name, degree in in_degree.items() if degree == 0]
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for successor in self._successors[name]:
+                in_degree[successor] -= 1
+                if in_degree[successor] == 0:
+                    ready.append(successor)
+        if len(order) != len(self.steps):
+            cycle = sorted(set(self.steps) - set(order))
+            raise ValueError(f"Workflow contains a dependency cycle among steps: {cycle}")
+        return order
+
+    def roots(self):
+        return [name for name in self.order if not self.steps[name].depends_on]
+
+    def successors(self, name):
+        return list(self._successors.get(name, []))
+
+    def ready_steps(self, completed, registered):
+        """依存がすべて完了し、まだ登録されていないステップを返す。"""
+        return [
+            name for name in self.order
+            if name not in registered and name not in completed
+            and all(dependency in completed for dependency in self.steps[name].depends_on)
+        ]
+
+    def generate_input(self, config, step_name, mol_name, geometry):
+        step = self.steps[step_name]
+        resources = None
+        if self.resource_tuner is not None:
+            resources = self.resource_tuner.choose(geometry, calc_type=step_name, basis=step.basis)
+        return generate_orca_input(
+            config, mol_name, geometry, calc_type=step_name,
+            calc_keyword=step.keywords, method=step.method, basis=step.basis, resources=resources
+        )
+
+
+def _parse_step_options(options):
+    depends_on = options.get('depends_on', '')
+    if isinstance(depends_on, str):
+        depends_on = [name.strip() for name in depends_on.split(',') if name.strip()]
+    return {
+        'depends_on': depends_on,
+        'keywords': options.get('keywords', '').strip(),
+        'method': options.get('method') or None,
+        'basis': options.get('basis') or None,
+        'geometry_from': options.get('geometry_from') or None,
+    }
+
+
+class WorkflowEngine:
+    """
+    分子ごとにワークフロー DAG を展開し、依存ステップが完了し次第、後続ステップを
+    スケジューラに登録するクラス。DAG の進行状況は StateStore のジョブ記録
+    (分子名 + 計算タイプ + ステータス) そのものであり、再起動後は resume() で再開できる。
+    """
+
+    def __init__(self, config, state_store, scheduler, definition=None):
+        # 依存関係の注入
+        self.config = config
+        self.state_store = state_store
+        self.scheduler = scheduler
+        self.definition = definition or WorkflowDefinition.from_config(config)
+        self.waiting_dir = Path(config['paths']['waiting_dir'])
+        self.products_dir = Path(config['paths']['products_dir'])
+        self.logger = _workflow_logger
+        # 振動数のステップを変位ジョブに分割する NumericalFrequencies (Setter注入、[numfreq])
+        self.numfreq = None
+
+    def set_scheduler(self, scheduler):
+        """循環依存解決のため、後からschedulerインスタンスを注入するメソッド。"""
+        self.scheduler = scheduler
+
+    def set_numerical_frequencies(self, numfreq):
+        self.numfreq = numfreq
+
+    def on_step_completed(self, mol_name, step_name):
+        """ステップ完了時に呼び出され、実行可能になった後続ステップを登録する。"""
+        if step_name not in self.definition.steps:
+            return []
+
+        completed, registered = self._molecule_progress(mol_name)
+        completed.add(step_name)
+        ready = [name for name in self.definition.successors(step_name)
+                 if name in self.definition.ready_steps(completed, registered)]
+        return self._release(mol_name, ready)
+
+    def resume(self):
+        """
+        起動時に呼び出し、途中まで完了しているワークフローの後続ステップを登録する。
+        (ステップ完了直後にコーディネーターが停止した場合の取りこぼしを防ぐ)
+        """
+        progress = {}
+        for _, info in self.state_store.items():
+            mol_name = info.get('molecule')
+            calc_type = info.get('calc_type')
+            if not mol_name or calc_type not in self.definition.steps:
+                continue
+            completed, registered = progress.setdefault(mol_name, (set(), set()))
+            # PERMANENT_FAILED のステップも登録済みとして扱う (再起動のたびに再実行しない)
+            if info.get('status') == 'COMPLETED':
+                completed.add(calc_type)
+            else:
+                registered.add(calc_type)
+
+        released = 0
+        for mol_name, (completed, registered) in progress.items():
+            if not completed:
+                continue
+            ready = self.definition.ready_steps(completed, registered)
+            released += len(self._release(mol_name, ready))
+
+        if released:
+            self.logger.info(f"Resumed workflows: released {released} pending steps.")
+        return released
+
+    def _molecule_progress(self, mol_name):
+        completed, registered = set(), set()
+        for _, info in self.state_store.molecule_items(mol_name):
+            if info.get('status') == 'COMPLETED':
+                completed.add(info.get('calc_type'))
+            else:
+                registered.add(info.get('calc_type'))
+        return completed, registered
+
+    def _release(self, mol_name, step_names):
+        """ステップの入力を waiting_dir に生成し、まとめてスケジューラに登録する。"""
+        inputs = []
+        split_jobs = []
+        for step_name in step_names:
+            step = self.definition.steps[step_name]
+            source_output = self.products_dir / mol_name / f"{mol_name}_{step.geometry_from}.out"
+            try:
+                geometry = None
+                if self.numfreq is not None:
+                    # 数値振動数に分割したステップの出力には最適化の座標ブロックが無いため、参照構造を使う
+                    geometry = self.numfreq.reference_geometry(mol_name, step.geometry_from)
+                if geometry is None:
+                    geometry = extract_final_structure(source_output)
+                if geometry is None:
+                    self.logger.error(
+                        f"Could not extract structure for {mol_name} from step '{step.geometry_from}'; "
+                        f"step '{step_name}' not released."
+                    )
+                    continue
+
+                if self.numfreq is not None and self.numfreq.applies(step_name):
+                    displacement_jobs = self.numfreq.split(mol_name, step, geometry)
+                    if displacement_jobs is not None:
+                        split_jobs.extend(displacement_jobs)
+                        continue
+
+                inp_path = self.waiting_dir / f"{mol_name}_{step_name}.inp"
+                inp_content = self.definition.generate_input(self.config, step_name, mol_name, geometry)
+                inputs.append((inp_path, inp_content, step_name))
+            except Exception as e:
+                self.logger.error(
+                    f"Error releasing step '{step_name}' for {mol_name}: {e}\n{traceback.format_exc()}"
+                )
+
+        # 入力はまとめて書き込む (ディレクトリの fsync は1回)
+        written = set(bulk_write((inp_path, inp_content) for inp_path, inp_content, _ in inputs))
+        jobs = []
+        for inp_path, _, step_name in inputs:
+            if inp_path in written:
+                self.logger.info(f"Released workflow step '{step_name}' for {mol_name}")
+                jobs.append((str(inp_path), mol_name, step_name))
+
+        if jobs:
+            self.scheduler.add_jobs_bulk(jobs)
+        return jobs + split_jobs